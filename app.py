@@ -30,6 +30,10 @@ def create_app(config_class: type[Config] = None) -> Flask:
     
     app.config.from_object(config_class)
     
+    # Bind the metrics hooks before any request can record into them
+    from services import metrics
+    metrics.configure(app.config)
+    
     # Configure logging
     logging.basicConfig(
         level=logging.INFO,
@@ -45,6 +49,19 @@ def create_app(config_class: type[Config] = None) -> Flask:
     from routes import register_error_handlers
     register_error_handlers(app)
     
+    # Pre-establish the OpenAI connection so the first generation does not pay for it
+    if app.config.get('OPENAI_WARMUP'):
+        from routes import openai_service
+        from services.openai_service import start_warm_up
+        start_warm_up(app, openai_service)
+    
+    # Profile sampled API requests around the whole WSGI call, session handling included
+    from services.profiler import ProfilingMiddleware, create_profiler
+    profiler = create_profiler(app.config)
+    app.extensions['profiler'] = profiler
+    if profiler is not None:
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profiler)
+    
     return app
 
 
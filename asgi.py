@@ -0,0 +1,198 @@
+"""
+ASGI entry point for the Mermaid Diagram Builder
+
+Endpoints in routes.ASYNC_VIEWS run natively on the event loop, so slow
+OpenAI calls (single, streamed and batch generations) do not tie up a
+worker thread each. Every other request is handed to the regular Flask
+WSGI app.
+
+Run with any ASGI server, e.g. ``uvicorn asgi:app``.
+"""
+
+import asyncio
+import io
+import sys
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask, Response, request
+from werkzeug.exceptions import HTTPException
+
+from app import create_app
+from config import Config
+
+
+class AsyncFlaskApp:
+    """ASGI application dispatching to async views of a Flask app"""
+    
+    def __init__(self, flask_app: Flask, async_views: Dict[str, Callable],
+                 warm_up: Optional[Callable[[], Awaitable[Any]]] = None):
+        """
+        Initialize the ASGI application
+        
+        Args:
+            flask_app: Configured Flask application
+            async_views: Mapping of endpoint name to coroutine view function
+            warm_up: Coroutine function run on the event loop at startup when OPENAI_WARMUP is set
+        """
+        self.flask_app = flask_app
+        self.async_views = async_views
+        self.warm_up = warm_up
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self._warm_up_task: Optional[asyncio.Task] = None
+    
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        
+        if scope['type'] == 'http':
+            environ = self._build_environ(scope, b'')
+            view = self._match_async_view(environ)
+            if view is not None:
+                environ['wsgi.input'] = io.BytesIO(await self._read_body(receive))
+                await self._dispatch(view, environ, send)
+                return
+        
+        await self.wsgi_app(scope, receive, send)
+    
+    def _match_async_view(self, environ: Dict[str, Any]) -> Optional[Callable]:
+        """Return the async view for the request, if there is one"""
+        adapter = self.flask_app.url_map.bind_to_environ(environ)
+        try:
+            endpoint, _ = adapter.match()
+        except HTTPException:
+            return None
+        return self.async_views.get(endpoint)
+    
+    async def _dispatch(self, view: Callable, environ: Dict[str, Any], send: Callable) -> None:
+        """
+        Run an async view with the same request lifecycle Flask uses
+        
+        The request context stays pushed until the body has been sent, so
+        streamed bodies (including async generators) can use it.
+        """
+        app = self.flask_app
+        ctx = app.request_context(environ)
+        error = None
+        try:
+            ctx.push()
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**(request.view_args or {}))
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            await self._send_response(response, send)
+        finally:
+            ctx.pop(error)
+    
+    @staticmethod
+    async def _send_response(response: Response, send: Callable) -> None:
+        """Send a Flask response, chunk by chunk for streamed bodies"""
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in response.headers.to_wsgi_list()
+            ],
+        })
+        body = response.response
+        try:
+            if hasattr(body, '__aiter__'):
+                async for chunk in body:
+                    chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            else:
+                for chunk in response.iter_encoded():
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'aclose'):
+                await body.aclose()
+            response.close()
+    
+    @staticmethod
+    async def _read_body(receive: Callable) -> bytes:
+        """Read the complete request body from the ASGI receive channel"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body', False):
+                return bytes(body)
+    
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        """Acknowledge ASGI lifespan events, warming the OpenAI connection at startup"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.warm_up is not None and self.flask_app.config.get('OPENAI_WARMUP'):
+                    # Each worker runs its own lifespan, so forked workers warm their own connections
+                    with self.flask_app.app_context():
+                        self._warm_up_task = asyncio.ensure_future(self.warm_up())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    @staticmethod
+    def _build_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+        """Build a WSGI environ from an ASGI HTTP scope"""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        
+        for raw_name, raw_value in scope.get('headers', []):
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'CONTENT_LENGTH':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        
+        return environ
+
+
+def create_asgi_app(config_class: type[Config] = None) -> AsyncFlaskApp:
+    """
+    Create the ASGI application
+    
+    Args:
+        config_class: Configuration class to use
+    
+    Returns:
+        ASGI application wrapping the Flask app
+    """
+    from routes import ASYNC_VIEWS, async_openai_service
+    return AsyncFlaskApp(create_app(config_class), ASYNC_VIEWS, warm_up=async_openai_service.warm_up)
+
+
+# Create application instance for ASGI servers
+app = create_asgi_app()
@@ -0,0 +1,137 @@
+"""
+Scaling benchmark for the Mermaid canonicalizer
+
+Canonicalizes the synthetic diagrams from benchmarks.validators at
+growing sizes and reports nanoseconds per line. For linear work the cost per line
+stays flat as diagrams grow; the run fails when it grows by more than
+--max-growth between the smallest and the largest size.
+
+Example::
+    
+    python -m benchmarks.canonicalize
+    python -m benchmarks.canonicalize --types flowchart,sequence --sizes 1000,100000 --max-growth 1.5
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.validators import GENERATORS, generate_diagram
+from services.canonical_syntax import canonicalize
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_MAX_GROWTH = 2.0
+
+
+def measure(syntax: str, diagram_type: str, min_time: float = 0.2, repeats: int = 5) -> Dict[str, Any]:
+    """
+    Time one canonicalization, best of several repeats
+    
+    Returns:
+        Seconds per call and nanoseconds per input line
+    """
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            canonicalize(syntax, diagram_type)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / repeats or loops >= 1 << 20:
+            break
+        loops *= 2
+    
+    best = elapsed
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            canonicalize(syntax, diagram_type)
+        best = min(best, time.perf_counter() - started)
+    
+    seconds = best / loops
+    return {
+        'seconds': seconds,
+        'ns_per_line': seconds * 1e9 / max(1, syntax.count('\n') + 1),
+    }
+
+
+def run(diagram_types: Optional[List[str]] = None, sizes: Optional[List[int]] = None,
+        min_time: float = 0.2) -> Dict[str, Any]:
+    """
+    Benchmark every type at every size
+    
+    Returns:
+        JSON-serializable report keyed by diagram type, with the cost per
+        line at each size and its growth from the smallest to the largest
+    """
+    sizes = sorted(sizes or DEFAULT_SIZES)
+    results = {}
+    for diagram_type in diagram_types or list(GENERATORS):
+        entries = {str(lines): measure(generate_diagram(diagram_type, lines), diagram_type, min_time)
+                   for lines in sizes}
+        first, last = entries[str(sizes[0])], entries[str(sizes[-1])]
+        results[diagram_type] = {
+            'sizes': entries,
+            'growth': round(last['ns_per_line'] / first['ns_per_line'], 3),
+        }
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': sizes,
+        },
+        'results': results,
+    }
+
+
+def check(report: Dict[str, Any], max_growth: float) -> List[str]:
+    """
+    Find cases whose cost per line grows with diagram size
+    
+    Args:
+        report: Output of run()
+        max_growth: Allowed ratio of ns/line at the largest size to the smallest
+    
+    Returns:
+        Human-readable violation messages, empty when every case scales linearly
+    """
+    return [
+        f"{name} costs {entry['growth']:.2f}x more per line at {report['meta']['sizes'][-1]} lines "
+        f"than at {report['meta']['sizes'][0]} (allowed {max_growth:.2f}x)"
+        for name, entry in report['results'].items() if entry['growth'] > max_growth
+    ]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--types', help="comma-separated diagram types (default: all)")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="comma-separated line counts")
+    parser.add_argument('--min-time', type=float, default=0.2, help="seconds spent timing each case")
+    parser.add_argument('--max-growth', type=float, default=DEFAULT_MAX_GROWTH,
+                        help="allowed growth of the cost per line from the smallest to the largest size")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = run(
+        diagram_types=args.types.split(',') if args.types else None,
+        sizes=[int(size) for size in args.sizes.split(',')],
+        min_time=args.min_time,
+    )
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    
+    violations = check(report, args.max_growth)
+    for message in violations:
+        print(f"NONLINEAR {message}", file=sys.stderr)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
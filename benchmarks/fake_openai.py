@@ -0,0 +1,260 @@
+"""
+Local stand-in for the OpenAI chat completions API
+
+Answers every completion with the example diagram from the request's
+system prompt (or, when asked for an edit script, with a one-line edit
+appending a comment to the numbered diagram), after a sampled latency plus the time the response would
+take at the configured token rate. Point OPENAI_BASE_URL at it to run the
+app without API quota or network variance. With a requests-per-minute
+limit it also sends x-ratelimit-* headers and answers 429 once the limit
+is spent, like the real API.
+
+Run standalone with ``python -m benchmarks.fake_openai --port 8100``.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+# Fallback when the system prompt carries no example
+DEFAULT_SYNTAX = "flowchart TD\n    A[Start] --> B{Decision}\n    B -->|Yes| C[Action 1]\n    B -->|No| D[Action 2]"
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    Build a latency sampler from a spec string (seconds)
+    
+    Args:
+        spec: 'fixed:0.2', 'uniform:0.1,0.5', 'normal:0.3,0.05' or 'lognormal:mu,sigma'
+    
+    Returns:
+        Function returning one latency sample
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',')] if params else []
+    
+    if kind == 'fixed':
+        return lambda: values[0] if values else 0.0
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution '{kind}'")
+
+
+def example_syntax(messages) -> str:
+    """Extract the example diagram from the system prompt"""
+    for message in messages:
+        if message.get('role') == 'system' and 'Example format:\n' in message.get('content', ''):
+            return message['content'].split('Example format:\n', 1)[1].strip()
+    return DEFAULT_SYNTAX
+
+
+def edit_script_answer(messages) -> Optional[str]:
+    """Answer an edit-script request with an insert after the last numbered line"""
+    if not any(message.get('role') == 'system' and '{"edits"' in message.get('content', '') for message in messages):
+        return None
+    numbered = re.findall(r'^\s*(\d+)\| ', messages[-1].get('content', ''), re.MULTILINE)
+    last = int(numbered[-1]) if numbered else 0
+    return json.dumps({'edits': [{'op': 'insert', 'after': last, 'lines': ['    %% edited']}]})
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Serve /v1/chat/completions, streaming or not"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        messages = body.get('messages', [])
+        content = edit_script_answer(messages) or example_syntax(messages)
+        model = body.get('model', 'fake-model')
+        completion_tokens = max(1, len(content) // 4)
+        
+        self.server.record_request()
+        allowed, self._rate_headers = self.server.take_request_slot()
+        if not allowed:
+            self._send_json({'error': {'message': 'Rate limit reached', 'type': 'requests'}}, status=429)
+            return
+        time.sleep(self.server.latency())
+        
+        if body.get('stream'):
+            self._stream(content, model)
+        else:
+            time.sleep(completion_tokens / self.server.tokens_per_second)
+            self._send_json({
+                'id': f"chatcmpl-{uuid.uuid4().hex}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {
+                    'prompt_tokens': sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': completion_tokens
+                }
+            })
+    
+    def _stream(self, content: str, model: str) -> None:
+        self.send_response(200)
+        self._send_rate_headers()
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        # Roughly one token per four characters
+        pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+        for piece in pieces:
+            time.sleep(1 / self.server.tokens_per_second)
+            self._write_event(self._chunk(chunk_id, model, {'content': piece}, None))
+        self._write_event(self._chunk(chunk_id, model, {}, 'stop'))
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+    
+    @staticmethod
+    def _chunk(chunk_id: str, model: str, delta: dict, finish_reason: Optional[str]) -> dict:
+        return {
+            'id': chunk_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+        }
+    
+    def _write_event(self, data: dict) -> None:
+        self._write_chunk(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+    
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+    
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self._send_rate_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _send_rate_headers(self) -> None:
+        for name, value in getattr(self, '_rate_headers', {}).items():
+            self.send_header(name, value)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Threaded fake completions server with request counting"""
+    
+    daemon_threads = True
+    
+    def __init__(self, address: Tuple[str, int] = ('127.0.0.1', 0), latency: str = 'fixed:0',
+                 tokens_per_second: float = 1000.0, requests_per_minute: Optional[int] = None):
+        """
+        Initialize the server
+        
+        Args:
+            address: (host, port) to bind, port 0 picks a free one
+            latency: Latency distribution spec, see parse_latency
+            tokens_per_second: Simulated generation speed
+            requests_per_minute: Simulated rate limit, or None for no limit
+        """
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.requests_per_minute = requests_per_minute
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._count_lock = threading.Lock()
+        self._window = deque()
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        """OpenAI base URL to configure clients with"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def record_request(self) -> None:
+        with self._count_lock:
+            self.request_count += 1
+    
+    def take_request_slot(self) -> Tuple[bool, Dict[str, str]]:
+        """
+        Count a request against the sliding one-minute limit
+        
+        Returns:
+            Tuple of (allowed, rate-limit headers for the response)
+        """
+        if not self.requests_per_minute:
+            return True, {}
+        with self._count_lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] >= 60:
+                self._window.popleft()
+            allowed = len(self._window) < self.requests_per_minute
+            if allowed:
+                self._window.append(now)
+            else:
+                self.rate_limited_count += 1
+            headers = {
+                'x-ratelimit-limit-requests': str(self.requests_per_minute),
+                'x-ratelimit-remaining-requests': str(self.requests_per_minute - len(self._window))
+            }
+            if not allowed:
+                headers['retry-after-ms'] = str(int((60 - (now - self._window[0])) * 1000))
+        return allowed, headers
+    
+    def start(self) -> 'FakeOpenAIServer':
+        """Serve from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self) -> None:
+        """Stop serving and release the port"""
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', default='lognormal:-1.2,0.4', help="e.g. fixed:0.2, uniform:0.1,0.5")
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--requests-per-minute', type=int, help="simulated rate limit")
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer((args.host, args.port), args.latency, args.tokens_per_second,
+                              args.requests_per_minute)
+    print(f"Fake OpenAI API at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
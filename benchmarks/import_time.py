@@ -0,0 +1,164 @@
+"""
+Cold-start import benchmark
+
+Imports the application in fresh interpreters with ``python -X importtime``
+and reports the total import time together with the modules that cost the
+most, both on their own and including everything they pulled in. The best
+of several runs is kept for every module. The run fails when the total is
+over budget or when a module that should load on first use (the openai SDK
+and httpx) was imported at startup.
+
+Example::
+    
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --module app --budget-ms 300 --top 15
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MODULE = 'app'
+DEFAULT_BUDGET_MS = 400.0
+DEFAULT_LAZY_MODULES = ['openai', 'httpx']
+
+_IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def parse_importtime(output: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse the stderr of ``python -X importtime``
+    
+    Args:
+        output: Interpreter stderr
+    
+    Returns:
+        Per module: self and cumulative microseconds and nesting depth
+    """
+    modules = {}
+    for line in output.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = {
+                'self_us': int(self_us),
+                'cumulative_us': int(cumulative_us),
+                'depth': len(indent) // 2
+            }
+    return modules
+
+
+def measure(module: str, repeat: int = 5) -> Dict[str, Dict[str, Any]]:
+    """
+    Import a module in fresh interpreters
+    
+    Args:
+        module: Module to import
+        repeat: Interpreters to start
+    
+    Returns:
+        Per module: the fastest self and cumulative microseconds seen
+    """
+    env = {name: value for name, value in os.environ.items() if name != 'PYTHONPROFILEIMPORTTIME'}
+    best: Dict[str, Dict[str, Any]] = {}
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                                capture_output=True, text=True, env=env)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+        for name, entry in parse_importtime(result.stderr).items():
+            previous = best.get(name)
+            if previous is None:
+                best[name] = entry
+            else:
+                previous['self_us'] = min(previous['self_us'], entry['self_us'])
+                previous['cumulative_us'] = min(previous['cumulative_us'], entry['cumulative_us'])
+    return best
+
+
+def run(module: str = DEFAULT_MODULE, repeat: int = 5, top: int = 10) -> Dict[str, Any]:
+    """
+    Measure the cold-start import of a module
+    
+    Returns:
+        JSON-serializable report with the total and the costliest modules
+    """
+    modules = measure(module, repeat)
+    top_level = [entry for entry in modules.values() if entry['depth'] == 0]
+    
+    def heaviest(key: str) -> List[Dict[str, Any]]:
+        ranked = sorted(modules.items(), key=lambda item: item[1][key], reverse=True)[:top]
+        return [{'module': name, 'ms': round(entry[key] / 1000, 3)} for name, entry in ranked]
+    
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'module': module,
+            'repeat': repeat,
+        },
+        'total_ms': round(modules.get(module, {}).get('cumulative_us', 0) / 1000, 3),
+        'all_imports_ms': round(sum(entry['cumulative_us'] for entry in top_level) / 1000, 3),
+        'module_count': len(modules),
+        'top_cumulative': heaviest('cumulative_us'),
+        'top_self': heaviest('self_us'),
+        'imported': sorted(modules),
+    }
+
+
+def check(report: Dict[str, Any], budget_ms: float, lazy_modules: List[str]) -> List[str]:
+    """
+    Find startup regressions in a report
+    
+    Args:
+        report: Output of run()
+        budget_ms: Allowed import time of the measured module
+        lazy_modules: Packages that must not be imported at startup
+    
+    Returns:
+        Human-readable violation messages, empty when startup is within bounds
+    """
+    violations = []
+    if report['total_ms'] > budget_ms:
+        violations.append(f"import {report['meta']['module']} took {report['total_ms']:.1f} ms "
+                          f"(budget {budget_ms:.1f} ms)")
+    imported = set(report['imported'])
+    for name in lazy_modules:
+        if name in imported:
+            violations.append(f"{name} is imported at startup but should load on first use")
+    return violations
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default=DEFAULT_MODULE, help="module to import")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument('--top', type=int, default=10, help="modules listed per ranking")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="allowed import time")
+    parser.add_argument('--lazy', default=','.join(DEFAULT_LAZY_MODULES),
+                        help="comma-separated packages that must not load at startup")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = run(module=args.module, repeat=args.repeat, top=args.top)
+    
+    output = json.dumps({key: value for key, value in report.items() if key != 'imported'}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    
+    violations = check(report, args.budget_ms, [name for name in args.lazy.split(',') if name])
+    for message in violations:
+        print(f"STARTUP {message}", file=sys.stderr)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
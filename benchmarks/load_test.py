@@ -0,0 +1,284 @@
+"""
+Offline load test for the Mermaid Diagram Builder
+
+Boots the app against benchmarks.fake_openai, drives the generation,
+validation and session endpoints at fixed concurrency levels and prints a
+JSON report (latency percentiles, throughput, memory) that can be diffed
+between commits.
+
+Example::
+
+    python -m benchmarks.load_test --concurrency 1,8,32 --requests 200 \
+        --latency lognormal:-1.2,0.4 --output bench.json
+"""
+
+import argparse
+import http.cookiejar
+import json
+import math
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from werkzeug.serving import make_server
+
+from app import create_app
+from benchmarks.fake_openai import FakeOpenAIServer
+from config import Config
+
+DIAGRAM_TYPES = [diagram_type['value'] for diagram_type in Config.DIAGRAM_TYPES]
+
+VALIDATE_SYNTAX = "flowchart TD\n" + "\n".join(
+    f"    N{i}[Step {i}] --> N{i + 1}(Next {i})" for i in range(50)
+)
+
+
+def percentile(samples: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of the samples"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return round(ordered[rank - 1], 3)
+
+
+class Client:
+    """HTTP client with its own cookie jar, i.e. one browser session"""
+    
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+    
+    def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> int:
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'} if data is not None else {}
+        )
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def generate_scenario(client: Client, index: int) -> bool:
+    diagram_type = DIAGRAM_TYPES[index % len(DIAGRAM_TYPES)]
+    status = client.request('POST', '/api/generate-diagram', {
+        'prompt': f"benchmark diagram {index}",
+        'diagram_type': diagram_type
+    })
+    return status == 200
+
+
+def validate_scenario(client: Client, index: int) -> bool:
+    status = client.request('POST', '/api/validate-syntax', {
+        'syntax': VALIDATE_SYNTAX,
+        'diagram_type': 'flowchart'
+    })
+    return status == 200
+
+
+def session_scenario(client: Client, index: int) -> bool:
+    if index % 2:
+        return client.request('POST', '/api/clear-session') == 200
+    return client.request('GET', '/api/session-info') == 200
+
+
+SCENARIOS: Dict[str, Callable[[Client, int], bool]] = {
+    'generate': generate_scenario,
+    'validate': validate_scenario,
+    'session': session_scenario,
+}
+
+
+def run_level(base_url: str, scenario: Callable[[Client, int], bool], concurrency: int,
+              requests: int, trace_memory: bool) -> Dict[str, Any]:
+    """
+    Run one scenario at a fixed concurrency
+    
+    Each worker is one client session issuing requests back to back.
+    """
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(requests))
+    
+    def worker():
+        nonlocal errors
+        client = Client(base_url)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = scenario(client, index)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed * 1000)
+                errors += not ok
+    
+    if trace_memory:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    duration = time.perf_counter() - started
+    
+    memory: Dict[str, Any] = {'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory.update({
+            'peak_traced_bytes': peak - baseline,
+            'retained_traced_bytes': current - baseline,
+            'peak_bytes_per_concurrent_request': (peak - baseline) // concurrency
+        })
+    
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'duration_s': round(duration, 4),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': round(max(latencies), 3) if latencies else None,
+        },
+        'memory': memory,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(concurrency_levels: List[int], requests: int, scenarios: List[str], latency: str,
+        tokens_per_second: float, cache_backend: str = 'none', trace_memory: bool = True,
+        warmup: int = 5, api_requests_per_minute: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run the load test and build the report
+    
+    Args:
+        concurrency_levels: Concurrent clients for each level
+        requests: Requests per scenario and level
+        scenarios: Names from SCENARIOS
+        latency: Fake API latency distribution spec
+        tokens_per_second: Fake API generation speed
+        cache_backend: RESPONSE_CACHE_BACKEND for the app under test
+        trace_memory: Track allocations with tracemalloc (slows requests down)
+        warmup: Unmeasured requests per scenario, so lazy imports and client setup are excluded
+        api_requests_per_minute: Rate limit enforced by the fake API, or None
+    
+    Returns:
+        JSON-serializable report
+    """
+    fake_api = FakeOpenAIServer(latency=latency, tokens_per_second=tokens_per_second,
+                                requests_per_minute=api_requests_per_minute).start()
+    
+    class BenchmarkConfig(Config):
+        OPENAI_API_KEY = 'benchmark-key'
+        OPENAI_BASE_URL = fake_api.base_url
+        RESPONSE_CACHE_BACKEND = cache_backend
+    
+    app = create_app(BenchmarkConfig)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    
+    results = []
+    try:
+        for name in scenarios:
+            warmup_client = Client(base_url)
+            for index in range(warmup):
+                SCENARIOS[name](warmup_client, index)
+            for concurrency in concurrency_levels:
+                level = run_level(base_url, SCENARIOS[name], concurrency, requests, trace_memory)
+                level['scenario'] = name
+                results.append(level)
+    finally:
+        server.shutdown()
+        fake_api.stop()
+    
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'latency': latency,
+            'tokens_per_second': tokens_per_second,
+            'cache_backend': cache_backend,
+            'trace_memory': trace_memory,
+            'warmup': warmup,
+            'fake_api_requests': fake_api.request_count,
+            'fake_api_rate_limited': fake_api.rate_limited_count,
+            'api_requests_per_minute': api_requests_per_minute,
+        },
+        'results': results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,8,32', help="comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario and level")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated scenarios")
+    parser.add_argument('--latency', default='lognormal:-1.2,0.4', help="fake API latency distribution")
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--cache-backend', default='none', help="response cache for the app under test")
+    parser.add_argument('--no-trace-memory', action='store_true', help="skip tracemalloc accounting")
+    parser.add_argument('--warmup', type=int, default=5, help="unmeasured requests per scenario")
+    parser.add_argument('--api-requests-per-minute', type=int, help="rate limit enforced by the fake API")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = run(
+        concurrency_levels=[int(level) for level in args.concurrency.split(',')],
+        requests=args.requests,
+        scenarios=args.scenarios.split(','),
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        cache_backend=args.cache_backend,
+        trace_memory=not args.no_trace_memory,
+        warmup=args.warmup,
+        api_requests_per_minute=args.api_requests_per_minute,
+    )
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
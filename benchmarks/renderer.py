@@ -0,0 +1,102 @@
+"""
+Throughput benchmark for the server-side SVG renderer
+
+Renders the synthetic pie, quadrant and Gantt charts from
+benchmarks.validators at several sizes and reports diagrams per second
+and output size, first with the cache disabled (validation, parsing and
+layout every time) and then for repeat requests answered from the cache.
+
+Example::
+    
+    python -m benchmarks.renderer
+    python -m benchmarks.renderer --types gantt --sizes 100,1000 --min-time 1 --output render.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.validators import generate_diagram
+from services.cache_service import MemoryCache
+from services.svg_renderer import RENDERABLE_TYPES, SVGRenderer
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+
+def throughput(renderer: SVGRenderer, syntax: str, diagram_type: str, min_time: float) -> Dict[str, Any]:
+    """
+    Render the same diagram repeatedly for at least min_time seconds
+    
+    Returns:
+        Diagrams per second, milliseconds per diagram and SVG size
+    """
+    svg = renderer.render(syntax, diagram_type)
+    count = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        renderer.render(syntax, diagram_type)
+        count += 1
+        elapsed = time.perf_counter() - started
+    return {
+        'diagrams_per_second': round(count / elapsed, 1),
+        'ms_per_diagram': round(elapsed / count * 1000, 4),
+        'svg_bytes': len(svg.encode('utf-8')),
+    }
+
+
+def run(diagram_types: Optional[List[str]] = None, sizes: Optional[List[int]] = None,
+        min_time: float = 0.5) -> Dict[str, Any]:
+    """
+    Benchmark every renderable type at every size
+    
+    Returns:
+        JSON-serializable report keyed by "<diagram_type>:<lines>"
+    """
+    uncached = SVGRenderer(cache=None)
+    cached = SVGRenderer(cache=MemoryCache(max_entries=64))
+    results = {}
+    for diagram_type in diagram_types or list(RENDERABLE_TYPES):
+        for lines in sizes or DEFAULT_SIZES:
+            syntax = generate_diagram(diagram_type, lines)
+            results[f"{diagram_type}:{lines}"] = {
+                'render': throughput(uncached, syntax, diagram_type, min_time),
+                'cached': throughput(cached, syntax, diagram_type, min_time),
+            }
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--types', help="comma-separated diagram types (default: all renderable)")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="comma-separated line counts")
+    parser.add_argument('--min-time', type=float, default=0.5, help="seconds spent timing each case")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = run(
+        diagram_types=args.types.split(',') if args.types else None,
+        sizes=[int(size) for size in args.sizes.split(',')],
+        min_time=args.min_time,
+    )
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Micro-benchmarks for DiagramService validation
+
+Generates synthetic diagrams of every type in Config.DIAGRAM_TYPES at
+several sizes, times DiagramService.validate_syntax (which applies the
+type's compiled rules from services.validation_rules) and records tracemalloc peaks. Results
+can be saved as a baseline and later runs checked against it.
+
+Example::
+    
+    python -m benchmarks.validators --save-baseline benchmarks/validators-baseline.json
+    python -m benchmarks.validators --baseline benchmarks/validators-baseline.json --threshold 0.5
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from config import Config
+from services.diagram_service import DiagramService
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def _flowchart(n: int) -> List[str]:
+    return ['flowchart TD'] + [f"    N{i}[Step {i}] --> N{i + 1}(Next {i})" for i in range(n - 1)]
+
+
+def _sequence(n: int) -> List[str]:
+    return ['sequenceDiagram'] + [
+        f"    participant P{i}" if i % 10 == 0 else f"    P{i % 7}->>P{(i + 1) % 7}: Message {i}"
+        for i in range(n - 1)
+    ]
+
+
+def _class_diagram(n: int) -> List[str]:
+    return ['classDiagram'] + [
+        f"    Class{i // 4} <|-- Class{i // 4 + 1}" if i % 4 == 3 else f"    Class{i // 4} : +field{i} int"
+        for i in range(n - 1)
+    ]
+
+
+def _state_diagram(n: int) -> List[str]:
+    return ['stateDiagram-v2'] + [f"    State{i} --> State{i + 1} : event{i}" for i in range(n - 1)]
+
+
+def _er_diagram(n: int) -> List[str]:
+    return ['erDiagram'] + [f"    ENTITY{i} ||--o{{ ENTITY{i + 1} : relates" for i in range(n - 1)]
+
+
+def _journey(n: int) -> List[str]:
+    return ['journey', '    title Synthetic journey'] + [
+        f"    section Stage {i}" if i % 10 == 0 else f"      Task {i}: {i % 5 + 1}: Me"
+        for i in range(n - 2)
+    ]
+
+
+def _gantt(n: int) -> List[str]:
+    return ['gantt', '    title Synthetic plan', '    dateFormat YYYY-MM-DD'] + [
+        f"    section Phase {i}" if i % 10 == 0 else f"    Task {i} :t{i}, 2024-01-01, {i % 30 + 1}d"
+        for i in range(n - 3)
+    ]
+
+
+def _pie(n: int) -> List[str]:
+    return ['pie title Synthetic shares'] + [f'    "Slice {i}" : {i % 97 + 1}' for i in range(n - 1)]
+
+
+def _quadrant_chart(n: int) -> List[str]:
+    header = ['quadrantChart', '    title Synthetic quadrant',
+              '    x-axis Low --> High', '    y-axis Low --> High']
+    return header + [f"    Point {i}: [{(i % 100) / 100:.2f}, {((i * 7) % 100) / 100:.2f}]" for i in range(n - 4)]
+
+
+def _mindmap(n: int) -> List[str]:
+    return ['mindmap', '  root((Synthetic))'] + [
+        '    ' + '  ' * (i % 4) + f"Idea {i}" for i in range(n - 2)
+    ]
+
+
+GENERATORS: Dict[str, Callable[[int], List[str]]] = {
+    'flowchart': _flowchart,
+    'sequence': _sequence,
+    'classDiagram': _class_diagram,
+    'stateDiagram': _state_diagram,
+    'erDiagram': _er_diagram,
+    'journey': _journey,
+    'gantt': _gantt,
+    'pie': _pie,
+    'quadrantChart': _quadrant_chart,
+    'mindmap': _mindmap,
+}
+
+
+def generate_diagram(diagram_type: str, lines: int) -> str:
+    """
+    Build a valid synthetic diagram
+    
+    Args:
+        diagram_type: One of Config.DIAGRAM_TYPES
+        lines: Number of lines, at least the header size
+    
+    Returns:
+        Mermaid syntax with exactly that many lines
+    """
+    return '\n'.join(GENERATORS[diagram_type](lines)[:lines])
+
+
+def measure(service: DiagramService, syntax: str, diagram_type: str,
+            min_time: float = 0.2, repeats: int = 5) -> Dict[str, Any]:
+    """
+    Time and trace one validation
+    
+    The call is looped until a run takes at least min_time / repeats and
+    the best of the repeats is reported; allocations are traced in a
+    separate call so tracemalloc overhead does not skew the timing.
+    """
+    result = service.validate_syntax(syntax, diagram_type)
+    
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            service.validate_syntax(syntax, diagram_type)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / repeats or loops >= 1 << 20:
+            break
+        loops *= 2
+    
+    best = elapsed
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            service.validate_syntax(syntax, diagram_type)
+        best = min(best, time.perf_counter() - started)
+    
+    tracemalloc.start()
+    service.validate_syntax(syntax, diagram_type)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    seconds = best / loops
+    return {
+        'is_valid': result.is_valid,
+        'seconds': seconds,
+        'ns_per_line': seconds * 1e9 / max(1, syntax.count('\n') + 1),
+        'peak_alloc_bytes': peak,
+    }
+
+
+def calibrate(repeats: int = 5) -> float:
+    """
+    Time a fixed pure-Python workload
+    
+    Stored with each report so comparisons can factor out how fast the
+    machine happens to be running.
+    """
+    text = '\n'.join(f"    N{i}[Step {i}] --> N{i + 1}" for i in range(2000))
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(20):
+            lines = [line.strip() for line in text.split('\n')]
+            sum(line.count('[') - line.count(']') for line in lines)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(diagram_types: Optional[List[str]] = None, sizes: Optional[List[int]] = None,
+        min_time: float = 0.2) -> Dict[str, Any]:
+    """
+    Benchmark every validator at every size
+    
+    Returns:
+        JSON-serializable report keyed by "<diagram_type>:<lines>"
+    """
+    service = DiagramService()
+    diagram_types = diagram_types or [diagram_type['value'] for diagram_type in Config.DIAGRAM_TYPES]
+    sizes = sizes or DEFAULT_SIZES
+    
+    calibration = calibrate()
+    results = {}
+    for diagram_type in diagram_types:
+        for lines in sizes:
+            syntax = generate_diagram(diagram_type, lines)
+            entry = measure(service, syntax, diagram_type, min_time=min_time)
+            results[f"{diagram_type}:{lines}"] = entry
+    
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'calibration_seconds': calibration,
+        },
+        'results': results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.5,
+            min_seconds: float = 1e-4) -> List[str]:
+    """
+    Find validators that regressed against a baseline
+    
+    Args:
+        report: Current run
+        baseline: Stored run
+        threshold: Allowed relative slowdown or allocation growth
+        min_seconds: Timings below this are too noisy to compare
+    
+    Returns:
+        Human-readable regression messages, empty when everything is within bounds
+    """
+    # Scale baseline timings by how fast the machine runs now
+    speed = 1.0
+    current_calibration = report.get('meta', {}).get('calibration_seconds')
+    baseline_calibration = baseline.get('meta', {}).get('calibration_seconds')
+    if current_calibration and baseline_calibration:
+        speed = current_calibration / baseline_calibration
+    
+    regressions = []
+    for key, current in report['results'].items():
+        previous = baseline.get('results', {}).get(key)
+        if previous is None:
+            continue
+        if current['is_valid'] != previous['is_valid']:
+            regressions.append(f"{key}: is_valid changed to {current['is_valid']}")
+        if max(current['seconds'], previous['seconds']) >= min_seconds:
+            expected = previous['seconds'] * speed
+            ratio = current['seconds'] / expected if expected else float('inf')
+            if ratio > 1 + threshold:
+                regressions.append(f"{key}: {ratio:.2f}x slower "
+                                   f"({expected * 1e3:.3f} ms expected, {current['seconds'] * 1e3:.3f} ms measured)")
+        if current['peak_alloc_bytes'] > previous['peak_alloc_bytes'] * (1 + threshold) + 1024:
+            regressions.append(f"{key}: peak allocations grew "
+                               f"{previous['peak_alloc_bytes']} -> {current['peak_alloc_bytes']} bytes")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--types', help="comma-separated diagram types (default: all)")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="comma-separated line counts")
+    parser.add_argument('--min-time', type=float, default=0.2, help="seconds spent timing each case")
+    parser.add_argument('--baseline', help="baseline JSON to check against")
+    parser.add_argument('--threshold', type=float, default=0.5, help="allowed relative regression")
+    parser.add_argument('--save-baseline', help="write this run as the new baseline")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = run(
+        diagram_types=args.types.split(',') if args.types else None,
+        sizes=[int(size) for size in args.sizes.split(',')],
+        min_time=args.min_time,
+    )
+    
+    output = json.dumps(report, indent=2)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                f.write(output + '\n')
+    if not args.output and not args.save_baseline:
+        print(output)
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,10 +18,107 @@ class Config:
     
     # OpenAI settings
     OPENAI_API_KEY: Optional[str] = os.environ.get('OPENAI_API_KEY')
+    OPENAI_BASE_URL: Optional[str] = os.environ.get('OPENAI_BASE_URL')  # None uses the OpenAI API
     OPENAI_MODEL: str = 'gpt-4o-mini'
     OPENAI_TEMPERATURE: float = 0.2
     OPENAI_MAX_TOKENS: int = 1000
     
+    # Batch generation settings (no token budget unless set)
+    OPENAI_BATCH_MAX_IN_FLIGHT: int = 8
+    OPENAI_BATCH_TOKENS_PER_MINUTE: Optional[int] = int(os.environ['OPENAI_BATCH_TOKENS_PER_MINUTE']) if os.environ.get('OPENAI_BATCH_TOKENS_PER_MINUTE') else None
+    OPENAI_BATCH_MAX_REQUESTS: int = 500
+    
+    # Client-side rate limiting (no budget unless set; x-ratelimit-* response headers fill in or tighten them)
+    OPENAI_RATE_LIMIT_ENABLED: bool = True
+    OPENAI_REQUESTS_PER_MINUTE: Optional[int] = int(os.environ['OPENAI_REQUESTS_PER_MINUTE']) if os.environ.get('OPENAI_REQUESTS_PER_MINUTE') else None
+    OPENAI_TOKENS_PER_MINUTE: Optional[int] = int(os.environ['OPENAI_TOKENS_PER_MINUTE']) if os.environ.get('OPENAI_TOKENS_PER_MINUTE') else None
+    OPENAI_RATE_LIMIT_ADAPTIVE: bool = True
+    OPENAI_QUEUE_TIMEOUT: float = 60.0  # seconds a call may wait for budget
+    OPENAI_MAX_RETRIES: int = 3  # jittered exponential backoff on 429, 5xx and connection errors
+    OPENAI_RETRY_BASE_DELAY: float = 0.5
+    OPENAI_RETRY_MAX_DELAY: float = 20.0
+    
+    # HTTP transport for OpenAI calls; each worker process builds its own client (HTTP/2 needs httpx[http2])
+    OPENAI_HTTP2: bool = os.environ.get('OPENAI_HTTP2', '').lower() in ('1', 'true', 'yes')
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY: float = 30.0  # seconds an idle connection stays pooled
+    OPENAI_CONNECT_TIMEOUT: float = 5.0
+    OPENAI_READ_TIMEOUT: float = 60.0  # also the longest gap between streamed chunks
+    OPENAI_WRITE_TIMEOUT: float = 30.0
+    OPENAI_POOL_TIMEOUT: float = 10.0  # seconds to wait for a free pooled connection
+    # Connect in the background at startup and in every forked worker, so the first request skips the TLS handshake
+    OPENAI_WARMUP: bool = os.environ.get('OPENAI_WARMUP', '').lower() in ('1', 'true', 'yes')
+    
+    # Iterations on diagrams of at least OPENAI_EDIT_MIN_LINES lines ask for a JSON edit script instead of
+    # the whole diagram; scripts that do not apply or validate fall back to full regeneration
+    OPENAI_EDIT_ITERATIONS: bool = os.environ.get('OPENAI_EDIT_ITERATIONS', 'true').lower() in ('1', 'true', 'yes')
+    OPENAI_EDIT_MIN_LINES: int = 20
+    OPENAI_EDIT_MAX_TOKENS: int = 400  # output cap for an edit script
+    
+    # Generated syntax that fails validation gets local fixes (prose, direction, brackets), then up to
+    # OPENAI_REPAIR_MAX_REPROMPTS edit-script requests showing only the failing lines, while the budget lasts
+    OPENAI_REPAIR_ENABLED: bool = os.environ.get('OPENAI_REPAIR_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    OPENAI_REPAIR_MAX_REPROMPTS: int = 1
+    OPENAI_REPAIR_BUDGET_SECONDS: float = 20.0  # measured from the start of the generation
+    OPENAI_REPAIR_CONTEXT_LINES: int = 2  # lines shown around the failing one
+    OPENAI_REPAIR_MAX_TOKENS: int = 400  # output cap for a repair edit script
+    
+    # Response cache settings ('memory', 'sqlite' or 'none')
+    RESPONSE_CACHE_BACKEND: str = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_TTL: Optional[int] = 24 * 60 * 60  # seconds
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1024
+    RESPONSE_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    RESPONSE_CACHE_PATH: str = os.environ.get('RESPONSE_CACHE_PATH', 'response_cache.sqlite3')
+    
+    # Semantic prompt cache: reuse the diagram of a similar enough earlier prompt
+    SEMANTIC_CACHE_ENABLED: bool = os.environ.get('SEMANTIC_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes')
+    SEMANTIC_CACHE_THRESHOLD: float = 0.8  # Jaccard similarity of prompt features
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 2048
+    SEMANTIC_CACHE_NUM_PERM: int = 64  # MinHash signature length
+    SEMANTIC_CACHE_BANDS: int = 16  # LSH bands, must divide SEMANTIC_CACHE_NUM_PERM
+    
+    # Identical in-flight generations share one API call; a lock directory extends this across worker processes
+    SINGLE_FLIGHT_ENABLED: bool = True
+    SINGLE_FLIGHT_LOCK_DIR: Optional[str] = os.environ.get('SINGLE_FLIGHT_LOCK_DIR')
+    SINGLE_FLIGHT_TIMEOUT: float = 120.0  # seconds to wait for another request's result
+    
+    # Server-side SVG rendering of pie, quadrant and Gantt charts, cached in memory by content hash (0 disables)
+    RENDER_CACHE_MAX_ENTRIES: int = 256
+    RENDER_CACHE_MAX_BYTES: Optional[int] = 32 * 1024 * 1024
+    
+    # Rendered artifacts on local disk, served under content-addressed URLs (evicts least recently used)
+    ARTIFACT_STORE_ENABLED: bool = True
+    ARTIFACT_STORE_DIR: str = os.environ.get('ARTIFACT_STORE_DIR', 'artifacts')
+    ARTIFACT_STORE_MAX_BYTES: int = 256 * 1024 * 1024
+    
+    # Session store settings ('memory', 'sqlite' or 'redis'); the cookie only holds an id
+    SESSION_STORE_BACKEND: str = os.environ.get('SESSION_STORE_BACKEND', 'memory')
+    SESSION_STORE_TTL: Optional[int] = 7 * 24 * 60 * 60  # seconds
+    SESSION_STORE_MAX_SESSIONS: int = 10000
+    SESSION_STORE_PATH: str = os.environ.get('SESSION_STORE_PATH', 'sessions.sqlite3')
+    SESSION_STORE_URL: str = os.environ.get('SESSION_STORE_URL', 'redis://localhost:6379/0')
+    SESSION_HISTORY_LIMIT: Optional[int] = 100
+    SESSION_HISTORY_KEYFRAME_INTERVAL: int = 10  # full copy every N history entries
+    SESSION_HISTORY_MAX_BYTES: Optional[int] = 256 * 1024
+    
+    # Batch validation settings (workers defaults to the CPU count)
+    VALIDATE_BATCH_WORKERS: Optional[int] = int(os.environ['VALIDATE_BATCH_WORKERS']) if os.environ.get('VALIDATE_BATCH_WORKERS') else None
+    VALIDATE_BATCH_CHUNK_SIZE: int = 256
+    VALIDATE_BATCH_MAX_ITEMS: int = 10000
+    
+    # Prometheus metrics at /metrics; when off, instrumentation is bound to no-op functions
+    METRICS_ENABLED: bool = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Sampled cProfile of /api/ requests, written to a ring of PROFILING_MAX_PROFILES in PROFILING_DIR and listed
+    # at /api/debug/profiles; a request can ask for a profile with PROFILING_HEADER, carrying PROFILING_TOKEN if set
+    PROFILING_ENABLED: bool = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+    PROFILING_SAMPLE_RATE: float = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+    PROFILING_HEADER: str = 'X-Profile-Request'
+    PROFILING_TOKEN: Optional[str] = os.environ.get('PROFILING_TOKEN')
+    PROFILING_DIR: str = os.environ.get('PROFILING_DIR', 'profiles')
+    PROFILING_MAX_PROFILES: int = 50
+    
     # Application settings
     MAX_CONTENT_LENGTH: int = 16 * 1024 * 1024  # 16MB max file size
     JSON_SORT_KEYS: bool = False
@@ -57,6 +154,10 @@ class TestingConfig(Config):
     TESTING: bool = True
     SECRET_KEY: str = 'test-secret-key'
     OPENAI_API_KEY: str = 'test-api-key'
+    RESPONSE_CACHE_BACKEND: str = 'none'
+    SEMANTIC_CACHE_ENABLED: bool = False
+    OPENAI_WARMUP: bool = False
+    ARTIFACT_STORE_ENABLED: bool = False
 
 
 class ProductionConfig(Config):
@@ -2,10 +2,18 @@
 Data models for the Mermaid Diagram Builder
 """
 
-from dataclasses import dataclass
-from typing import Optional, Dict, Any, List
+import difflib
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Dict, Any, List, Union
 from datetime import datetime
 
+# Same order as the validation rule registry, for error messages
+DIAGRAM_TYPES = ('flowchart', 'sequence', 'classDiagram', 'stateDiagram',
+                 'erDiagram', 'journey', 'gantt', 'pie', 'quadrantChart', 'mindmap')
+DIAGRAM_TYPE_NAMES = frozenset(DIAGRAM_TYPES)
+
+_INVALID_TYPE_ERROR = f"Invalid diagram type. Must be one of: {', '.join(DIAGRAM_TYPES)}"
+
 
 @dataclass
 class DiagramRequest:
@@ -13,6 +21,8 @@ class DiagramRequest:
     prompt: str
     diagram_type: str
     is_iteration: bool = False
+    use_semantic_cache: bool = True
+    previous_syntax: Optional[str] = None  # the diagram an iteration edits
     
     def validate(self) -> tuple[bool, Optional[str]]:
         """
@@ -27,11 +37,8 @@ class DiagramRequest:
         if len(self.prompt) > 1000:
             return False, "Prompt too long (max 1000 characters)"
         
-        valid_types = ['flowchart', 'sequence', 'classDiagram', 'stateDiagram', 
-                      'erDiagram', 'journey', 'gantt', 'pie', 'quadrantChart', 'mindmap']
-        
-        if self.diagram_type not in valid_types:
-            return False, f"Invalid diagram type. Must be one of: {', '.join(valid_types)}"
+        if self.diagram_type not in DIAGRAM_TYPE_NAMES:
+            return False, _INVALID_TYPE_ERROR
         
         return True, None
 
@@ -44,6 +51,7 @@ class DiagramResponse:
     success: bool
     error: Optional[str] = None
     timestamp: datetime = None
+    similarity: Optional[float] = None  # set when served for a similar earlier prompt
     
     def __post_init__(self):
         if self.timestamp is None:
@@ -51,13 +59,29 @@ class DiagramResponse:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
-        return {
+        data = {
             'syntax': self.syntax,
             'diagram_type': self.diagram_type,
             'success': self.success,
             'error': self.error,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
+        if self.similarity is not None:
+            data['similarity'] = self.similarity
+        return data
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DiagramResponse':
+        """Create from dictionary"""
+        timestamp = data.get('timestamp')
+        return cls(
+            syntax=data.get('syntax', ''),
+            diagram_type=data.get('diagram_type', 'flowchart'),
+            success=data.get('success', False),
+            error=data.get('error'),
+            timestamp=datetime.fromisoformat(timestamp) if timestamp else None,
+            similarity=data.get('similarity')
+        )
 
 
 @dataclass
@@ -76,38 +100,306 @@ class ValidationResult:
         }
 
 
+# A history entry is either a full keyframe or a list of ops rebuilding a
+# version from its successor: [start, end] copies successor lines, a list of
+# strings inserts those lines
+HistoryEntry = Union[str, List[list]]
+
+
+def encode_delta(previous: str, successor: str) -> List[list]:
+    """
+    Encode previous as line operations against successor
+    
+    Args:
+        previous: Version to encode
+        successor: Version it is rebuilt from
+    
+    Returns:
+        List of copy ([start, end]) and insert ([line, ...]) operations
+    """
+    old_lines = successor.split('\n')
+    new_lines = previous.split('\n')
+    
+    # Most iterations touch a few lines, so match the common ends directly
+    # and only diff the middle
+    prefix = 0
+    limit = min(len(old_lines), len(new_lines))
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < limit - prefix and
+           old_lines[len(old_lines) - 1 - suffix] == new_lines[len(new_lines) - 1 - suffix]):
+        suffix += 1
+    
+    ops: List[list] = []
+    
+    def copy(start: int, end: int):
+        if start >= end:
+            return
+        if ops and isinstance(ops[-1][0], int) and ops[-1][1] == start:
+            ops[-1][1] = end
+        else:
+            ops.append([start, end])
+    
+    def insert(lines: List[str]):
+        if not lines:
+            return
+        if ops and not isinstance(ops[-1][0], int):
+            ops[-1].extend(lines)
+        else:
+            ops.append(list(lines))
+    
+    copy(0, prefix)
+    old_middle = old_lines[prefix:len(old_lines) - suffix]
+    new_middle = new_lines[prefix:len(new_lines) - suffix]
+    matcher = difflib.SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            copy(prefix + i1, prefix + i2)
+        else:
+            insert(new_middle[j1:j2])
+    copy(len(old_lines) - suffix, len(old_lines))
+    return ops
+
+
+def apply_delta(ops: List[list], successor: str) -> str:
+    """Rebuild a version from its successor and the ops encoding it"""
+    lines = successor.split('\n')
+    result: List[str] = []
+    for op in ops:
+        if isinstance(op[0], int):
+            result.extend(lines[op[0]:op[1]])
+        else:
+            result.extend(op)
+    return '\n'.join(result)
+
+
+def rebase_entry(entry: HistoryEntry, successor: str, new_successor: str) -> HistoryEntry:
+    """
+    Re-encode a history entry against a successor that replaced its own
+    
+    Args:
+        entry: Entry rebuilding its version from successor
+        successor: Text the entry was encoded against
+        new_successor: Text replacing successor
+    
+    Returns:
+        Entry rebuilding the same version from new_successor
+    """
+    if isinstance(entry, str):
+        return entry
+    previous = apply_delta(entry, successor)
+    delta = encode_delta(previous, new_successor)
+    return delta if _entry_size(delta) < len(previous) else previous
+
+
+def _entry_size(entry: HistoryEntry) -> int:
+    if isinstance(entry, str):
+        return len(entry)
+    return sum(8 if isinstance(op[0], int) else sum(len(line) + 1 for line in op) for op in entry)
+
+
+@dataclass
+class DiagramHistory:
+    """
+    Previous versions of a diagram stored as reverse line deltas
+    
+    Each entry rebuilds a version from the one after it (the newest from the
+    current syntax), so appending never rewrites older entries and the
+    oldest entries can be dropped freely. Every keyframe_interval-th entry
+    is stored in full, bounding how many deltas a lookup applies.
+    """
+    entries: List[HistoryEntry] = field(default_factory=list)
+    total: int = 0
+    keyframe_interval: int = 10
+    max_depth: Optional[int] = 100
+    max_bytes: Optional[int] = 256 * 1024
+    
+    def __post_init__(self):
+        self._sizes = [_entry_size(entry) for entry in self.entries]
+        self._bytes = sum(self._sizes)
+    
+    def append(self, previous: str, successor: str) -> HistoryEntry:
+        """
+        Record previous as the version before successor
+        
+        Args:
+            previous: Version being superseded
+            successor: Version replacing it
+        
+        Returns:
+            The stored entry
+        """
+        entry: HistoryEntry = previous
+        if self.total % self.keyframe_interval:
+            delta = encode_delta(previous, successor)
+            # Keep the full text when the delta would not be smaller
+            if _entry_size(delta) < len(previous):
+                entry = delta
+        
+        self.entries.append(entry)
+        self._sizes.append(_entry_size(entry))
+        self._bytes += self._sizes[-1]
+        self.total += 1
+        
+        while self.entries and (
+            (self.max_depth is not None and len(self.entries) > self.max_depth) or
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            self.entries.pop(0)
+            self._bytes -= self._sizes.pop(0)
+        return entry
+    
+    def rebase(self, current: str, new_current: str) -> Optional[HistoryEntry]:
+        """
+        Re-encode the newest entry for a current syntax replaced in place
+        
+        Args:
+            current: Current syntax the newest entry is relative to
+            new_current: Text replacing it
+        
+        Returns:
+            The re-encoded newest entry, or None when there are no entries
+        """
+        if not self.entries:
+            return None
+        self.entries[-1] = rebase_entry(self.entries[-1], current, new_current)
+        size = _entry_size(self.entries[-1])
+        self._bytes += size - self._sizes[-1]
+        self._sizes[-1] = size
+        return self.entries[-1]
+    
+    def version(self, index: int, current: str) -> str:
+        """
+        Rebuild one version, applying at most keyframe_interval deltas
+        
+        Args:
+            index: Position in the history, oldest first (negative counts from the end)
+            current: Current syntax the newest entry is relative to
+        
+        Returns:
+            Syntax of that version
+        """
+        if index < 0:
+            index += len(self.entries)
+        if not 0 <= index < len(self.entries):
+            raise IndexError("history index out of range")
+        
+        # Start from the nearest keyframe at or after index
+        position = index
+        while position < len(self.entries) and not isinstance(self.entries[position], str):
+            position += 1
+        syntax = self.entries[position] if position < len(self.entries) else current
+        for entry in reversed(self.entries[index:position]):
+            syntax = apply_delta(entry, syntax)
+        return syntax
+    
+    def versions(self, current: str) -> List[str]:
+        """
+        Rebuild every version in one backward pass
+        
+        Args:
+            current: Current syntax the newest entry is relative to
+        
+        Returns:
+            Syntax of each version, oldest first
+        """
+        result = []
+        syntax = current
+        for entry in reversed(self.entries):
+            syntax = entry if isinstance(entry, str) else apply_delta(entry, syntax)
+            result.append(syntax)
+        result.reverse()
+        return result
+    
+    @property
+    def size_bytes(self) -> int:
+        """Approximate size of the stored entries"""
+        return self._bytes
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for compact serialization"""
+        return {'total': self.total, 'entries': self.entries}
+    
+    @classmethod
+    def from_versions(cls, versions: List[str], current: str, **limits) -> 'DiagramHistory':
+        """Encode full versions, oldest first, ending before current"""
+        history = cls(**limits)
+        for previous, successor in zip(versions, versions[1:] + [current]):
+            history.append(previous, successor)
+        return history
+
+
 @dataclass 
 class DiagramSession:
     """Model for tracking diagram session state"""
     current_syntax: str = ""
     diagram_type: str = "flowchart"
-    history: List[str] = None
+    history: DiagramHistory = None
     
     def __post_init__(self):
         if self.history is None:
-            self.history = []
-    
-    def add_to_history(self, syntax: str):
-        """Add diagram syntax to history"""
-        if syntax:
-            # Only add to history if current_syntax is not empty and different
-            if self.current_syntax and syntax != self.current_syntax:
-                self.history.append(self.current_syntax)
+            self.history = DiagramHistory()
+    
+    def add_to_history(self, syntax: str,
+                       same_diagram: Optional[Callable[[str, str], bool]] = None) -> Optional[HistoryEntry]:
+        """
+        Add diagram syntax to history
+        
+        A version that same_diagram considers equal to the current one (e.g.
+        it only differs in formatting) replaces the current syntax in place
+        without a new history entry; the newest entry is re-based onto it.
+        
+        Args:
+            syntax: New version
+            same_diagram: Compares the current and the new version; by default they must be identical
+        
+        Returns:
+            The history entry stored for the superseded syntax, if any
+        """
+        if not syntax or syntax == self.current_syntax:
+            return None
+        if not self.current_syntax:
             self.current_syntax = syntax
+            return None
+        if same_diagram is not None and same_diagram(self.current_syntax, syntax):
+            self.history.rebase(self.current_syntax, syntax)
+            self.current_syntax = syntax
+            return None
+        
+        entry = self.history.append(self.current_syntax, syntax)
+        self.current_syntax = syntax
+        return entry
+    
+    def get_history(self) -> List[str]:
+        """Get the full syntax of every previous version, oldest first"""
+        return self.history.versions(self.current_syntax)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for session storage"""
         return {
             'current_syntax': self.current_syntax,
             'diagram_type': self.diagram_type,
-            'history': self.history
+            'history': self.history.to_dict()
         }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'DiagramSession':
-        """Create from dictionary"""
+        """Create from dictionary, accepting the older list of full versions"""
+        current_syntax = data.get('current_syntax', '')
+        history_data = data.get('history') or {}
+        if isinstance(history_data, list):
+            history = DiagramHistory.from_versions(history_data, current_syntax)
+        else:
+            history = DiagramHistory(
+                entries=history_data.get('entries', []),
+                total=history_data.get('total', 0)
+            )
         return cls(
-            current_syntax=data.get('current_syntax', ''),
+            current_syntax=current_syntax,
             diagram_type=data.get('diagram_type', 'flowchart'),
-            history=data.get('history', [])
-        )
\ No newline at end of file
+            history=history
+        )
@@ -2,13 +2,25 @@
 Route definitions for the Mermaid Diagram Builder
 """
 
-from flask import Blueprint, render_template, jsonify, request, current_app, session
-from typing import Tuple, Dict, Any
+from asgiref.sync import sync_to_async
+from flask import (Blueprint, Response, render_template, jsonify, request, current_app, session, send_file,
+                   stream_with_context, url_for)
+from typing import Tuple, Dict, Any, List, Optional
+import json
 import logging
+import os
 
-from models import DiagramRequest, DiagramResponse, ValidationResult, DiagramSession
+from models import (DiagramRequest, DiagramResponse, ValidationResult, DiagramSession, DiagramHistory,
+                    rebase_entry)
+from services import metrics
 from services.openai_service import OpenAIService
+from services.async_openai_service import AsyncOpenAIService
 from services.diagram_service import DiagramService
+from services.incremental_validation import IncrementalValidator, LineEdit
+from services.session_store import SessionStore, create_session_store, new_session_id
+from services.artifact_store import (ARTIFACT_TYPES, ArtifactStore, create_artifact_store, is_artifact_key,
+                                    png_available, rasterize_png)
+from services.svg_renderer import RenderError, SVGRenderer, create_renderer, render_key
 
 # Create blueprints
 main_bp = Blueprint('main', __name__)
@@ -16,11 +28,16 @@ api_bp = Blueprint('api', __name__)
 
 # Initialize services
 openai_service = OpenAIService()
+async_openai_service = AsyncOpenAIService()
 diagram_service = DiagramService()
+incremental_validator = IncrementalValidator(diagram_service)
 
 # Logger
 logger = logging.getLogger(__name__)
 
+# Artifacts never change under their key, so browsers may keep them for a year
+ARTIFACT_MAX_AGE = 365 * 24 * 60 * 60
+
 
 @main_bp.route('/')
 def index():
@@ -29,6 +46,213 @@ def index():
     return render_template('index.html', diagram_types=diagram_types)
 
 
+@main_bp.route('/metrics')
+def metrics_endpoint():
+    """
+    Expose metrics in Prometheus text format
+    
+    Returns:
+        Text exposition of every recorded metric, or 404 when metrics are disabled
+    """
+    registry = metrics.registry
+    if registry is None:
+        return Response('Metrics are disabled\n', status=404, mimetype='text/plain')
+    
+    try:
+        _collect_cache_metrics()
+    except Exception as e:
+        logger.error(f"Error collecting cache metrics: {str(e)}")
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _collect_cache_metrics() -> None:
+    """Copy the counters of every enabled cache into the metrics registry"""
+    caches = {}
+    stats = openai_service.cache_stats()
+    if stats is not None:
+        caches['response'] = (stats['hits'], stats['misses'])
+    stats = openai_service.semantic_cache_stats()
+    if stats is not None:
+        caches['semantic'] = (stats['hits'], stats['misses'])
+    stats = openai_service.coalescing_stats()
+    if stats is not None:
+        # Callers served by another request's upstream call count as hits
+        shared = stats['coalesced'] + stats['cross_process_shared'] - stats['timeouts']
+        caches['coalescing'] = (max(0, shared), stats['leaders'])
+    stats = _get_renderer().render_stats()['cache']
+    if stats is not None:
+        caches['render'] = (stats['hits'], stats['misses'])
+    store = _get_artifact_store()
+    if store is not None:
+        stats = store.store_stats()
+        caches['artifact'] = (stats['hits'], stats['misses'])
+    
+    for cache, (hits, misses) in caches.items():
+        metrics.set_value('cache_hits_total', hits, cache=cache)
+        metrics.set_value('cache_misses_total', misses, cache=cache)
+        metrics.set_value('cache_hit_ratio', hits / (hits + misses) if hits + misses else 0.0, cache=cache)
+
+
+def _prepare_generation(data: Dict[str, Any]) -> Tuple[DiagramRequest, DiagramSession, Optional[str], Optional[str]]:
+    """
+    Build the generation request and session state from request data
+    
+    Args:
+        data: Parsed JSON request body
+    
+    Returns:
+        Tuple of (diagram_request, diagram_session, previous_syntax, error_message)
+    """
+    # Create and validate request
+    diagram_request = DiagramRequest(
+        prompt=data.get('prompt', ''),
+        diagram_type=data.get('diagram_type', 'flowchart'),
+        is_iteration=data.get('is_iteration', False),
+        use_semantic_cache=data.get('semantic_cache', True) is not False
+    )
+    
+    is_valid, error_msg = diagram_request.validate()
+    if not is_valid:
+        return diagram_request, None, None, error_msg
+    
+    # Get or create session state
+    diagram_session = _load_diagram_session()
+    
+    # Determine what previous syntax to use
+    previous_syntax = None
+    if diagram_request.is_iteration:
+        # For iterations, use existing syntax regardless of diagram type
+        previous_syntax = diagram_session.current_syntax
+        logger.info(f"Iteration request - using previous syntax: {len(previous_syntax or '')} chars")
+    else:
+        # For new diagrams, clear session if diagram type changed
+        if diagram_request.diagram_type != diagram_session.diagram_type:
+            logger.info(f"New diagram - clearing session (type changed from {diagram_session.diagram_type} to {diagram_request.diagram_type})")
+            diagram_session = DiagramSession(diagram_type=diagram_request.diagram_type)
+        else:
+            logger.info(f"New diagram - same type ({diagram_request.diagram_type})")
+    
+    logger.info(f"Request: is_iteration={diagram_request.is_iteration}, has_previous={bool(previous_syntax)}")
+    return diagram_request, diagram_session, previous_syntax, None
+
+
+def _get_session_store() -> SessionStore:
+    """Get the application's session store, creating it from config on first use"""
+    if 'session_store' not in current_app.extensions:
+        current_app.extensions['session_store'] = create_session_store(current_app.config)
+    return current_app.extensions['session_store']
+
+
+def _get_renderer() -> SVGRenderer:
+    """Get the application's SVG renderer, creating it from config on first use"""
+    if 'svg_renderer' not in current_app.extensions:
+        current_app.extensions['svg_renderer'] = create_renderer(current_app.config)
+    return current_app.extensions['svg_renderer']
+
+
+def _get_artifact_store() -> Optional[ArtifactStore]:
+    """Get the application's artifact store, creating it from config on first use"""
+    if 'artifact_store' not in current_app.extensions:
+        current_app.extensions['artifact_store'] = create_artifact_store(current_app.config)
+    return current_app.extensions['artifact_store']
+
+
+def _session_id(create: bool = False) -> Optional[str]:
+    """
+    Get the session id carried by the cookie
+    
+    Args:
+        create: Issue a new id if the cookie has none
+    
+    Returns:
+        Session id, or None if there is none and create is False
+    """
+    session_id = session.get('session_id')
+    if session_id is None and create:
+        session_id = new_session_id()
+        session['session_id'] = session_id
+    return session_id
+
+
+def _load_diagram_session(include_history: bool = False) -> DiagramSession:
+    """
+    Load the diagram session from the server-side store
+    
+    Args:
+        include_history: Also read the history, which most requests never need
+    
+    Returns:
+        Stored session, or an empty one
+    """
+    store = _get_session_store()
+    
+    # Move state from cookies issued before the server-side store
+    legacy_data = session.pop('diagram_session', None)
+    if legacy_data:
+        legacy_session = DiagramSession.from_dict(legacy_data)
+        session_id = _session_id(create=True)
+        for entry in legacy_session.history.entries:
+            store.append_history(session_id, json.dumps(entry))
+        store.save(session_id, legacy_session.current_syntax, legacy_session.diagram_type,
+                   legacy_session.history.total)
+    
+    session_id = _session_id()
+    state = store.load(session_id) if session_id else None
+    if state is None:
+        return DiagramSession()
+    
+    entries = [json.loads(entry) for entry in store.load_history(session_id)] if include_history else []
+    return DiagramSession(
+        current_syntax=state['current_syntax'],
+        diagram_type=state['diagram_type'],
+        history=DiagramHistory(
+            entries=entries,
+            total=state['history_total'],
+            keyframe_interval=current_app.config['SESSION_HISTORY_KEYFRAME_INTERVAL'],
+            max_depth=current_app.config['SESSION_HISTORY_LIMIT'],
+            max_bytes=current_app.config['SESSION_HISTORY_MAX_BYTES']
+        )
+    )
+
+
+def _commit_generation(diagram_session: DiagramSession, syntax: str, diagram_type: str) -> None:
+    """Record newly generated syntax in the session store"""
+    store = _get_session_store()
+    session_id = _session_id(create=True)
+    
+    if not diagram_session.current_syntax:
+        # A session without current syntax starts a fresh history
+        store.delete(session_id)
+    
+    def same_diagram(current: str, new: str) -> bool:
+        # A formatting-only change is not a new version
+        previous_type = diagram_session.diagram_type
+        return (diagram_service.canonicalize(current, previous_type)
+                == diagram_service.canonicalize(new, previous_type))
+    
+    # Only the new delta-encoded entry is written; older entries stay put
+    current = diagram_session.current_syntax
+    entry = diagram_session.add_to_history(syntax, same_diagram)
+    if entry is not None:
+        serialized = json.dumps(entry, separators=(',', ':'))
+        metrics.observe('session_serialized_bytes', len(serialized), part='history')
+        store.append_history(session_id, serialized)
+    elif current and diagram_session.current_syntax != current:
+        # Replaced in place: the newest stored entry is re-based onto the new text
+        newest = store.last_history(session_id)
+        if newest is not None:
+            rebased = rebase_entry(json.loads(newest), current, diagram_session.current_syntax)
+            store.replace_last_history(session_id, json.dumps(rebased, separators=(',', ':')))
+    diagram_session.diagram_type = diagram_type
+    metrics.observe('session_serialized_bytes', len(diagram_session.current_syntax), part='state')
+    store.save(session_id, diagram_session.current_syntax, diagram_type, diagram_session.history.total)
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @api_bp.route('/generate-diagram', methods=['POST'])
 def generate_diagram() -> Tuple[Dict[str, Any], int]:
     """
@@ -43,47 +267,61 @@ def generate_diagram() -> Tuple[Dict[str, Any], int]:
         if not data:
             return jsonify({'success': False, 'error': 'No data provided'}), 400
         
-        # Create and validate request
-        diagram_request = DiagramRequest(
-            prompt=data.get('prompt', ''),
-            diagram_type=data.get('diagram_type', 'flowchart'),
-            is_iteration=data.get('is_iteration', False)
+        diagram_request, diagram_session, previous_syntax, error_msg = _prepare_generation(data)
+        if error_msg:
+            return jsonify({'success': False, 'error': error_msg}), 400
+        
+        response = openai_service.generate_diagram_syntax(
+            prompt=diagram_request.prompt,
+            diagram_type=diagram_request.diagram_type,
+            previous_syntax=previous_syntax,
+            use_semantic_cache=diagram_request.use_semantic_cache
         )
         
-        is_valid, error_msg = diagram_request.validate()
-        if not is_valid:
-            return jsonify({'success': False, 'error': error_msg}), 400
+        # Update session if successful
+        if response.success:
+            _commit_generation(diagram_session, response.syntax, diagram_request.diagram_type)
+        
+        return jsonify(response.to_dict()), 200 if response.success else 500
+    
+    except Exception as e:
+        logger.error(f"Error generating diagram: {str(e)}")
+        return jsonify({
+            'success': False, 
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+async def generate_diagram_async() -> Tuple[Dict[str, Any], int]:
+    """
+    Async variant of generate_diagram served by the ASGI entry point
+    
+    Returns:
+        JSON response with generated syntax or error
+    """
+    try:
+        data = request.get_json()
         
-        # Get or create session state
-        session_data = session.get('diagram_session', {})
-        diagram_session = DiagramSession.from_dict(session_data)
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
         
-        # Determine what previous syntax to use
-        previous_syntax = None
-        if diagram_request.is_iteration:
-            # For iterations, use existing syntax regardless of diagram type
-            previous_syntax = diagram_session.current_syntax
-            logger.info(f"Iteration request - using previous syntax: {len(previous_syntax or '')} chars")
-        else:
-            # For new diagrams, clear session if diagram type changed
-            if diagram_request.diagram_type != diagram_session.diagram_type:
-                logger.info(f"New diagram - clearing session (type changed from {diagram_session.diagram_type} to {diagram_request.diagram_type})")
-                diagram_session = DiagramSession(diagram_type=diagram_request.diagram_type)
-            else:
-                logger.info(f"New diagram - same type ({diagram_request.diagram_type})")
-        
-        logger.info(f"Request: is_iteration={diagram_request.is_iteration}, has_previous={bool(previous_syntax)}")
-        response = openai_service.generate_diagram_syntax(
+        # Session store round-trips run on a worker thread, off the event loop
+        diagram_request, diagram_session, previous_syntax, error_msg = await sync_to_async(
+            _prepare_generation, thread_sensitive=False)(data)
+        if error_msg:
+            return jsonify({'success': False, 'error': error_msg}), 400
+        
+        response = await async_openai_service.generate_diagram_syntax(
             prompt=diagram_request.prompt,
             diagram_type=diagram_request.diagram_type,
-            previous_syntax=previous_syntax
+            previous_syntax=previous_syntax,
+            use_semantic_cache=diagram_request.use_semantic_cache
         )
         
         # Update session if successful
         if response.success:
-            diagram_session.add_to_history(response.syntax)
-            diagram_session.diagram_type = diagram_request.diagram_type
-            session['diagram_session'] = diagram_session.to_dict()
+            await sync_to_async(_commit_generation, thread_sensitive=False)(
+                diagram_session, response.syntax, diagram_request.diagram_type)
         
         return jsonify(response.to_dict()), 200 if response.success else 500
         
@@ -95,6 +333,254 @@ def generate_diagram() -> Tuple[Dict[str, Any], int]:
         }), 500
 
 
+def _begin_stream() -> Tuple[Optional[Tuple[Any, int]], Optional[DiagramRequest], Optional[DiagramSession],
+                             Optional[str]]:
+    """
+    Validate a streaming generation request and issue its session id
+    
+    Returns:
+        Tuple of (error_response, diagram_request, diagram_session, previous_syntax),
+        where error_response is None for a valid request
+    """
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return (jsonify({'success': False, 'error': 'No data provided'}), 400), None, None, None
+        
+        diagram_request, diagram_session, previous_syntax, error_msg = _prepare_generation(data)
+        if error_msg:
+            return (jsonify({'success': False, 'error': error_msg}), 400), None, None, None
+        
+        # The id must be in the cookie before the response headers go out
+        _session_id(create=True)
+        return None, diagram_request, diagram_session, previous_syntax
+    
+    except Exception as e:
+        logger.error(f"Error starting diagram stream: {str(e)}")
+        return (jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500), None, None, None
+
+
+def _stream_done_event(diagram_request: DiagramRequest, diagram_session: DiagramSession,
+                       payload: DiagramResponse) -> str:
+    """Validate and commit the final streamed response, formatted as the 'done' event"""
+    result = payload.to_dict()
+    result['committed'] = False
+    if payload.success:
+        validation = diagram_service.validate_syntax(payload.syntax, payload.diagram_type)
+        result['validation'] = validation.to_dict()
+        if validation.is_valid:
+            _commit_generation(diagram_session, payload.syntax, diagram_request.diagram_type)
+            result['committed'] = True
+    return _sse_event('done', result)
+
+
+def _event_stream(events) -> Response:
+    """Wrap Server-Sent Events (a sync or async iterable) in an unbuffered response"""
+    return Response(
+        events,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@api_bp.route('/generate-diagram/stream', methods=['POST'])
+def generate_diagram_stream():
+    """
+    Stream generated diagram syntax as Server-Sent Events
+    
+    Emits a 'line' event per cleaned syntax line and a final 'done' event
+    with the full response and its validation result. Valid results are
+    committed to the session store before the 'done' event is sent.
+    
+    Returns:
+        text/event-stream response, or JSON error for invalid requests
+    """
+    error_response, diagram_request, diagram_session, previous_syntax = _begin_stream()
+    if error_response is not None:
+        return error_response
+    
+    def generate():
+        line_index = 0
+        for event, payload in openai_service.stream_diagram_syntax(
+            prompt=diagram_request.prompt,
+            diagram_type=diagram_request.diagram_type,
+            previous_syntax=previous_syntax,
+            use_semantic_cache=diagram_request.use_semantic_cache
+        ):
+            if event == 'line':
+                yield _sse_event('line', {'index': line_index, 'line': payload})
+                line_index += 1
+                continue
+            yield _stream_done_event(diagram_request, diagram_session, payload)
+    
+    return _event_stream(stream_with_context(generate()))
+
+
+async def generate_diagram_stream_async():
+    """
+    Async variant of generate_diagram_stream served by the ASGI entry point
+    
+    Returns:
+        text/event-stream response, or JSON error for invalid requests
+    """
+    error_response, diagram_request, diagram_session, previous_syntax = await sync_to_async(
+        _begin_stream, thread_sensitive=False)()
+    if error_response is not None:
+        return error_response
+    
+    async def generate():
+        line_index = 0
+        async for event, payload in async_openai_service.stream_diagram_syntax(
+            prompt=diagram_request.prompt,
+            diagram_type=diagram_request.diagram_type,
+            previous_syntax=previous_syntax,
+            use_semantic_cache=diagram_request.use_semantic_cache
+        ):
+            if event == 'line':
+                yield _sse_event('line', {'index': line_index, 'line': payload})
+                line_index += 1
+                continue
+            yield await sync_to_async(_stream_done_event, thread_sensitive=False)(
+                diagram_request, diagram_session, payload)
+    
+    # The ASGI entry point keeps the request context until the body is sent
+    return _event_stream(generate())
+
+
+def _parse_generate_batch() -> Tuple[Optional[Tuple[Any, int]], Dict[int, str], List[Tuple[int, DiagramRequest]]]:
+    """
+    Read a generation batch, rejecting invalid requests up front
+    
+    Returns:
+        Tuple of (error_response, {index: error} for invalid requests, [(index, request)] to generate),
+        where error_response is None unless the whole batch is rejected
+    """
+    data = request.get_json(silent=True)
+    items = data.get('requests') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return (jsonify({'success': False, 'error': 'No requests provided'}), 400), {}, []
+    
+    max_requests = current_app.config['OPENAI_BATCH_MAX_REQUESTS']
+    if len(items) > max_requests:
+        return (jsonify({'success': False, 'error': f'Batch exceeds {max_requests} requests'}), 413), {}, []
+    
+    errors = {}
+    batch = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = 'Request must be an object'
+            continue
+        previous_syntax = item.get('previous_syntax') or None
+        if previous_syntax is not None and not isinstance(previous_syntax, str):
+            errors[index] = 'previous_syntax must be a string'
+            continue
+        diagram_request = DiagramRequest(
+            prompt=item.get('prompt', ''),
+            diagram_type=item.get('diagram_type', 'flowchart'),
+            is_iteration=previous_syntax is not None,
+            previous_syntax=previous_syntax
+        )
+        is_valid, error_msg = diagram_request.validate()
+        if is_valid:
+            batch.append((index, diagram_request))
+        else:
+            errors[index] = error_msg
+    return None, errors, batch
+
+
+@api_bp.route('/generate-batch', methods=['POST'])
+def generate_batch():
+    """
+    Generate many independent diagrams in one request
+    
+    Accepts {"requests": [{"prompt", "diagram_type", "previous_syntax"?}, ...]}
+    (or the bare list)
+    and streams one NDJSON result per request as each finishes. Batch
+    results are not recorded in the session.
+    
+    Returns:
+        NDJSON stream of generation results tagged with their request index
+    """
+    error_response, errors, batch = _parse_generate_batch()
+    if error_response is not None:
+        return error_response
+    
+    def generate():
+        for index, error_msg in errors.items():
+            yield json.dumps({'index': index, 'success': False, 'error': error_msg}) + '\n'
+        try:
+            results = openai_service.generate_many([diagram_request for _, diagram_request in batch])
+            for position, response in results:
+                yield json.dumps({'index': batch[position][0], **response.to_dict()}) + '\n'
+        except Exception as e:
+            logger.error(f"Error generating batch: {str(e)}")
+            yield json.dumps({'success': False, 'error': 'An unexpected error occurred'}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+async def generate_batch_async():
+    """
+    Async variant of generate_batch served by the ASGI entry point
+    
+    Returns:
+        NDJSON stream of generation results tagged with their request index
+    """
+    error_response, errors, batch = _parse_generate_batch()
+    if error_response is not None:
+        return error_response
+    
+    async def generate():
+        for index, error_msg in errors.items():
+            yield json.dumps({'index': index, 'success': False, 'error': error_msg}) + '\n'
+        try:
+            results = async_openai_service.generate_many([diagram_request for _, diagram_request in batch])
+            async for position, response in results:
+                yield json.dumps({'index': batch[position][0], **response.to_dict()}) + '\n'
+        except Exception as e:
+            logger.error(f"Error generating batch: {str(e)}")
+            yield json.dumps({'success': False, 'error': 'An unexpected error occurred'}) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@api_bp.route('/generate-diagram/commit', methods=['POST'])
+def commit_generated_diagram() -> Tuple[Dict[str, Any], int]:
+    """
+    Persist edited or uncommitted streamed syntax into the session once it validates
+    
+    Returns:
+        JSON response with validation result
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('syntax'):
+            return jsonify({'success': False, 'error': 'No syntax provided'}), 400
+        
+        diagram_request, diagram_session, _, error_msg = _prepare_generation(data)
+        if error_msg:
+            return jsonify({'success': False, 'error': error_msg}), 400
+        
+        validation = diagram_service.validate_syntax(data['syntax'], diagram_request.diagram_type)
+        if not validation.is_valid:
+            return jsonify({'success': False, 'validation': validation.to_dict()}), 422
+        
+        _commit_generation(diagram_session, data['syntax'], diagram_request.diagram_type)
+        return jsonify({'success': True, 'validation': validation.to_dict()}), 200
+    
+    except Exception as e:
+        logger.error(f"Error committing diagram: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
 @api_bp.route('/validate-syntax', methods=['POST'])
 def validate_syntax() -> Tuple[Dict[str, Any], int]:
     """
@@ -128,6 +614,306 @@ def validate_syntax() -> Tuple[Dict[str, Any], int]:
         }), 500
 
 
+@api_bp.route('/format', methods=['POST'])
+def format_syntax() -> Tuple[Dict[str, Any], int]:
+    """
+    Format Mermaid syntax into its canonical spelling
+    
+    Expects 'syntax' and 'diagram_type'. Statement order and node ids are
+    kept; only the spelling of each line changes.
+    
+    Returns:
+        JSON response with the formatted syntax and whether it changed
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'syntax' not in data:
+            return jsonify({'success': False, 'error': 'No syntax provided'}), 400
+        
+        syntax = data.get('syntax', '')
+        diagram_type = data.get('diagram_type', 'flowchart')
+        formatted = diagram_service.canonicalize(syntax, diagram_type)
+        
+        return jsonify({
+            'success': True,
+            'syntax': formatted,
+            'changed': formatted != syntax.strip()
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error formatting syntax: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+def _parse_batch_items(body: str) -> Tuple[List[Tuple[str, str]], Dict[int, str], int]:
+    """
+    Parse a validate-batch body given as a JSON array or NDJSON
+    
+    Returns:
+        Tuple of (valid (syntax, diagram_type) pairs, errors by item index, item count)
+    """
+    stripped = body.lstrip()
+    if stripped.startswith('['):
+        entries = [(item, None) for item in json.loads(stripped)]
+    else:
+        entries = []
+        for line in stripped.splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append((json.loads(line), None))
+            except ValueError:
+                entries.append((None, 'Invalid JSON'))
+    
+    pairs = []
+    errors = {}
+    for index, (item, error) in enumerate(entries):
+        if error is None and (not isinstance(item, dict) or not isinstance(item.get('syntax'), str)):
+            error = 'No syntax provided'
+        if error:
+            errors[index] = error
+        else:
+            pairs.append((item['syntax'], item.get('diagram_type', 'flowchart')))
+    return pairs, errors, len(entries)
+
+
+@api_bp.route('/validate-batch', methods=['POST'])
+def validate_batch():
+    """
+    Validate many diagrams in one request
+    
+    Accepts a JSON array or NDJSON of {"syntax", "diagram_type"} objects and
+    streams one NDJSON result per item, in input order.
+    
+    Returns:
+        NDJSON stream of validation results tagged with their item index
+    """
+    try:
+        pairs, errors, count = _parse_batch_items(request.get_data(as_text=True))
+    except ValueError:
+        return jsonify({'error': 'Body must be a JSON array or NDJSON'}), 400
+    
+    max_items = current_app.config['VALIDATE_BATCH_MAX_ITEMS']
+    if count > max_items:
+        return jsonify({'error': f'Batch exceeds {max_items} items'}), 413
+    
+    results = diagram_service.validate_many(
+        pairs,
+        workers=current_app.config['VALIDATE_BATCH_WORKERS'],
+        chunk_size=current_app.config['VALIDATE_BATCH_CHUNK_SIZE']
+    )
+    
+    def generate():
+        try:
+            for index in range(count):
+                if index in errors:
+                    payload = {'is_valid': False, 'error': errors[index]}
+                else:
+                    payload = next(results).to_dict()
+                yield json.dumps({'index': index, **payload}) + '\n'
+        except Exception as e:
+            logger.error(f"Error validating batch: {str(e)}")
+            yield json.dumps({'error': 'An unexpected error occurred'}) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@api_bp.route('/validate-incremental', methods=['POST'])
+def validate_incremental() -> Tuple[Dict[str, Any], int]:
+    """
+    Validate Mermaid syntax from line edits against a previously validated version
+    
+    Send either the full 'syntax', or the 'base_hash' returned by an earlier
+    call plus 'edits' ([{start, end, lines}], 0-based, end exclusive).
+    
+    Returns:
+        JSON response with validation result and the new document hash, or
+        409 when the base document is unknown and the full syntax is needed
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or ('syntax' not in data and 'base_hash' not in data):
+            return jsonify({
+                'is_valid': False,
+                'error': 'No syntax provided'
+            }), 400
+        
+        diagram_type = data.get('diagram_type', 'flowchart')
+        
+        if 'base_hash' in data:
+            try:
+                edits = [LineEdit.from_dict(edit) for edit in data.get('edits', [])]
+                outcome = incremental_validator.apply_edits(data['base_hash'], edits, diagram_type)
+            except (KeyError, TypeError, ValueError) as e:
+                return jsonify({'is_valid': False, 'error': f'Invalid edits: {str(e)}', 'resync': True}), 400
+            
+            if outcome is None:
+                return jsonify({'is_valid': False, 'error': 'Unknown base document', 'resync': True}), 409
+        else:
+            outcome = incremental_validator.validate_full(data.get('syntax', ''), diagram_type)
+        
+        document_hash, result = outcome
+        response = result.to_dict()
+        response['document_hash'] = document_hash
+        return jsonify(response), 200
+    
+    except Exception as e:
+        logger.error(f"Error validating syntax incrementally: {str(e)}")
+        return jsonify({
+            'is_valid': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+def _render_artifact(data: Dict[str, Any]) -> Tuple[str, bytes]:
+    """
+    Render a request's diagram as SVG, reusing the stored artifact when there is one
+    
+    Returns:
+        Tuple of (render key, SVG bytes)
+    
+    Raises:
+        RenderError: If the diagram cannot be rendered
+    """
+    syntax = data['syntax']
+    diagram_type = data.get('diagram_type', 'pie')
+    theme = data.get('theme', 'default')
+    key = render_key(syntax, diagram_type, theme)
+    
+    store = _get_artifact_store()
+    path = store.get(key, 'svg') if store is not None else None
+    if path is not None:
+        with open(path, 'rb') as f:
+            return key, f.read()
+    
+    svg = _get_renderer().render(syntax, diagram_type, theme).encode('utf-8')
+    if store is not None:
+        store.put(key, 'svg', svg)
+    return key, svg
+
+
+def _artifact_url(key: str, kind: str) -> str:
+    return url_for('api.get_artifact', key=key, kind=kind)
+
+
+@api_bp.route('/render', methods=['POST'])
+def render_diagram():
+    """
+    Render a pie, quadrant or Gantt chart as SVG on the server
+    
+    Expects 'syntax', 'diagram_type' and optionally 'theme'.
+    
+    Returns:
+        The SVG document with its ETag and, when the artifact store is enabled, its URL
+        (Content-Location), or a JSON error with the offending line for unsupported types
+        and syntax that cannot be drawn
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'syntax' not in data:
+            return jsonify({'success': False, 'error': 'No syntax provided'}), 400
+        
+        try:
+            key, svg = _render_artifact(data)
+        except RenderError as e:
+            return jsonify({'success': False, 'error': str(e), 'line_number': e.line_number}), 400
+        
+        response = Response(svg, mimetype=ARTIFACT_TYPES['svg'])
+        response.set_etag(f"{key}.svg")
+        if _get_artifact_store() is not None:
+            response.headers['Content-Location'] = _artifact_url(key, 'svg')
+        return response
+    
+    except Exception as e:
+        logger.error(f"Error rendering diagram: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+@api_bp.route('/artifacts', methods=['POST'])
+def create_artifact() -> Tuple[Dict[str, Any], int]:
+    """
+    Render a diagram into the artifact store and return its URLs
+    
+    Expects 'syntax', 'diagram_type' and optionally 'theme'.
+    
+    Returns:
+        JSON response with the render key and the GET URL of each available format
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'syntax' not in data:
+            return jsonify({'success': False, 'error': 'No syntax provided'}), 400
+        if _get_artifact_store() is None:
+            return jsonify({'success': False, 'error': 'Artifact store is disabled'}), 404
+        
+        try:
+            key, _ = _render_artifact(data)
+        except RenderError as e:
+            return jsonify({'success': False, 'error': str(e), 'line_number': e.line_number}), 400
+        
+        urls = {'svg': _artifact_url(key, 'svg')}
+        if png_available():
+            urls['png'] = _artifact_url(key, 'png')
+        return jsonify({'success': True, 'key': key, 'urls': urls}), 200
+    
+    except Exception as e:
+        logger.error(f"Error creating artifact: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+@api_bp.route('/artifacts/<string(length=64):key>.<kind>', methods=['GET'])
+def get_artifact(key: str, kind: str):
+    """
+    Serve a stored artifact with a strong ETag and immutable caching
+    
+    PNGs are rasterized from the stored SVG on first request when cairosvg
+    is installed.
+    
+    Returns:
+        The file, 304 when the client's ETag matches, 404 for unknown
+        artifacts or 501 when PNG output is unavailable
+    """
+    store = _get_artifact_store()
+    if store is None or kind not in ARTIFACT_TYPES or not is_artifact_key(key):
+        return jsonify({'error': 'Not found'}), 404
+    
+    # Keys name their content, so a matching ETag is answered without touching the disk
+    etag = f"{key}.{kind}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        path = store.get(key, kind)
+        if path is None and kind == 'png':
+            svg_path = store.get(key, 'svg')
+            if svg_path is not None:
+                if not png_available():
+                    return jsonify({'error': 'PNG output needs the cairosvg package'}), 501
+                with open(svg_path, 'rb') as f:
+                    path = store.put(key, 'png', rasterize_png(f.read()))
+        if path is None:
+            return jsonify({'error': 'Not found'}), 404
+        response = send_file(os.path.abspath(path), mimetype=ARTIFACT_TYPES[kind], etag=False)
+    
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = ARTIFACT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 @api_bp.route('/clear-session', methods=['POST'])
 def clear_session() -> Tuple[Dict[str, Any], int]:
     """
@@ -137,6 +923,10 @@ def clear_session() -> Tuple[Dict[str, Any], int]:
         JSON response confirming session cleared
     """
     try:
+        session_id = _session_id()
+        if session_id:
+            _get_session_store().delete(session_id)
+        session.pop('session_id', None)
         session.pop('diagram_session', None)
         return jsonify({'success': True, 'message': 'Session cleared'}), 200
         
@@ -157,12 +947,15 @@ def get_session_info() -> Tuple[Dict[str, Any], int]:
         JSON response with session data
     """
     try:
-        session_data = session.get('diagram_session', {})
-        diagram_session = DiagramSession.from_dict(session_data)
+        diagram_session = _load_diagram_session(include_history=True)
         
         return jsonify({
             'success': True,
-            'session': diagram_session.to_dict(),
+            'session': {
+                'current_syntax': diagram_session.current_syntax,
+                'diagram_type': diagram_session.diagram_type,
+                'history': diagram_session.get_history()
+            },
             'has_current_diagram': bool(diagram_session.current_syntax)
         }), 200
         
@@ -174,6 +967,228 @@ def get_session_info() -> Tuple[Dict[str, Any], int]:
         }), 500
 
 
+def _session_version(diagram_session: DiagramSession, index: int) -> str:
+    """
+    Syntax of one version of the session, oldest first
+    
+    The current syntax is the last version; negative indexes count from it
+    backwards (-1 is the current syntax, -2 the one before).
+    
+    Raises:
+        IndexError: If there is no such version
+    """
+    count = len(diagram_session.history) + 1 if diagram_session.current_syntax else 0
+    if index < 0:
+        index += count
+    if not 0 <= index < count:
+        raise IndexError("version index out of range")
+    if index == count - 1:
+        return diagram_session.current_syntax
+    return diagram_session.history.version(index, diagram_session.current_syntax)
+
+
+@api_bp.route('/diff', methods=['POST'])
+def diff_versions() -> Tuple[Dict[str, Any], int]:
+    """
+    Structural diff between two diagram versions
+    
+    Compares either 'old_syntax' and 'new_syntax', or the session versions
+    'from' and 'to' (indexes into the history with the current syntax last,
+    negative counting back from it; default -2 and -1).
+    
+    Returns:
+        JSON response with the patch of added, removed and changed elements
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        if 'old_syntax' in data or 'new_syntax' in data:
+            old_syntax = data.get('old_syntax') or ''
+            new_syntax = data.get('new_syntax') or ''
+            if not all(isinstance(syntax, str) for syntax in (old_syntax, new_syntax)):
+                return jsonify({'success': False, 'error': "'old_syntax' and 'new_syntax' must be strings"}), 400
+            diagram_type = data.get('diagram_type', 'flowchart')
+            versions = {}
+        else:
+            old_index, new_index = data.get('from', -2), data.get('to', -1)
+            if not all(isinstance(index, int) and not isinstance(index, bool) for index in (old_index, new_index)):
+                return jsonify({'success': False, 'error': "'from' and 'to' must be integers"}), 400
+            
+            diagram_session = _load_diagram_session(include_history=True)
+            try:
+                old_syntax = _session_version(diagram_session, old_index)
+                new_syntax = _session_version(diagram_session, new_index)
+            except IndexError:
+                return jsonify({'success': False, 'error': 'No such version in the session history'}), 404
+            diagram_type = data.get('diagram_type', diagram_session.diagram_type)
+            versions = {'from': old_index, 'to': new_index}
+        
+        patch = diagram_service.diff(old_syntax, new_syntax, diagram_type)
+        
+        return jsonify({
+            'success': True,
+            'diagram_type': diagram_type,
+            **versions,
+            'identical': not patch,
+            'patch': patch
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error computing diff: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+@api_bp.route('/cache-stats', methods=['GET'])
+def get_cache_stats() -> Tuple[Dict[str, Any], int]:
+    """
+    Get response cache, semantic cache, request coalescing, edit-script, repair and rendering counters
+    
+    Returns:
+        JSON response with hit/miss/eviction counts, the semantic reuse rate, coalescing events,
+        how many iterations were served by an edit script, how many invalid answers were repaired
+        locally or with a second call, and how many SVG renders were cached
+    """
+    try:
+        stats = openai_service.cache_stats()
+        semantic_stats = openai_service.semantic_cache_stats()
+        coalescing_stats = openai_service.coalescing_stats()
+        edit_stats = openai_service.edit_script_stats()
+        repair_stats = openai_service.syntax_repair_stats()
+        store = _get_artifact_store()
+        artifact_stats = store.store_stats() if store is not None else None
+        return jsonify({
+            'success': True,
+            'enabled': stats is not None,
+            'stats': stats,
+            'semantic': {
+                'enabled': semantic_stats is not None,
+                'stats': semantic_stats
+            },
+            'coalescing': {
+                'enabled': coalescing_stats is not None,
+                'stats': coalescing_stats
+            },
+            'edit_scripts': {
+                'enabled': edit_stats is not None,
+                'stats': edit_stats
+            },
+            'repairs': {
+                'enabled': repair_stats is not None,
+                'stats': repair_stats
+            },
+            'render': _get_renderer().render_stats(),
+            'artifacts': {
+                'enabled': artifact_stats is not None,
+                'stats': artifact_stats
+            }
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error getting cache stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+@api_bp.route('/rate-limit-stats', methods=['GET'])
+def get_rate_limit_stats() -> Tuple[Dict[str, Any], int]:
+    """
+    Get OpenAI rate limiter metrics
+    
+    Returns:
+        JSON response with queue depth per priority, current budgets and retry counters
+    """
+    try:
+        stats = openai_service.rate_limit_stats()
+        return jsonify({
+            'success': True,
+            'enabled': stats is not None,
+            'stats': stats
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error getting rate limit stats: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+def _get_profiler():
+    """Get the request profiler if profiling is enabled and the caller may read profiles"""
+    profiler = current_app.extensions.get('profiler')
+    if profiler is None or not profiler.is_authorized(request.headers.get(profiler.header)):
+        return None
+    return profiler
+
+
+@api_bp.route('/debug/profiles', methods=['GET'])
+def list_profiles() -> Tuple[Dict[str, Any], int]:
+    """
+    List the stored request profiles
+    
+    Returns:
+        JSON response with profile summaries, newest first, and profiler counters
+    """
+    profiler = _get_profiler()
+    if profiler is None:
+        return jsonify({'error': 'Not found'}), 404
+    
+    try:
+        return jsonify({
+            'success': True,
+            'profiles': profiler.list_profiles(),
+            'stats': profiler.stats.to_dict()
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"Error listing profiles: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'An unexpected error occurred'
+        }), 500
+
+
+@api_bp.route('/debug/profiles/<profile_id>/<kind>', methods=['GET'])
+def get_profile(profile_id: str, kind: str):
+    """
+    Download one stored profile
+    
+    Args:
+        profile_id: Id from the profile listing
+        kind: 'pstats' for the cProfile dump, 'collapsed' for flame graph input
+    
+    Returns:
+        The profile file
+    """
+    profiler = _get_profiler()
+    path = profiler.profile_path(profile_id, kind) if profiler is not None else None
+    if path is None:
+        return jsonify({'error': 'Not found'}), 404
+    
+    if kind == 'collapsed':
+        return send_file(os.path.abspath(path), mimetype='text/plain')
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f"{profile_id}.pstats")
+
+
+# Async implementations of api_bp endpoints, used in place of the sync
+# views when the app is served through asgi.create_asgi_app. Only the
+# generations, which mostly wait on OpenAI, run on the event loop, with
+# their cache and session store calls on worker threads; every other view
+# renders, validates or does file or store I/O and is served by the Flask
+# WSGI app on its thread pool.
+ASYNC_VIEWS = {
+    'api.generate_diagram': generate_diagram_async,
+    'api.generate_diagram_stream': generate_diagram_stream_async,
+    'api.generate_batch': generate_batch_async,
+}
+
+
 def register_error_handlers(app):
     """Register error handlers for the application"""
     
@@ -0,0 +1,225 @@
+"""
+Content-addressed store for rendered diagrams
+
+Rendered SVG (and PNG, where cairosvg is installed) is written to local
+disk under the render key, a hash of the renderer version, syntax,
+diagram type and theme. Since a key always names the same bytes, the files
+can be served with strong ETags and cached by browsers as immutable. The
+store is bounded by total size and evicts the least recently read files
+first; reads touch a file's mtime so the order survives restarts.
+"""
+
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_TYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+_ARTIFACT_KEY = re.compile(r'[0-9a-f]{64}')
+
+
+def is_artifact_key(key: str) -> bool:
+    """Whether key looks like a render key, so it is safe to use in a path"""
+    return bool(_ARTIFACT_KEY.fullmatch(key))
+
+
+def png_available() -> bool:
+    """Whether PNG artifacts can be produced (needs the optional cairosvg package)"""
+    try:
+        import cairosvg  # noqa: F401
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+def rasterize_png(svg: bytes) -> bytes:
+    """
+    Convert an SVG document to PNG
+    
+    Raises:
+        ImportError: If cairosvg is not installed
+    """
+    import cairosvg
+    return cairosvg.svg2png(bytestring=svg)
+
+
+@dataclass
+class ArtifactStats:
+    """Counters describing the artifact store"""
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions
+        }
+
+
+class ArtifactStore:
+    """Size-bounded LRU directory of rendered artifacts"""
+    
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize the store, indexing the files already on disk
+        
+        Args:
+            directory: Where artifacts are written
+            max_bytes: Total size kept before the least recently used files are deleted
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.stats = ArtifactStats()
+        self._entries: 'OrderedDict[Tuple[str, str], int]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+    
+    def path(self, key: str, kind: str) -> str:
+        """File path of an artifact, whether or not it exists"""
+        return os.path.join(self.directory, key[:2], f"{key}.{kind}")
+    
+    def get(self, key: str, kind: str) -> Optional[str]:
+        """
+        Find a stored artifact and mark it as recently used
+        
+        Args:
+            key: Render key
+            kind: 'svg' or 'png'
+        
+        Returns:
+            Path of the file, or None if it is not stored
+        """
+        path = self.path(key, kind)
+        try:
+            size = os.stat(path).st_size
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                # Evicted by another worker sharing the directory
+                self.current_bytes -= self._entries.pop((key, kind), 0)
+                self.stats.misses += 1
+            return None
+        
+        with self._lock:
+            self.stats.hits += 1
+            # Another worker may have written it; adopt it into this process's index
+            if (key, kind) not in self._entries:
+                self._entries[(key, kind)] = size
+                self.current_bytes += size
+            self._entries.move_to_end((key, kind))
+            self._evict()
+        return path
+    
+    def put(self, key: str, kind: str, data: bytes) -> str:
+        """
+        Store an artifact, replacing any previous copy
+        
+        Args:
+            key: Render key
+            kind: 'svg' or 'png'
+            data: File contents
+        
+        Returns:
+            Path of the stored file
+        """
+        path = self.path(key, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a reader never sees a partial artifact
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except OSError:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+        
+        with self._lock:
+            self.current_bytes += len(data) - self._entries.pop((key, kind), 0)
+            self._entries[(key, kind)] = len(data)
+            self.stats.writes += 1
+            self._evict(keep=(key, kind))
+        return path
+    
+    def store_stats(self) -> Dict[str, Any]:
+        """
+        Counters plus the current size of the store
+        
+        Returns:
+            Dictionary for JSON serialization
+        """
+        with self._lock:
+            stats = self.stats.to_dict()
+            stats.update({'entries': len(self._entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes})
+        return stats
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _load(self) -> None:
+        """Index existing artifacts, oldest mtime first"""
+        found = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                key, _, kind = name.partition('.')
+                if kind not in ARTIFACT_TYPES or not is_artifact_key(key):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, key, kind, stat.st_size))
+        for _, key, kind, size in sorted(found):
+            self._entries[(key, kind)] = size
+            self.current_bytes += size
+        self._evict()
+    
+    def _evict(self, keep: Optional[Tuple[str, str]] = None) -> None:
+        while self.current_bytes > self.max_bytes and self._entries:
+            entry, size = next(iter(self._entries.items()))
+            if entry == keep:
+                break
+            del self._entries[entry]
+            self.current_bytes -= size
+            self.stats.evictions += 1
+            try:
+                os.unlink(self.path(*entry))
+            except OSError:
+                pass
+
+
+def create_artifact_store(config: Mapping[str, Any]) -> Optional[ArtifactStore]:
+    """
+    Create the artifact store configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        ArtifactStore, or None when the store is disabled or its directory cannot be created
+    """
+    if not config.get('ARTIFACT_STORE_ENABLED', True):
+        return None
+    directory = config.get('ARTIFACT_STORE_DIR') or 'artifacts'
+    try:
+        return ArtifactStore(directory, max_bytes=config.get('ARTIFACT_STORE_MAX_BYTES', 256 * 1024 * 1024))
+    except OSError as e:
+        logger.error(f"Error creating artifact store in {directory}: {str(e)}")
+        return None
@@ -0,0 +1,369 @@
+"""
+Async OpenAI service for generating Mermaid diagram syntax
+"""
+
+from asgiref.sync import sync_to_async
+from flask import current_app
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from models import DiagramRequest, DiagramResponse, ValidationResult
+from services import metrics
+from services.http_transport import transport_options
+from services.openai_service import OpenAIService, StreamingSyntaxCleaner, retryable_errors
+from services.rate_limiter import PRIORITY_BATCH, PRIORITY_ITERATION, PRIORITY_NAMES, PRIORITY_NEW
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOpenAIService(OpenAIService):
+    """
+    Service for interacting with OpenAI API without blocking the event loop
+    
+    Mirrors OpenAIService, sharing its prompts, cleaning, caches, request
+    coalescer and rate limiter, but awaits the completion on AsyncOpenAI so
+    one process can keep many generations in flight. Cache reads and writes,
+    which may hit SQLite, Redis or the embeddings API, run on worker threads.
+    """
+    
+    def _get_client(self):
+        """Get the async OpenAI client"""
+        self._drop_forked_client()
+        if not self.client:
+            api_key = current_app.config.get('OPENAI_API_KEY')
+            if not api_key:
+                raise ValueError("OpenAI API key not configured")
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            options = transport_options(current_app.config)
+            self._http_client = DefaultAsyncHttpxClient(
+                event_hooks={'response': [self._observe_response_async]}, **options
+            )
+            self.client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=current_app.config.get('OPENAI_BASE_URL'),
+                max_retries=0,
+                timeout=options['timeout'],
+                http_client=self._http_client
+            )
+            self._client_pid = os.getpid()
+        return self.client
+    
+    async def warm_up(self) -> bool:
+        """
+        Async counterpart of OpenAIService.warm_up
+        
+        The client's connections belong to the event loop that opened them,
+        so this runs on the serving loop (see asgi.AsyncFlaskApp).
+        
+        Returns:
+            True if a connection was established
+        """
+        try:
+            client = self._get_client()
+            started = time.perf_counter()
+            await self._http_client.head(str(client.base_url))
+        except Exception as e:
+            logger.warning(f"OpenAI connection warm-up failed: {str(e)}")
+            return False
+        logger.info(f"OpenAI connection warmed up in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return True
+    
+    async def _observe_response_async(self, response) -> None:
+        self._observe_response(response)
+    
+    async def _create_completion(self, messages: List[Dict[str, str]], priority: int, **kwargs):
+        """
+        Async counterpart of OpenAIService._create_completion
+        
+        Waiting for the rate limiter is awaited too, so queued calls hold no thread.
+        """
+        client = self._get_client()
+        rate_limiter = self._get_rate_limiter()
+        config = current_app.config
+        max_tokens = kwargs.pop('max_tokens', config['OPENAI_MAX_TOKENS'])
+        tokens = self._estimate_message_tokens(messages, max_tokens)
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        if kwargs.get('stream') and metrics.registry is not None:
+            kwargs.setdefault('stream_options', {'include_usage': True})
+        
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async(tokens, priority)
+            try:
+                with metrics.timer('openai_request_duration_seconds', priority=priority_name,
+                                   call='stream' if kwargs.get('stream') else 'complete'):
+                    response = await client.chat.completions.create(
+                        model=config['OPENAI_MODEL'],
+                        messages=messages,
+                        temperature=config['OPENAI_TEMPERATURE'],
+                        max_tokens=max_tokens,
+                        **kwargs
+                    )
+                if not kwargs.get('stream'):
+                    self._record_usage(getattr(response, 'usage', None), priority_name)
+                return response
+            except retryable_errors() as e:
+                if attempt >= config['OPENAI_MAX_RETRIES']:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                logger.warning(f"OpenAI request failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+    
+    @staticmethod
+    async def _in_thread(func: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking call on a worker thread, keeping the app and request context"""
+        return await sync_to_async(func, thread_sensitive=False)(*args)
+    
+    async def generate_diagram_syntax(self, prompt: str, diagram_type: str, previous_syntax: Optional[str] = None,
+                                      use_semantic_cache: bool = True) -> DiagramResponse:
+        """
+        Generate Mermaid diagram syntax from natural language prompt
+        
+        Args:
+            prompt: Natural language description of the diagram
+            diagram_type: Type of diagram to generate
+            previous_syntax: Previous diagram syntax for iterative updates
+            use_semantic_cache: Allow the answer to a similar earlier prompt to be served
+        
+        Returns:
+            DiagramResponse with generated syntax or error
+        """
+        try:
+            cache_key, cached = await self._in_thread(self._lookup_answer, prompt, diagram_type, previous_syntax,
+                                                      use_semantic_cache)
+            if cached is not None:
+                return cached
+            
+            return await self._generate_coalesced_async(prompt, diagram_type, previous_syntax, cache_key)
+        
+        except Exception as e:
+            logger.error(f"Error generating diagram syntax: {str(e)}")
+            return DiagramResponse(
+                syntax='',
+                diagram_type=diagram_type,
+                success=False,
+                error=f"API request failed: {str(e)}"
+            )
+    
+    async def _generate_coalesced_async(self, prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                                        cache_key: str, priority: Optional[int] = None) -> DiagramResponse:
+        """Async counterpart of OpenAIService._generate_coalesced"""
+        async def generate() -> DiagramResponse:
+            return await self._generate_fresh_async(prompt, diagram_type, previous_syntax, cache_key, priority)
+        
+        # Identical requests in flight on either service share one upstream call
+        single_flight = self._get_single_flight()
+        if single_flight is None:
+            return await generate()
+        response, _ = await single_flight.do_async(cache_key, generate)
+        return response
+    
+    async def _generate_fresh_async(self, prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                                    cache_key: str, priority: Optional[int] = None) -> DiagramResponse:
+        """Async counterpart of OpenAIService._generate_fresh"""
+        try:
+            syntax, validation = await self._complete_async(prompt, diagram_type, previous_syntax, priority)
+            return await self._in_thread(self._answer, prompt, diagram_type, previous_syntax, cache_key, syntax,
+                                         validation)
+        
+        except Exception as e:
+            logger.error(f"Error generating diagram syntax: {str(e)}")
+            return DiagramResponse(
+                syntax='',
+                diagram_type=diagram_type,
+                success=False,
+                error=f"API request failed: {str(e)}"
+            )
+    
+    async def _complete_async(self, prompt: str, diagram_type: str, previous_syntax: Optional[str] = None,
+                              priority: Optional[int] = None) -> Tuple[str, Optional[ValidationResult]]:
+        """Async counterpart of OpenAIService._complete"""
+        started = time.monotonic()
+        if priority is None:
+            priority = PRIORITY_ITERATION if previous_syntax else PRIORITY_NEW
+        
+        syntax = await self._try_edit_script_async(prompt, diagram_type, previous_syntax, priority)
+        if syntax is not None:
+            return syntax, None
+        
+        response = await self._create_completion(
+            self._build_messages(prompt, diagram_type, previous_syntax),
+            priority
+        )
+        syntax = self._clean_syntax(response.choices[0].message.content.strip())
+        return await self._validate_and_repair_async(syntax, diagram_type, priority, started)
+    
+    async def _try_edit_script_async(self, prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                                     priority: int) -> Optional[str]:
+        """Async counterpart of OpenAIService._try_edit_script"""
+        if not self._use_edit_script(previous_syntax):
+            return None
+        response = await self._create_completion(
+            self._build_edit_messages(prompt, diagram_type, previous_syntax),
+            priority,
+            max_tokens=current_app.config['OPENAI_EDIT_MAX_TOKENS']
+        )
+        return self._apply_edit_answer(previous_syntax, diagram_type, response.choices[0].message.content)
+    
+    async def _validate_and_repair_async(self, syntax: str, diagram_type: str, priority: int,
+                                         started: float) -> Tuple[str, Optional[ValidationResult]]:
+        """Async counterpart of OpenAIService._validate_and_repair"""
+        if not current_app.config.get('OPENAI_REPAIR_ENABLED', False):
+            return syntax, None
+        syntax, validation = self._repair_locally(syntax, diagram_type)
+        if validation.is_valid:
+            return syntax, validation
+        
+        for _ in range(current_app.config['OPENAI_REPAIR_MAX_REPROMPTS']):
+            remaining = self._repair_time_left(started)
+            if remaining is None:
+                break
+            try:
+                response = await self._create_completion(
+                    self._build_repair_messages(syntax, diagram_type, validation),
+                    priority,
+                    max_tokens=current_app.config['OPENAI_REPAIR_MAX_TOKENS'],
+                    timeout=remaining
+                )
+            except Exception as e:
+                logger.warning(f"Repair request failed: {str(e)}")
+                break
+            syntax, validation = self._apply_repair_answer(syntax, diagram_type, response.choices[0].message.content)
+            if validation.is_valid:
+                break
+        
+        self._record_repair_result(validation)
+        return syntax, validation
+    
+    async def stream_diagram_syntax(self, prompt: str, diagram_type: str, previous_syntax: Optional[str] = None,
+                                    use_semantic_cache: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Async counterpart of OpenAIService.stream_diagram_syntax
+        
+        Yields:
+            ('line', str) for each cleaned syntax line, then a final
+            ('done', DiagramResponse) carrying the fully cleaned syntax
+        """
+        try:
+            cache_key, cached = await self._in_thread(self._lookup_answer, prompt, diagram_type, previous_syntax,
+                                                      use_semantic_cache)
+            if cached is not None:
+                for event in self._replay(cached):
+                    yield event
+                return
+            
+            # An identical generation in flight is replayed once it finishes
+            single_flight = self._get_single_flight()
+            call, leader = single_flight.join(cache_key) if single_flight is not None else (None, True)
+            if not leader:
+                found, response = await single_flight.wait_async(call)
+                if found:
+                    for event in self._replay(response):
+                        yield event
+                    return
+            
+            try:
+                started = time.monotonic()
+                priority = PRIORITY_ITERATION if previous_syntax else PRIORITY_NEW
+                syntax = await self._try_edit_script_async(prompt, diagram_type, previous_syntax, priority)
+                validation = None
+                if syntax is not None:
+                    for line in syntax.split('\n'):
+                        yield 'line', line
+                else:
+                    stream = await self._create_completion(
+                        self._build_messages(prompt, diagram_type, previous_syntax),
+                        priority,
+                        stream=True
+                    )
+                    
+                    cleaner = StreamingSyntaxCleaner()
+                    raw_parts = []
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            self._record_usage(getattr(chunk, 'usage', None), PRIORITY_NAMES[priority])
+                            continue
+                        content = chunk.choices[0].delta.content
+                        if not content:
+                            continue
+                        raw_parts.append(content)
+                        for line in cleaner.feed(content):
+                            yield 'line', line
+                    
+                    for line in cleaner.finish():
+                        yield 'line', line
+                    
+                    syntax = self._clean_syntax(''.join(raw_parts).strip())
+                    syntax, validation = await self._validate_and_repair_async(syntax, diagram_type, priority,
+                                                                               started)
+                response = await self._in_thread(self._answer, prompt, diagram_type, previous_syntax, cache_key,
+                                                 syntax, validation)
+            except BaseException as e:
+                if leader and call is not None:
+                    single_flight.finish(cache_key, call, error=e)
+                raise
+            if leader and call is not None:
+                single_flight.finish(cache_key, call, result=response)
+            yield 'done', response
+        
+        except Exception as e:
+            logger.error(f"Error streaming diagram syntax: {str(e)}")
+            yield 'done', DiagramResponse(
+                syntax='',
+                diagram_type=diagram_type,
+                success=False,
+                error=f"API request failed: {str(e)}"
+            )
+    
+    async def generate_many(self, requests: List[DiagramRequest], max_in_flight: Optional[int] = None,
+                            tokens_per_minute: Optional[int] = None) -> AsyncIterator[Tuple[int, DiagramResponse]]:
+        """
+        Async counterpart of OpenAIService.generate_many
+        
+        Requests run as tasks on the event loop rather than on worker threads.
+        
+        Yields:
+            Tuple of (request_index, DiagramResponse) as each request completes
+        """
+        max_in_flight, budget, queue, cached = await self._in_thread(self._plan_batch, requests, max_in_flight,
+                                                                     tokens_per_minute)
+        for result in cached:
+            yield result
+        
+        async def generate(key: str, diagram_request: DiagramRequest) -> DiagramResponse:
+            return await self._generate_coalesced_async(diagram_request.prompt, diagram_request.diagram_type,
+                                                        diagram_request.previous_syntax, key, PRIORITY_BATCH)
+        
+        pending = {}
+        try:
+            while queue or pending:
+                # Start while there is room in flight and budget to spend
+                wait_time = None
+                while queue and len(pending) < max_in_flight:
+                    key, indices = queue[0]
+                    diagram_request = requests[indices[0]]
+                    if budget is not None:
+                        wait_time = budget.reserve(self._estimate_tokens(diagram_request))
+                        if wait_time:
+                            break
+                    queue.popleft()
+                    pending[asyncio.ensure_future(generate(key, diagram_request))] = (key, indices)
+                
+                if not pending:
+                    await asyncio.sleep(wait_time)
+                    continue
+                
+                done, _ = await asyncio.wait(pending, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    key, indices = pending.pop(task)
+                    response = self._batch_response(requests[indices[0]].diagram_type, task)
+                    for index in indices:
+                        yield index, response
+        finally:
+            for task in pending:
+                task.cancel()
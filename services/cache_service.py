@@ -0,0 +1,289 @@
+"""
+Response cache for generated Mermaid diagram syntax
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Mapping
+
+from services.canonical_syntax import canonicalize
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalize a prompt for cache keying
+    
+    Collapses runs of whitespace and trims the ends so that prompts which
+    only differ in spacing share a cache entry.
+    """
+    return ' '.join((prompt or '').split())
+
+
+def make_cache_key(prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                   config: Mapping[str, Any]) -> str:
+    """
+    Build a content-addressed cache key for a generation request
+    
+    The previous syntax is keyed by its canonical form, so iterations on
+    diagrams that differ only in formatting share an entry.
+    
+    Args:
+        prompt: Natural language description of the diagram
+        diagram_type: Type of diagram to generate
+        previous_syntax: Previous diagram syntax for iterative updates
+        config: Application config providing the model settings
+    
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = json.dumps([
+        normalize_prompt(prompt),
+        diagram_type,
+        canonicalize(previous_syntax or '', diagram_type),
+        config.get('OPENAI_MODEL'),
+        config.get('OPENAI_TEMPERATURE'),
+        config.get('OPENAI_MAX_TOKENS'),
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """Counters describing cache effectiveness"""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups served from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hit_rate
+        }
+
+
+class CacheBackend:
+    """Base class for response cache backends"""
+    
+    def __init__(self, ttl: Optional[float] = None):
+        """
+        Initialize the backend
+        
+        Args:
+            ttl: Seconds an entry stays valid, or None to never expire
+        """
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None on a miss"""
+        raise NotImplementedError
+    
+    def set(self, key: str, value: str) -> None:
+        """Store value under key"""
+        raise NotImplementedError
+    
+    def clear(self) -> None:
+        """Remove every entry from the cache"""
+        raise NotImplementedError
+    
+    def __len__(self) -> int:
+        raise NotImplementedError
+    
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU cache bounded by entry count and byte budget"""
+    
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        """
+        Initialize the in-memory cache
+        
+        Args:
+            max_entries: Maximum number of entries kept
+            max_bytes: Maximum total size of keys and values, or None for no limit
+            ttl: Seconds an entry stays valid, or None to never expire
+        """
+        super().__init__(ttl=ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: 'OrderedDict[str, tuple[str, float, int]]' = OrderedDict()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            
+            value, stored_at, size = entry
+            if self._is_expired(stored_at, time.monotonic()):
+                self._remove(key)
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+    
+    def set(self, key: str, value: str) -> None:
+        size = len(key) + len(value.encode('utf-8'))
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Never let a single oversized entry flush the whole cache
+            return
+        
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic(), size)
+            self.current_bytes += size
+            
+            while self._entries and (
+                len(self._entries) > self.max_entries or
+                (self.max_bytes is not None and self.current_bytes > self.max_bytes)
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.stats.evictions += 1
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+class SQLiteCache(CacheBackend):
+    """On-disk cache that survives process restarts"""
+    
+    def __init__(self, path: str, max_entries: int = 10000, ttl: Optional[float] = None):
+        """
+        Initialize the SQLite cache
+        
+        Args:
+            path: Database file path
+            max_entries: Maximum number of entries kept
+            ttl: Seconds an entry stays valid, or None to never expire
+        """
+        super().__init__(ttl=ttl)
+        self.path = path
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'stored_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS response_cache_accessed '
+                'ON response_cache (accessed_at)'
+            )
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, stored_at FROM response_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            
+            value, stored_at = row
+            # Wall-clock time here since entries outlive the process
+            now = time.time()
+            with self._conn:
+                if self._is_expired(stored_at, now):
+                    self._conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                    self.stats.expirations += 1
+                    self.stats.misses += 1
+                    return None
+                self._conn.execute(
+                    'UPDATE response_cache SET accessed_at = ? WHERE key = ?', (now, key)
+                )
+            
+            self.stats.hits += 1
+            return value
+    
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?)', (key, value, now, now)
+            )
+            overflow = self._conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM response_cache WHERE key IN ('
+                    'SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)', (overflow,)
+                )
+                self.stats.evictions += overflow
+    
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM response_cache')
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0]
+
+
+def create_cache(config: Mapping[str, Any]) -> Optional[CacheBackend]:
+    """
+    Create the response cache configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        Cache backend, or None when caching is disabled
+    """
+    backend = (config.get('RESPONSE_CACHE_BACKEND') or 'none').lower()
+    ttl = config.get('RESPONSE_CACHE_TTL')
+    
+    if backend == 'memory':
+        return MemoryCache(
+            max_entries=config.get('RESPONSE_CACHE_MAX_ENTRIES', 1024),
+            max_bytes=config.get('RESPONSE_CACHE_MAX_BYTES'),
+            ttl=ttl
+        )
+    if backend == 'sqlite':
+        return SQLiteCache(
+            path=config.get('RESPONSE_CACHE_PATH', 'response_cache.sqlite3'),
+            max_entries=config.get('RESPONSE_CACHE_MAX_ENTRIES', 1024),
+            ttl=ttl
+        )
+    if backend != 'none':
+        logger.warning(f"Unknown response cache backend '{backend}', caching disabled")
+    return None
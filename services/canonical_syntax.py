@@ -0,0 +1,267 @@
+"""
+Canonical form of Mermaid syntax
+
+Diagrams that render the same but differ in whitespace, indentation,
+quoting or arrow spelling are rewritten to one text, so caches, history
+deduplication and the editor's "format" action agree on it. Statement
+order and node ids, which Mermaid's layout depends on, are kept, as are pie
+values, which showData prints as written; only the spelling of each line
+changes. The rewrite is a single pass over the lines; each line is handled
+on its own apart from the block depth carried from the lines above it.
+Lines that are not understood are kept with their whitespace collapsed.
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from services.mermaid_parser import (_FLOW_AMPERSAND, _FLOW_LINK, _FLOW_NODE, _FLOW_SKIP, _SECTIONED_DIRECTIVES,
+                                     _SEQ_MESSAGE)
+
+INDENT = '    '
+
+_WHITESPACE = re.compile(r'\s+')
+_QUOTED = re.compile(r'("[^"]*")')
+_SAFE_LABEL = re.compile(r"[\w .,!?'+-]+")
+_NUMBER = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+_STATEMENT_END = re.compile(r'\s*(;)?\s*')
+_SHAPE_CLOSERS = {'((': '))', '([': '])', '[[': ']]', '[(': ')]', '{{': '}}',
+                  '[': ']', '(': ')', '{': '}', '>': ']'}
+
+_SEQUENCE_BLOCKS = ('loop', 'alt', 'opt', 'par', 'critical', 'break', 'rect', 'box')
+_SEQUENCE_BRANCHES = ('else', 'and', 'option')
+
+# A flowchart statement: groups of '&'-joined nodes separated by links
+_Node = Tuple[str, Optional[Tuple[str, str, str]]]
+_Link = Tuple[str, Optional[str]]
+_Statement = Tuple[List[List[_Node]], List[_Link]]
+
+
+def collapse_whitespace(text: str) -> str:
+    """Strip a line and collapse runs of whitespace outside double quotes"""
+    if '"' not in text:
+        return _WHITESPACE.sub(' ', text).strip()
+    parts = _QUOTED.split(text)
+    for index in range(0, len(parts), 2):
+        parts[index] = _WHITESPACE.sub(' ', parts[index])
+    return ''.join(parts).strip()
+
+
+def _label(text: str) -> str:
+    """Trim a label and drop quotes that are not needed"""
+    text = text.strip()
+    if '"' not in text:
+        return text
+    if len(text) > 1 and text[0] == text[-1] == '"' and _SAFE_LABEL.fullmatch(text[1:-1].strip()):
+        return text[1:-1].strip()
+    return text
+
+
+def _number(raw: str) -> str:
+    """Spell a number in its shortest form (1.50 -> 1.5, 2.0 -> 2); other text is returned as is"""
+    raw = raw.strip()
+    if not _NUMBER.fullmatch(raw):
+        return raw
+    value = float(raw)
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _split_shape(shape: str) -> Optional[Tuple[str, str, str]]:
+    """Split a node shape such as '(["Start"])' into opener, label and closer"""
+    for opener in (shape[:2], shape[:1]):
+        closer = _SHAPE_CLOSERS.get(opener)
+        if closer is not None and shape.endswith(closer) and len(shape) >= len(opener) + len(closer):
+            return opener, _label(shape[len(opener):-len(closer)]), closer
+    return None
+
+
+def _parse_flow_statements(text: str) -> Optional[List[_Statement]]:
+    """
+    Split a flowchart line into statements of node groups and links
+    
+    Returns:
+        Statements in order, or None when the line is not entirely nodes, links, '&' and ';'
+    """
+    statements = []
+    pos = 0
+    while pos < len(text):
+        groups: List[List[_Node]] = []
+        links: List[_Link] = []
+        while True:
+            group = []
+            while True:
+                match = _FLOW_NODE.match(text, pos)
+                if not match or not match.group(1):
+                    return None
+                shape = _split_shape(match.group(2)) if match.group(2) else None
+                if match.group(2) and shape is None:
+                    return None
+                group.append((match.group(1), shape))
+                pos = match.end()
+                ampersand = _FLOW_AMPERSAND.match(text, pos)
+                if not ampersand:
+                    break
+                pos = ampersand.end()
+            groups.append(group)
+            link = _FLOW_LINK.match(text, pos)
+            if not link:
+                break
+            label = link.group(2) if link.group(2) is not None else link.group(4)
+            links.append((link.group(3), _label(label) if label and label.strip() else None))
+            pos = link.end()
+        statements.append((groups, links))
+        end = _STATEMENT_END.match(text, pos)
+        if end.group(1) is None and end.end() < len(text):
+            return None
+        pos = end.end()
+    return statements
+
+
+def _format_node(node: _Node) -> str:
+    node_id, shape = node
+    return node_id if shape is None else f"{node_id}{shape[0]}{shape[1]}{shape[2]}"
+
+
+def _format_link(link: _Link) -> str:
+    arrow, label = link
+    return f" {arrow}|{label}| " if label is not None else f" {arrow} "
+
+
+def _format_statement(statement: _Statement) -> str:
+    groups, links = statement
+    parts = [' & '.join(_format_node(node) for node in groups[0])]
+    for link, group in zip(links, groups[1:]):
+        parts.append(_format_link(link))
+        parts.append(' & '.join(_format_node(node) for node in group))
+    return ''.join(parts)
+
+
+def _format_header(text: str, diagram_type: str) -> str:
+    text = collapse_whitespace(text)
+    if diagram_type == 'flowchart':
+        return ' '.join(text.rstrip(';').split())
+    return text
+
+
+def _format_line(text: str, diagram_type: str) -> str:
+    """Canonical spelling of one body line"""
+    if text.startswith('%%'):
+        return text
+    
+    if diagram_type == 'flowchart':
+        if text.startswith(_FLOW_SKIP):
+            return text.rstrip(';').rstrip()
+        statements = _parse_flow_statements(text)
+        if statements is None:
+            return text
+        return '; '.join(_format_statement(statement) for statement in statements)
+    
+    if diagram_type == 'sequence':
+        match = _SEQ_MESSAGE.fullmatch(text.rstrip(';'))
+        if match:
+            source, arrow, activation, target, message = match.groups()
+            return f"{source.strip()}{arrow}{activation}{target.strip()}: {message.strip()}"
+        return text
+    
+    if diagram_type == 'pie':
+        label, colon, value = text.rpartition(':')
+        label = label.strip()
+        if colon and len(label) > 1 and label[0] == label[-1] == '"':
+            # showData prints values as written, so they are not respelled
+            value = value.strip().strip('"')
+            return f'"{label[1:-1].strip()}" : {value}'
+        return text
+    
+    if diagram_type == 'quadrantChart':
+        label, colon, point = text.partition(':')
+        coordinates = point.strip()
+        if colon and coordinates.startswith('[') and coordinates.endswith(']') and coordinates.count(',') == 1:
+            x, y = coordinates[1:-1].split(',')
+            return f"{label.strip()}: [{_number(x)}, {_number(y)}]"
+        return text
+    
+    if diagram_type in ('gantt', 'journey'):
+        if ':' not in text or text.startswith(('title ', 'section ') + _SECTIONED_DIRECTIVES):
+            return text
+        name, _, spec = text.partition(':')
+        if diagram_type == 'gantt':
+            return f"{name.strip()} :{', '.join(part.strip() for part in spec.split(','))}"
+        score, _, actors = spec.partition(':')
+        actors = ', '.join(actor.strip() for actor in actors.split(',') if actor.strip())
+        return f"{name.strip()}: {score.strip()}" + (f": {actors}" if actors else '')
+    
+    return text
+
+
+def _depths(lines: List[Tuple[int, str]], diagram_type: str) -> List[int]:
+    """Nesting depth of every body line, 1 for top-level statements"""
+    depths = []
+    depth = 1
+    if diagram_type == 'mindmap':
+        # Indentation is the tree here; renumber levels without changing their nesting
+        stack: List[int] = []
+        for indent, _ in lines:
+            while stack and stack[-1] >= indent:
+                stack.pop()
+            stack.append(indent)
+            depths.append(len(stack))
+        return depths
+    
+    for _, text in lines:
+        word = text.split(None, 1)[0]
+        if diagram_type in ('flowchart', 'sequence'):
+            if word == 'end':
+                depth = max(1, depth - 1)
+                depths.append(depth)
+            elif diagram_type == 'sequence' and word in _SEQUENCE_BRANCHES:
+                depths.append(max(1, depth - 1))
+            else:
+                depths.append(depth)
+                if word == 'subgraph' or (diagram_type == 'sequence' and word in _SEQUENCE_BLOCKS):
+                    depth += 1
+        elif diagram_type in ('gantt', 'journey'):
+            if word == 'section':
+                depths.append(1)
+                depth = 2
+            else:
+                depths.append(depth)
+        elif diagram_type in ('classDiagram', 'stateDiagram', 'erDiagram'):
+            if text.startswith('}'):
+                depth = max(1, depth - 1)
+                depths.append(depth)
+            elif text == '--':
+                depths.append(max(1, depth - 1))
+            else:
+                depths.append(depth)
+                if text.endswith('{'):
+                    depth += 1
+        else:
+            depths.append(depth)
+    return depths
+
+
+def canonicalize(syntax: str, diagram_type: str) -> str:
+    """
+    Rewrite Mermaid syntax into its canonical form
+    
+    Args:
+        syntax: Mermaid syntax
+        diagram_type: Type of diagram
+    
+    Returns:
+        Canonical syntax with four-space indentation per block level, or an empty string for blank input
+    """
+    lines = []
+    for raw in syntax.split('\n'):
+        text = collapse_whitespace(raw)
+        if text:
+            lines.append((len(raw) - len(raw.lstrip()), text))
+    if not lines:
+        return ''
+    
+    header = _format_header(lines[0][1], diagram_type)
+    lines = lines[1:]
+    body = [INDENT * depth + _format_line(text, diagram_type)
+            for depth, (_, text) in zip(_depths(lines, diagram_type), lines)]
+    return '\n'.join([header] + body)
@@ -2,15 +2,146 @@
 Diagram service for validating Mermaid syntax
 """
 
-import re
-from typing import Optional, List, Tuple
+import atexit
+import os
+import threading
+from collections import deque
+from itertools import islice
+from typing import Any, Dict, Optional, Tuple, List, Iterable, Iterator
 
 from models import ValidationResult
+from services import metrics
+from services.canonical_syntax import canonicalize
+from services.mermaid_parser import MermaidDocument, parse
+from services.structural_diff import diff_documents
+from services.validation_rules import DIAGRAM_TYPE_NAMES, get_rules
+
+
+def _validate_chunk(items: List[Tuple[str, str]]) -> List[ValidationResult]:
+    """Validate a chunk of (syntax, diagram_type) pairs in a worker process"""
+    service = DiagramService()
+    return [service.validate_syntax(syntax, diagram_type) for syntax, diagram_type in items]
+
+
+# One worker pool per process, started by the first batch large enough to need it
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_process_pool(workers: int):
+    """
+    Return this process's validation pool, starting it with this many workers on first use
+    
+    A pool inherited through fork belongs to the parent, so a child starts its own.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            from concurrent.futures import ProcessPoolExecutor
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@atexit.register
+def _shutdown_process_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
 
 
 class DiagramService:
     """Service for diagram-related operations"""
     
+    def parse(self, syntax: str, diagram_type: str) -> MermaidDocument:
+        """
+        Tokenize Mermaid syntax once for validation and structural analysis
+        
+        Args:
+            syntax: Mermaid syntax
+            diagram_type: Type of diagram
+        
+        Returns:
+            MermaidDocument with token stream and lazily parsed AST
+        """
+        return parse(syntax, diagram_type)
+    
+    def canonicalize(self, syntax: str, diagram_type: str) -> str:
+        """
+        Rewrite Mermaid syntax into the one spelling shared by diagrams that only differ in formatting
+        
+        Args:
+            syntax: Mermaid syntax
+            diagram_type: Type of diagram
+        
+        Returns:
+            Canonical syntax
+        """
+        return canonicalize(syntax, diagram_type)
+    
+    def diff(self, old_syntax: str, new_syntax: str, diagram_type: str) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+        """
+        Structural diff between two versions of a diagram
+        
+        Args:
+            old_syntax: Earlier version
+            new_syntax: Later version
+            diagram_type: Type of diagram
+        
+        Returns:
+            Patch of added, removed and changed elements per collection; empty when they match
+        """
+        return diff_documents(self.parse(old_syntax, diagram_type), self.parse(new_syntax, diagram_type))
+    
+    def validate_many(self, items: Iterable[Tuple[str, str]], workers: Optional[int] = None,
+                      chunk_size: int = 256) -> Iterator[ValidationResult]:
+        """
+        Validate many diagrams, fanning chunks out across processes
+        
+        Input is consumed lazily and at most a few chunks per worker are in
+        flight, so arbitrarily long iterables run in bounded memory. The
+        worker processes are started by the first such batch and reused by
+        later ones until the process exits.
+        
+        Args:
+            items: Iterable of (syntax, diagram_type) pairs
+            workers: Worker processes, defaulting to the CPU count; 1 validates in-process
+            chunk_size: Diagrams sent to a worker at a time
+        
+        Yields:
+            ValidationResult for each item, in input order
+        """
+        iterator = iter(items)
+        first_chunk = list(islice(iterator, chunk_size))
+        workers = workers or os.cpu_count() or 1
+        
+        # Small batches are not worth the process start-up cost
+        if workers <= 1 or len(first_chunk) < chunk_size:
+            yield from _validate_chunk(first_chunk)
+            for syntax, diagram_type in iterator:
+                yield self.validate_syntax(syntax, diagram_type)
+            return
+        
+        executor = _get_process_pool(workers)
+        pending = deque([executor.submit(_validate_chunk, first_chunk)])
+        try:
+            exhausted = False
+            while pending:
+                while not exhausted and len(pending) < workers * 2:
+                    chunk = list(islice(iterator, chunk_size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    pending.append(executor.submit(_validate_chunk, chunk))
+                yield from pending.popleft().result()
+        finally:
+            # A batch abandoned midway leaves no queued chunks behind
+            for future in pending:
+                future.cancel()
+    
     def validate_syntax(self, syntax: str, diagram_type: str) -> ValidationResult:
         """
         Validate Mermaid syntax
@@ -22,89 +153,59 @@ class DiagramService:
         Returns:
             ValidationResult indicating if syntax is valid
         """
+        # Unknown types share one label so user input cannot grow the metric
+        label = diagram_type if diagram_type in DIAGRAM_TYPE_NAMES else 'unknown'
+        with metrics.timer('validate_syntax_duration_seconds', diagram_type=label):
+            return self._validate_syntax(syntax, diagram_type)
+    
+    def _validate_syntax(self, syntax: str, diagram_type: str) -> ValidationResult:
         if not syntax or not syntax.strip():
             return ValidationResult(is_valid=False, error="Syntax cannot be empty")
         
-        # Check if syntax starts with valid diagram declaration
-        valid_start = self._check_diagram_start(syntax, diagram_type)
-        if not valid_start[0]:
+        document = self.parse(syntax, diagram_type)
+        rules = get_rules(diagram_type)
+        
+        # Check the diagram declaration and any header rules
+        error = rules.check_header(document.texts[0])
+        if error:
             return ValidationResult(
                 is_valid=False, 
-                error=valid_start[1],
+                error=error,
                 line_number=1
             )
         
-        # Perform type-specific validation
-        validation_method = getattr(self, f'_validate_{diagram_type}', None)
-        if validation_method:
-            return validation_method(syntax)
-        
-        # Default validation - just check basic structure
-        return self._basic_validation(syntax)
-    
-    def _check_diagram_start(self, syntax: str, diagram_type: str) -> Tuple[bool, Optional[str]]:
-        """
-        Check if syntax starts with correct diagram declaration
+        # Apply every per-line rule of the type in one pass over the body
+        failure = rules.check_body(document.texts[1:])
+        if failure:
+            return ValidationResult(
+                is_valid=False,
+                error=failure[1],
+                line_number=failure[0]
+            )
         
-        Returns:
-            Tuple of (is_valid, error_message)
-        """
-        first_line = syntax.strip().split('\n')[0].strip()
-        
-        valid_starts = {
-            'flowchart': ['flowchart', 'graph'],
-            'sequence': ['sequenceDiagram'],
-            'classDiagram': ['classDiagram'],
-            'stateDiagram': ['stateDiagram', 'stateDiagram-v2'],
-            'erDiagram': ['erDiagram'],
-            'journey': ['journey'],
-            'gantt': ['gantt'],
-            'pie': ['pie'],
-            'quadrantChart': ['quadrantChart'],
-            'mindmap': ['mindmap']
-        }
-        
-        expected_starts = valid_starts.get(diagram_type, [])
-        
-        for start in expected_starts:
-            if first_line.startswith(start):
-                return True, None
-        
-        return False, f"Diagram must start with one of: {', '.join(expected_starts)}"
+        return self._basic_validation(document)
     
-    def _basic_validation(self, syntax: str) -> ValidationResult:
+    def _basic_validation(self, document: MermaidDocument) -> ValidationResult:
         """
         Basic syntax validation common to all diagram types
-        """
-        lines = syntax.strip().split('\n')
         
-        # Check for balanced brackets/parentheses
-        bracket_count = 0
-        paren_count = 0
+        Bracket and parenthesis depth is tracked by the tokenizer, so this
+        only reports what that scan found.
+        """
+        if document.balance_error is not None:
+            line_number, error = document.balance_error
+            return ValidationResult(
+                is_valid=False,
+                error=error,
+                line_number=line_number
+            )
         
-        for i, line in enumerate(lines, 1):
-            bracket_count += line.count('[') - line.count(']')
-            paren_count += line.count('(') - line.count(')')
-            
-            if bracket_count < 0:
-                return ValidationResult(
-                    is_valid=False,
-                    error="Unmatched closing bracket ']'",
-                    line_number=i
-                )
-            if paren_count < 0:
-                return ValidationResult(
-                    is_valid=False,
-                    error="Unmatched closing parenthesis ')'",
-                    line_number=i
-                )
-        
-        if bracket_count != 0:
+        if document.bracket_depth != 0:
             return ValidationResult(
                 is_valid=False,
                 error="Unmatched opening bracket '['"
             )
-        if paren_count != 0:
+        if document.paren_depth != 0:
             return ValidationResult(
                 is_valid=False,
                 error="Unmatched opening parenthesis '('"
@@ -112,116 +213,28 @@ class DiagramService:
         
         return ValidationResult(is_valid=True)
     
-    def _validate_flowchart(self, syntax: str) -> ValidationResult:
-        """Validate flowchart syntax"""
-        lines = syntax.strip().split('\n')
-        
-        # Check for valid flowchart direction
-        first_line = lines[0].strip()
-        valid_directions = ['TD', 'TB', 'BT', 'LR', 'RL']
-        
-        if first_line.startswith('flowchart'):
-            parts = first_line.split()
-            if len(parts) > 1 and parts[1] not in valid_directions:
-                return ValidationResult(
-                    is_valid=False,
-                    error=f"Invalid flowchart direction. Must be one of: {', '.join(valid_directions)}",
-                    line_number=1
-                )
-        
-        return self._basic_validation(syntax)
-    
-    def _validate_sequence(self, syntax: str) -> ValidationResult:
-        """Validate sequence diagram syntax"""
-        lines = syntax.strip().split('\n')
-        
-        for i, line in enumerate(lines[1:], 2):  # Skip first line
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Check for valid sequence diagram elements
-            valid_patterns = [
-                r'participant\s+\w+',
-                r'actor\s+\w+',
-                r'\w+\s*->>[-+]?\s*\w+\s*:',
-                r'\w+\s*-->>[-+]?\s*\w+\s*:',
-                r'Note\s+(right|left|over)\s+of\s+\w+',
-                r'loop\s+',
-                r'alt\s+',
-                r'else\s*',
-                r'end\s*'
-            ]
-            
-            if not any(re.match(pattern, line) for pattern in valid_patterns):
-                # Check if it might be a continuation of previous line
-                if ':' not in line and not line.startswith(('Note', 'loop', 'alt', 'else', 'end')):
-                    continue
-                    
-        return self._basic_validation(syntax)
-    
-    def _validate_classDiagram(self, syntax: str) -> ValidationResult:
-        """Validate class diagram syntax"""
-        return self._basic_validation(syntax)
-    
-    def _validate_stateDiagram(self, syntax: str) -> ValidationResult:
-        """Validate state diagram syntax"""
-        return self._basic_validation(syntax)
-    
-    def _validate_erDiagram(self, syntax: str) -> ValidationResult:
-        """Validate ER diagram syntax"""
-        lines = syntax.strip().split('\n')
-        
-        for i, line in enumerate(lines[1:], 2):  # Skip first line
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Check for valid ER diagram relationships
-            if not re.match(r'\w+\s+\|[\|o\{]--[\|o\}]\|\s+\w+\s*:', line):
-                # Could be an attribute definition
-                if not re.match(r'\s+\w+\s+\w+', line):
-                    pass  # Allow other valid syntax
+    def check_header(self, header: str, diagram_type: str) -> Optional[str]:
+        """
+        Check the first line of a diagram on its own
         
-        return self._basic_validation(syntax)
-    
-    def _validate_journey(self, syntax: str) -> ValidationResult:
-        """Validate user journey syntax"""
-        return self._basic_validation(syntax)
-    
-    def _validate_gantt(self, syntax: str) -> ValidationResult:
-        """Validate Gantt chart syntax"""
-        return self._basic_validation(syntax)
-    
-    def _validate_pie(self, syntax: str) -> ValidationResult:
-        """Validate pie chart syntax"""
-        lines = syntax.strip().split('\n')
-        
-        for i, line in enumerate(lines[1:], 2):  # Skip first line
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Check for valid pie chart entries (label : value)
-            if not line.startswith('title') and ':' in line:
-                parts = line.split(':')
-                if len(parts) == 2:
-                    try:
-                        # Try to parse the value as a number
-                        float(parts[1].strip().strip('"'))
-                    except ValueError:
-                        return ValidationResult(
-                            is_valid=False,
-                            error="Pie chart values must be numbers",
-                            line_number=i
-                        )
-        
-        return self._basic_validation(syntax)
-    
-    def _validate_quadrantChart(self, syntax: str) -> ValidationResult:
-        """Validate quadrant chart syntax"""
-        return self._basic_validation(syntax)
+        Args:
+            header: Stripped first line
+            diagram_type: Type of diagram
+        
+        Returns:
+            Error message, or None if the header is valid
+        """
+        return get_rules(diagram_type).check_header(header)
     
-    def _validate_mindmap(self, syntax: str) -> ValidationResult:
-        """Validate mindmap syntax"""
-        return self._
\ No newline at end of file
+    def check_line(self, text: str, diagram_type: str) -> Optional[str]:
+        """
+        Check one body line independently of its neighbours
+        
+        Args:
+            text: Stripped line text
+            diagram_type: Type of diagram
+        
+        Returns:
+            Error message, or None if the line is valid
+        """
+        return get_rules(diagram_type).check_line(text)
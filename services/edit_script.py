@@ -0,0 +1,211 @@
+"""
+Edit scripts for iterating on an existing diagram
+
+Instead of regenerating a whole diagram for a small change, the model is
+shown the current diagram with line numbers and answers with a JSON list
+of operations against those numbers:
+
+    {"edits": [
+        {"op": "replace", "start": 4, "end": 5, "lines": ["    B --> C[Checkout]"]},
+        {"op": "insert", "after": 9, "lines": ["    C --> D[Done]"]},
+        {"op": "delete", "start": 12},
+        {"op": "remove_node", "id": "E"}
+    ]}
+
+Line numbers are 1-based and always refer to the diagram as shown, so the
+order of operations does not matter. Operations are resolved to line-range
+splices and applied bottom-up.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from services.incremental_validation import LineEdit
+from services.mermaid_parser import tokenize
+
+EDIT_OPERATIONS = ('replace', 'insert', 'delete', 'remove_node')
+
+
+class EditScriptError(ValueError):
+    """Raised when an edit script is malformed or does not fit the diagram"""
+
+
+@dataclass
+class EditScriptStats:
+    """Counters describing edit-script iterations"""
+    attempts: int = 0
+    applied: int = 0
+    full_answers: int = 0
+    rejected_scripts: int = 0
+    invalid_results: int = 0
+    answer_chars: int = 0
+    result_chars: int = 0
+    
+    @property
+    def output_ratio(self) -> float:
+        """Size of the applied edit scripts relative to the diagrams they produced"""
+        return self.answer_chars / self.result_chars if self.result_chars else 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'attempts': self.attempts,
+            'applied': self.applied,
+            'full_answers': self.full_answers,
+            'rejected_scripts': self.rejected_scripts,
+            'invalid_results': self.invalid_results,
+            'fallbacks': self.rejected_scripts + self.invalid_results,
+            'output_ratio': round(self.output_ratio, 4)
+        }
+
+
+def number_lines(syntax: str) -> str:
+    """
+    Prefix every line with its 1-based number, as shown to the model
+    
+    Args:
+        syntax: Mermaid syntax
+    
+    Returns:
+        Lines formatted as "<number>| <line>"
+    """
+    lines = syntax.split('\n')
+    width = len(str(len(lines)))
+    return '\n'.join(f"{number:>{width}}| {line}" for number, line in enumerate(lines, 1))
+
+
+def parse_edit_script(text: str) -> List[Dict[str, Any]]:
+    """
+    Decode the model's answer into a list of operations
+    
+    Accepts the {"edits": [...]} object or a bare list, optionally wrapped
+    in a markdown code block.
+    
+    Args:
+        text: Raw model output
+    
+    Returns:
+        List of operation dictionaries
+    
+    Raises:
+        EditScriptError: If the text is not an edit script
+    """
+    text = (text or '').strip()
+    if text.startswith('```'):
+        text = '\n'.join(line for line in text.split('\n') if not line.strip().startswith('```'))
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise EditScriptError(f"Edit script is not valid JSON: {str(e)}")
+    
+    if isinstance(data, dict):
+        data = data.get('edits')
+    if not isinstance(data, list) or not all(isinstance(operation, dict) for operation in data):
+        raise EditScriptError("Edit script must be a list of operations")
+    return data
+
+
+def resolve_edit_script(syntax: str, operations: List[Dict[str, Any]], diagram_type: str) -> List[LineEdit]:
+    """
+    Turn operations into non-overlapping 0-based line splices
+    
+    Args:
+        syntax: Diagram the line numbers refer to
+        operations: Parsed edit script
+        diagram_type: Diagram type, used to find the lines of a node
+    
+    Returns:
+        LineEdits sorted by position
+    
+    Raises:
+        EditScriptError: For unknown operations, out-of-range or overlapping lines
+    """
+    total = syntax.count('\n') + 1
+    edits = []
+    for operation in operations:
+        op = operation.get('op')
+        if op not in EDIT_OPERATIONS:
+            raise EditScriptError(f"Unknown edit operation: {op!r}")
+        
+        if op == 'remove_node':
+            edits.extend(_node_deletions(syntax, diagram_type, operation.get('id')))
+            continue
+        
+        lines = _operation_lines(operation) if op != 'delete' else []
+        if op == 'insert':
+            after = _line_number(operation, 'after', 0, total)
+            edits.append(LineEdit(start=after, end=after, lines=lines))
+        else:
+            start = _line_number(operation, 'start', 1, total)
+            end = _line_number(operation, 'end', start, total) if operation.get('end') is not None else start
+            edits.append(LineEdit(start=start - 1, end=end, lines=lines))
+    
+    # Inserts at the same position keep their order, a line deleted twice (say by
+    # remove_node and delete) is deleted once, everything else must be disjoint
+    edits.sort(key=lambda edit: (edit.start, edit.end))
+    resolved = []
+    for edit in edits:
+        if resolved and edit.start < resolved[-1].end:
+            if edit == resolved[-1] and not edit.lines:
+                continue
+            raise EditScriptError(f"Edit operations overlap at line {edit.start + 1}")
+        resolved.append(edit)
+    return resolved
+
+
+def apply_edit_script(syntax: str, operations: List[Dict[str, Any]], diagram_type: str) -> str:
+    """
+    Apply an edit script to a diagram
+    
+    Args:
+        syntax: Current diagram
+        operations: Parsed edit script
+        diagram_type: Diagram type, used to find the lines of a node
+    
+    Returns:
+        Edited syntax
+    
+    Raises:
+        EditScriptError: If the script does not fit the diagram
+    """
+    lines = syntax.split('\n')
+    for edit in reversed(resolve_edit_script(syntax, operations, diagram_type)):
+        lines[edit.start:edit.end] = edit.lines
+    return '\n'.join(lines).strip()
+
+
+def _operation_lines(operation: Dict[str, Any]) -> List[str]:
+    lines = operation.get('lines')
+    if lines is None:
+        text = operation.get('text')
+        lines = text.split('\n') if isinstance(text, str) else None
+    if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+        raise EditScriptError(f"Edit operation {operation.get('op')!r} needs a list of lines")
+    return lines
+
+
+def _line_number(operation: Dict[str, Any], name: str, lowest: int, highest: int) -> int:
+    value = operation.get(name)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise EditScriptError(f"Edit operation {operation.get('op')!r} needs an integer {name!r}")
+    if not lowest <= value <= highest:
+        raise EditScriptError(f"Line {value} is outside the diagram (1-{highest})")
+    return value
+
+
+def _node_deletions(syntax: str, diagram_type: str, node_id: Optional[str]) -> List[LineEdit]:
+    """Delete every line that defines the node or connects to it"""
+    if not isinstance(node_id, str) or not node_id.strip():
+        raise EditScriptError("Edit operation 'remove_node' needs a node 'id'")
+    node_id = node_id.strip()
+    
+    document = tokenize(syntax, diagram_type)
+    numbers = {edge.line for edge in document.ast.edges if node_id in (edge.source, edge.target)}
+    definition = re.compile(rf"(?:participant\s+|actor\s+|class\s+|state\s+)?{re.escape(node_id)}(?![\w-])")
+    numbers.update(number for number, text in document.body_texts if definition.match(text))
+    if not numbers:
+        raise EditScriptError(f"Node {node_id!r} does not appear in the diagram")
+    return [LineEdit(start=number - 1, end=number, lines=[]) for number in sorted(numbers)]
+
@@ -0,0 +1,58 @@
+"""
+HTTP transport settings for the OpenAI clients
+
+Connection pool limits, keep-alive, timeouts and HTTP/2 come from config
+and are applied to the httpx client the OpenAI SDK sends through. httpx is
+imported on first use, like the SDK itself. HTTP/2 needs the optional h2
+package (pip install "httpx[http2]"); without it the clients stay on
+HTTP/1.1 and a warning is logged.
+"""
+
+import importlib.util
+import logging
+from typing import Any, Dict, Mapping
+
+logger = logging.getLogger(__name__)
+
+_warned_http2 = False
+
+
+def http2_available() -> bool:
+    """Whether the h2 package HTTP/2 support depends on is installed"""
+    return importlib.util.find_spec('h2') is not None
+
+
+def transport_options(config: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Keyword arguments for DefaultHttpxClient / DefaultAsyncHttpxClient
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        Dictionary with http2, limits and timeout
+    """
+    import httpx
+    
+    global _warned_http2
+    http2 = bool(config.get('OPENAI_HTTP2'))
+    if http2 and not http2_available():
+        if not _warned_http2:
+            logger.warning("OPENAI_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+            _warned_http2 = True
+        http2 = False
+    
+    return {
+        'http2': http2,
+        'limits': httpx.Limits(
+            max_connections=config.get('OPENAI_MAX_CONNECTIONS', 100),
+            max_keepalive_connections=config.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 20),
+            keepalive_expiry=config.get('OPENAI_KEEPALIVE_EXPIRY', 30.0)
+        ),
+        'timeout': httpx.Timeout(
+            connect=config.get('OPENAI_CONNECT_TIMEOUT', 5.0),
+            read=config.get('OPENAI_READ_TIMEOUT', 60.0),
+            write=config.get('OPENAI_WRITE_TIMEOUT', 30.0),
+            pool=config.get('OPENAI_POOL_TIMEOUT', 10.0)
+        )
+    }
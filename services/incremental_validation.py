@@ -0,0 +1,318 @@
+"""
+Incremental re-validation of Mermaid documents from line-range edits
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Tuple
+
+from models import ValidationResult
+from services.diagram_service import DiagramService
+
+# Rough per-line cost of a tracked line beyond its text: list slots, the
+# bracket and parenthesis deltas and the block bookkeeping
+_LINE_OVERHEAD = 64
+
+
+def document_hash(syntax: str) -> str:
+    """Hash identifying a fully synced document"""
+    return hashlib.sha256(syntax.encode('utf-8')).hexdigest()
+
+
+def _lines_size(lines: List[str]) -> int:
+    """Approximate memory held for tracked lines: the raw line, its stripped copy and the per-line summaries"""
+    return sum(2 * len(line) + _LINE_OVERHEAD for line in lines)
+
+
+def edited_hash(base_hash: str, edits: List['LineEdit']) -> str:
+    """
+    Hash identifying a document derived from base_hash by edits
+    
+    Chaining from the base hash keeps the cost proportional to the edit
+    rather than to the document size.
+    """
+    payload = json.dumps([base_hash, [[edit.start, edit.end, edit.lines] for edit in edits]])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class LineEdit:
+    """Replace lines [start, end) with new lines (0-based, as in the editor)"""
+    start: int
+    end: int
+    lines: List[str]
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LineEdit':
+        """Create from dictionary"""
+        lines = data.get('lines')
+        if lines is None:
+            text = data.get('text', '')
+            lines = text.split('\n') if text else []
+        return cls(start=int(data['start']), end=int(data['end']), lines=list(lines))
+
+
+class _Block:
+    """
+    Checkpoint for a run of consecutive lines
+    
+    Holds per-line bracket/parenthesis deltas and line errors plus the
+    block's net depth change and lowest running depth, so unchanged blocks
+    are combined without rescanning their lines.
+    """
+    
+    __slots__ = ('texts', 'bracket_deltas', 'paren_deltas', 'errors', 'content_offset',
+                 'bracket_sum', 'paren_sum', 'bracket_min', 'paren_min')
+    
+    def __init__(self, raw_lines: List[str], diagram_type: str, service: DiagramService):
+        self.texts = [line.strip() for line in raw_lines]
+        self.bracket_deltas = [text.count('[') - text.count(']') for text in self.texts]
+        self.paren_deltas = [text.count('(') - text.count(')') for text in self.texts]
+        self.recheck_lines(diagram_type, service)
+        
+        self.content_offset = next((i for i, text in enumerate(self.texts) if text), None)
+        self.bracket_sum, self.bracket_min = self._summarize(self.bracket_deltas)
+        self.paren_sum, self.paren_min = self._summarize(self.paren_deltas)
+    
+    def recheck_lines(self, diagram_type: str, service: DiagramService) -> None:
+        """Recompute per-line errors, e.g. after the diagram type changed"""
+        self.errors = {}
+        for offset, text in enumerate(self.texts):
+            if text:
+                error = service.check_line(text, diagram_type)
+                if error:
+                    self.errors[offset] = error
+    
+    @staticmethod
+    def _summarize(deltas: List[int]) -> Tuple[int, int]:
+        depth = 0
+        lowest = 0
+        for delta in deltas:
+            depth += delta
+            if depth < lowest:
+                lowest = depth
+        return depth, lowest
+    
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+class _TrackedDocument:
+    """Document split into checkpoint blocks"""
+    
+    def __init__(self, syntax: str, diagram_type: str, service: DiagramService, block_size: int):
+        self.diagram_type = diagram_type
+        self.service = service
+        self.block_size = block_size
+        self.raw_lines = syntax.split('\n')
+        self.blocks = self._build_blocks(self.raw_lines)
+        self.size_bytes = _lines_size(self.raw_lines)
+    
+    def _build_blocks(self, raw_lines: List[str]) -> List[_Block]:
+        size = self.block_size
+        return [
+            _Block(raw_lines[i:i + size], self.diagram_type, self.service)
+            for i in range(0, len(raw_lines), size)
+        ]
+    
+    def set_diagram_type(self, diagram_type: str) -> None:
+        if diagram_type != self.diagram_type:
+            self.diagram_type = diagram_type
+            for block in self.blocks:
+                block.recheck_lines(diagram_type, self.service)
+    
+    def apply(self, edit: LineEdit) -> None:
+        """Splice an edit into the lines and rebuild only the blocks it touches"""
+        total = len(self.raw_lines)
+        if not 0 <= edit.start <= edit.end <= total:
+            raise ValueError(f"Edit range {edit.start}-{edit.end} outside document of {total} lines")
+        self.size_bytes += _lines_size(edit.lines) - _lines_size(self.raw_lines[edit.start:edit.end])
+        
+        if not self.blocks:
+            self.raw_lines[edit.start:edit.end] = edit.lines
+            self.blocks = self._build_blocks(self.raw_lines)
+            return
+        
+        # Locate the blocks covering [start, end]
+        first_block = last_block = None
+        block_start = first_start = 0
+        for index, block in enumerate(self.blocks):
+            block_end = block_start + len(block)
+            if first_block is None and edit.start <= block_end:
+                first_block, first_start = index, block_start
+            if edit.end <= block_end:
+                last_block = index
+                break
+            block_start = block_end
+        last_end = block_start + len(self.blocks[last_block])
+        
+        self.raw_lines[edit.start:edit.end] = edit.lines
+        region_end = last_end - (edit.end - edit.start) + len(edit.lines)
+        
+        # Fold a short trailing chunk into the next block so deletions do
+        # not leave the document fragmented into many tiny blocks
+        if (region_end - first_start) % self.block_size < self.block_size // 2 and last_block + 1 < len(self.blocks):
+            last_block += 1
+            region_end += len(self.blocks[last_block])
+        
+        self.blocks[first_block:last_block + 1] = self._build_blocks(self.raw_lines[first_start:region_end])
+    
+    def validate(self) -> ValidationResult:
+        """Validate from block checkpoints, matching DiagramService.validate_syntax"""
+        # The stripped document starts at the first line with content
+        line_base = 0
+        header_block = None
+        for index, block in enumerate(self.blocks):
+            if block.content_offset is not None:
+                header_block = index
+                break
+            line_base += len(block)
+        if header_block is None:
+            return ValidationResult(is_valid=False, error="Syntax cannot be empty")
+        
+        header_offset = self.blocks[header_block].content_offset
+        header_index = line_base + header_offset
+        
+        error = self.service.check_header(self.blocks[header_block].texts[header_offset], self.diagram_type)
+        if error:
+            return ValidationResult(is_valid=False, error=error, line_number=1)
+        
+        # First per-line error after the header
+        block_start = line_base
+        for block in self.blocks[header_block:]:
+            offsets = [offset for offset in block.errors if block_start + offset > header_index]
+            if offsets:
+                offset = min(offsets)
+                return ValidationResult(
+                    is_valid=False,
+                    error=block.errors[offset],
+                    line_number=block_start + offset - header_index + 1
+                )
+            block_start += len(block)
+        
+        # Bracket balance, descending into a block only when it goes negative
+        bracket_depth = 0
+        paren_depth = 0
+        block_start = line_base
+        for block in self.blocks[header_block:]:
+            if bracket_depth + block.bracket_min < 0 or paren_depth + block.paren_min < 0:
+                for offset, (brackets, parens) in enumerate(zip(block.bracket_deltas, block.paren_deltas)):
+                    bracket_depth += brackets
+                    paren_depth += parens
+                    line_number = block_start + offset - header_index + 1
+                    if bracket_depth < 0:
+                        return ValidationResult(is_valid=False, error="Unmatched closing bracket ']'",
+                                                line_number=line_number)
+                    if paren_depth < 0:
+                        return ValidationResult(is_valid=False, error="Unmatched closing parenthesis ')'",
+                                                line_number=line_number)
+            bracket_depth += block.bracket_sum
+            paren_depth += block.paren_sum
+            block_start += len(block)
+        
+        if bracket_depth != 0:
+            return ValidationResult(is_valid=False, error="Unmatched opening bracket '['")
+        if paren_depth != 0:
+            return ValidationResult(is_valid=False, error="Unmatched opening parenthesis '('")
+        
+        return ValidationResult(is_valid=True)
+
+
+class IncrementalValidator:
+    """
+    Keeps recently validated documents so edits only re-check what changed
+    
+    A full sync is keyed by the hash of its content and each edited version
+    by a hash chained from its base. Clients send the hash returned for the
+    version they last validated plus line edits; an unknown hash means the
+    client has to resend the full syntax.
+    
+    Documents are evicted by count and by their approximate size, and a
+    document larger than the whole budget is validated but not kept.
+    """
+    
+    def __init__(self, diagram_service: Optional[DiagramService] = None,
+                 max_documents: int = 256, block_size: int = 64, max_bytes: Optional[int] = 64 * 1024 * 1024):
+        """
+        Initialize the validator
+        
+        Args:
+            diagram_service: Service providing header and line checks
+            max_documents: Number of documents kept, least recently used first out
+            block_size: Lines per checkpoint block
+            max_bytes: Approximate memory all kept documents may use, or None for no limit
+        """
+        self.diagram_service = diagram_service or DiagramService()
+        self.max_documents = max_documents
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._documents: 'OrderedDict[str, _TrackedDocument]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def validate_full(self, syntax: str, diagram_type: str) -> Tuple[str, ValidationResult]:
+        """
+        Validate a complete document and keep its checkpoints
+        
+        Returns:
+            Tuple of (document_hash, validation_result)
+        """
+        document = _TrackedDocument(syntax, diagram_type, self.diagram_service, self.block_size)
+        doc_hash = document_hash(syntax)
+        result = document.validate()
+        with self._lock:
+            self._store(doc_hash, document)
+        return doc_hash, result
+    
+    def apply_edits(self, base_hash: str, edits: List[LineEdit],
+                    diagram_type: str) -> Optional[Tuple[str, ValidationResult]]:
+        """
+        Apply line edits to a known document and re-validate it
+        
+        Args:
+            base_hash: Hash of the document the edits were made against
+            edits: Edits applied in order, each against the previous result
+            diagram_type: Type of diagram
+        
+        Returns:
+            Tuple of (document_hash, validation_result), or None when the
+            base document is unknown and the full syntax must be sent
+        """
+        with self._lock:
+            document = self._remove(base_hash)
+            if document is None:
+                return None
+            
+            # The document stays out of the store if an edit is rejected,
+            # so a half-applied edit list forces a full resync
+            document.set_diagram_type(diagram_type)
+            for edit in edits:
+                document.apply(edit)
+            
+            doc_hash = edited_hash(base_hash, edits)
+            self._store(doc_hash, document)
+            return doc_hash, document.validate()
+    
+    def _store(self, doc_hash: str, document: _TrackedDocument) -> None:
+        self._remove(doc_hash)
+        if self.max_bytes is not None and document.size_bytes > self.max_bytes:
+            # Never let a single oversized document flush every other one
+            return
+        self._documents[doc_hash] = document
+        self.current_bytes += document.size_bytes
+        while len(self._documents) > self.max_documents or (
+            self.max_bytes is not None and self.current_bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._documents)))
+    
+    def _remove(self, doc_hash: str) -> Optional[_TrackedDocument]:
+        document = self._documents.pop(doc_hash, None)
+        if document is not None:
+            self.current_bytes -= document.size_bytes
+        return document
+    
+    def __len__(self) -> int:
+        return len(self._documents)
@@ -0,0 +1,469 @@
+"""
+Single-pass tokenizer and lightweight AST for Mermaid syntax
+"""
+
+import re
+from itertools import accumulate
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, NamedTuple, Tuple
+
+
+class SyntaxLine(NamedTuple):
+    """One source line with everything validators need precomputed"""
+    number: int
+    text: str
+    indent: int
+    brackets: int
+    parens: int
+
+
+class Edge(NamedTuple):
+    """Connection between two nodes (flowchart link, message, relation)"""
+    source: str
+    target: str
+    arrow: str
+    label: Optional[str]
+    line: int
+
+
+class PieSlice(NamedTuple):
+    """Pie chart entry; value is None when it is not a number"""
+    label: str
+    raw_value: str
+    value: Optional[float]
+    line: int
+
+
+class Task(NamedTuple):
+    """Gantt task or journey step"""
+    section: Optional[str]
+    name: str
+    spec: str
+    line: int
+
+
+class QuadrantPoint(NamedTuple):
+    """Quadrant chart data point"""
+    label: str
+    x: Optional[float]
+    y: Optional[float]
+    line: int
+
+
+@dataclass
+class DiagramAST:
+    """Structure of a parsed diagram; fields not used by a type stay empty"""
+    diagram_type: str
+    title: Optional[str] = None
+    direction: Optional[str] = None
+    nodes: Dict[str, Optional[str]] = field(default_factory=dict)
+    edges: List[Edge] = field(default_factory=list)
+    participants: List[str] = field(default_factory=list)
+    slices: List[PieSlice] = field(default_factory=list)
+    sections: List[str] = field(default_factory=list)
+    tasks: List[Task] = field(default_factory=list)
+    points: List[QuadrantPoint] = field(default_factory=list)
+    axes: Dict[str, str] = field(default_factory=dict)
+    quadrants: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class MermaidDocument:
+    """
+    Token stream for one diagram
+    
+    Line texts and per-line bracket/parenthesis deltas come from a single
+    tokenizer pass; SyntaxLine objects and the AST are built on demand.
+    """
+    diagram_type: str
+    raw_lines: List[str]
+    texts: List[str]
+    bracket_deltas: List[int]
+    paren_deltas: List[int]
+    bracket_depth: int = 0
+    paren_depth: int = 0
+    balance_error: Optional[Tuple[int, str]] = None
+    _lines: Optional[List[SyntaxLine]] = field(default=None, repr=False)
+    _ast: Optional[DiagramAST] = field(default=None, repr=False)
+    
+    @property
+    def lines(self) -> List[SyntaxLine]:
+        """All lines as SyntaxLine tokens"""
+        if self._lines is None:
+            self._lines = [
+                SyntaxLine(number, text, len(raw) - len(raw.lstrip()), brackets, parens)
+                for number, raw, text, brackets, parens in zip(
+                    range(1, len(self.texts) + 1), self.raw_lines, self.texts,
+                    self.bracket_deltas, self.paren_deltas
+                )
+            ]
+        return self._lines
+    
+    @property
+    def header_parts(self) -> List[str]:
+        """Whitespace-separated words of the first line"""
+        return self.texts[0].split()
+    
+    @property
+    def body(self) -> List[SyntaxLine]:
+        """Non-empty lines after the header"""
+        return [line for line in self.lines[1:] if line.text]
+    
+    @property
+    def body_texts(self) -> List[Tuple[int, str]]:
+        """(line_number, text) for non-empty lines after the header"""
+        return [(number, text) for number, text in enumerate(self.texts[1:], 2) if text]
+    
+    @property
+    def ast(self) -> DiagramAST:
+        """Diagram structure, parsed on first access"""
+        if self._ast is None:
+            parser = _PARSERS.get(self.diagram_type, _parse_generic)
+            self._ast = parser(self)
+        return self._ast
+
+
+def find_balance_error(bracket_deltas: List[int], paren_deltas: List[int],
+                       first_line: int = 1) -> Optional[Tuple[int, str]]:
+    """
+    Find the first line where a closing bracket or parenthesis is unmatched
+    
+    Args:
+        bracket_deltas: Net '[' minus ']' per line
+        paren_deltas: Net '(' minus ')' per line
+        first_line: Line number of the first delta
+    
+    Returns:
+        Tuple of (line_number, error_message), or None when depth never
+        drops below zero
+    """
+    bracket_prefix = list(accumulate(bracket_deltas))
+    paren_prefix = list(accumulate(paren_deltas))
+    if (not bracket_prefix or min(bracket_prefix) >= 0) and (not paren_prefix or min(paren_prefix) >= 0):
+        return None
+    
+    for offset, (brackets, parens) in enumerate(zip(bracket_prefix, paren_prefix)):
+        if brackets < 0:
+            return first_line + offset, "Unmatched closing bracket ']'"
+        if parens < 0:
+            return first_line + offset, "Unmatched closing parenthesis ')'"
+    return None
+
+
+def tokenize(syntax: str, diagram_type: str) -> MermaidDocument:
+    """
+    Split syntax into lines and measure bracket/parenthesis depth in one pass
+    
+    Args:
+        syntax: Mermaid syntax
+        diagram_type: Type of diagram, selecting the AST parser
+    
+    Returns:
+        MermaidDocument whose AST is built lazily
+    """
+    raw_lines = syntax.strip().split('\n')
+    texts = [line.strip() for line in raw_lines]
+    bracket_deltas = [text.count('[') - text.count(']') for text in texts]
+    paren_deltas = [text.count('(') - text.count(')') for text in texts]
+    
+    return MermaidDocument(
+        diagram_type=diagram_type,
+        raw_lines=raw_lines,
+        texts=texts,
+        bracket_deltas=bracket_deltas,
+        paren_deltas=paren_deltas,
+        bracket_depth=sum(bracket_deltas),
+        paren_depth=sum(paren_deltas),
+        balance_error=find_balance_error(bracket_deltas, paren_deltas)
+    )
+
+
+parse = tokenize
+
+
+def _to_float(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _title_from_header(document: MermaidDocument) -> Optional[str]:
+    parts = document.texts[0].split(None, 2)
+    if len(parts) == 3 and parts[1] == 'title':
+        return parts[2]
+    return None
+
+
+def _parse_generic(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    for number, text in document.body_texts:
+        if text.startswith('title '):
+            ast.title = text[6:].strip()
+    return ast
+
+
+# Flowchart node: id followed by an optional shape holding the label
+_FLOW_NODE = re.compile(
+    r'\s*(\w+(?:[.-]\w+)*)\s*'
+    r'(\(\(.*?\)\)|\(\[.*?\]\)|\[\[.*?\]\]|\[\(.*?\)\]|\{\{.*?\}\}|\[.*?\]|\(.*?\)|\{.*?\}|>.*?\])?'
+)
+_FLOW_LINK = re.compile(
+    r'\s*(?:(--|==)\s+([^|>]+?)\s+)?'
+    r'(<?(?:-{2,}|={2,}|-\.+-|~{3,})(?:>|o|x)?)'
+    r'(?:\s*\|([^|]*)\|)?'
+)
+_FLOW_AMPERSAND = re.compile(r'\s*&')
+_FLOW_SKIP = ('subgraph', 'end', 'classDef', 'class ', 'style ', 'linkStyle', 'click ', 'direction ', '%%')
+_SHAPE_QUOTES = '"\''
+
+
+def _shape_label(shape: Optional[str]) -> Optional[str]:
+    if not shape:
+        return None
+    label = shape.strip('[](){}>/\\')
+    return label.strip(_SHAPE_QUOTES)
+
+
+def _parse_flow_group(text: str, pos: int, ast: DiagramAST) -> Tuple[List[str], int]:
+    """Parse one or more '&'-joined nodes starting at pos"""
+    ids = []
+    while True:
+        match = _FLOW_NODE.match(text, pos)
+        if not match or not match.group(1):
+            return ids, pos
+        node_id, shape = match.group(1), match.group(2)
+        label = _shape_label(shape)
+        if label is not None or node_id not in ast.nodes:
+            ast.nodes[node_id] = label if label is not None else ast.nodes.get(node_id)
+        ids.append(node_id)
+        pos = match.end()
+        ampersand = _FLOW_AMPERSAND.match(text, pos)
+        if not ampersand:
+            return ids, pos
+        pos = ampersand.end()
+
+
+def _parse_flowchart(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    parts = document.header_parts
+    if len(parts) > 1:
+        ast.direction = parts[1]
+    
+    for number, text in document.body_texts:
+        if text.startswith(_FLOW_SKIP):
+            continue
+        sources, pos = _parse_flow_group(text, 0, ast)
+        while sources:
+            link = _FLOW_LINK.match(text, pos)
+            if not link:
+                break
+            targets, pos = _parse_flow_group(text, link.end(), ast)
+            label = link.group(2) or link.group(4)
+            for source in sources:
+                for target in targets:
+                    ast.edges.append(Edge(source, target, link.group(3), label, number))
+            sources = targets
+    return ast
+
+
+_SEQ_PARTICIPANT = re.compile(r'(participant|actor)\s+(\S+)(?:\s+as\s+(.+))?')
+_SEQ_MESSAGE = re.compile(r'([^-+>\s][^->]*?)\s*(-{1,2}(?:>>|>|x|\)))([+-]?)\s*([^:]+?)\s*:\s*(.*)')
+
+
+def _parse_sequence(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    seen = set()
+    
+    def add_participant(name: str, alias: Optional[str] = None) -> None:
+        if name not in seen:
+            seen.add(name)
+            ast.participants.append(name)
+        if alias is not None or name not in ast.nodes:
+            ast.nodes[name] = alias
+    
+    for number, text in document.body_texts:
+        match = _SEQ_PARTICIPANT.match(text)
+        if match:
+            add_participant(match.group(2), match.group(3))
+            continue
+        match = _SEQ_MESSAGE.match(text)
+        if match:
+            source, target = match.group(1).strip(), match.group(4).strip()
+            add_participant(source)
+            add_participant(target)
+            ast.edges.append(Edge(source, target, match.group(2), match.group(5), number))
+    return ast
+
+
+_CLASS_DECL = re.compile(r'class\s+([\w~<>,]+)(?:\s*\[.*?\])?\s*(\{)?')
+_CLASS_RELATION = re.compile(
+    r'([\w~]+)\s*(?:"[^"]*"\s*)?'
+    r'(<\|--|\*--|o--|-->|--\*|--o|--\|>|\.\.>|<\.\.|\.\.\|>|<\|\.\.|--|\.\.)'
+    r'\s*(?:"[^"]*"\s*)?([\w~]+)\s*(?::\s*(.*))?'
+)
+
+
+def _parse_classDiagram(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    in_body = False
+    for number, text in document.body_texts:
+        if in_body:
+            if text.startswith('}'):
+                in_body = False
+            continue
+        match = _CLASS_DECL.match(text)
+        if match:
+            ast.nodes.setdefault(match.group(1), None)
+            in_body = bool(match.group(2)) and not text.endswith('}')
+            continue
+        match = _CLASS_RELATION.match(text)
+        if match:
+            source, target = match.group(1), match.group(3)
+            ast.nodes.setdefault(source, None)
+            ast.nodes.setdefault(target, None)
+            ast.edges.append(Edge(source, target, match.group(2), match.group(4), number))
+    return ast
+
+
+_STATE_TRANSITION = re.compile(r'(\[\*\]|[\w.-]+)\s*-->\s*(\[\*\]|[\w.-]+)\s*(?::\s*(.*))?')
+_STATE_DECL = re.compile(r'state\s+(?:"([^"]*)"\s+as\s+)?([\w.-]+)')
+
+
+def _parse_stateDiagram(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    for number, text in document.body_texts:
+        match = _STATE_TRANSITION.match(text)
+        if match:
+            source, target = match.group(1), match.group(2)
+            ast.nodes.setdefault(source, None)
+            ast.nodes.setdefault(target, None)
+            ast.edges.append(Edge(source, target, '-->', match.group(3), number))
+            continue
+        match = _STATE_DECL.match(text)
+        if match:
+            ast.nodes[match.group(2)] = match.group(1)
+    return ast
+
+
+_ER_RELATION = re.compile(r'([\w-]+)\s+([|}o][|o]?(?:--|\.\.)[|o][|{o]?)\s+([\w-]+)\s*:\s*(.*)')
+_ER_ENTITY = re.compile(r'([\w-]+)\s*\{')
+
+
+def _parse_erDiagram(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    in_entity = False
+    for number, text in document.body_texts:
+        if in_entity:
+            if text.startswith('}'):
+                in_entity = False
+            continue
+        match = _ER_RELATION.match(text)
+        if match:
+            source, target = match.group(1), match.group(3)
+            ast.nodes.setdefault(source, None)
+            ast.nodes.setdefault(target, None)
+            ast.edges.append(Edge(source, target, match.group(2), match.group(4).strip('"'), number))
+            continue
+        match = _ER_ENTITY.match(text)
+        if match:
+            ast.nodes.setdefault(match.group(1), None)
+            in_entity = not text.endswith('}')
+    return ast
+
+
+_SECTIONED_DIRECTIVES = (
+    'dateFormat', 'axisFormat', 'tickInterval', 'excludes', 'includes',
+    'todayMarker', 'weekday', 'accTitle', 'accDescr', '%%'
+)
+
+
+def _parse_sectioned(document: MermaidDocument) -> DiagramAST:
+    """Shared parser for journey and gantt: title, sections and tasks"""
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    section = None
+    for number, text in document.body_texts:
+        if text.startswith(_SECTIONED_DIRECTIVES):
+            continue
+        if text.startswith('title '):
+            ast.title = text[6:].strip()
+        elif text.startswith('section '):
+            section = text[8:].strip()
+            ast.sections.append(section)
+        elif ':' in text:
+            name, spec = text.split(':', 1)
+            ast.tasks.append(Task(section, name.strip(), spec.strip(), number))
+    return ast
+
+
+def _parse_pie(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type, title=_title_from_header(document))
+    for number, text in document.body_texts:
+        if text.startswith('title'):
+            ast.title = text[5:].strip()
+            continue
+        if ':' not in text:
+            continue
+        parts = text.split(':')
+        if len(parts) != 2:
+            continue
+        raw_value = parts[1].strip().strip('"')
+        try:
+            value = float(raw_value)
+        except ValueError:
+            value = None
+        ast.slices.append(PieSlice(parts[0].strip().strip('"'), raw_value, value, number))
+    return ast
+
+
+_QUADRANT_POINT = re.compile(r'(.+?)\s*:\s*\[\s*([^,\]]+)\s*,\s*([^\]]+?)\s*\]')
+
+
+def _parse_quadrantChart(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    for number, text in document.body_texts:
+        if text.startswith('title '):
+            ast.title = text[6:].strip()
+        elif text.startswith(('x-axis ', 'y-axis ')):
+            ast.axes[text[:6]] = text[7:].strip()
+        elif text.startswith('quadrant-'):
+            key, _, label = text.partition(' ')
+            ast.quadrants[key] = label.strip()
+        else:
+            match = _QUADRANT_POINT.match(text)
+            if match:
+                ast.points.append(QuadrantPoint(
+                    match.group(1).strip('"'), _to_float(match.group(2)), _to_float(match.group(3)), number
+                ))
+    return ast
+
+
+def _parse_mindmap(document: MermaidDocument) -> DiagramAST:
+    ast = DiagramAST(diagram_type=document.diagram_type)
+    stack: List[Tuple[int, str]] = []
+    for line in document.body:
+        match = _FLOW_NODE.match(line.text)
+        shape_label = _shape_label(match.group(2)) if match and match.end() == len(line.text) else None
+        node_id = match.group(1) if shape_label is not None else line.text
+        ast.nodes[node_id] = shape_label if shape_label is not None else node_id
+        
+        while stack and stack[-1][0] >= line.indent:
+            stack.pop()
+        if stack:
+            ast.edges.append(Edge(stack[-1][1], node_id, '', None, line.number))
+        stack.append((line.indent, node_id))
+    return ast
+
+
+_PARSERS = {
+    'flowchart': _parse_flowchart,
+    'sequence': _parse_sequence,
+    'classDiagram': _parse_classDiagram,
+    'stateDiagram': _parse_stateDiagram,
+    'erDiagram': _parse_erDiagram,
+    'journey': _parse_sectioned,
+    'gantt': _parse_sectioned,
+    'pie': _parse_pie,
+    'quadrantChart': _parse_quadrantChart,
+    'mindmap': _parse_mindmap,
+}
@@ -0,0 +1,219 @@
+"""
+In-process metrics with Prometheus text exposition
+
+Every metric the application records is declared in METRIC_DEFINITIONS.
+Call sites go through the module-level functions (metrics.observe,
+metrics.inc, metrics.set_value, metrics.timer), which configure() binds
+either to a MetricsRegistry or to no-op functions, so a disabled build pays
+for one empty call per hot-path site and nothing else. Import the module,
+not the functions, so the binding made at app creation is seen.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+SECONDS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# (type, help, label names, histogram buckets)
+MetricDefinition = Tuple[str, str, Tuple[str, ...], Tuple[float, ...]]
+
+METRIC_DEFINITIONS: Dict[str, MetricDefinition] = {
+    'openai_request_duration_seconds': (
+        'histogram', "Time until the OpenAI API answered (response headers for streams)",
+        ('priority', 'call'), SECONDS_BUCKETS),
+    'openai_prompt_tokens': (
+        'histogram', "Prompt tokens reported in the completion usage", ('priority',), TOKEN_BUCKETS),
+    'openai_completion_tokens': (
+        'histogram', "Completion tokens reported in the completion usage", ('priority',), TOKEN_BUCKETS),
+    'clean_syntax_duration_seconds': (
+        'histogram', "Time spent cleaning generated syntax", (), SECONDS_BUCKETS),
+    'validate_syntax_duration_seconds': (
+        'histogram', "Time spent validating syntax", ('diagram_type',), SECONDS_BUCKETS),
+    'render_duration_seconds': (
+        'histogram', "Time spent laying out a diagram as SVG on the server", ('diagram_type',), SECONDS_BUCKETS),
+    'session_serialized_bytes': (
+        'histogram', "Bytes written to the session store per generation", ('part',), BYTE_BUCKETS),
+    'cache_hits_total': ('counter', "Lookups answered by a cache", ('cache',), ()),
+    'cache_misses_total': ('counter', "Lookups a cache could not answer", ('cache',), ()),
+    'cache_hit_ratio': ('gauge', "Fraction of lookups answered by a cache", ('cache',), ()),
+    'syntax_repairs_total': (
+        'counter', "Invalid generated syntax by repair outcome (local, reprompt, unrepaired)", ('outcome',), ()),
+}
+
+
+class _Histogram:
+    """Bucket counts, sum and count for one label combination"""
+    
+    __slots__ = ('counts', 'sum', 'count')
+    
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+    """Context manager observing the elapsed time of its block"""
+    
+    __slots__ = ('_registry', '_name', '_labels', '_started')
+    
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: Dict[str, Any]):
+        self._registry = registry
+        self._name = name
+        self._labels = labels
+    
+    def __enter__(self) -> '_Timer':
+        self._started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info) -> bool:
+        self._registry.observe(self._name, time.perf_counter() - self._started, **self._labels)
+        return False
+
+
+class _NoopTimer:
+    """Shared stand-in for _Timer when metrics are disabled"""
+    
+    __slots__ = ()
+    
+    def __enter__(self) -> '_NoopTimer':
+        return self
+    
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class MetricsRegistry:
+    """Thread-safe store for the metrics in METRIC_DEFINITIONS"""
+    
+    def __init__(self, definitions: Optional[Mapping[str, MetricDefinition]] = None):
+        """
+        Initialize the registry
+        
+        Args:
+            definitions: Metrics to expose, METRIC_DEFINITIONS by default
+        """
+        self.definitions = dict(definitions if definitions is not None else METRIC_DEFINITIONS)
+        self._values: Dict[str, Dict[Tuple[str, ...], Any]] = {name: {} for name in self.definitions}
+        self._lock = threading.Lock()
+    
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Add one observation to a histogram"""
+        _, _, label_names, buckets = self.definitions[name]
+        key = tuple(str(labels.get(label, '')) for label in label_names)
+        with self._lock:
+            histogram = self._values[name].get(key)
+            if histogram is None:
+                histogram = self._values[name][key] = _Histogram(len(buckets))
+            histogram.counts[bisect_left(buckets, value)] += 1
+            histogram.sum += value
+            histogram.count += 1
+    
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        """Increase a counter"""
+        key = tuple(str(labels.get(label, '')) for label in self.definitions[name][2])
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + amount
+    
+    def set_value(self, name: str, value: float, **labels: Any) -> None:
+        """Set a gauge, or a counter whose total is kept elsewhere"""
+        key = tuple(str(labels.get(label, '')) for label in self.definitions[name][2])
+        with self._lock:
+            self._values[name][key] = value
+    
+    def timer(self, name: str, **labels: Any) -> _Timer:
+        """Context manager observing the elapsed seconds of its block in a histogram"""
+        return _Timer(self, name, labels)
+    
+    def render(self) -> str:
+        """
+        Render every metric with at least one value
+        
+        Returns:
+            Prometheus text exposition format (version 0.0.4)
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, (kind, help_text, label_names, buckets) in self.definitions.items():
+                values = self._values[name]
+                if not values:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key in sorted(values):
+                    labels = list(zip(label_names, key))
+                    if kind != 'histogram':
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(values[key])}")
+                        continue
+                    histogram = values[key]
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + [('le', _format_value(bound))]
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _noop(*args: Any, **kwargs: Any) -> None:
+    return None
+
+
+def _noop_timer(*args: Any, **kwargs: Any) -> _NoopTimer:
+    return _NOOP_TIMER
+
+
+# Bound by configure(); disabled until then
+registry: Optional[MetricsRegistry] = None
+observe = _noop
+inc = _noop
+set_value = _noop
+timer = _noop_timer
+
+
+def configure(config: Mapping[str, Any]) -> Optional[MetricsRegistry]:
+    """
+    Enable or disable metrics for the process
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        The new MetricsRegistry, or None when metrics are disabled
+    """
+    global registry, observe, inc, set_value, timer
+    if config.get('METRICS_ENABLED', True):
+        registry = MetricsRegistry()
+        observe, inc, set_value, timer = registry.observe, registry.inc, registry.set_value, registry.timer
+    else:
+        registry = None
+        observe, inc, set_value, timer = _noop, _noop, _noop, _noop_timer
+    return registry
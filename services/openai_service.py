@@ -2,104 +2,66 @@
 OpenAI service for generating Mermaid diagram syntax
 """
 
-from openai import OpenAI
 from flask import current_app
+import json
 import logging
-from typing import Optional
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Iterator, Tuple, Any, List, Dict, Callable, Mapping
 
-from models import DiagramResponse
+from models import DiagramRequest, DiagramResponse, ValidationResult
+from services import metrics
+from services.cache_service import CacheBackend, create_cache, make_cache_key
+from services.diagram_service import DiagramService
+from services.edit_script import (EditScriptError, EditScriptStats, apply_edit_script, number_lines,
+                                  parse_edit_script)
+from services.http_transport import transport_options
+from services.semantic_cache import SemanticCache, SemanticMatch, create_semantic_cache, namespace_for
+from services.single_flight import SingleFlight, create_single_flight
+from services.syntax_repair import RepairStats, failing_excerpt, repair_locally
+from services.rate_limiter import (PRIORITY_BATCH, PRIORITY_ITERATION, PRIORITY_NAMES, PRIORITY_NEW, RateLimiter,
+                                   TokenBudget, backoff_delay, create_rate_limiter, retry_after_seconds)
 
 logger = logging.getLogger(__name__)
 
+# Guards creation of the per-app shared components and updates to the shared counters
+_shared_lock = threading.Lock()
 
-class OpenAIService:
-    """Service for interacting with OpenAI API"""
-    
-    def __init__(self):
-        """Initialize the OpenAI service"""
-        self.client = None
-    
-    def _get_client(self):
-        """Get the OpenAI client"""
-        if not self.client:
-            api_key = current_app.config.get('OPENAI_API_KEY')
-            if not api_key:
-                raise ValueError("OpenAI API key not configured")
-            self.client = OpenAI(api_key=api_key)
-        return self.client
-    
-    def generate_diagram_syntax(self, prompt: str, diagram_type: str, previous_syntax: Optional[str] = None) -> DiagramResponse:
-        """
-        Generate Mermaid diagram syntax from natural language prompt
-        
-        Args:
-            prompt: Natural language description of the diagram
-            diagram_type: Type of diagram to generate
-            previous_syntax: Previous diagram syntax for iterative updates
-            
-        Returns:
-            DiagramResponse with generated syntax or error
-        """
-        try:
-            client = self._get_client()
-            
-            # Construct the system prompt
-            system_prompt = self._get_system_prompt(diagram_type)
-            
-            # Prepare user message with context if iterating
-            user_message = prompt
-            if previous_syntax:
-                user_message = f"Here is the current diagram:\n\n{previous_syntax}\n\nNow modify it based on this request: {prompt}"
-            
-            # Make API call using official OpenAI client
-            response = client.chat.completions.create(
-                model=current_app.config['OPENAI_MODEL'],
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=current_app.config['OPENAI_TEMPERATURE'],
-                max_tokens=current_app.config['OPENAI_MAX_TOKENS']
-            )
-            
-            # Extract syntax from response
-            syntax = response.choices[0].message.content.strip()
-            
-            # Clean up syntax (remove markdown code blocks if present)
-            syntax = self._clean_syntax(syntax)
-            
-            return DiagramResponse(
-                syntax=syntax,
-                diagram_type=diagram_type,
-                success=True
-            )
-            
-        except Exception as e:
-            logger.error(f"Error generating diagram syntax: {str(e)}")
-            return DiagramResponse(
-                syntax='',
-                diagram_type=diagram_type,
-                success=False,
-                error=f"API request failed: {str(e)}"
-            )
+
+def retryable_errors() -> Tuple[type, ...]:
+    """
+    Failures worth another attempt after a backoff
     
-    def _get_system_prompt(self, diagram_type: str) -> str:
-        """
-        Get the system prompt for the specific diagram type
-        
-        Args:
-            diagram_type: Type of diagram
-            
-        Returns:
-            System prompt string
-        """
-        base_prompt = """You are a Mermaid diagram syntax generator. 
+    The openai SDK takes about half a second to import, so it is loaded on
+    the first API call rather than when the app starts. An except clause
+    only evaluates this once an exception is being matched.
+    """
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    return (RateLimitError, APIConnectionError, InternalServerError)
+
+
+EDIT_SYSTEM_PROMPT = """You are editing an existing Mermaid diagram.
+The user shows the current diagram with line numbers ("<number>| <line>") and asks for a change.
+You MUST respond with ONLY a JSON object of the form {"edits": [...]} - no explanations, no markdown code blocks, no full diagram.
+Each edit is one of:
+{"op": "replace", "start": <line>, "end": <line>, "lines": ["<new line>", ...]}
+{"op": "insert", "after": <line, 0 for the top>, "lines": ["<new line>", ...]}
+{"op": "delete", "start": <line>, "end": <line>}
+{"op": "remove_node", "id": "<node id>"}
+Line numbers always refer to the diagram as shown. Write new lines without the number prefix, keeping the diagram's indentation.
+Only change what the request asks for; leave every other line as it is."""
+
+
+SYSTEM_PROMPT = """You are a Mermaid diagram syntax generator. 
 You MUST respond with ONLY valid Mermaid syntax - no explanations, no markdown code blocks, no additional text.
 Generate clean, well-structured Mermaid syntax based EXACTLY on the user's description.
 IMPORTANT: Only include the steps, elements, or components that the user explicitly mentions. Do NOT add any additional steps, elements, or details that are not specifically requested by the user."""
 
-        type_specific_prompts = {
-            'flowchart': """
+TYPE_PROMPTS: Dict[str, str] = {
+    'flowchart': """
 Generate a flowchart using Mermaid syntax.
 Use 'flowchart TD' or 'flowchart LR' for top-down or left-right layouts.
 Example format:
@@ -107,8 +69,8 @@ flowchart TD
     A[Start] --> B{Decision}
     B -->|Yes| C[Action 1]
     B -->|No| D[Action 2]""",
-            
-            'sequence': """
+    
+    'sequence': """
 Generate a sequence diagram using Mermaid syntax.
 Example format:
 sequenceDiagram
@@ -116,8 +78,8 @@ sequenceDiagram
     participant B as Bob
     A->>B: Hello Bob
     B->>A: Hi Alice""",
-            
-            'classDiagram': """
+    
+    'classDiagram': """
 Generate a class diagram using Mermaid syntax.
 Example format:
 classDiagram
@@ -126,23 +88,23 @@ classDiagram
         +int age
         +makeSound()
     }""",
-            
-            'stateDiagram': """
+    
+    'stateDiagram': """
 Generate a state diagram using Mermaid syntax.
 Example format:
 stateDiagram-v2
     [*] --> State1
     State1 --> State2
     State2 --> [*]""",
-            
-            'erDiagram': """
+    
+    'erDiagram': """
 Generate an entity relationship diagram using Mermaid syntax.
 Example format:
 erDiagram
     CUSTOMER ||--o{ ORDER : places
     ORDER ||--|{ LINE-ITEM : contains""",
-            
-            'journey': """
+    
+    'journey': """
 Generate a user journey diagram using Mermaid syntax.
 Example format:
 journey
@@ -150,8 +112,8 @@ journey
     section Go to work
       Make tea: 5: Me
       Go upstairs: 3: Me""",
-            
-            'gantt': """
+    
+    'gantt': """
 Generate a Gantt chart using Mermaid syntax.
 Example format:
 gantt
@@ -159,16 +121,16 @@ gantt
     dateFormat YYYY-MM-DD
     section Section
         A task :a1, 2024-01-01, 30d""",
-            
-            'pie': """
+    
+    'pie': """
 Generate a pie chart using Mermaid syntax.
 Example format:
 pie title Pets adopted by volunteers
     "Dogs" : 386
     "Cats" : 85
     "Rats" : 15""",
-            
-            'quadrantChart': """
+    
+    'quadrantChart': """
 Generate a quadrant chart using Mermaid syntax.
 Example format:
 quadrantChart
@@ -179,8 +141,8 @@ quadrantChart
     quadrant-2 Need to promote
     quadrant-3 Re-evaluate
     quadrant-4 May be improved""",
-            
-            'mindmap': """
+    
+    'mindmap': """
 Generate a mindmap using Mermaid syntax.
 Example format:
 mindmap
@@ -191,10 +153,954 @@ mindmap
     Research
       On effectiveness
       On features"""
-        }
+}
+
+
+def _join_prompt(base_prompt: str, diagram_type: str) -> str:
+    return f"{base_prompt}\n\n{TYPE_PROMPTS.get(diagram_type, '')}"
+
+
+# Full system prompts per diagram type, joined once at import
+SYSTEM_PROMPTS: Dict[str, str] = {
+    diagram_type: _join_prompt(SYSTEM_PROMPT, diagram_type) for diagram_type in TYPE_PROMPTS
+}
+EDIT_SYSTEM_PROMPTS: Dict[str, str] = {
+    diagram_type: _join_prompt(EDIT_SYSTEM_PROMPT, diagram_type) for diagram_type in TYPE_PROMPTS
+}
+
+
+class OpenAIService:
+    """Service for interacting with OpenAI API"""
+    
+    def __init__(self, cache: Optional[CacheBackend] = None, semantic_cache: Optional[SemanticCache] = None,
+                 single_flight: Optional[SingleFlight] = None, rate_limiter: Optional[RateLimiter] = None):
+        """
+        Initialize the OpenAI service
+        
+        Args:
+            cache: Response cache to use instead of the app's shared one
+            semantic_cache: Similar-prompt cache to use instead of the app's shared one
+            single_flight: Request coalescer to use instead of the app's shared one
+            rate_limiter: Rate limiter to use instead of the app's shared one
+        """
+        self.client = None
+        self._http_client = None
+        self._client_pid: Optional[int] = None
+        self.cache = cache
+        self._cache_configured = cache is not None
+        self.semantic_cache = semantic_cache
+        self._semantic_cache_configured = semantic_cache is not None
+        self.single_flight = single_flight
+        self._single_flight_configured = single_flight is not None
+        self.rate_limiter = rate_limiter
+        self._rate_limiter_configured = rate_limiter is not None
+        self.diagram_service = DiagramService()
+    
+    def _get_client(self):
+        """Get the OpenAI client for this process"""
+        self._drop_forked_client()
+        if not self.client:
+            api_key = current_app.config.get('OPENAI_API_KEY')
+            if not api_key:
+                raise ValueError("OpenAI API key not configured")
+            from openai import OpenAI, DefaultHttpxClient
+            options = transport_options(current_app.config)
+            self._http_client = DefaultHttpxClient(event_hooks={'response': [self._observe_response]}, **options)
+            # Retries are done here, after the rate limiter, rather than inside the client
+            self.client = OpenAI(
+                api_key=api_key,
+                base_url=current_app.config.get('OPENAI_BASE_URL'),
+                max_retries=0,
+                timeout=options['timeout'],
+                http_client=self._http_client
+            )
+            self._client_pid = os.getpid()
+        return self.client
+    
+    def _drop_forked_client(self) -> None:
+        """Forget a client built before this worker was forked"""
+        if self.client is not None and self._client_pid not in (None, os.getpid()):
+            # Its pooled sockets and TLS sessions are shared with the parent; leave them to the parent
+            logger.info(f"Recreating the OpenAI client in forked process {os.getpid()}")
+            self.client = None
+            self._http_client = None
+    
+    def warm_up(self) -> bool:
+        """
+        Open a pooled connection to the API before the first request needs it
+        
+        Sends an unauthenticated HEAD request to the base URL; whatever the
+        answer, the connection and its TLS session stay in the keep-alive pool.
+        
+        Returns:
+            True if a connection was established
+        """
+        try:
+            client = self._get_client()
+            started = time.perf_counter()
+            self._http_client.head(str(client.base_url))
+        except Exception as e:
+            logger.warning(f"OpenAI connection warm-up failed: {str(e)}")
+            return False
+        logger.info(f"OpenAI connection warmed up in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return True
+    
+    @staticmethod
+    def _shared(name: str, factory: Callable[[Mapping[str, Any]], Any]) -> Any:
+        """
+        Get a component of the current app, creating it from config on first use
+        
+        Components live in app.extensions, so the sync and async services of
+        one app share their caches, request coalescer, rate limiter and counters.
+        """
+        extensions = current_app.extensions
+        if name not in extensions:
+            with _shared_lock:
+                if name not in extensions:
+                    extensions[name] = factory(current_app.config)
+        return extensions[name]
+    
+    def _get_rate_limiter(self) -> Optional[RateLimiter]:
+        """Get the rate limiter passed in, or the app's shared one"""
+        if self._rate_limiter_configured:
+            return self.rate_limiter
+        return self._shared('openai_rate_limiter', create_rate_limiter)
+    
+    def _observe_response(self, response) -> None:
+        """Feed rate-limit headers of every API response to the limiter"""
+        rate_limiter = self._get_rate_limiter()
+        if rate_limiter is not None:
+            rate_limiter.update_from_headers(response.headers, response.status_code)
+    
+    def rate_limit_stats(self) -> Optional[dict]:
+        """
+        Get rate limiter queue depth, budgets and counters
+        
+        Returns:
+            Dictionary of rate limiting metrics, or None when rate limiting is disabled
+        """
+        rate_limiter = self._get_rate_limiter()
+        return rate_limiter.metrics() if rate_limiter is not None else None
+    
+    def _create_completion(self, messages: List[Dict[str, str]], priority: int, **kwargs):
+        """
+        Send a chat completion through the rate limiter, retrying transient failures
+        
+        Args:
+            messages: Chat messages
+            priority: Queue priority, see services.rate_limiter
+            **kwargs: Extra arguments for chat.completions.create, e.g. stream or a smaller max_tokens
+        
+        Returns:
+            The client's completion (or stream)
+        
+        Raises:
+            RateLimitTimeout: If the call could not be scheduled in time
+            Exception: Whatever the OpenAI client raises once retries are exhausted
+        """
+        client = self._get_client()
+        rate_limiter = self._get_rate_limiter()
+        config = current_app.config
+        max_tokens = kwargs.pop('max_tokens', config['OPENAI_MAX_TOKENS'])
+        tokens = self._estimate_message_tokens(messages, max_tokens)
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        if kwargs.get('stream') and metrics.registry is not None:
+            # Usage arrives in a final chunk only when asked for
+            kwargs.setdefault('stream_options', {'include_usage': True})
+        
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire(tokens, priority)
+            try:
+                with metrics.timer('openai_request_duration_seconds', priority=priority_name,
+                                   call='stream' if kwargs.get('stream') else 'complete'):
+                    response = client.chat.completions.create(
+                        model=config['OPENAI_MODEL'],
+                        messages=messages,
+                        temperature=config['OPENAI_TEMPERATURE'],
+                        max_tokens=max_tokens,
+                        **kwargs
+                    )
+                if not kwargs.get('stream'):
+                    self._record_usage(getattr(response, 'usage', None), priority_name)
+                return response
+            except retryable_errors() as e:
+                if attempt >= config['OPENAI_MAX_RETRIES']:
+                    raise
+                delay = self._retry_delay(e, attempt)
+                logger.warning(f"OpenAI request failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+    
+    @staticmethod
+    def _record_usage(usage: Any, priority_name: str) -> None:
+        """Record the token counts of a completion's usage field, when it has one"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+        if isinstance(prompt_tokens, int):
+            metrics.observe('openai_prompt_tokens', prompt_tokens, priority=priority_name)
+        if isinstance(completion_tokens, int):
+            metrics.observe('openai_completion_tokens', completion_tokens, priority=priority_name)
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """Backoff before the next attempt, honoring any retry-after header"""
+        rate_limiter = self._get_rate_limiter()
+        if rate_limiter is not None:
+            rate_limiter.record_retry()
+        response = getattr(error, 'response', None)
+        return backoff_delay(
+            attempt,
+            current_app.config['OPENAI_RETRY_BASE_DELAY'],
+            current_app.config['OPENAI_RETRY_MAX_DELAY'],
+            retry_after_seconds(response.headers if response is not None else None)
+        )
+    
+    def _get_cache(self) -> Optional[CacheBackend]:
+        """Get the response cache passed in, or the app's shared one"""
+        if self._cache_configured:
+            return self.cache
+        return self._shared('openai_response_cache', create_cache)
+    
+    def cache_stats(self) -> Optional[dict]:
+        """
+        Get response cache counters
+        
+        Returns:
+            Dictionary of cache statistics, or None when caching is disabled
+        """
+        cache = self._get_cache()
+        if cache is None:
+            return None
+        stats = cache.stats.to_dict()
+        stats['entries'] = len(cache)
+        return stats
+    
+    def _get_semantic_cache(self) -> Optional[SemanticCache]:
+        """Get the semantic cache passed in, or the app's shared one"""
+        if self._semantic_cache_configured:
+            return self.semantic_cache
+        return self._shared('openai_semantic_cache', create_semantic_cache)
+    
+    def semantic_cache_stats(self) -> Optional[dict]:
+        """
+        Get semantic cache counters
+        
+        Returns:
+            Dictionary of reuse statistics, or None when the semantic cache is disabled
+        """
+        semantic_cache = self._get_semantic_cache()
+        if semantic_cache is None:
+            return None
+        stats = semantic_cache.stats.to_dict()
+        stats['entries'] = len(semantic_cache)
+        stats['threshold'] = semantic_cache.threshold
+        return stats
+    
+    def _get_single_flight(self) -> Optional[SingleFlight]:
+        """Get the request coalescer passed in, or the app's shared one"""
+        if self._single_flight_configured:
+            return self.single_flight
+        return self._shared('openai_single_flight', create_single_flight)
+    
+    def coalescing_stats(self) -> Optional[dict]:
+        """
+        Get request coalescing counters
+        
+        Returns:
+            Dictionary of coalescing statistics, or None when coalescing is disabled
+        """
+        single_flight = self._get_single_flight()
+        if single_flight is None:
+            return None
+        stats = single_flight.stats.to_dict()
+        stats['cross_process'] = single_flight.lock_dir is not None
+        return stats
+    
+    def _semantic_lookup(self, prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                         use_semantic_cache: bool) -> Optional[SemanticMatch]:
+        """Find the stored answer to a similar prompt; iterations always go to the model"""
+        semantic_cache = self._get_semantic_cache()
+        if semantic_cache is None or not use_semantic_cache or previous_syntax:
+            return None
+        return semantic_cache.lookup(namespace_for(diagram_type, current_app.config), prompt)
+    
+    def _semantic_add(self, prompt: str, diagram_type: str, previous_syntax: Optional[str], syntax: str) -> None:
+        """Index a fresh answer for later similar prompts"""
+        semantic_cache = self._get_semantic_cache()
+        if semantic_cache is not None and not previous_syntax and syntax:
+            semantic_cache.add(namespace_for(diagram_type, current_app.config), prompt, syntax)
+    
+    def generate_diagram_syntax(self, prompt: str, diagram_type: str, previous_syntax: Optional[str] = None,
+                                use_semantic_cache: bool = True) -> DiagramResponse:
+        """
+        Generate Mermaid diagram syntax from natural language prompt
+        
+        Args:
+            prompt: Natural language description of the diagram
+            diagram_type: Type of diagram to generate
+            previous_syntax: Previous diagram syntax for iterative updates
+            use_semantic_cache: Allow the answer to a similar earlier prompt to be served
+            
+        Returns:
+            DiagramResponse with generated syntax or error
+        """
+        try:
+            cache_key, cached = self._lookup_answer(prompt, diagram_type, previous_syntax, use_semantic_cache)
+            if cached is not None:
+                return cached
+            
+            return self._generate_coalesced(prompt, diagram_type, previous_syntax, cache_key)
+        
+        except Exception as e:
+            logger.error(f"Error generating diagram syntax: {str(e)}")
+            return DiagramResponse(
+                syntax='',
+                diagram_type=diagram_type,
+                success=False,
+                error=f"API request failed: {str(e)}"
+            )
+    
+    def _lookup_answer(self, prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                       use_semantic_cache: bool) -> Tuple[str, Optional[DiagramResponse]]:
+        """
+        Find an answer that needs no API call
+        
+        Returns:
+            Tuple of (cache_key, response from the response or semantic cache, or None)
+        """
+        cache_key = make_cache_key(prompt, diagram_type, previous_syntax, current_app.config)
+        cache = self._get_cache()
+        if cache is not None:
+            cached_syntax = cache.get(cache_key)
+            if cached_syntax is not None:
+                return cache_key, DiagramResponse(
+                    syntax=cached_syntax,
+                    diagram_type=diagram_type,
+                    success=True
+                )
+        
+        match = self._semantic_lookup(prompt, diagram_type, previous_syntax, use_semantic_cache)
+        if match is not None:
+            return cache_key, DiagramResponse(
+                syntax=match.syntax,
+                diagram_type=diagram_type,
+                success=True,
+                similarity=match.similarity
+            )
+        return cache_key, None
+    
+    def _store_answer(self, prompt: str, diagram_type: str, previous_syntax: Optional[str], cache_key: str,
+                      syntax: str) -> None:
+        """Store a fresh answer in the response and semantic caches"""
+        cache = self._get_cache()
+        if cache is not None and syntax:
+            cache.set(cache_key, syntax)
+        self._semantic_add(prompt, diagram_type, previous_syntax, syntax)
+    
+    def _answer(self, prompt: str, diagram_type: str, previous_syntax: Optional[str], cache_key: str,
+                syntax: str, validation: Optional[ValidationResult]) -> DiagramResponse:
+        """
+        Build the response for a fresh answer, caching it unless it failed validation
+        
+        Syntax still invalid after repair is returned so the user can fix it
+        in the editor, but it is neither cached nor reported as a success.
+        
+        Args:
+            validation: Result of _validate_and_repair, None when it did not validate
+        
+        Returns:
+            DiagramResponse with the generated syntax
+        """
+        if validation is not None and not validation.is_valid:
+            return DiagramResponse(
+                syntax=syntax,
+                diagram_type=diagram_type,
+                success=False,
+                error=f"Generated syntax is invalid: {validation.error}"
+            )
+        self._store_answer(prompt, diagram_type, previous_syntax, cache_key, syntax)
+        return DiagramResponse(
+            syntax=syntax,
+            diagram_type=diagram_type,
+            success=True
+        )
+    
+    def _generate_coalesced(self, prompt: str, diagram_type: str, previous_syntax: Optional[str], cache_key: str,
+                            priority: Optional[int] = None) -> DiagramResponse:
+        """
+        Generate a fresh answer unless an identical generation is already in flight
+        
+        Returns:
+            DiagramResponse with generated syntax or error
+        """
+        def generate() -> DiagramResponse:
+            return self._generate_fresh(prompt, diagram_type, previous_syntax, cache_key, priority)
         
-        specific_prompt = type_specific_prompts.get(diagram_type, '')
-        return f"{base_prompt}\n\n{specific_prompt}"
+        # Identical requests already in flight share one upstream call
+        single_flight = self._get_single_flight()
+        if single_flight is None:
+            return generate()
+        response, _ = single_flight.do(
+            cache_key, generate,
+            encode=lambda response: json.dumps(response.to_dict()),
+            decode=lambda data: DiagramResponse.from_dict(json.loads(data))
+        )
+        return response
+    
+    def _generate_fresh(self, prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                        cache_key: str, priority: Optional[int] = None) -> DiagramResponse:
+        """
+        Call the model and store its answer in the caches
+        
+        Returns:
+            DiagramResponse with generated syntax or error
+        """
+        try:
+            syntax, validation = self._complete(prompt, diagram_type, previous_syntax, priority)
+            return self._answer(prompt, diagram_type, previous_syntax, cache_key, syntax, validation)
+        
+        except Exception as e:
+            logger.error(f"Error generating diagram syntax: {str(e)}")
+            return DiagramResponse(
+                syntax='',
+                diagram_type=diagram_type,
+                success=False,
+                error=f"API request failed: {str(e)}"
+            )
+    
+    def _complete(self, prompt: str, diagram_type: str, previous_syntax: Optional[str] = None,
+                  priority: Optional[int] = None) -> Tuple[str, Optional[ValidationResult]]:
+        """
+        Request a completion and return the cleaned syntax, bypassing the cache
+        
+        Args:
+            priority: Rate limiter priority, by default iterations before new diagrams
+        
+        Returns:
+            Tuple of (syntax, validation result as in _validate_and_repair)
+        
+        Raises:
+            Exception: Whatever the OpenAI client raises
+        """
+        started = time.monotonic()
+        if priority is None:
+            priority = PRIORITY_ITERATION if previous_syntax else PRIORITY_NEW
+        
+        syntax = self._try_edit_script(prompt, diagram_type, previous_syntax, priority)
+        if syntax is not None:
+            return syntax, None
+        
+        # Make API call using official OpenAI client
+        response = self._create_completion(self._build_messages(prompt, diagram_type, previous_syntax), priority)
+        
+        # Extract syntax from response
+        syntax = response.choices[0].message.content.strip()
+        
+        # Clean up syntax (remove markdown code blocks if present)
+        return self._validate_and_repair(self._clean_syntax(syntax), diagram_type, priority, started)
+    
+    def _try_edit_script(self, prompt: str, diagram_type: str, previous_syntax: Optional[str],
+                         priority: int) -> Optional[str]:
+        """
+        Ask for an edit script when the iteration qualifies for one
+        
+        Returns:
+            The edited, valid syntax, or None to fall back to full regeneration
+        """
+        if not self._use_edit_script(previous_syntax):
+            return None
+        response = self._create_completion(
+            self._build_edit_messages(prompt, diagram_type, previous_syntax),
+            priority,
+            max_tokens=current_app.config['OPENAI_EDIT_MAX_TOKENS']
+        )
+        return self._apply_edit_answer(previous_syntax, diagram_type, response.choices[0].message.content)
+    
+    def generate_many(self, requests: List[DiagramRequest], max_in_flight: Optional[int] = None,
+                      tokens_per_minute: Optional[int] = None) -> Iterator[Tuple[int, DiagramResponse]]:
+        """
+        Generate many diagrams concurrently
+        
+        Identical requests share one API call, also with identical generations
+        already in flight, and cached ones need none. The rest run on worker
+        threads under an in-flight limit and a budget of estimated tokens per
+        minute.
+        
+        Args:
+            requests: Diagram requests to generate
+            max_in_flight: Concurrent API calls, defaulting to OPENAI_BATCH_MAX_IN_FLIGHT
+            tokens_per_minute: Token budget, defaulting to OPENAI_BATCH_TOKENS_PER_MINUTE
+        
+        Yields:
+            Tuple of (request_index, DiagramResponse) as each request completes
+        """
+        max_in_flight, budget, queue, cached = self._plan_batch(requests, max_in_flight, tokens_per_minute)
+        yield from cached
+        
+        app = current_app._get_current_object()
+        
+        def generate(key: str, diagram_request: DiagramRequest) -> DiagramResponse:
+            with app.app_context():
+                return self._generate_coalesced(diagram_request.prompt, diagram_request.diagram_type,
+                                                diagram_request.previous_syntax, key, PRIORITY_BATCH)
+        
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        pending = {}
+        try:
+            while queue or pending:
+                # Submit while there is room in flight and budget to spend
+                wait_time = None
+                while queue and len(pending) < max_in_flight:
+                    key, indices = queue[0]
+                    diagram_request = requests[indices[0]]
+                    if budget is not None:
+                        wait_time = budget.reserve(self._estimate_tokens(diagram_request))
+                        if wait_time:
+                            break
+                    queue.popleft()
+                    pending[executor.submit(generate, key, diagram_request)] = (key, indices)
+                
+                if not pending:
+                    time.sleep(wait_time)
+                    continue
+                
+                done, _ = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, indices = pending.pop(future)
+                    response = self._batch_response(requests[indices[0]].diagram_type, future)
+                    for index in indices:
+                        yield index, response
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _plan_batch(self, requests: List[DiagramRequest], max_in_flight: Optional[int],
+                    tokens_per_minute: Optional[int]) -> Tuple[int, Optional[TokenBudget], deque,
+                                                              List[Tuple[int, DiagramResponse]]]:
+        """
+        Group a batch by cache key and answer what the cache already holds
+        
+        Returns:
+            Tuple of (max_in_flight, token budget, queue of (cache_key, request indices) to generate,
+            (request_index, DiagramResponse) pairs served from the cache)
+        """
+        config = current_app.config
+        max_in_flight = max_in_flight or config['OPENAI_BATCH_MAX_IN_FLIGHT']
+        if tokens_per_minute is None:
+            tokens_per_minute = config['OPENAI_BATCH_TOKENS_PER_MINUTE']
+        budget = TokenBudget(tokens_per_minute) if tokens_per_minute else None
+        
+        # Group identical requests under their cache key
+        groups: Dict[str, List[int]] = {}
+        for index, diagram_request in enumerate(requests):
+            key = make_cache_key(diagram_request.prompt, diagram_request.diagram_type,
+                                 diagram_request.previous_syntax, config)
+            groups.setdefault(key, []).append(index)
+        
+        cache = self._get_cache()
+        queue = deque()
+        cached = []
+        for key, indices in groups.items():
+            cached_syntax = cache.get(key) if cache is not None else None
+            if cached_syntax is None:
+                queue.append((key, indices))
+                continue
+            response = DiagramResponse(
+                syntax=cached_syntax,
+                diagram_type=requests[indices[0]].diagram_type,
+                success=True
+            )
+            cached.extend((index, response) for index in indices)
+        return max_in_flight, budget, queue, cached
+    
+    def _batch_response(self, diagram_type: str, future) -> DiagramResponse:
+        """Outcome of one batch generation (a finished future or task)"""
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"Error generating diagram syntax: {str(e)}")
+            return DiagramResponse(
+                syntax='',
+                diagram_type=diagram_type,
+                success=False,
+                error=f"API request failed: {str(e)}"
+            )
+    
+    def _estimate_tokens(self, diagram_request: DiagramRequest) -> int:
+        """Rough upper bound on the tokens a request consumes"""
+        return self._estimate_message_tokens(self._build_messages(diagram_request.prompt, diagram_request.diagram_type,
+                                                                  diagram_request.previous_syntax))
+    
+    def _estimate_message_tokens(self, messages: List[Dict[str, str]], max_tokens: Optional[int] = None) -> int:
+        """Rough upper bound on the tokens a completion consumes (~4 characters per token)"""
+        prompt_tokens = sum(len(message['content']) for message in messages) // 4
+        return prompt_tokens + (max_tokens if max_tokens is not None else current_app.config['OPENAI_MAX_TOKENS'])
+    
+    def stream_diagram_syntax(self, prompt: str, diagram_type: str, previous_syntax: Optional[str] = None,
+                              use_semantic_cache: bool = True) -> Iterator[Tuple[str, Any]]:
+        """
+        Stream Mermaid diagram syntax line by line as the model produces it
+        
+        Args:
+            prompt: Natural language description of the diagram
+            diagram_type: Type of diagram to generate
+            previous_syntax: Previous diagram syntax for iterative updates
+            use_semantic_cache: Allow the answer to a similar earlier prompt to be served
+        
+        Yields:
+            ('line', str) for each cleaned syntax line, then a final
+            ('done', DiagramResponse) carrying the fully cleaned syntax
+        """
+        try:
+            cache_key, cached = self._lookup_answer(prompt, diagram_type, previous_syntax, use_semantic_cache)
+            if cached is not None:
+                yield from self._replay(cached)
+                return
+            
+            # An identical generation in flight is replayed once it finishes
+            single_flight = self._get_single_flight()
+            call, leader = single_flight.join(cache_key) if single_flight is not None else (None, True)
+            if not leader:
+                found, response = single_flight.wait(call)
+                if found:
+                    yield from self._replay(response)
+                    return
+            
+            response = None
+            try:
+                started = time.monotonic()
+                priority = PRIORITY_ITERATION if previous_syntax else PRIORITY_NEW
+                # An edit script is small enough to wait for; its result is sent in one go
+                syntax = self._try_edit_script(prompt, diagram_type, previous_syntax, priority)
+                validation = None
+                if syntax is not None:
+                    for line in syntax.split('\n'):
+                        yield 'line', line
+                else:
+                    stream = self._create_completion(
+                        self._build_messages(prompt, diagram_type, previous_syntax),
+                        priority,
+                        stream=True
+                    )
+                    
+                    cleaner = StreamingSyntaxCleaner()
+                    raw_parts = []
+                    for chunk in stream:
+                        if not chunk.choices:
+                            self._record_usage(getattr(chunk, 'usage', None), PRIORITY_NAMES[priority])
+                            continue
+                        content = chunk.choices[0].delta.content
+                        if not content:
+                            continue
+                        raw_parts.append(content)
+                        for line in cleaner.feed(content):
+                            yield 'line', line
+                    
+                    for line in cleaner.finish():
+                        yield 'line', line
+                    
+                    # The incremental lines are a preview; the final syntax goes
+                    # through the same cleaning and repair as the non-streaming path
+                    syntax = self._clean_syntax(''.join(raw_parts).strip())
+                    syntax, validation = self._validate_and_repair(syntax, diagram_type, priority, started)
+                response = self._answer(prompt, diagram_type, previous_syntax, cache_key, syntax, validation)
+            except BaseException as e:
+                if leader and call is not None:
+                    single_flight.finish(cache_key, call, error=e)
+                raise
+            if leader and call is not None:
+                single_flight.finish(cache_key, call, result=response)
+            yield 'done', response
+        
+        except Exception as e:
+            logger.error(f"Error streaming diagram syntax: {str(e)}")
+            yield 'done', DiagramResponse(
+                syntax='',
+                diagram_type=diagram_type,
+                success=False,
+                error=f"API request failed: {str(e)}"
+            )
+    
+    @staticmethod
+    def _replay(response: DiagramResponse) -> Iterator[Tuple[str, Any]]:
+        """Stream events for an answer that is already complete"""
+        if response.success:
+            for line in response.syntax.split('\n'):
+                yield 'line', line
+        yield 'done', response
+    
+    def _build_messages(self, prompt: str, diagram_type: str,
+                        previous_syntax: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Build the chat messages for a generation request
+        
+        Args:
+            prompt: Natural language description of the diagram
+            diagram_type: Type of diagram to generate
+            previous_syntax: Previous diagram syntax for iterative updates
+        
+        Returns:
+            List of chat messages
+        """
+        # Construct the system prompt
+        system_prompt = self._get_system_prompt(diagram_type)
+        
+        # Prepare user message with context if iterating
+        user_message = prompt
+        if previous_syntax:
+            user_message = f"Here is the current diagram:\n\n{previous_syntax}\n\nNow modify it based on this request: {prompt}"
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+    
+    def _use_edit_script(self, previous_syntax: Optional[str]) -> bool:
+        """Whether an iteration asks for an edit script rather than the whole diagram"""
+        config = current_app.config
+        return (bool(previous_syntax) and config.get('OPENAI_EDIT_ITERATIONS', False)
+                and previous_syntax.count('\n') + 1 >= config.get('OPENAI_EDIT_MIN_LINES', 0))
+    
+    def _build_edit_messages(self, prompt: str, diagram_type: str, previous_syntax: str) -> List[Dict[str, str]]:
+        """
+        Build the chat messages asking for an edit script against the current diagram
+        
+        Args:
+            prompt: Requested change
+            diagram_type: Type of diagram
+            previous_syntax: Current diagram
+        
+        Returns:
+            List of chat messages
+        """
+        user_message = (f"Here is the current diagram with line numbers:\n\n{number_lines(previous_syntax)}\n\n"
+                        f"Return the edits for this request: {prompt}")
+        return [
+            {"role": "system", "content": self._get_system_prompt(diagram_type, base_prompt=EDIT_SYSTEM_PROMPT)},
+            {"role": "user", "content": user_message}
+        ]
+    
+    def _apply_edit_answer(self, previous_syntax: str, diagram_type: str, answer: Optional[str]) -> Optional[str]:
+        """
+        Apply the model's edit script to the current diagram
+        
+        A model that answered with a whole diagram anyway is taken at its word
+        if that diagram validates.
+        
+        Args:
+            previous_syntax: Current diagram
+            diagram_type: Type of diagram
+            answer: Raw model output
+        
+        Returns:
+            The edited, valid syntax, or None to fall back to full regeneration
+        """
+        answer = (answer or '').strip()
+        outcome = 'applied'
+        try:
+            syntax = apply_edit_script(previous_syntax, parse_edit_script(answer), diagram_type)
+        except EditScriptError as e:
+            syntax = self._clean_syntax(answer)
+            if not self.diagram_service.validate_syntax(syntax, diagram_type).is_valid:
+                logger.warning(f"Edit script rejected, regenerating the diagram: {str(e)}")
+                self._record_edit('rejected_scripts')
+                return None
+            outcome = 'full_answers'
+        else:
+            validation = self.diagram_service.validate_syntax(syntax, diagram_type)
+            if not validation.is_valid:
+                logger.warning(f"Edited diagram is invalid, regenerating it: {validation.error}")
+                self._record_edit('invalid_results')
+                return None
+        
+        self._record_edit(outcome, len(answer), len(syntax))
+        return syntax
+    
+    def _record_edit(self, outcome: str, answer_chars: int = 0, result_chars: int = 0) -> None:
+        edit_stats = self._shared('openai_edit_stats', lambda config: EditScriptStats())
+        with _shared_lock:
+            edit_stats.attempts += 1
+            setattr(edit_stats, outcome, getattr(edit_stats, outcome) + 1)
+            if outcome == 'applied':
+                edit_stats.answer_chars += answer_chars
+                edit_stats.result_chars += result_chars
+    
+    def edit_script_stats(self) -> Optional[dict]:
+        """
+        Get edit-script iteration counters
+        
+        Returns:
+            Dictionary of edit outcomes, or None when edit-script iterations are disabled
+        """
+        if not current_app.config.get('OPENAI_EDIT_ITERATIONS', False):
+            return None
+        edit_stats = self._shared('openai_edit_stats', lambda config: EditScriptStats())
+        with _shared_lock:
+            return edit_stats.to_dict()
+    
+    def _validate_and_repair(self, syntax: str, diagram_type: str, priority: int,
+                             started: float) -> Tuple[str, Optional[ValidationResult]]:
+        """
+        Validate generated syntax and repair it if it fails
+        
+        Local fixes come first. What they cannot fix is sent back to the
+        model with only the failing lines, at most OPENAI_REPAIR_MAX_REPROMPTS
+        times and only while OPENAI_REPAIR_BUDGET_SECONDS since the generation
+        started have not run out. Syntax that cannot be repaired is returned
+        as it is with its failing validation, so the user can still fix it in
+        the editor.
+        
+        Args:
+            syntax: Cleaned model output
+            diagram_type: Type of diagram
+            priority: Rate limiter priority for a re-prompt
+            started: time.monotonic() when the generation started
+        
+        Returns:
+            Tuple of (repaired syntax or the best attempt, its validation
+            result, or None when repairs are disabled)
+        """
+        if not current_app.config.get('OPENAI_REPAIR_ENABLED', False):
+            return syntax, None
+        syntax, validation = self._repair_locally(syntax, diagram_type)
+        if validation.is_valid:
+            return syntax, validation
+        
+        for _ in range(current_app.config['OPENAI_REPAIR_MAX_REPROMPTS']):
+            remaining = self._repair_time_left(started)
+            if remaining is None:
+                break
+            try:
+                response = self._create_completion(
+                    self._build_repair_messages(syntax, diagram_type, validation),
+                    priority,
+                    max_tokens=current_app.config['OPENAI_REPAIR_MAX_TOKENS'],
+                    timeout=remaining
+                )
+            except Exception as e:
+                logger.warning(f"Repair request failed: {str(e)}")
+                break
+            syntax, validation = self._apply_repair_answer(syntax, diagram_type, response.choices[0].message.content)
+            if validation.is_valid:
+                break
+        
+        self._record_repair_result(validation)
+        return syntax, validation
+    
+    def _repair_locally(self, syntax: str, diagram_type: str) -> Tuple[str, ValidationResult]:
+        """Validate syntax, applying the local fixes when it fails"""
+        syntax, validation, fixes = repair_locally(syntax, diagram_type, self.diagram_service)
+        outcome = 'valid' if not fixes and validation.is_valid else 'local_repairs' if validation.is_valid else None
+        self._count_repair('checked')
+        if outcome is not None:
+            self._count_repair(outcome)
+        if outcome == 'local_repairs':
+            metrics.inc('syntax_repairs_total', outcome='local')
+        return syntax, validation
+    
+    def _repair_time_left(self, started: float) -> Optional[float]:
+        """Seconds left in the repair budget, or None (counted as exhausted) when it has run out"""
+        remaining = current_app.config['OPENAI_REPAIR_BUDGET_SECONDS'] - (time.monotonic() - started)
+        if remaining > 0:
+            return remaining
+        self._count_repair('budget_exhausted')
+        return None
+    
+    def _build_repair_messages(self, syntax: str, diagram_type: str,
+                               validation: ValidationResult) -> List[Dict[str, str]]:
+        """
+        Build the chat messages asking for an edit script that fixes a validation error
+        
+        Only the failing lines and a little context are sent, numbered as in
+        the full diagram so the edit script applies to it.
+        
+        Args:
+            syntax: Invalid syntax
+            diagram_type: Type of diagram
+            validation: Its validation result
+        
+        Returns:
+            List of chat messages
+        """
+        excerpt = failing_excerpt(syntax, validation, current_app.config['OPENAI_REPAIR_CONTEXT_LINES'])
+        user_message = (f"These lines of the diagram fail validation with the error: {validation.error}\n\n"
+                        f"{excerpt}\n\nReturn the edits that fix the error.")
+        return [
+            {"role": "system", "content": self._get_system_prompt(diagram_type, base_prompt=EDIT_SYSTEM_PROMPT)},
+            {"role": "user", "content": user_message}
+        ]
+    
+    def _apply_repair_answer(self, syntax: str, diagram_type: str,
+                             answer: Optional[str]) -> Tuple[str, ValidationResult]:
+        """
+        Apply the model's fix to invalid syntax
+        
+        A whole diagram instead of an edit script is used if it validates.
+        
+        Args:
+            syntax: Invalid syntax
+            diagram_type: Type of diagram
+            answer: Raw model output
+        
+        Returns:
+            Tuple of (syntax, its validation result); the input syntax when the answer does not apply
+        """
+        self._count_repair('reprompts')
+        answer = (answer or '').strip()
+        try:
+            repaired = apply_edit_script(syntax, parse_edit_script(answer), diagram_type)
+        except EditScriptError:
+            repaired = self._clean_syntax(answer)
+        repaired, validation, _ = repair_locally(repaired, diagram_type, self.diagram_service)
+        if validation.is_valid:
+            return repaired, validation
+        return syntax, self.diagram_service.validate_syntax(syntax, diagram_type)
+    
+    def _record_repair_result(self, validation: ValidationResult) -> None:
+        """Count the outcome of repairs that went beyond the local fixes"""
+        self._count_repair('reprompt_repairs' if validation.is_valid else 'unrepaired')
+        if validation.is_valid:
+            metrics.inc('syntax_repairs_total', outcome='reprompt')
+        else:
+            metrics.inc('syntax_repairs_total', outcome='unrepaired')
+            logger.warning(f"Generated syntax is still invalid after repair: {validation.error}")
+    
+    def syntax_repair_stats(self) -> Optional[dict]:
+        """
+        Get validation-and-repair counters
+        
+        Returns:
+            Dictionary of repair outcomes, or None when repairs are disabled
+        """
+        if not current_app.config.get('OPENAI_REPAIR_ENABLED', False):
+            return None
+        repair_stats = self._shared('openai_repair_stats', lambda config: RepairStats())
+        with _shared_lock:
+            return repair_stats.to_dict()
+    
+    def _count_repair(self, outcome: str) -> None:
+        repair_stats = self._shared('openai_repair_stats', lambda config: RepairStats())
+        with _shared_lock:
+            setattr(repair_stats, outcome, getattr(repair_stats, outcome) + 1)
+    
+    def _get_system_prompt(self, diagram_type: str, base_prompt: Optional[str] = None) -> str:
+        """
+        Get the system prompt for the specific diagram type
+        
+        Args:
+            diagram_type: Type of diagram
+            base_prompt: Instructions to use instead of the full-diagram ones
+            
+        Returns:
+            System prompt string
+        """
+        if base_prompt is None:
+            prompt = SYSTEM_PROMPTS.get(diagram_type)
+        elif base_prompt is EDIT_SYSTEM_PROMPT:
+            prompt = EDIT_SYSTEM_PROMPTS.get(diagram_type)
+        else:
+            prompt = None
+        return prompt or _join_prompt(base_prompt or SYSTEM_PROMPT, diagram_type)
     
     def _clean_syntax(self, syntax: str) -> str:
         """
@@ -206,16 +1112,126 @@ mindmap
         Returns:
             Cleaned syntax
         """
-        # Remove markdown code blocks
-        if syntax.startswith('```'):
-            lines = syntax.split('\n')
-            if len(lines) > 2:
-                # Remove first and last lines (code block markers)
-                syntax = '\n'.join(lines[1:-1])
+        with metrics.timer('clean_syntax_duration_seconds'):
+            # Remove markdown code blocks
+            if syntax.startswith('```'):
+                lines = syntax.split('\n')
+                if len(lines) > 2:
+                    # Remove first and last lines (code block markers)
+                    syntax = '\n'.join(lines[1:-1])
+            
+            # Remove 'mermaid' keyword if it's on the first line
+            lines = syntax.strip().split('\n')
+            if lines and lines[0].strip().lower() == 'mermaid':
+                syntax = '\n'.join(lines[1:])
+            
+            return syntax.strip()
+
+
+class StreamingSyntaxCleaner:
+    """
+    Incremental counterpart of OpenAIService._clean_syntax
+    
+    Buffers streamed text into complete lines, dropping the opening code
+    fence, a leading 'mermaid' line and a trailing closing fence.
+    """
+    
+    def __init__(self):
+        """Initialize the cleaner"""
+        self._buffer = ''
+        self._seen_content = False
+        self._fenced = False
+        self._pending: List[str] = []
+    
+    def feed(self, text: str) -> List[str]:
+        """
+        Add streamed text
+        
+        Args:
+            text: Next chunk of model output
         
-        # Remove 'mermaid' keyword if it's on the first line
-        lines = syntax.strip().split('\n')
-        if lines and lines[0].strip().lower() == 'mermaid':
-            syntax = '\n'.join(lines[1:])
+        Returns:
+            Cleaned lines completed by this chunk
+        """
+        self._buffer += text
+        *complete, self._buffer = self._buffer.split('\n')
+        lines = []
+        for line in complete:
+            lines.extend(self._process(line))
+        return lines
+    
+    def finish(self) -> List[str]:
+        """
+        Flush the remaining buffered text at the end of the stream
+        
+        Returns:
+            Cleaned lines still held back
+        """
+        lines = self._process(self._buffer) if self._buffer else []
+        self._buffer = ''
+        
+        # A fence held back at the very end closes the opening fence
+        pending = [line for line in self._pending if line.strip()]
+        if self._fenced and pending and pending[-1].strip().startswith('```'):
+            pending.pop()
+        self._pending = []
+        return lines + pending
+    
+    def _process(self, line: str) -> List[str]:
+        if not self._seen_content:
+            if not line.strip():
+                return []
+            if line.strip().startswith('```') and not self._fenced:
+                self._fenced = True
+                return []
+            if line.strip().lower() == 'mermaid':
+                return []
+            self._seen_content = True
+            return [line.lstrip()]
         
-        return syntax.strip()
\ No newline at end of file
+        # Hold back blank lines and fences until we know they are not trailing
+        if not line.strip() or line.strip().startswith('```'):
+            self._pending.append(line)
+            return []
+        
+        lines = self._pending + [line]
+        self._pending = []
+        return lines
+
+
+# The app and service warmed up after a fork; the hook is registered once per process
+_warm_up_target: Optional[Tuple[Any, OpenAIService]] = None
+_fork_hook_registered = False
+
+
+def start_warm_up(app, service: OpenAIService) -> None:
+    """
+    Warm a service's connection on a background thread, now and after every fork
+    
+    Workers forked from a preloaded app drop the parent's client, so each
+    child warms its own. Only the most recently started app is warmed in
+    forked children.
+    
+    Args:
+        app: Flask application whose config builds the client
+        service: Service to warm up
+    """
+    global _warm_up_target, _fork_hook_registered
+    _warm_up_target = (app, service)
+    _start_warm_up_thread(app, service)
+    if not _fork_hook_registered:
+        os.register_at_fork(after_in_child=_warm_up_after_fork)
+        _fork_hook_registered = True
+
+
+def _start_warm_up_thread(app, service: OpenAIService) -> None:
+    def run() -> None:
+        with app.app_context():
+            service.warm_up()
+    
+    threading.Thread(target=run, name='openai-warm-up', daemon=True).start()
+
+
+def _warm_up_after_fork() -> None:
+    if _warm_up_target is not None:
+        _start_warm_up_thread(*_warm_up_target)
@@ -0,0 +1,328 @@
+"""
+Sampled per-request profiling for the API
+
+ProfilingMiddleware wraps the WSGI app and runs cProfile around requests to
+/api/ endpoints that are picked by a sampling rate or carry the profiling
+header, so the profile covers Flask dispatch, session handling and the view
+alike. Each profile is written as a pstats file, a collapsed-stack text
+file for flame graph tools and a JSON summary, in a directory that keeps
+only the most recent profiles. At most one request is profiled at a time;
+requests picked while another is being profiled run unprofiled.
+"""
+
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILE_KINDS = {'pstats': '.pstats', 'collapsed': '.collapsed'}
+
+_PROFILE_ID = re.compile(r'\d{16}-[0-9a-f]{8}')
+
+# Frames whose share of a stack is below this many seconds are left out of the flame graph
+_MIN_FRAME_SECONDS = 1e-6
+_MAX_STACK_DEPTH = 64
+
+
+def _frame_label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == '~':
+        return name.replace(';', ':')
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ':')
+
+
+def collapsed_stacks(stats: Mapping[Tuple[str, int, str], tuple]) -> List[str]:
+    """
+    Approximate collapsed stacks from cProfile's caller graph
+    
+    cProfile records caller/callee pairs rather than whole stacks, so the
+    time of a function reached along several paths is split between them
+    in proportion to the time each caller spent in it.
+    
+    Args:
+        stats: pstats.Stats(...).stats
+    
+    Returns:
+        Lines of "frame;frame;frame microseconds", heaviest first
+    """
+    callees: Dict[tuple, Dict[tuple, tuple]] = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+    
+    totals: Dict[str, float] = defaultdict(float)
+    
+    def walk(func: tuple, path: Tuple[tuple, ...], self_time: float, share: float) -> None:
+        totals[';'.join(_frame_label(frame) for frame in path)] += self_time
+        if len(path) >= _MAX_STACK_DEPTH:
+            return
+        for callee, edge in callees.get(func, {}).items():
+            cumulative = stats[callee][3]
+            if callee in path or not cumulative or share * edge[3] < _MIN_FRAME_SECONDS:
+                continue
+            walk(callee, path + (callee,), share * edge[2], share * edge[3] / cumulative)
+    
+    for func, (_, _, self_time, _, callers) in stats.items():
+        if not callers:
+            walk(func, (func,), self_time, 1.0)
+    
+    lines = [(stack, seconds) for stack, seconds in totals.items() if seconds >= _MIN_FRAME_SECONDS]
+    lines.sort(key=lambda item: item[1], reverse=True)
+    return [f"{stack} {round(seconds * 1e6)}" for stack, seconds in lines]
+
+
+@dataclass
+class ProfilerStats:
+    """Counters describing request profiling"""
+    sampled: int = 0
+    requested: int = 0
+    skipped_busy: int = 0
+    written: int = 0
+    errors: int = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'sampled': self.sampled,
+            'requested': self.requested,
+            'skipped_busy': self.skipped_busy,
+            'written': self.written,
+            'errors': self.errors
+        }
+
+
+class RequestProfiler:
+    """Decides which requests to profile and keeps their profiles in a bounded directory"""
+    
+    def __init__(self, directory: str, max_profiles: int = 50, sample_rate: float = 0.0,
+                 header: str = 'X-Profile-Request', token: Optional[str] = None, path_prefix: str = '/api/'):
+        """
+        Initialize the profiler
+        
+        Args:
+            directory: Where profiles are written
+            max_profiles: Profiles kept, oldest are deleted first
+            sample_rate: Fraction of requests profiled without being asked
+            header: Request header asking for a profile
+            token: Value the header must carry; when set it is also required to read profiles
+            path_prefix: Only paths under this prefix are profiled
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sample_rate = sample_rate
+        self.header = header
+        self.token = token
+        self.path_prefix = path_prefix
+        self.stats = ProfilerStats()
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+    
+    def is_authorized(self, value: Optional[str]) -> bool:
+        """Check a header value against the token; anything goes when no token is set"""
+        if self.token is None:
+            return True
+        return value is not None and hmac.compare_digest(value, self.token)
+    
+    def trigger(self, path: str, header_value: Optional[str]) -> Optional[str]:
+        """
+        Decide whether a request is profiled
+        
+        Args:
+            path: Request path
+            header_value: Value of the profiling header, if sent
+        
+        Returns:
+            'header' or 'sample' when the request should be profiled, otherwise None
+        """
+        if not path.startswith(self.path_prefix) or path.startswith(f"{self.path_prefix}debug/"):
+            return None
+        if header_value is not None and self.is_authorized(header_value):
+            return 'header'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+    
+    def profile(self, fn: Callable[[], Any], trigger: str) -> Tuple[Any, Optional[cProfile.Profile]]:
+        """
+        Run fn under cProfile unless another request is being profiled
+        
+        Returns:
+            Tuple of (fn's result, the profile or None if it ran unprofiled)
+        """
+        with self._lock:
+            if trigger == 'header':
+                self.stats.requested += 1
+            else:
+                self.stats.sampled += 1
+            busy = not self._active.acquire(blocking=False)
+            if busy:
+                self.stats.skipped_busy += 1
+        if busy:
+            return fn(), None
+        
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                result = fn()
+            finally:
+                profile.disable()
+        finally:
+            self._active.release()
+        return result, profile
+    
+    def save(self, profile: cProfile.Profile, summary: Dict[str, Any]) -> Optional[str]:
+        """
+        Write a profile and drop the oldest beyond max_profiles
+        
+        Args:
+            profile: Finished profile
+            summary: Request details stored alongside it
+        
+        Returns:
+            Profile id, or None if writing failed
+        """
+        profile_id = f"{time.time_ns() // 1000:016d}-{secrets.token_hex(4)}"
+        base = os.path.join(self.directory, profile_id)
+        try:
+            profile.dump_stats(base + PROFILE_KINDS['pstats'])
+            with open(base + PROFILE_KINDS['collapsed'], 'w') as f:
+                f.write('\n'.join(collapsed_stacks(pstats.Stats(profile).stats)) + '\n')
+            with open(base + '.json', 'w') as f:
+                json.dump({'id': profile_id, **summary}, f)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error writing request profile: {str(e)}")
+            with self._lock:
+                self.stats.errors += 1
+            return None
+        
+        with self._lock:
+            self.stats.written += 1
+            self._evict()
+        return profile_id
+    
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """
+        Summaries of the stored profiles
+        
+        Returns:
+            Newest first
+        """
+        profiles = []
+        for profile_id in reversed(self._profile_ids()):
+            try:
+                with open(os.path.join(self.directory, profile_id + '.json')) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+    
+    def profile_path(self, profile_id: str, kind: str) -> Optional[str]:
+        """
+        Path of a stored profile file
+        
+        Args:
+            profile_id: Id from list_profiles
+            kind: 'pstats' or 'collapsed'
+        
+        Returns:
+            Path, or None for unknown ids and kinds
+        """
+        if kind not in PROFILE_KINDS or not _PROFILE_ID.fullmatch(profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + PROFILE_KINDS[kind])
+        return path if os.path.exists(path) else None
+    
+    def _profile_ids(self) -> List[str]:
+        """Stored ids, oldest first (ids start with a zero-padded timestamp)"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith('.json') and _PROFILE_ID.fullmatch(name[:-5]))
+    
+    def _evict(self) -> None:
+        profile_ids = self._profile_ids()
+        for profile_id in profile_ids[:max(0, len(profile_ids) - self.max_profiles)]:
+            for suffix in ('.json', *PROFILE_KINDS.values()):
+                try:
+                    os.unlink(os.path.join(self.directory, profile_id + suffix))
+                except OSError:
+                    pass
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling the requests RequestProfiler picks"""
+    
+    def __init__(self, wsgi_app: Callable, profiler: RequestProfiler):
+        """
+        Initialize the middleware
+        
+        Args:
+            wsgi_app: The wrapped WSGI application
+            profiler: Decides what to profile and stores the results
+        """
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+        self._header_key = 'HTTP_' + profiler.header.upper().replace('-', '_')
+    
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        path = environ.get('PATH_INFO', '')
+        trigger = self.profiler.trigger(path, environ.get(self._header_key))
+        if trigger is None:
+            return self.wsgi_app(environ, start_response)
+        
+        status = []
+        
+        def record_status(status_line: str, headers, exc_info=None):
+            status.append(status_line)
+            return start_response(status_line, headers, exc_info)
+        
+        started = time.perf_counter()
+        # Streamed bodies are produced after this returns and are not part of the profile
+        result, profile = self.profiler.profile(lambda: self.wsgi_app(environ, record_status), trigger)
+        duration = time.perf_counter() - started
+        if profile is not None:
+            self.profiler.save(profile, {
+                'method': environ.get('REQUEST_METHOD'),
+                'path': path,
+                'status': int(status[0].split()[0]) if status else None,
+                'duration_ms': round(duration * 1000, 3),
+                'trigger': trigger,
+                'created': time.time()
+            })
+        return result
+
+
+def create_profiler(config: Mapping[str, Any]) -> Optional[RequestProfiler]:
+    """
+    Create the request profiler configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        RequestProfiler, or None when profiling is disabled
+    """
+    if not config.get('PROFILING_ENABLED'):
+        return None
+    return RequestProfiler(
+        directory=config.get('PROFILING_DIR') or 'profiles',
+        max_profiles=config.get('PROFILING_MAX_PROFILES', 50),
+        sample_rate=config.get('PROFILING_SAMPLE_RATE', 0.0),
+        header=config.get('PROFILING_HEADER', 'X-Profile-Request'),
+        token=config.get('PROFILING_TOKEN')
+    )
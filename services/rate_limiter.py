@@ -0,0 +1,393 @@
+"""
+Client-side rate limiting for OpenAI calls
+
+Requests and estimated tokens are drawn from per-minute token buckets.
+Callers that cannot be served yet wait in a priority queue (iterations on
+an existing diagram before new diagrams, new diagrams before batch work)
+and the buckets are retuned from the x-ratelimit-* headers the API sends
+back, so the limiter converges on the account's real limits.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+# Lower values are served first
+PRIORITY_ITERATION = 0
+PRIORITY_NEW = 1
+PRIORITY_BATCH = 2
+
+PRIORITY_NAMES = {PRIORITY_ITERATION: 'iteration', PRIORITY_NEW: 'new', PRIORITY_BATCH: 'batch'}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a call waited longer than the queue timeout"""
+
+
+class TokenBudget:
+    """Token bucket refilled continuously up to a per-minute allowance"""
+    
+    def __init__(self, tokens_per_minute: int):
+        """
+        Initialize the budget
+        
+        Args:
+            tokens_per_minute: Tokens that may be spent per minute
+        """
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.available = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self, tokens: int) -> float:
+        """
+        Spend tokens if the budget allows it
+        
+        Args:
+            tokens: Tokens to spend, capped at the per-minute allowance
+        
+        Returns:
+            0 if the tokens were spent, otherwise seconds until they will be available
+        """
+        with self._lock:
+            wait = self._wait_time(tokens)
+            if not wait:
+                self.available -= min(tokens, self.capacity)
+            return wait
+    
+    def wait_time(self, tokens: int) -> float:
+        """Seconds until tokens could be spent, without spending them"""
+        with self._lock:
+            return self._wait_time(tokens)
+    
+    def set_limit(self, tokens_per_minute: int) -> None:
+        """Change the per-minute allowance, keeping what is currently available within it"""
+        with self._lock:
+            self._refill()
+            self.capacity = tokens_per_minute
+            self.rate = tokens_per_minute / 60.0
+            self.available = min(self.available, float(tokens_per_minute))
+    
+    def set_remaining(self, tokens: float) -> None:
+        """Lower the available tokens to what the server reports as remaining"""
+        with self._lock:
+            self._refill()
+            self.available = min(self.available, float(tokens))
+    
+    def _wait_time(self, tokens: int) -> float:
+        tokens = min(tokens, self.capacity)
+        self._refill()
+        if self.available >= tokens:
+            return 0.0
+        return (tokens - self.available) / self.rate
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+@dataclass
+class RateLimiterStats:
+    """Counters describing rate limiting"""
+    acquired: int = 0
+    queued: int = 0
+    wait_seconds: float = 0.0
+    max_queue_depth: int = 0
+    timeouts: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    adaptations: int = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'acquired': self.acquired,
+            'queued': self.queued,
+            'wait_seconds': round(self.wait_seconds, 3),
+            'max_queue_depth': self.max_queue_depth,
+            'timeouts': self.timeouts,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'adaptations': self.adaptations
+        }
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """
+    Jittered exponential backoff
+    
+    Args:
+        attempt: Retry number, starting at 0
+        base: Delay scale for the first retry
+        cap: Upper bound before jitter
+        retry_after: Server-requested delay, used as a floor
+    
+    Returns:
+        Seconds to sleep before the retry
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Parse retry-after-ms or retry-after from response headers"""
+    if not headers:
+        return None
+    for name, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
+
+
+class RateLimiter:
+    """Priority queue in front of request and token budgets"""
+    
+    # Longest a waiting coroutine sleeps before checking its place in the queue again
+    ASYNC_POLL_INTERVAL = 0.05
+    
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                 queue_timeout: float = 60.0, adaptive: bool = True):
+        """
+        Initialize the limiter
+        
+        Args:
+            requests_per_minute: Request budget, or None until the API reports one
+            tokens_per_minute: Token budget, or None until the API reports one
+            queue_timeout: Seconds a call may wait before RateLimitTimeout is raised
+            adaptive: Retune the budgets from rate-limit response headers
+        """
+        self.requests = TokenBudget(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBudget(tokens_per_minute) if tokens_per_minute else None
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.stats = RateLimiterStats()
+        self._condition = threading.Condition()
+        self._queue: list = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+    
+    def acquire(self, tokens: int, priority: int = PRIORITY_NEW) -> float:
+        """
+        Wait until a call of the given size may be sent and spend its budget
+        
+        Only the head of the queue spends budget, so higher priorities
+        overtake waiting lower ones and equal priorities keep their order.
+        
+        Args:
+            tokens: Estimated tokens the call consumes
+            priority: PRIORITY_ITERATION, PRIORITY_NEW or PRIORITY_BATCH
+        
+        Returns:
+            Seconds spent waiting
+        
+        Raises:
+            RateLimitTimeout: If the call waited longer than queue_timeout
+        """
+        ticket, started, deadline = self._enqueue(priority)
+        queued = False
+        with self._condition:
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._try_spend(ticket, tokens, now, deadline)
+                    if wait == 0.0:
+                        break
+                    queued = True
+                    self._condition.wait(wait)
+            finally:
+                self._dequeue(ticket)
+            return self._record_acquired(started, queued)
+    
+    async def acquire_async(self, tokens: int, priority: int = PRIORITY_NEW) -> float:
+        """
+        Awaitable counterpart of acquire, sharing its queue and budgets
+        
+        Waiting coroutines hold no thread. They cannot be woken by the
+        condition the threads wait on, so they check again at most every
+        ASYNC_POLL_INTERVAL seconds.
+        
+        Args:
+            tokens: Estimated tokens the call consumes
+            priority: PRIORITY_ITERATION, PRIORITY_NEW or PRIORITY_BATCH
+        
+        Returns:
+            Seconds spent waiting
+        
+        Raises:
+            RateLimitTimeout: If the call waited longer than queue_timeout
+        """
+        ticket, started, deadline = self._enqueue(priority)
+        queued = False
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_spend(ticket, tokens, time.monotonic(), deadline)
+                if wait == 0.0:
+                    break
+                queued = True
+                await asyncio.sleep(min(wait, self.ASYNC_POLL_INTERVAL))
+        finally:
+            with self._condition:
+                self._dequeue(ticket)
+        with self._condition:
+            return self._record_acquired(started, queued)
+    
+    def _enqueue(self, priority: int) -> Tuple[Tuple[int, int], float, float]:
+        """Queue a ticket; returns it with the start time and the deadline"""
+        ticket = (priority, next(self._sequence))
+        started = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._queue, ticket)
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, len(self._queue))
+        return ticket, started, started + self.queue_timeout
+    
+    def _try_spend(self, ticket: Tuple[int, int], tokens: int, now: float, deadline: float) -> float:
+        """
+        Spend the budget if ticket is at the head of the queue and it suffices
+        
+        Returns:
+            0 once spent, otherwise seconds to wait before trying again
+        
+        Raises:
+            RateLimitTimeout: If the deadline has passed
+        """
+        wait = None
+        if self._queue[0] == ticket:
+            wait = self._wait_time(tokens, now)
+            if not wait:
+                self._spend(tokens)
+                return 0.0
+        if now >= deadline:
+            self.stats.timeouts += 1
+            raise RateLimitTimeout(f"Rate limit queue wait exceeded {self.queue_timeout:g}s")
+        return min(wait, deadline - now) if wait is not None else deadline - now
+    
+    def _dequeue(self, ticket: Tuple[int, int]) -> None:
+        self._queue.remove(ticket)
+        heapq.heapify(self._queue)
+        self._condition.notify_all()
+    
+    def _record_acquired(self, started: float, queued: bool) -> float:
+        waited = time.monotonic() - started
+        self.stats.acquired += 1
+        self.stats.queued += queued
+        self.stats.wait_seconds += waited
+        return waited
+    
+    def update_from_headers(self, headers: Mapping[str, str], status_code: Optional[int] = None) -> None:
+        """
+        Retune the budgets from an API response
+        
+        Args:
+            headers: Response headers carrying x-ratelimit-* and retry-after values
+            status_code: HTTP status; a 429 pauses the queue for the retry-after delay
+        """
+        with self._condition:
+            if status_code == 429:
+                self.stats.rate_limited += 1
+                delay = retry_after_seconds(headers)
+                if delay:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            
+            if self.adaptive:
+                self.requests = self._adapt(self.requests, headers, 'requests')
+                self.tokens = self._adapt(self.tokens, headers, 'tokens')
+            self._condition.notify_all()
+    
+    def record_retry(self) -> None:
+        with self._condition:
+            self.stats.retries += 1
+    
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Current queue depth, budgets and counters
+        
+        Returns:
+            Dictionary for JSON serialization
+        """
+        with self._condition:
+            depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+            for priority, _ in self._queue:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                depth[name] = depth.get(name, 0) + 1
+            metrics = self.stats.to_dict()
+            metrics.update({
+                'queue_depth': len(self._queue),
+                'queue_depth_by_priority': depth,
+                'requests_per_minute': self.requests.capacity if self.requests else None,
+                'tokens_per_minute': self.tokens.capacity if self.tokens else None,
+                'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 3)
+            })
+            return metrics
+    
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+    
+    def _spend(self, tokens: int) -> None:
+        if self.requests is not None:
+            self.requests.reserve(1)
+        if self.tokens is not None:
+            self.tokens.reserve(tokens)
+    
+    def _adapt(self, budget: Optional[TokenBudget], headers: Mapping[str, str], kind: str) -> Optional[TokenBudget]:
+        limit = _header_number(headers, f"x-ratelimit-limit-{kind}")
+        remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+        if limit:
+            if budget is None:
+                budget = TokenBudget(int(limit))
+                self.stats.adaptations += 1
+            elif budget.capacity != int(limit):
+                budget.set_limit(int(limit))
+                self.stats.adaptations += 1
+        if budget is not None and remaining is not None:
+            budget.set_remaining(remaining)
+        return budget
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def create_rate_limiter(config: Mapping[str, Any]) -> Optional[RateLimiter]:
+    """
+    Create the OpenAI rate limiter configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        RateLimiter, or None when rate limiting is disabled
+    """
+    if not config.get('OPENAI_RATE_LIMIT_ENABLED', True):
+        return None
+    return RateLimiter(
+        requests_per_minute=config.get('OPENAI_REQUESTS_PER_MINUTE'),
+        tokens_per_minute=config.get('OPENAI_TOKENS_PER_MINUTE'),
+        queue_timeout=config.get('OPENAI_QUEUE_TIMEOUT', 60.0),
+        adaptive=config.get('OPENAI_RATE_LIMIT_ADAPTIVE', True)
+    )
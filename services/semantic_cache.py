@@ -0,0 +1,331 @@
+"""
+Similarity-based prompt cache for generated Mermaid diagram syntax
+
+Near-duplicate prompts ("login flow with 2FA", "2FA login flowchart") miss
+the exact-match response cache. This index keeps every answered prompt as
+a set of character trigrams and word bigrams with a MinHash signature;
+LSH banding over the signatures finds candidate prompts without scanning
+the whole index, and the best candidate is served when its Jaccard
+similarity to the new prompt reaches the threshold and the two prompts do
+not swap roles ("Alice pays Bob", "Bob pays Alice"). Everything is computed
+locally, no embedding model is involved.
+"""
+
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from services.cache_service import make_cache_key
+
+# Filler words and diagram nouns carry no meaning once the index is per type
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'as', 'by', 'for', 'from', 'in', 'into', 'is', 'it', 'me', 'of', 'on',
+    'or', 'please', 'show', 'that', 'the', 'this', 'to', 'with', 'create', 'draw', 'generate',
+    'make', 'build', 'chart', 'diagram', 'flow', 'flowchart', 'graph', 'sequence', 'class',
+    'state', 'er', 'journey', 'gantt', 'pie', 'quadrant', 'mindmap',
+})
+
+_WORD = re.compile(r'\w+')
+
+# Mersenne prime for the (a * h + b) mod p permutation family
+_PRIME = (1 << 61) - 1
+
+
+def content_words(prompt: str) -> List[str]:
+    """Lower-cased words of a prompt without stopwords, in order"""
+    return [word for word in _WORD.findall((prompt or '').lower()) if word not in STOPWORDS]
+
+
+def roles_swapped(first: List[str], second: List[str]) -> bool:
+    """
+    Check whether two prompts trade words across a word they share
+    
+    "Alice sends money to Bob" and "Bob sends money to Alice" share every
+    word, but Alice moves from before "sends" to after it while Bob moves
+    the other way. A single word moving ("login flow with 2FA", "2FA login
+    flowchart") is only a rephrasing and does not count.
+    
+    Args:
+        first: Content words of one prompt
+        second: Content words of the other
+    
+    Returns:
+        True when some shared word has one shared word move from before it
+        to after it and another move the opposite way
+    """
+    first_positions = {}
+    for position, word in enumerate(first):
+        first_positions.setdefault(word, position)
+    second_positions = {}
+    for position, word in enumerate(second):
+        second_positions.setdefault(word, position)
+    shared = [word for word in first_positions if word in second_positions]
+    
+    for anchor in shared:
+        moved_after = moved_before = False
+        for word in shared:
+            before_first = first_positions[word] < first_positions[anchor]
+            before_second = second_positions[word] < second_positions[anchor]
+            if word == anchor or before_first == before_second:
+                continue
+            if before_first:
+                moved_after = True
+            else:
+                moved_before = True
+        if moved_after and moved_before:
+            return True
+    return False
+
+
+def prompt_features(prompt: str, ngram: int = 3) -> FrozenSet[str]:
+    """
+    Reduce a prompt to the set compared between prompts
+    
+    Character n-grams of each content word make the match tolerant to
+    inflections and word order; bigrams of adjacent words keep some of the
+    order so "Alice calls Bob" and "Bob calls Alice" are not identical.
+    
+    Args:
+        prompt: Natural language description of the diagram
+        ngram: Character n-gram length
+    
+    Returns:
+        Feature set, empty when the prompt has no content words
+    """
+    words = content_words(prompt)
+    features = set()
+    for word in words:
+        padded = f"#{word}#"
+        if len(padded) <= ngram:
+            features.add(padded)
+        else:
+            features.update(padded[i:i + ngram] for i in range(len(padded) - ngram + 1))
+    features.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+    return frozenset(features)
+
+
+def jaccard(first: FrozenSet[str], second: FrozenSet[str]) -> float:
+    """Jaccard similarity of two feature sets"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class MinHasher:
+    """MinHash signatures over string feature sets"""
+    
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        """
+        Initialize the hasher
+        
+        Args:
+            num_perm: Signature length
+            seed: Seed for the permutation coefficients, fixed so signatures are stable
+        """
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._permutations = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+    
+    def signature(self, features: FrozenSet[str]) -> Tuple[int, ...]:
+        """
+        Compute the MinHash signature of a non-empty feature set
+        
+        Returns:
+            Tuple of num_perm minimum hash values
+        """
+        hashes = [
+            int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            for feature in features
+        ]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._permutations)
+
+
+@dataclass
+class SemanticMatch:
+    """Stored answer served for a similar prompt"""
+    syntax: str
+    prompt: str
+    similarity: float
+
+
+@dataclass
+class SemanticCacheStats:
+    """Counters describing how often stored answers are reused"""
+    lookups: int = 0
+    hits: int = 0
+    candidates: int = 0
+    role_swaps: int = 0
+    evictions: int = 0
+    
+    @property
+    def reuse_rate(self) -> float:
+        """Fraction of lookups answered with a stored diagram"""
+        return self.hits / self.lookups if self.lookups else 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'misses': self.lookups - self.hits,
+            'candidates': self.candidates,
+            'role_swaps': self.role_swaps,
+            'evictions': self.evictions,
+            'reuse_rate': self.reuse_rate
+        }
+
+
+class SemanticCache:
+    """In-process LSH index of answered prompts, one namespace per diagram type and model settings"""
+    
+    def __init__(self, threshold: float = 0.8, max_entries: int = 2048, num_perm: int = 64, bands: int = 16):
+        """
+        Initialize the index
+        
+        Args:
+            threshold: Minimum Jaccard similarity for serving a stored answer
+            max_entries: Maximum number of prompts kept, least recently used go first
+            num_perm: MinHash signature length
+            bands: LSH bands; num_perm must be a multiple of it
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.stats = SemanticCacheStats()
+        self._lock = threading.Lock()
+        # (namespace, features) -> (signature, prompt, syntax)
+        self._entries: 'OrderedDict[Tuple[str, FrozenSet[str]], tuple]' = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], set] = {}
+    
+    def lookup(self, namespace: str, prompt: str) -> Optional[SemanticMatch]:
+        """
+        Find the stored answer for the most similar prompt
+        
+        Args:
+            namespace: Index partition, see namespace_for
+            prompt: Prompt to match
+        
+        Returns:
+            SemanticMatch at or above the threshold, or None
+        """
+        words = content_words(prompt)
+        features = prompt_features(prompt)
+        signature = self.hasher.signature(features) if features else None
+        with self._lock:
+            self.stats.lookups += 1
+            if signature is None:
+                return None
+            
+            if (namespace, features) in self._entries:
+                best_key, best_similarity = (namespace, features), 1.0
+            else:
+                best_key, best_similarity = None, 0.0
+                for key in self._candidates(namespace, signature):
+                    self.stats.candidates += 1
+                    similarity = jaccard(features, key[1])
+                    if similarity <= best_similarity or similarity < self.threshold:
+                        continue
+                    # Similar words in swapped roles describe a different diagram
+                    if roles_swapped(words, content_words(self._entries[key][1])):
+                        self.stats.role_swaps += 1
+                        continue
+                    best_key, best_similarity = key, similarity
+            
+            if best_key is None or best_similarity < self.threshold:
+                return None
+            
+            self._entries.move_to_end(best_key)
+            _, stored_prompt, syntax = self._entries[best_key]
+            self.stats.hits += 1
+            return SemanticMatch(syntax=syntax, prompt=stored_prompt, similarity=best_similarity)
+    
+    def add(self, namespace: str, prompt: str, syntax: str) -> None:
+        """
+        Index an answered prompt
+        
+        Args:
+            namespace: Index partition, see namespace_for
+            prompt: Prompt that was answered
+            syntax: Generated syntax to serve for similar prompts
+        """
+        features = prompt_features(prompt)
+        if not features or not syntax:
+            return
+        
+        key = (namespace, features)
+        signature = self.hasher.signature(features)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, prompt, syntax)
+            for bucket in self._band_keys(namespace, signature):
+                self._buckets.setdefault(bucket, set()).add(key)
+            
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _band_keys(self, namespace: str, signature: Tuple[int, ...]) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        rows = self.rows
+        return [(namespace, band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+    
+    def _candidates(self, namespace: str, signature: Tuple[int, ...]) -> set:
+        candidates = set()
+        for bucket in self._band_keys(namespace, signature):
+            candidates.update(self._buckets.get(bucket, ()))
+        return candidates
+    
+    def _remove(self, key: Tuple[str, FrozenSet[str]]) -> None:
+        signature = self._entries.pop(key)[0]
+        for bucket in self._band_keys(key[0], signature):
+            keys = self._buckets.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[bucket]
+
+
+def namespace_for(diagram_type: str, config: Mapping[str, Any]) -> str:
+    """
+    Index partition for a diagram type under the configured model settings
+    
+    Answers are only shared between prompts for the same diagram type and
+    the same model, temperature and token limit.
+    """
+    return make_cache_key('', diagram_type, None, config)
+
+
+def create_semantic_cache(config: Mapping[str, Any]) -> Optional[SemanticCache]:
+    """
+    Create the semantic cache configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        SemanticCache, or None when it is disabled
+    """
+    if not config.get('SEMANTIC_CACHE_ENABLED'):
+        return None
+    return SemanticCache(
+        threshold=config.get('SEMANTIC_CACHE_THRESHOLD', 0.8),
+        max_entries=config.get('SEMANTIC_CACHE_MAX_ENTRIES', 2048),
+        num_perm=config.get('SEMANTIC_CACHE_NUM_PERM', 64),
+        bands=config.get('SEMANTIC_CACHE_BANDS', 16)
+    )
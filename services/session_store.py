@@ -0,0 +1,578 @@
+"""
+Server-side storage for diagram sessions
+
+The browser cookie only carries a random session id; the current syntax,
+diagram type and history live in one of these backends.
+"""
+
+import logging
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Mapping, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def new_session_id() -> str:
+    """Generate an unguessable session id"""
+    return secrets.token_urlsafe(24)
+
+
+class SessionStore:
+    """
+    Base class for session store backends
+    
+    A session is its state (current syntax and diagram type) plus a history
+    list that is only read when explicitly requested.
+    """
+    
+    def __init__(self, ttl: Optional[float] = None, history_limit: Optional[int] = None,
+                 history_max_bytes: Optional[int] = None):
+        """
+        Initialize the backend
+        
+        Args:
+            ttl: Seconds a session is kept after its last write, or None to keep it
+            history_limit: Most recent history entries kept per session, or None for all
+            history_max_bytes: Most bytes of history entries kept per session, or None for no limit
+        """
+        self.ttl = ttl
+        self.history_limit = history_limit
+        self.history_max_bytes = history_max_bytes
+        self._lock = threading.Lock()
+    
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return {'current_syntax', 'diagram_type', 'history_total'} for a session, or None if unknown"""
+        raise NotImplementedError
+    
+    def save(self, session_id: str, current_syntax: str, diagram_type: str, history_total: int = 0) -> None:
+        """Store the session state; history_total counts entries ever appended"""
+        raise NotImplementedError
+    
+    def append_history(self, session_id: str, syntax: str) -> None:
+        """Append one entry to the session history, dropping the oldest entries beyond the limits"""
+        raise NotImplementedError
+    
+    def load_history(self, session_id: str) -> List[str]:
+        """Return the session history, oldest first"""
+        raise NotImplementedError
+    
+    def last_history(self, session_id: str) -> Optional[str]:
+        """Return the newest history entry, or None if the history is empty"""
+        raise NotImplementedError
+    
+    def replace_last_history(self, session_id: str, syntax: str) -> None:
+        """Replace the newest history entry, if there is one"""
+        raise NotImplementedError
+    
+    def delete(self, session_id: str) -> None:
+        """Remove the session and its history"""
+        raise NotImplementedError
+    
+    def _entries_over_bytes(self, sizes: List[int]) -> int:
+        """Number of oldest entries to drop so the newest ones fit in history_max_bytes"""
+        if self.history_max_bytes is None:
+            return 0
+        kept = 0
+        remaining = self.history_max_bytes
+        for size in reversed(sizes):
+            if size > remaining:
+                break
+            remaining -= size
+            kept += 1
+        return len(sizes) - kept
+
+
+def _entry_bytes(syntax: str) -> int:
+    return len(syntax.encode('utf-8'))
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store evicting the least recently used sessions"""
+    
+    def __init__(self, max_sessions: int = 10000, ttl: Optional[float] = None,
+                 history_limit: Optional[int] = None, history_max_bytes: Optional[int] = None):
+        """
+        Initialize the in-memory store
+        
+        Args:
+            max_sessions: Maximum number of sessions kept
+            ttl: Seconds a session is kept after its last use, or None to keep it
+            history_limit: Most recent history entries kept per session, or None for all
+            history_max_bytes: Most bytes of history entries kept per session, or None for no limit
+        """
+        super().__init__(ttl=ttl, history_limit=history_limit, history_max_bytes=history_max_bytes)
+        self.max_sessions = max_sessions
+        self._sessions: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+    
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._get(session_id)
+            return dict(entry['state']) if entry and entry['state'] else None
+    
+    def save(self, session_id: str, current_syntax: str, diagram_type: str, history_total: int = 0) -> None:
+        with self._lock:
+            entry = self._get_or_create(session_id)
+            entry['state'] = {
+                'current_syntax': current_syntax,
+                'diagram_type': diagram_type,
+                'history_total': history_total
+            }
+    
+    def append_history(self, session_id: str, syntax: str) -> None:
+        with self._lock:
+            history = self._get_or_create(session_id)['history']
+            history.append(syntax)
+            if self.history_limit is not None and len(history) > self.history_limit:
+                del history[:len(history) - self.history_limit]
+            dropped = self._entries_over_bytes([_entry_bytes(entry) for entry in history])
+            if dropped:
+                del history[:dropped]
+    
+    def load_history(self, session_id: str) -> List[str]:
+        with self._lock:
+            entry = self._get(session_id)
+            return list(entry['history']) if entry else []
+    
+    def last_history(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            entry = self._get(session_id)
+            return entry['history'][-1] if entry and entry['history'] else None
+    
+    def replace_last_history(self, session_id: str, syntax: str) -> None:
+        with self._lock:
+            entry = self._get(session_id)
+            if entry and entry['history']:
+                entry['history'][-1] = syntax
+    
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+    
+    def __len__(self) -> int:
+        return len(self._sessions)
+    
+    def _get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        
+        now = time.monotonic()
+        if self.ttl is not None and now - entry['touched_at'] > self.ttl:
+            del self._sessions[session_id]
+            return None
+        
+        entry['touched_at'] = now
+        self._sessions.move_to_end(session_id)
+        return entry
+    
+    def _get_or_create(self, session_id: str) -> Dict[str, Any]:
+        entry = self._get(session_id)
+        if entry is None:
+            entry = {'state': None, 'history': [], 'touched_at': time.monotonic()}
+            self._sessions[session_id] = entry
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return entry
+
+
+class SQLiteSessionStore(SessionStore):
+    """On-disk store shared by all processes on one host"""
+    
+    def __init__(self, path: str, ttl: Optional[float] = None, history_limit: Optional[int] = None,
+                 history_max_bytes: Optional[int] = None):
+        """
+        Initialize the SQLite store
+        
+        Args:
+            path: Database file path
+            ttl: Seconds a session is kept after its last write, or None to keep it
+            history_limit: Most recent history entries kept per session, or None for all
+            history_max_bytes: Most bytes of history entries kept per session, or None for no limit
+        """
+        super().__init__(ttl=ttl, history_limit=history_limit, history_max_bytes=history_max_bytes)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS diagram_sessions ('
+                'id TEXT PRIMARY KEY, current_syntax TEXT NOT NULL, '
+                'diagram_type TEXT NOT NULL, history_total INTEGER NOT NULL DEFAULT 0, '
+                'updated_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS diagram_sessions_updated '
+                'ON diagram_sessions (updated_at)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS diagram_session_history ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, '
+                'syntax TEXT NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS diagram_session_history_session '
+                'ON diagram_session_history (session_id, id)'
+            )
+    
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT current_syntax, diagram_type, history_total, updated_at '
+                'FROM diagram_sessions WHERE id = ?',
+                (session_id,)
+            ).fetchone()
+        if row is None or self._is_expired(row[3]):
+            return None
+        return {'current_syntax': row[0], 'diagram_type': row[1], 'history_total': row[2]}
+    
+    def save(self, session_id: str, current_syntax: str, diagram_type: str, history_total: int = 0) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO diagram_sessions '
+                '(id, current_syntax, diagram_type, history_total, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (session_id, current_syntax, diagram_type, history_total, now)
+            )
+            if self.ttl is not None:
+                self._purge_expired(now)
+    
+    def append_history(self, session_id: str, syntax: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO diagram_session_history (session_id, syntax) VALUES (?, ?)',
+                (session_id, syntax)
+            )
+            if self.history_limit is not None:
+                self._conn.execute(
+                    'DELETE FROM diagram_session_history WHERE session_id = ? AND id NOT IN ('
+                    'SELECT id FROM diagram_session_history WHERE session_id = ? '
+                    'ORDER BY id DESC LIMIT ?)', (session_id, session_id, self.history_limit)
+                )
+            if self.history_max_bytes is not None:
+                rows = self._conn.execute(
+                    'SELECT id, LENGTH(CAST(syntax AS BLOB)) FROM diagram_session_history '
+                    'WHERE session_id = ? ORDER BY id', (session_id,)
+                ).fetchall()
+                dropped = self._entries_over_bytes([row[1] for row in rows])
+                if dropped:
+                    self._conn.execute(
+                        'DELETE FROM diagram_session_history WHERE session_id = ? AND id <= ?',
+                        (session_id, rows[dropped - 1][0])
+                    )
+    
+    def load_history(self, session_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT syntax FROM diagram_session_history WHERE session_id = ? ORDER BY id',
+                (session_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def last_history(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT syntax FROM diagram_session_history WHERE session_id = ? ORDER BY id DESC LIMIT 1',
+                (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def replace_last_history(self, session_id: str, syntax: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE diagram_session_history SET syntax = ? WHERE id = ('
+                'SELECT MAX(id) FROM diagram_session_history WHERE session_id = ?)',
+                (syntax, session_id)
+            )
+    
+    def delete(self, session_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM diagram_sessions WHERE id = ?', (session_id,))
+            self._conn.execute('DELETE FROM diagram_session_history WHERE session_id = ?', (session_id,))
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM diagram_sessions').fetchone()[0]
+    
+    def _is_expired(self, updated_at: float) -> bool:
+        return self.ttl is not None and time.time() - updated_at > self.ttl
+    
+    def _purge_expired(self, now: float) -> None:
+        cutoff = now - self.ttl
+        self._conn.execute(
+            'DELETE FROM diagram_session_history WHERE session_id IN ('
+            'SELECT id FROM diagram_sessions WHERE updated_at < ?)', (cutoff,)
+        )
+        self._conn.execute('DELETE FROM diagram_sessions WHERE updated_at < ?', (cutoff,))
+
+
+class RedisError(Exception):
+    """Error reply from a Redis server"""
+
+
+class RedisClient:
+    """
+    Minimal Redis client speaking RESP over a single socket
+    
+    Only what the session store needs: send a command, read one reply.
+    The connection is opened lazily and re-opened once after a failure.
+    """
+    
+    def __init__(self, url: str = 'redis://localhost:6379/0', timeout: float = 5.0):
+        """
+        Initialize the client
+        
+        Args:
+            url: redis://[:password@]host[:port][/db]
+            timeout: Socket timeout in seconds
+        """
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+    
+    def execute(self, *args: Any) -> Any:
+        """
+        Run one command and return its decoded reply
+        
+        Raises:
+            RedisError: If the server replies with an error
+        """
+        with self._lock:
+            try:
+                return self._execute(args)
+            except (OSError, ConnectionError):
+                # One retry on a fresh connection covers dropped idle sockets
+                self._close()
+                return self._execute(args)
+    
+    def _execute(self, args) -> Any:
+        if self._sock is None:
+            self._connect()
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+    
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self._sock.sendall(self._encode(('AUTH', self.password)))
+            self._read_reply()
+        if self.db:
+            self._sock.sendall(self._encode(('SELECT', self.db)))
+            self._read_reply()
+    
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+    
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+    
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by Redis server")
+        kind, rest = line[:1], line[1:-2]
+        
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            count = int(rest)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply type {kind!r}")
+
+
+# KEYS: history list, parallel list of entry sizes, running byte total.
+# ARGV: entry, history limit (-1 for none), byte limit (-1 for none), ttl (0 for none).
+# Sizes are rebuilt once for histories written before they were tracked.
+_APPEND_HISTORY_SCRIPT = """
+if redis.call('LLEN', KEYS[2]) ~= redis.call('LLEN', KEYS[1]) then
+    redis.call('DEL', KEYS[2], KEYS[3])
+    for _, entry in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+        redis.call('RPUSH', KEYS[2], string.len(entry))
+        redis.call('INCRBY', KEYS[3], string.len(entry))
+    end
+end
+local length = redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('RPUSH', KEYS[2], string.len(ARGV[1]))
+local total = redis.call('INCRBY', KEYS[3], string.len(ARGV[1]))
+local limit, max_bytes, ttl = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+while length > 0 and ((limit >= 0 and length > limit) or (max_bytes >= 0 and total > max_bytes)) do
+    redis.call('LPOP', KEYS[1])
+    total = redis.call('DECRBY', KEYS[3], redis.call('LPOP', KEYS[2]))
+    length = length - 1
+end
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('EXPIRE', KEYS[2], ttl)
+    redis.call('EXPIRE', KEYS[3], ttl)
+end
+return length
+"""
+
+# KEYS as above; ARGV: the replacement entry
+_REPLACE_LAST_HISTORY_SCRIPT = """
+local old = redis.call('LINDEX', KEYS[1], -1)
+if not old then
+    return 0
+end
+redis.call('LSET', KEYS[1], -1, ARGV[1])
+if redis.call('LLEN', KEYS[2]) == redis.call('LLEN', KEYS[1]) then
+    redis.call('LSET', KEYS[2], -1, string.len(ARGV[1]))
+    redis.call('INCRBY', KEYS[3], string.len(ARGV[1]) - string.len(old))
+end
+return 1
+"""
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Store shared across hosts through a Redis-protocol server
+    
+    History appends and in-place replacements run as Lua scripts, so
+    concurrent writes to one session cannot interleave. The byte size of
+    every entry is kept in a parallel list with a running total, so the byte
+    limit is enforced without reading the history back.
+    """
+    
+    def __init__(self, client: RedisClient, ttl: Optional[float] = None,
+                 history_limit: Optional[int] = None, prefix: str = 'diagram-session:',
+                 history_max_bytes: Optional[int] = None):
+        """
+        Initialize the Redis store
+        
+        Args:
+            client: Connected Redis client
+            ttl: Seconds a session is kept after its last write, or None to keep it
+            history_limit: Most recent history entries kept per session, or None for all
+            prefix: Key prefix for session entries
+            history_max_bytes: Most bytes of history entries kept per session, or None for no limit
+        """
+        super().__init__(ttl=ttl, history_limit=history_limit, history_max_bytes=history_max_bytes)
+        self.client = client
+        self.prefix = prefix
+    
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        reply = self.client.execute('HGETALL', self._state_key(session_id))
+        if not reply:
+            return None
+        fields = dict(zip(reply[::2], reply[1::2]))
+        return {
+            'current_syntax': fields.get('current_syntax', ''),
+            'diagram_type': fields.get('diagram_type', 'flowchart'),
+            'history_total': int(fields.get('history_total', 0))
+        }
+    
+    def save(self, session_id: str, current_syntax: str, diagram_type: str, history_total: int = 0) -> None:
+        key = self._state_key(session_id)
+        self.client.execute('HSET', key, 'current_syntax', current_syntax, 'diagram_type', diagram_type,
+                            'history_total', history_total)
+        self._touch(key, *self._history_keys(session_id))
+    
+    def append_history(self, session_id: str, syntax: str) -> None:
+        self.client.execute(
+            'EVAL', _APPEND_HISTORY_SCRIPT, 3, *self._history_keys(session_id), syntax,
+            -1 if self.history_limit is None else self.history_limit,
+            -1 if self.history_max_bytes is None else self.history_max_bytes,
+            0 if self.ttl is None else int(self.ttl)
+        )
+    
+    def load_history(self, session_id: str) -> List[str]:
+        return self.client.execute('LRANGE', self._history_key(session_id), 0, -1) or []
+    
+    def last_history(self, session_id: str) -> Optional[str]:
+        return self.client.execute('LINDEX', self._history_key(session_id), -1)
+    
+    def replace_last_history(self, session_id: str, syntax: str) -> None:
+        self.client.execute('EVAL', _REPLACE_LAST_HISTORY_SCRIPT, 3, *self._history_keys(session_id), syntax)
+    
+    def delete(self, session_id: str) -> None:
+        self.client.execute('DEL', self._state_key(session_id), *self._history_keys(session_id))
+    
+    def _touch(self, *keys: str) -> None:
+        if self.ttl is not None:
+            for key in keys:
+                self.client.execute('EXPIRE', key, int(self.ttl))
+    
+    def _state_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+    
+    def _history_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}:history"
+    
+    def _history_keys(self, session_id: str) -> Tuple[str, str, str]:
+        """The history list, its entry sizes and their total"""
+        key = self._history_key(session_id)
+        return key, f"{key}:sizes", f"{key}:bytes"
+
+
+def create_session_store(config: Mapping[str, Any]) -> SessionStore:
+    """
+    Create the session store configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        Session store backend
+    """
+    backend = (config.get('SESSION_STORE_BACKEND') or 'memory').lower()
+    ttl = config.get('SESSION_STORE_TTL')
+    history_limit = config.get('SESSION_HISTORY_LIMIT')
+    history_max_bytes = config.get('SESSION_HISTORY_MAX_BYTES')
+    
+    if backend == 'sqlite':
+        return SQLiteSessionStore(
+            path=config.get('SESSION_STORE_PATH', 'sessions.sqlite3'),
+            ttl=ttl,
+            history_limit=history_limit,
+            history_max_bytes=history_max_bytes
+        )
+    if backend == 'redis':
+        return RedisSessionStore(
+            RedisClient(config.get('SESSION_STORE_URL', 'redis://localhost:6379/0')),
+            ttl=ttl,
+            history_limit=history_limit,
+            history_max_bytes=history_max_bytes
+        )
+    if backend != 'memory':
+        logger.warning(f"Unknown session store backend '{backend}', using memory")
+    return MemorySessionStore(
+        max_sessions=config.get('SESSION_STORE_MAX_SESSIONS', 10000),
+        ttl=ttl,
+        history_limit=history_limit,
+        history_max_bytes=history_max_bytes
+    )
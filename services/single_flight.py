@@ -0,0 +1,334 @@
+"""
+Single-flight coalescing for identical in-flight generations
+
+The first caller for a key runs the upstream call; concurrent callers with
+the same key wait for it and share its result. Threads of one process meet
+in a dictionary of in-flight calls. Worker processes meet on a lock file per
+key in a shared directory: the process holding the lock generates, writes
+its encoded result into the file and releases the lock, and processes that
+waited on the lock read that result instead of calling upstream themselves.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SingleFlightStats:
+    """Counters describing request coalescing"""
+    leaders: int = 0
+    coalesced: int = 0
+    cross_process_waits: int = 0
+    cross_process_shared: int = 0
+    timeouts: int = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'cross_process_waits': self.cross_process_waits,
+            'cross_process_shared': self.cross_process_shared,
+            'timeouts': self.timeouts
+        }
+
+
+class _Call:
+    """One in-flight call and its outcome"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Run one call per key at a time and hand its result to every concurrent caller"""
+    
+    def __init__(self, lock_dir: Optional[str] = None, timeout: float = 120.0,
+                 poll_interval: float = 0.02, stale_after: float = 600.0):
+        """
+        Initialize the coalescer
+        
+        Args:
+            lock_dir: Directory shared by worker processes, or None to coalesce within this process only
+            timeout: Seconds a caller waits for another's result before calling upstream itself
+            poll_interval: Seconds between attempts to take another process's lock
+            stale_after: Seconds after which unused lock files are removed
+        """
+        if lock_dir is not None and fcntl is None:
+            logger.warning("File locks are unavailable on this platform, coalescing within the process only")
+            lock_dir = None
+        if lock_dir is not None:
+            os.makedirs(lock_dir, exist_ok=True)
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.stats = SingleFlightStats()
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+    
+    def do(self, key: str, fn: Callable[[], Any], encode: Optional[Callable[[Any], str]] = None,
+           decode: Optional[Callable[[str], Any]] = None) -> Tuple[Any, bool]:
+        """
+        Run fn for key unless an identical call is already in flight
+        
+        Args:
+            key: Identity of the call, e.g. a response cache key
+            fn: Upstream call
+            encode: Serialize a result for other processes; without it results are not shared across processes
+            decode: Inverse of encode
+        
+        Returns:
+            Tuple of (result, shared) where shared is True if another caller produced the result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.stats.coalesced += 1
+        
+        if not leader:
+            if call.done.wait(self.timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            with self._lock:
+                self.stats.timeouts += 1
+            return fn(), False
+        
+        try:
+            call.result, shared = self._lead(key, fn, encode, decode)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+    
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Awaitable counterpart of do, meeting threads and coroutines on the same keys
+        
+        Waiting coroutines poll the leader's outcome every poll_interval
+        seconds rather than holding a thread. A coroutine that leads does not
+        take the cross-process lock, whose waits would block the event loop.
+        
+        Args:
+            key: Identity of the call, e.g. a response cache key
+            fn: Coroutine function making the upstream call
+        
+        Returns:
+            Tuple of (result, shared) where shared is True if another caller produced the result
+        """
+        call, leader = self.join(key)
+        if not leader:
+            found, result = await self.wait_async(call)
+            if found:
+                return result, True
+            return await fn(), False
+        
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result, False
+    
+    def join(self, key: str) -> Tuple[_Call, bool]:
+        """
+        Register for a call whose result is produced step by step, e.g. a streamed generation
+        
+        A leader must hand its outcome to finish; the others wait for it
+        with wait or wait_async. Leaders do not take the cross-process lock.
+        
+        Args:
+            key: Identity of the call, e.g. a response cache key
+        
+        Returns:
+            Tuple of (call, leader) where leader is True if no identical call was in flight
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats.leaders += 1
+            else:
+                self.stats.coalesced += 1
+        return call, leader
+    
+    def finish(self, key: str, call: _Call, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """Publish a joined call's outcome and release its key"""
+        if error is not None and not isinstance(error, Exception):
+            # A cancelled leader must not cancel its followers
+            error = RuntimeError("Shared call was cancelled")
+        call.result, call.error = result, error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+    
+    def wait(self, call: _Call) -> Tuple[bool, Any]:
+        """
+        Wait for another caller's outcome
+        
+        Returns:
+            Tuple of (found, result); found is False when the wait timed out
+        
+        Raises:
+            Exception: The leader's error
+        """
+        if not call.done.wait(self.timeout):
+            with self._lock:
+                self.stats.timeouts += 1
+            return False, None
+        if call.error is not None:
+            raise call.error
+        return True, call.result
+    
+    async def wait_async(self, call: _Call) -> Tuple[bool, Any]:
+        """Awaitable counterpart of wait, polling every poll_interval seconds"""
+        deadline = time.monotonic() + self.timeout
+        while not call.done.is_set():
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self.stats.timeouts += 1
+                return False, None
+            await asyncio.sleep(self.poll_interval)
+        if call.error is not None:
+            raise call.error
+        return True, call.result
+    
+    def _lead(self, key: str, fn: Callable[[], Any], encode: Optional[Callable[[Any], str]],
+              decode: Optional[Callable[[str], Any]]) -> Tuple[Any, bool]:
+        """Run fn as this process's leader, first waiting out any other process on the same key"""
+        if self.lock_dir is None or encode is None or decode is None:
+            with self._lock:
+                self.stats.leaders += 1
+            return fn(), False
+        
+        path = os.path.join(self.lock_dir, f"{key}.lock")
+        started = time.time()
+        with open(path, 'a+') as lock_file:
+            locked = self._try_lock(lock_file)
+            if not locked:
+                with self._lock:
+                    self.stats.cross_process_waits += 1
+                locked = self._wait_for_lock(lock_file, time.monotonic() + self.timeout)
+                if locked:
+                    # The other process wrote its result before releasing the lock; the
+                    # margin allows for coarse file timestamps
+                    result = self._read_result(lock_file, started - 1.0, decode)
+                    if result is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+                        with self._lock:
+                            self.stats.cross_process_shared += 1
+                        return result, True
+                else:
+                    with self._lock:
+                        self.stats.timeouts += 1
+            
+            with self._lock:
+                self.stats.leaders += 1
+            try:
+                result = fn()
+                if locked:
+                    lock_file.seek(0)
+                    lock_file.truncate()
+                    lock_file.write(encode(result))
+                    lock_file.flush()
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        
+        self._sweep()
+        return result, False
+    
+    @staticmethod
+    def _try_lock(lock_file) -> bool:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+    
+    def _wait_for_lock(self, lock_file, deadline: float) -> bool:
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            if self._try_lock(lock_file):
+                return True
+        return False
+    
+    @staticmethod
+    def _read_result(lock_file, since: float, decode: Callable[[str], Any]) -> Optional[Any]:
+        """Decode the result in the lock file if it was written after since"""
+        if os.fstat(lock_file.fileno()).st_mtime < since:
+            return None
+        lock_file.seek(0)
+        data = lock_file.read()
+        if not data:
+            return None
+        try:
+            return decode(data)
+        except ValueError:
+            return None
+    
+    def _sweep(self) -> None:
+        """Remove lock files nobody has used for stale_after seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep < self.stale_after:
+                return
+            self._last_sweep = now
+        
+        cutoff = time.time() - self.stale_after
+        for entry in os.scandir(self.lock_dir):
+            if not entry.name.endswith('.lock'):
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                with open(entry.path, 'a+') as lock_file:
+                    if self._try_lock(lock_file):
+                        os.unlink(entry.path)
+            except OSError:
+                continue
+
+
+def create_single_flight(config: Mapping[str, Any]) -> Optional[SingleFlight]:
+    """
+    Create the request coalescer configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        SingleFlight, or None when coalescing is disabled
+    """
+    if not config.get('SINGLE_FLIGHT_ENABLED', True):
+        return None
+    return SingleFlight(
+        lock_dir=config.get('SINGLE_FLIGHT_LOCK_DIR'),
+        timeout=config.get('SINGLE_FLIGHT_TIMEOUT', 120.0)
+    )
@@ -0,0 +1,121 @@
+"""
+Structural diff between two versions of a diagram
+
+Both versions are parsed into their AST and flattened into keyed
+collections (nodes, edges, participants, slices, sections, tasks, points
+and scalar properties such as the title). Each collection is compared by
+key with dictionary lookups, so the diff is linear in the size of the two
+diagrams and does not depend on formatting or line order. The patch lists
+only what was added, removed or changed, and removed elements carry just
+their identifying fields.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+from services.mermaid_parser import DiagramAST, MermaidDocument
+
+# Fields that identify an element of each collection, in patch order
+IDENTITY_FIELDS: Dict[str, Tuple[str, ...]] = {
+    'properties': ('name',),
+    'participants': ('name',),
+    'nodes': ('id',),
+    'edges': ('source', 'target', 'arrow', 'occurrence'),
+    'sections': ('name',),
+    'tasks': ('section', 'name'),
+    'slices': ('label',),
+    'points': ('label',),
+}
+
+Structure = Dict[str, Dict[tuple, Dict[str, Any]]]
+
+
+def _keyed(collection: str, elements: List[Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+    fields = IDENTITY_FIELDS[collection]
+    return {tuple(element.get(name, 0) for name in fields): element for element in elements}
+
+
+def extract_structure(ast: DiagramAST) -> Structure:
+    """
+    Flatten a diagram AST into collections keyed by element identity
+    
+    Repeated edges between the same nodes with the same arrow (common for
+    sequence messages) are told apart by an occurrence number, which is only
+    included in an element when it is not zero.
+    
+    Args:
+        ast: Parsed diagram
+    
+    Returns:
+        Mapping of collection name to {identity: element}
+    """
+    properties = [{'name': 'title', 'value': ast.title}, {'name': 'direction', 'value': ast.direction}]
+    properties.extend({'name': name, 'value': value} for name, value in ast.axes.items())
+    properties.extend({'name': name, 'value': value} for name, value in ast.quadrants.items())
+    
+    edges = []
+    occurrences: Dict[Tuple[str, str, str], int] = {}
+    for edge in ast.edges:
+        pair = (edge.source, edge.target, edge.arrow)
+        occurrence = occurrences.get(pair, 0)
+        occurrences[pair] = occurrence + 1
+        element = {'source': edge.source, 'target': edge.target, 'arrow': edge.arrow, 'label': edge.label}
+        if occurrence:
+            element['occurrence'] = occurrence
+        edges.append(element)
+    
+    # Sequence diagrams keep participant aliases in nodes; report them as participants only
+    participants = set(ast.participants)
+    return {
+        'properties': _keyed('properties', [prop for prop in properties if prop['value'] is not None]),
+        'participants': _keyed('participants', [{'name': name, 'alias': ast.nodes.get(name)}
+                                                for name in ast.participants]),
+        'nodes': _keyed('nodes', [{'id': node_id, 'label': label} for node_id, label in ast.nodes.items()
+                                  if node_id not in participants]),
+        'edges': _keyed('edges', edges),
+        'sections': _keyed('sections', [{'name': name} for name in ast.sections]),
+        'tasks': _keyed('tasks', [{'section': task.section, 'name': task.name, 'spec': task.spec}
+                                  for task in ast.tasks]),
+        'slices': _keyed('slices', [{'label': item.label, 'value': item.raw_value} for item in ast.slices]),
+        'points': _keyed('points', [{'label': point.label, 'x': point.x, 'y': point.y} for point in ast.points]),
+    }
+
+
+def diff_structures(old: Structure, new: Structure) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Compare two flattened diagrams
+    
+    Args:
+        old: Structure of the earlier version
+        new: Structure of the later version
+    
+    Returns:
+        Patch mapping each collection that differs to its non-empty 'added',
+        'removed' and 'changed' lists; empty when the diagrams match
+    """
+    patch = {}
+    for collection, fields in IDENTITY_FIELDS.items():
+        before, after = old.get(collection, {}), new.get(collection, {})
+        changes = {
+            'added': [element for key, element in after.items() if key not in before],
+            'removed': [{name: element[name] for name in fields if name in element}
+                        for key, element in before.items() if key not in after],
+            'changed': [element for key, element in after.items() if key in before and before[key] != element],
+        }
+        changes = {kind: elements for kind, elements in changes.items() if elements}
+        if changes:
+            patch[collection] = changes
+    return patch
+
+
+def diff_documents(old: MermaidDocument, new: MermaidDocument) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Structural diff between two tokenized diagrams
+    
+    Args:
+        old: Earlier version
+        new: Later version
+    
+    Returns:
+        Patch as returned by diff_structures
+    """
+    return diff_structures(extract_structure(old.ast), extract_structure(new.ast))
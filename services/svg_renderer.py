@@ -0,0 +1,551 @@
+"""
+Server-side SVG rendering for data-driven diagrams
+
+Pie charts, quadrant charts and Gantt charts are laid out from the AST that
+DiagramService parses, without a browser: the geometry is arithmetic on
+the data, so a headless job or a large chart can be turned into SVG in
+Python. Output is cached by a hash of the syntax, diagram type and theme.
+Other diagram types need Mermaid's graph layout and stay client-side.
+"""
+
+import hashlib
+import html
+import json
+import math
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from services import metrics
+from services.cache_service import CacheBackend, MemoryCache
+from services.canonical_syntax import canonicalize
+from services.diagram_service import DiagramService
+from services.mermaid_parser import MermaidDocument, Task
+
+# Bump when the output changes so cached renders of the old layout are not reused
+RENDERER_VERSION = 1
+
+FONT_FAMILY = 'Arial, sans-serif'
+
+
+class Theme(NamedTuple):
+    """Colours for one rendering theme"""
+    background: str
+    text: str
+    muted: str
+    grid: str
+    palette: Tuple[str, ...]
+    quadrants: Tuple[str, str, str, str]
+    point: str
+    task: str
+    done: str
+    active: str
+    crit: str
+    sections: Tuple[str, str]
+
+
+THEMES: Dict[str, Theme] = {
+    'default': Theme(
+        background='#ffffff', text='#333333', muted='#666666', grid='#e0e0e0',
+        palette=('#4e79a7', '#f28e2b', '#e15759', '#76b7b2', '#59a14f',
+                 '#edc948', '#b07aa1', '#ff9da7', '#9c755f', '#bab0ac'),
+        quadrants=('#e8eaf6', '#f3e5f5', '#fff8e1', '#e0f2f1'), point='#3f51b5',
+        task='#8a90dd', done='#d3d3d3', active='#bfc7ff', crit='#ff8888', sections=('#f4f4ff', '#ffffde')
+    ),
+    'dark': Theme(
+        background='#1f2020', text='#e0e0e0', muted='#a0a0a0', grid='#3a3a3a',
+        palette=('#8ab4f8', '#f6ae2d', '#f28b82', '#81c995', '#c58af9',
+                 '#fdd663', '#78d9ec', '#ff8bcb', '#e6c9a8', '#9aa0a6'),
+        quadrants=('#2b2f3a', '#33283a', '#3a3426', '#263a35'), point='#8ab4f8',
+        task='#5c6bc0', done='#555555', active='#3949ab', crit='#c62828', sections=('#262a30', '#2e2a22')
+    ),
+    'neutral': Theme(
+        background='#ffffff', text='#222222', muted='#555555', grid='#dddddd',
+        palette=('#333333', '#555555', '#777777', '#999999', '#bbbbbb',
+                 '#444444', '#666666', '#888888', '#aaaaaa', '#cccccc'),
+        quadrants=('#f5f5f5', '#ebebeb', '#f5f5f5', '#ebebeb'), point='#333333',
+        task='#888888', done='#cccccc', active='#aaaaaa', crit='#444444', sections=('#f7f7f7', '#eeeeee')
+    ),
+    'forest': Theme(
+        background='#ffffff', text='#1b3a1b', muted='#4a6b4a', grid='#dbe8d4',
+        palette=('#2e7d32', '#66bb6a', '#a5d6a7', '#1b5e20', '#81c784',
+                 '#cddc39', '#388e3c', '#c5e1a5', '#43a047', '#9ccc65'),
+        quadrants=('#e8f5e9', '#f1f8e9', '#f9fbe7', '#e0f2f1'), point='#2e7d32',
+        task='#66bb6a', done='#c8e6c9', active='#a5d6a7', crit='#e57373', sections=('#f1f8e9', '#fffde7')
+    ),
+}
+
+
+class RenderError(ValueError):
+    """Raised when a diagram cannot be rendered on the server"""
+    
+    def __init__(self, message: str, line_number: Optional[int] = None):
+        super().__init__(message)
+        self.line_number = line_number
+
+
+@dataclass
+class RenderStats:
+    """Counters describing server-side rendering"""
+    rendered: int = 0
+    cached: int = 0
+    rejected: int = 0
+    render_seconds: float = 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'rendered': self.rendered,
+            'cached': self.cached,
+            'rejected': self.rejected,
+            'render_seconds': round(self.render_seconds, 6)
+        }
+
+
+def render_key(syntax: str, diagram_type: str, theme: str) -> str:
+    """
+    Content hash identifying a rendered diagram
+    
+    The syntax is hashed in its canonical form, so charts that only differ
+    in spacing or quoting share a render and an artifact.
+    
+    Args:
+        syntax: Mermaid syntax
+        diagram_type: Type of diagram
+        theme: Theme name
+    
+    Returns:
+        Hex digest
+    """
+    payload = json.dumps([RENDERER_VERSION, diagram_type, theme, canonicalize(syntax, diagram_type)],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _num(value: float) -> str:
+    return f"{value:.2f}"
+
+
+def _text_width(text: str, size: float) -> float:
+    """Rough width of text in Arial, enough to reserve space for labels"""
+    return len(text) * size * 0.6
+
+
+class _Canvas:
+    """Accumulates SVG elements"""
+    
+    def __init__(self, theme: Theme):
+        self.theme = theme
+        self.parts: List[str] = []
+    
+    def rect(self, x: float, y: float, width: float, height: float, fill: str, extra: str = '') -> None:
+        self.parts.append(f'<rect x="{_num(x)}" y="{_num(y)}" width="{_num(width)}" height="{_num(height)}" '
+                          f'fill="{fill}"{extra}/>')
+    
+    def line(self, x1: float, y1: float, x2: float, y2: float, stroke: str) -> None:
+        self.parts.append(f'<line x1="{_num(x1)}" y1="{_num(y1)}" x2="{_num(x2)}" y2="{_num(y2)}" '
+                          f'stroke="{stroke}"/>')
+    
+    def circle(self, x: float, y: float, radius: float, fill: str, extra: str = '') -> None:
+        self.parts.append(f'<circle cx="{_num(x)}" cy="{_num(y)}" r="{_num(radius)}" fill="{fill}"{extra}/>')
+    
+    def path(self, d: str, fill: str, extra: str = '') -> None:
+        self.parts.append(f'<path d="{d}" fill="{fill}"{extra}/>')
+    
+    def text(self, x: float, y: float, text: str, size: float = 14, anchor: str = 'start',
+             fill: Optional[str] = None, extra: str = '') -> None:
+        self.parts.append(f'<text x="{_num(x)}" y="{_num(y)}" font-size="{size:g}" text-anchor="{anchor}" '
+                          f'fill="{fill or self.theme.text}"{extra}>{html.escape(text)}</text>')
+    
+    def title(self, width: float, text: Optional[str]) -> float:
+        """Draw a centred title and return the height it takes"""
+        if not text:
+            return 10
+        self.text(width / 2, 30, text, size=20, anchor='middle', extra=' font-weight="bold"')
+        return 50
+    
+    def to_svg(self, width: float, height: float, label: str) -> str:
+        width, height = math.ceil(width), math.ceil(height)
+        return ''.join([
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" ',
+            f'viewBox="0 0 {width} {height}" font-family="{FONT_FAMILY}" role="img" ',
+            f'aria-label="{html.escape(label)}">',
+            f'<rect width="100%" height="100%" fill="{self.theme.background}"/>',
+            *self.parts,
+            '</svg>'
+        ])
+
+
+def _render_pie(document: MermaidDocument, theme: Theme) -> str:
+    ast = document.ast
+    for piece in ast.slices:
+        if piece.value is not None and not math.isfinite(piece.value):
+            raise RenderError(f"Slice '{piece.label}' needs a finite value", piece.line)
+    slices = [piece for piece in ast.slices if piece.value is not None and piece.value > 0]
+    if not slices:
+        raise RenderError("Pie chart has no positive values to draw")
+    total = sum(piece.value for piece in slices)
+    if not math.isfinite(total):
+        raise RenderError("Pie chart values add up to more than can be drawn")
+    show_data = 'showData' in document.header_parts
+    labels = [f"{piece.label} [{piece.raw_value}]" if show_data else piece.label for piece in slices]
+    
+    radius = 150
+    legend_width = 40 + max(_text_width(label, 14) for label in labels)
+    width = 20 + 2 * radius + 40 + legend_width
+    canvas = _Canvas(theme)
+    top = canvas.title(width, ast.title)
+    cx, cy = 20 + radius, top + radius + 10
+    
+    angle = -math.pi / 2
+    for index, piece in enumerate(slices):
+        fraction = piece.value / total
+        color = theme.palette[index % len(theme.palette)]
+        sweep = fraction * 2 * math.pi
+        if fraction >= 0.999999:
+            canvas.circle(cx, cy, radius, color, f' stroke="{theme.background}"')
+        else:
+            x0, y0 = cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+            x1, y1 = cx + radius * math.cos(angle + sweep), cy + radius * math.sin(angle + sweep)
+            large = 1 if sweep > math.pi else 0
+            canvas.path(f"M{_num(cx)},{_num(cy)} L{_num(x0)},{_num(y0)} "
+                        f"A{radius},{radius} 0 {large} 1 {_num(x1)},{_num(y1)} Z",
+                        color, f' stroke="{theme.background}" stroke-width="1"')
+        if fraction >= 0.03:
+            middle = angle + sweep / 2
+            canvas.text(cx + radius * 0.7 * math.cos(middle), cy + radius * 0.7 * math.sin(middle) + 5,
+                        f"{fraction * 100:.0f}%", size=13, anchor='middle')
+        angle += sweep
+    
+    legend_x = cx + radius + 40
+    for index, label in enumerate(labels):
+        y = top + 10 + index * 22
+        canvas.rect(legend_x, y, 14, 14, theme.palette[index % len(theme.palette)])
+        canvas.text(legend_x + 22, y + 12, label)
+    
+    height = max(cy + radius, top + 10 + len(labels) * 22) + 20
+    return canvas.to_svg(width, height, ast.title or 'Pie chart')
+
+
+def _axis_labels(text: Optional[str]) -> Tuple[str, str]:
+    """Split "Low --> High" into its two ends; a single label goes first"""
+    if not text:
+        return '', ''
+    low, _, high = text.partition('-->')
+    return low.strip(), high.strip()
+
+
+def _render_quadrant(document: MermaidDocument, theme: Theme) -> str:
+    ast = document.ast
+    size = 400
+    left, width = 40, 40 + size + 20
+    canvas = _Canvas(theme)
+    top = canvas.title(width, ast.title)
+    
+    half = size / 2
+    # quadrant-1 is top right, then counter-clockwise
+    for index, (x, y) in enumerate(((half, 0), (0, 0), (0, half), (half, half))):
+        canvas.rect(left + x, top + y, half, half, theme.quadrants[index])
+        label = ast.quadrants.get(f"quadrant-{index + 1}")
+        if label:
+            canvas.text(left + x + half / 2, top + y + 24, label, size=14, anchor='middle',
+                        extra=' font-weight="bold"')
+    canvas.line(left + half, top, left + half, top + size, theme.background)
+    canvas.line(left, top + half, left + size, top + half, theme.background)
+    
+    x_low, x_high = _axis_labels(ast.axes.get('x-axis'))
+    if x_high:
+        canvas.text(left + half / 2, top + size + 22, x_low, anchor='middle', fill=theme.muted)
+        canvas.text(left + size - half / 2, top + size + 22, x_high, anchor='middle', fill=theme.muted)
+    elif x_low:
+        canvas.text(left + half, top + size + 22, x_low, anchor='middle', fill=theme.muted)
+    y_low, y_high = _axis_labels(ast.axes.get('y-axis'))
+    for label, y in ((y_low, top + size - half / 2), (y_high, top + half / 2)) if y_high else ((y_low, top + half),):
+        if label:
+            canvas.text(left - 14, y, label, anchor='middle', fill=theme.muted,
+                        extra=f' transform="rotate(-90 {_num(left - 14)} {_num(y)})"')
+    
+    for point in ast.points:
+        if point.x is None or point.y is None:
+            raise RenderError(f"Point '{point.label}' needs numeric coordinates", point.line)
+        if not (0 <= point.x <= 1 and 0 <= point.y <= 1):
+            raise RenderError(f"Point '{point.label}' must lie between 0 and 1 on both axes", point.line)
+        x, y = left + point.x * size, top + (1 - point.y) * size
+        canvas.circle(x, y, 5, theme.point)
+        canvas.text(x, y + 18, point.label, size=12, anchor='middle')
+    
+    return canvas.to_svg(width, top + size + 40, ast.title or 'Quadrant chart')
+
+
+_GANTT_TAGS = frozenset(('done', 'active', 'crit', 'milestone'))
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)\s*(ms|s|m|h|d|w)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+# Mermaid (dayjs) date tokens and their strptime equivalents, longest first
+_DATE_TOKENS = (('YYYY', '%Y'), ('YY', '%y'), ('MM', '%m'), ('DD', '%d'), ('HH', '%H'), ('mm', '%M'), ('ss', '%S'))
+_TICK_STEPS = (3600, 6 * 3600, 86400, 2 * 86400, 7 * 86400, 14 * 86400, 30 * 86400, 91 * 86400, 365 * 86400)
+_MAX_TICKS = 10
+
+
+class _Bar(NamedTuple):
+    task: Task
+    start: datetime
+    end: datetime
+    tags: frozenset
+
+
+def _strptime_format(date_format: str) -> str:
+    result = date_format
+    for token, directive in _DATE_TOKENS:
+        result = result.replace(token, directive)
+    return result
+
+
+def _parse_date(value: str, date_format: str) -> Optional[datetime]:
+    for attempt in (lambda: datetime.strptime(value, date_format), lambda: datetime.fromisoformat(value)):
+        try:
+            return attempt()
+        except ValueError:
+            continue
+    return None
+
+
+def _schedule(document: MermaidDocument) -> List[_Bar]:
+    """Resolve every task's start and end the way Mermaid does"""
+    directives = dict(text.split(None, 1) for _, text in document.body_texts
+                      if text.startswith(('dateFormat ', 'axisFormat ')))
+    date_format = _strptime_format(directives.get('dateFormat', 'YYYY-MM-DD').strip())
+    
+    bars: List[_Bar] = []
+    starts: Dict[str, datetime] = {}
+    ends: Dict[str, datetime] = {}
+    previous_end: Optional[datetime] = None
+    for task in document.ast.tasks:
+        parts = [part.strip() for part in task.spec.split(',') if part.strip()]
+        tags = set()
+        while parts and parts[0] in _GANTT_TAGS:
+            tags.add(parts.pop(0))
+        task_id = None
+        if len(parts) >= 3:
+            task_id, start_spec, end_spec = parts[:3]
+        elif len(parts) == 2:
+            start_spec, end_spec = parts
+        elif len(parts) == 1:
+            start_spec, end_spec = None, parts[0]
+        else:
+            raise RenderError(f"Task '{task.name}' needs a duration or an end date", task.line)
+        
+        if start_spec is None:
+            start = previous_end
+        elif start_spec.startswith('after '):
+            start = max((_lookup(ends, name, task) for name in start_spec[6:].split()), default=None)
+        else:
+            start = _parse_date(start_spec, date_format)
+        if start is None:
+            raise RenderError(f"Task '{task.name}' has no start date", task.line)
+        
+        duration = _DURATION.fullmatch(end_spec)
+        if duration:
+            try:
+                end = start + timedelta(seconds=float(duration.group(1)) * _DURATION_UNITS[duration.group(2)])
+            except OverflowError:
+                raise RenderError(f"Task '{task.name}' lasts beyond the last drawable date", task.line) from None
+        elif end_spec.startswith('until '):
+            end = min(_lookup(starts, name, task) for name in end_spec[6:].split())
+        else:
+            end = _parse_date(end_spec, date_format)
+            if end is None:
+                raise RenderError(f"Task '{task.name}' has an unreadable end '{end_spec}'", task.line)
+        if end < start:
+            raise RenderError(f"Task '{task.name}' ends before it starts", task.line)
+        
+        if task_id:
+            starts[task_id], ends[task_id] = start, end
+        previous_end = end
+        bars.append(_Bar(task, start, end, frozenset(tags)))
+    
+    if not bars:
+        raise RenderError("Gantt chart has no tasks to draw")
+    return bars
+
+
+def _lookup(dates: Dict[str, datetime], name: str, task: Task) -> datetime:
+    if name not in dates:
+        raise RenderError(f"Task '{task.name}' refers to unknown task '{name}'", task.line)
+    return dates[name]
+
+
+def _render_gantt(document: MermaidDocument, theme: Theme) -> str:
+    ast = document.ast
+    bars = _schedule(document)
+    axis_format = next((text[11:].strip() for _, text in document.body_texts if text.startswith('axisFormat ')),
+                       '%Y-%m-%d')
+    
+    first = min(bar.start for bar in bars)
+    last = max(bar.end for bar in bars)
+    span = max((last - first).total_seconds(), 3600)
+    
+    row, bar_height, chart_width = 24, 18, 800
+    label_width = min(220, 20 + max((_text_width(section, 13) for section in ast.sections), default=0))
+    # Room on the right for the names of bars too short to hold them
+    width = label_width + chart_width + 140
+    canvas = _Canvas(theme)
+    top = canvas.title(width, ast.title)
+    scale = chart_width / span
+    
+    def x_of(moment: datetime) -> float:
+        return label_width + (moment - first).total_seconds() * scale
+    
+    # Section bands first so bars and grid lines draw over them
+    band_start, section_index = 0, -1
+    for index, bar in enumerate(bars + [None]):
+        if bar is None or index == 0 or bar.task.section != bars[index - 1].task.section:
+            if index > 0:
+                y = top + band_start * row
+                canvas.rect(0, y, width, (index - band_start) * row, theme.sections[section_index % 2])
+                if bars[band_start].task.section:
+                    canvas.text(8, y + row / 2 + 5, bars[band_start].task.section, size=13)
+            band_start, section_index = index, section_index + 1
+    
+    bottom = top + len(bars) * row
+    step = next((step for step in _TICK_STEPS if span / step <= _MAX_TICKS), None)
+    if step is None:
+        # Spans of more than ten years tick every few years
+        step = math.ceil(span / _MAX_TICKS / _TICK_STEPS[-1]) * _TICK_STEPS[-1]
+    tick = first.replace(minute=0, second=0, microsecond=0)
+    if step >= 86400:
+        tick = tick.replace(hour=0)
+    while tick <= last:
+        if tick >= first:
+            x = x_of(tick)
+            canvas.line(x, top, x, bottom, theme.grid)
+            canvas.text(x, bottom + 18, tick.strftime(axis_format), size=11, anchor='middle', fill=theme.muted)
+        try:
+            tick += timedelta(seconds=step)
+        except OverflowError:
+            break
+    
+    for index, bar in enumerate(bars):
+        y = top + index * row + (row - bar_height) / 2
+        x = x_of(bar.start)
+        if 'milestone' in bar.tags:
+            size = bar_height / 2
+            canvas.path(f"M{_num(x)},{_num(y)} l{size},{size} l{-size},{size} l{-size},{-size} Z",
+                        theme.crit if 'crit' in bar.tags else theme.task)
+            canvas.text(x + size + 6, y + bar_height - 4, bar.task.name, size=12)
+            continue
+        
+        fill = (theme.crit if 'crit' in bar.tags else theme.done if 'done' in bar.tags
+                else theme.active if 'active' in bar.tags else theme.task)
+        bar_width = max(x_of(bar.end) - x, 1)
+        canvas.rect(x, y, bar_width, bar_height, fill, ' rx="3"')
+        if _text_width(bar.task.name, 12) + 8 <= bar_width:
+            canvas.text(x + bar_width / 2, y + bar_height - 5, bar.task.name, size=12, anchor='middle')
+        else:
+            canvas.text(x + bar_width + 4, y + bar_height - 5, bar.task.name, size=12)
+    
+    return canvas.to_svg(width, bottom + 30, ast.title or 'Gantt chart')
+
+
+_RENDERERS: Dict[str, Callable[[MermaidDocument, Theme], str]] = {
+    'pie': _render_pie,
+    'quadrantChart': _render_quadrant,
+    'gantt': _render_gantt,
+}
+
+RENDERABLE_TYPES: Tuple[str, ...] = tuple(_RENDERERS)
+
+
+class SVGRenderer:
+    """Validates, renders and caches server-side SVG"""
+    
+    def __init__(self, cache: Optional[CacheBackend] = None, diagram_service: Optional[DiagramService] = None):
+        """
+        Initialize the renderer
+        
+        Args:
+            cache: Cache for rendered SVG keyed by render_key, or None to always render
+            diagram_service: Service used to validate and parse syntax
+        """
+        self.cache = cache
+        self.diagram_service = diagram_service or DiagramService()
+        self.stats = RenderStats()
+        self._lock = threading.Lock()
+    
+    def render(self, syntax: str, diagram_type: str, theme: str = 'default') -> str:
+        """
+        Render a diagram as SVG
+        
+        Args:
+            syntax: Mermaid syntax
+            diagram_type: One of RENDERABLE_TYPES
+            theme: One of THEMES
+        
+        Returns:
+            SVG document
+        
+        Raises:
+            RenderError: For unsupported types or themes, invalid syntax or data that cannot be drawn
+        """
+        if diagram_type not in _RENDERERS:
+            raise RenderError(f"Server-side rendering supports {', '.join(RENDERABLE_TYPES)}")
+        if theme not in THEMES:
+            raise RenderError(f"Unknown theme '{theme}'. Must be one of: {', '.join(THEMES)}")
+        
+        key = render_key(syntax, diagram_type, theme)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                with self._lock:
+                    self.stats.cached += 1
+                return cached
+        
+        try:
+            result = self.diagram_service.validate_syntax(syntax, diagram_type)
+            if not result.is_valid:
+                raise RenderError(result.error or "Invalid syntax", result.line_number)
+            started = time.perf_counter()
+            with metrics.timer('render_duration_seconds', diagram_type=diagram_type):
+                svg = _RENDERERS[diagram_type](self.diagram_service.parse(syntax, diagram_type), THEMES[theme])
+            elapsed = time.perf_counter() - started
+        except RenderError:
+            with self._lock:
+                self.stats.rejected += 1
+            raise
+        
+        with self._lock:
+            self.stats.rendered += 1
+            self.stats.render_seconds += elapsed
+        if self.cache is not None:
+            self.cache.set(key, svg)
+        return svg
+    
+    def render_stats(self) -> Dict[str, Any]:
+        """
+        Rendering counters and the cache's hit/miss statistics
+        
+        Returns:
+            Dictionary for JSON serialization
+        """
+        with self._lock:
+            stats = self.stats.to_dict()
+        stats['cache'] = self.cache.stats.to_dict() if self.cache is not None else None
+        return stats
+
+
+def create_renderer(config: Mapping[str, Any]) -> SVGRenderer:
+    """
+    Create the SVG renderer configured for the application
+    
+    Args:
+        config: Application config
+    
+    Returns:
+        SVGRenderer, caching in memory unless RENDER_CACHE_MAX_ENTRIES is 0
+    """
+    max_entries = config.get('RENDER_CACHE_MAX_ENTRIES', 256)
+    if not max_entries:
+        return SVGRenderer(cache=None)
+    return SVGRenderer(cache=MemoryCache(max_entries=max_entries, max_bytes=config.get('RENDER_CACHE_MAX_BYTES')))
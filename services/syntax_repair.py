@@ -0,0 +1,186 @@
+"""
+Local repairs for generated syntax that fails validation
+
+Models often get a diagram almost right: a sentence of prose around it, a
+flowchart direction spelled out in words, a label whose bracket is never
+closed. These are fixed here without another API call. Whatever is still
+invalid afterwards is sent back to the model as an edit-script request that
+shows only the failing lines (see OpenAIService._validate_and_repair).
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from models import ValidationResult
+from services.diagram_service import DiagramService
+from services.validation_rules import FLOWCHART_DIRECTIONS, get_rules
+
+# A sentence rather than a statement: capitalized words ending in punctuation, no arrows or shapes
+_PROSE = re.compile(r"[A-Z][\w']*(?:[ ,]+[\w'()-]+){2,}[ ]*[.!?:]")
+_FENCE = re.compile(r'```\w*')
+_LINK = re.compile(r'\s*(?:<?(?:-{2,}|={2,}|-\.+-|~{3,})(?:>|o|x)?|-\.|==)')
+_DIRECTION_WORDS = {
+    'TOP-DOWN': 'TD', 'TOPDOWN': 'TD', 'TOP-BOTTOM': 'TB', 'TOPTOBOTTOM': 'TB', 'DOWN': 'TD', 'VERTICAL': 'TD',
+    'BOTTOM-UP': 'BT', 'BOTTOM-TOP': 'BT', 'UP': 'BT',
+    'LEFT-RIGHT': 'LR', 'LEFTTORIGHT': 'LR', 'RIGHT': 'LR', 'HORIZONTAL': 'LR',
+    'RIGHT-LEFT': 'RL', 'RIGHTTOLEFT': 'RL', 'LEFT': 'RL',
+}
+_PAIRS = (('[', ']'), ('(', ')'))
+
+
+@dataclass
+class RepairStats:
+    """Counters describing how generated syntax was validated and repaired"""
+    checked: int = 0
+    valid: int = 0
+    local_repairs: int = 0
+    reprompts: int = 0
+    reprompt_repairs: int = 0
+    unrepaired: int = 0
+    budget_exhausted: int = 0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return {
+            'checked': self.checked,
+            'valid': self.valid,
+            'local_repairs': self.local_repairs,
+            'reprompts': self.reprompts,
+            'reprompt_repairs': self.reprompt_repairs,
+            'unrepaired': self.unrepaired,
+            'budget_exhausted': self.budget_exhausted,
+            'repair_rate': round((self.local_repairs + self.reprompt_repairs) / (self.checked - self.valid), 4)
+            if self.checked > self.valid else 0.0
+        }
+
+
+def _is_prose(text: str) -> bool:
+    return bool(_FENCE.fullmatch(text) or _PROSE.fullmatch(text))
+
+
+def strip_prose(lines: List[str], diagram_type: str) -> List[str]:
+    """
+    Drop explanations and code fences around the diagram
+    
+    Lines before the first valid header are dropped when there is one;
+    otherwise leading prose is. Prose and fences at the end are dropped too.
+    """
+    rules = get_rules(diagram_type)
+    start = next((index for index, line in enumerate(lines) if rules.check_header(line.strip()) is None), None)
+    if start is None:
+        start = 0
+        while start < len(lines) and (not lines[start].strip() or _is_prose(lines[start].strip())):
+            start += 1
+    end = len(lines)
+    while end > start + 1 and (not lines[end - 1].strip() or _is_prose(lines[end - 1].strip())):
+        end -= 1
+    return [line for line in lines[start:end] if not _FENCE.fullmatch(line.strip())]
+
+
+def fix_header(lines: List[str], diagram_type: str) -> List[str]:
+    """
+    Add a missing diagram declaration and correct the flowchart direction
+    
+    Directions in lower case or spelled out ("top-down", "left to right")
+    are mapped to the Mermaid keyword; anything else becomes TD.
+    """
+    rules = get_rules(diagram_type)
+    header = lines[0].strip() if lines else ''
+    if not rules.starts or rules.check_header(header) is None:
+        return lines
+    if not header.startswith(rules.starts):
+        default = 'flowchart TD' if diagram_type == 'flowchart' else rules.starts[0]
+        return [default] + lines
+    
+    if diagram_type == 'flowchart':
+        keyword, _, direction = header.partition(' ')
+        direction = direction.strip().upper().replace(' TO ', 'TO').replace(' ', '-').replace('_', '-')
+        if direction not in FLOWCHART_DIRECTIONS:
+            direction = _DIRECTION_WORDS.get(direction, _DIRECTION_WORDS.get(direction.replace('-', ''), 'TD'))
+        return [f"{keyword} {direction}"] + lines[1:]
+    return lines
+
+
+def balance_line(line: str) -> str:
+    """
+    Balance square brackets and parentheses within one line
+    
+    Closers without an opener are removed. An opener that is never closed
+    is closed before the next link arrow, or at the end of the line.
+    """
+    for opener, closer in _PAIRS:
+        if line.count(opener) == line.count(closer):
+            continue
+        kept = []
+        open_positions = []
+        for char in line:
+            if char == opener:
+                open_positions.append(len(kept))
+            elif char == closer:
+                if not open_positions:
+                    continue
+                open_positions.pop()
+            kept.append(char)
+        line = ''.join(kept)
+        for position in reversed(open_positions):
+            link = _LINK.search(line, position + 1)
+            insert_at = link.start() if link else len(line.rstrip().rstrip(';'))
+            line = line[:insert_at].rstrip() + closer + line[insert_at:]
+    return line
+
+
+def repair_locally(syntax: str, diagram_type: str,
+                   diagram_service: Optional[DiagramService] = None) -> Tuple[str, ValidationResult, List[str]]:
+    """
+    Apply the local fixes to syntax that fails validation
+    
+    Each fix runs only if the syntax is still invalid after the previous
+    one, so valid syntax is returned untouched.
+    
+    Args:
+        syntax: Generated syntax
+        diagram_type: Type of diagram
+        diagram_service: Validator to use
+    
+    Returns:
+        Tuple of (syntax, its validation result, names of the fixes that changed it)
+    """
+    diagram_service = diagram_service or DiagramService()
+    validation = diagram_service.validate_syntax(syntax, diagram_type)
+    fixes = []
+    for name, fix in (('prose', strip_prose), ('header', fix_header),
+                      ('brackets', lambda lines, _: [balance_line(line) for line in lines])):
+        if validation.is_valid:
+            break
+        fixed = '\n'.join(fix(syntax.split('\n'), diagram_type)).strip('\n').rstrip()
+        if fixed and fixed != syntax:
+            syntax = fixed
+            fixes.append(name)
+            validation = diagram_service.validate_syntax(syntax, diagram_type)
+    return syntax, validation, fixes
+
+
+def failing_excerpt(syntax: str, validation: ValidationResult, context: int = 2) -> str:
+    """
+    Number the lines around a validation error, as the full diagram would be numbered
+    
+    Errors without a line (an opening bracket never closed) point at the
+    first line whose brackets or parentheses do not balance.
+    
+    Args:
+        syntax: Invalid syntax
+        validation: Its validation result
+        context: Lines shown before and after the failing one
+    
+    Returns:
+        Lines formatted as "<number>| <line>"
+    """
+    lines = syntax.split('\n')
+    line_number = validation.line_number
+    if line_number is None:
+        line_number = next((number for number, line in enumerate(lines, 1)
+                            if any(line.count(opener) != line.count(closer) for opener, closer in _PAIRS)), 1)
+    width = len(str(len(lines)))
+    first, last = max(1, line_number - context), min(len(lines), line_number + context)
+    return '\n'.join(f"{number:>{width}}| {lines[number - 1]}" for number in range(first, last + 1))
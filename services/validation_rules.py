@@ -0,0 +1,198 @@
+"""
+Declarative validation rules for each Mermaid diagram type
+
+Rules are plain data compiled once at import: header starts become a tuple
+for str.startswith, header rules one regex each, and every per-line rule of
+a type is folded into a single multiline alternation. The body is scanned
+with that regex in one pass, so lines no rule matches never reach Python
+code no matter how many rules the type has.
+"""
+
+import re
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Optional, Pattern, Tuple
+
+
+def _is_number(text: str) -> bool:
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _pie_value_is_number(text: str) -> bool:
+    return _is_number(text[text.index(':') + 1:].strip().strip('"'))
+
+
+@dataclass(frozen=True)
+class HeaderRule:
+    """Error reported when the header line matches pattern"""
+    pattern: str
+    error: str
+
+
+@dataclass(frozen=True)
+class LineRule:
+    """
+    Rule for body lines
+    
+    A stripped line that fully matches pattern is an error unless check is
+    given and returns True for it. Lines are tested against the first
+    matching rule of their type only. Patterns run over the joined body, so
+    negated character classes must exclude newlines.
+    """
+    pattern: str
+    error: str
+    check: Optional[Callable[[str], bool]] = None
+
+
+@dataclass(frozen=True)
+class DiagramRules:
+    """Rules for one diagram type"""
+    diagram_type: str
+    starts: Tuple[str, ...]
+    header_rules: Tuple[HeaderRule, ...] = ()
+    line_rules: Tuple[LineRule, ...] = ()
+
+
+@dataclass(frozen=True)
+class CompiledRules:
+    """DiagramRules compiled for matching"""
+    diagram_type: str
+    starts: Tuple[str, ...]
+    start_error: str
+    header_patterns: Tuple[Tuple[Pattern, str], ...]
+    line_pattern: Optional[Pattern]
+    line_rules: Mapping[str, LineRule] = field(default_factory=dict)
+    
+    def check_header(self, header: str) -> Optional[str]:
+        """Return the first header error, or None"""
+        if not header.startswith(self.starts):
+            return self.start_error
+        for pattern, error in self.header_patterns:
+            if pattern.match(header):
+                return error
+        return None
+    
+    def check_line(self, text: str) -> Optional[str]:
+        """Return the error for one stripped body line, or None"""
+        if self.line_pattern is None:
+            return None
+        match = self.line_pattern.fullmatch(text)
+        return self._match_error(match) if match is not None else None
+    
+    def check_body(self, texts: List[str], first_line: int = 2) -> Optional[Tuple[int, str]]:
+        """
+        Apply every line rule to the body in one regex pass
+        
+        Args:
+            texts: Stripped body lines
+            first_line: Line number of texts[0]
+        
+        Returns:
+            (line_number, error) for the first failing line, or None
+        """
+        if self.line_pattern is None:
+            return None
+        
+        body = '\n'.join(texts)
+        line_number, position = first_line, 0
+        for match in self.line_pattern.finditer(body):
+            if match.start() == match.end():
+                continue
+            line_number += body.count('\n', position, match.start())
+            position = match.start()
+            error = self._match_error(match)
+            if error:
+                return line_number, error
+        return None
+    
+    def _match_error(self, match) -> Optional[str]:
+        rule = self.line_rules[match.lastgroup]
+        if rule.check is not None and rule.check(match.group()):
+            return None
+        return rule.error
+
+
+FLOWCHART_DIRECTIONS = ('TD', 'TB', 'BT', 'LR', 'RL')
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+
+RULES: Tuple[DiagramRules, ...] = (
+    DiagramRules(
+        'flowchart',
+        starts=('flowchart', 'graph'),
+        header_rules=(
+            HeaderRule(
+                rf"flowchart\S*\s+(?=\S)(?!(?:{'|'.join(FLOWCHART_DIRECTIONS)})(?:\s|$))",
+                f"Invalid flowchart direction. Must be one of: {', '.join(FLOWCHART_DIRECTIONS)}"
+            ),
+        ),
+    ),
+    DiagramRules('sequence', starts=('sequenceDiagram',)),
+    DiagramRules('classDiagram', starts=('classDiagram',)),
+    DiagramRules('stateDiagram', starts=('stateDiagram', 'stateDiagram-v2')),
+    DiagramRules('erDiagram', starts=('erDiagram',)),
+    DiagramRules('journey', starts=('journey',)),
+    DiagramRules('gantt', starts=('gantt',)),
+    DiagramRules(
+        'pie',
+        starts=('pie',),
+        line_rules=(
+            # label : value entries (title lines excluded) need a numeric value;
+            # plain numbers are ruled out in the pattern, float() settles the rest
+            LineRule(
+                rf'(?!title)[^:\n]*:(?![ \t]*"?{_NUMBER}"?[ \t]*$)[^:\n]*',
+                "Pie chart values must be numbers",
+                check=_pie_value_is_number
+            ),
+        ),
+    ),
+    DiagramRules('quadrantChart', starts=('quadrantChart',)),
+    DiagramRules('mindmap', starts=('mindmap',)),
+)
+
+
+def compile_rules(rules: DiagramRules) -> CompiledRules:
+    """
+    Compile one diagram type's rules
+    
+    Args:
+        rules: Declarative rules
+    
+    Returns:
+        CompiledRules with one multiline alternation regex for all line rules
+    """
+    line_rules = {f"r{index}": rule for index, rule in enumerate(rules.line_rules)}
+    line_pattern = None
+    if line_rules:
+        alternation = '|'.join(f"(?P<{name}>{rule.pattern})" for name, rule in line_rules.items())
+        line_pattern = re.compile(f"^(?:{alternation})$", re.MULTILINE)
+    
+    return CompiledRules(
+        diagram_type=rules.diagram_type,
+        starts=rules.starts,
+        start_error=f"Diagram must start with one of: {', '.join(rules.starts)}",
+        header_patterns=tuple((re.compile(rule.pattern), rule.error) for rule in rules.header_rules),
+        line_pattern=line_pattern,
+        line_rules=MappingProxyType(line_rules),
+    )
+
+
+COMPILED_RULES: Mapping[str, CompiledRules] = MappingProxyType({
+    rules.diagram_type: compile_rules(rules) for rules in RULES
+})
+
+# Unknown types accept no header, as before the registry existed
+UNKNOWN_TYPE_RULES = compile_rules(DiagramRules('', starts=()))
+
+# Registry order, for error messages
+DIAGRAM_TYPES: Tuple[str, ...] = tuple(rules.diagram_type for rules in RULES)
+DIAGRAM_TYPE_NAMES: frozenset = frozenset(DIAGRAM_TYPES)
+
+
+def get_rules(diagram_type: str) -> CompiledRules:
+    """Get the compiled rules for a diagram type"""
+    return COMPILED_RULES.get(diagram_type, UNKNOWN_TYPE_RULES)
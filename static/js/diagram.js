@@ -10,6 +10,13 @@ mermaid.initialize({
     fontFamily: 'Arial, sans-serif'
 });
 
+// Large data-driven charts are laid out by /api/render instead of in the browser
+const serverRenderedTypes = ['pie', 'quadrantChart', 'gantt'];
+const serverRenderMinLines = 200;
+// Artifact URLs of recent server renders; repeat views become a conditional GET the browser cache answers
+const artifactUrls = new Map();
+const artifactUrlsMax = 50;
+
 // Zoom and pan state
 let currentZoom = 1.0;
 let panX = 0;
@@ -72,19 +79,13 @@ async function generateDiagram(forceIteration = false) {
     hideError();
     
     try {
-        const response = await fetch('/api/generate-diagram', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                prompt: prompt,
-                diagram_type: diagramType,
-                is_iteration: shouldIterate
-            })
-        });
+        const requestBody = {
+            prompt: prompt,
+            diagram_type: diagramType,
+            is_iteration: shouldIterate
+        };
         
-        const data = await response.json();
+        const data = await streamDiagram(requestBody);
         
         if (data.success) {
             document.getElementById('syntaxEditor').value = data.syntax;
@@ -93,6 +94,10 @@ async function generateDiagram(forceIteration = false) {
             updateIterationUI();
             saveDiagramToLocalStorage();
         } else {
+            // Syntax that failed validation is still shown so it can be fixed by hand
+            if (data.syntax) {
+                document.getElementById('syntaxEditor').value = data.syntax;
+            }
             showError(data.error || 'Failed to generate diagram');
         }
     } catch (error) {
@@ -103,6 +108,54 @@ async function generateDiagram(forceIteration = false) {
     }
 }
 
+// Stream generated syntax into the editor as Server-Sent Events arrive
+async function streamDiagram(requestBody) {
+    const response = await fetch('/api/generate-diagram/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream'
+        },
+        body: JSON.stringify(requestBody)
+    });
+    
+    if (!response.ok || !response.body) {
+        return await response.json();
+    }
+    
+    const editor = document.getElementById('syntaxEditor');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const lines = [];
+    let buffer = '';
+    let result = { success: false, error: 'Stream ended unexpectedly' };
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        
+        for (const block of events) {
+            const eventLine = block.split('\n').find(line => line.startsWith('event: '));
+            const dataLine = block.split('\n').find(line => line.startsWith('data: '));
+            if (!eventLine || !dataLine) continue;
+            
+            const payload = JSON.parse(dataLine.slice(6));
+            if (eventLine.slice(7) === 'line') {
+                lines.push(payload.line);
+                editor.value = lines.join('\n');
+            } else {
+                result = payload;
+            }
+        }
+    }
+    
+    return result;
+}
+
 // Force new diagram (ignore existing syntax)
 async function generateNewDiagram() {
     await generateDiagram(false);
@@ -238,7 +291,7 @@ async function updateDiagram() {
         diagramWrapper.innerHTML = '<div id="mermaidDiagram"></div>';
         
         // Render the diagram
-        const { svg } = await mermaid.render('mermaidDiagram', syntax);
+        const svg = await renderOnServer(syntax) || (await mermaid.render('mermaidDiagram', syntax)).svg;
         diagramWrapper.innerHTML = svg;
         
         // Reset zoom when new diagram is loaded
@@ -252,6 +305,46 @@ async function updateDiagram() {
     }
 }
 
+// Fetch a ready SVG for large pie, quadrant and Gantt charts; null means render client-side
+async function renderOnServer(syntax) {
+    const diagramType = syntax.split(/\s/, 1)[0];
+    if (!serverRenderedTypes.includes(diagramType) || syntax.split('\n').length < serverRenderMinLines) {
+        return null;
+    }
+    
+    const artifactKey = `${diagramType}\n${syntax}`;
+    try {
+        const artifactUrl = artifactUrls.get(artifactKey);
+        if (artifactUrl) {
+            const cached = await fetch(artifactUrl);
+            if (cached.ok) {
+                return await cached.text();
+            }
+            artifactUrls.delete(artifactKey);
+        }
+        
+        const response = await fetch('/api/render', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ syntax: syntax, diagram_type: diagramType })
+        });
+        if (!response.ok) {
+            return null;
+        }
+        const location = response.headers.get('Content-Location');
+        if (location) {
+            if (artifactUrls.size >= artifactUrlsMax) {
+                artifactUrls.delete(artifactUrls.keys().next().value);
+            }
+            artifactUrls.set(artifactKey, location);
+        }
+        return await response.text();
+    } catch (error) {
+        console.error('Server rendering failed:', error);
+        return null;
+    }
+}
+
 // Debounced update function for real-time editing
 const updateDiagramDebounced = debounce(updateDiagram, 500);
 
@@ -356,6 +449,37 @@ async function copySyntax() {
     }
 }
 
+// Rewrite the syntax into its canonical formatting, keeping statement order
+async function formatSyntax() {
+    const editor = document.getElementById('syntaxEditor');
+    if (!editor.value.trim()) {
+        return;
+    }
+    
+    try {
+        const response = await fetch('/api/format', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                syntax: editor.value,
+                diagram_type: document.getElementById('diagramType').value
+            })
+        });
+        const data = await response.json();
+        
+        if (data.success && data.changed) {
+            editor.value = data.syntax;
+            updateDiagram();
+            saveDiagramToLocalStorage();
+        } else if (!data.success) {
+            showError(data.error || 'Failed to format syntax');
+        }
+    } catch (error) {
+        console.error('Failed to format:', error);
+        showError('Failed to format syntax');
+    }
+}
+
 // Clear syntax
 function clearSyntax() {
     if (confirm('Are you sure you want to clear the syntax?')) {
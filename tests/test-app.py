@@ -2,10 +2,25 @@
 Tests for the Flask application
 """
 
+import asyncio
+import json
+
 import pytest
-from flask import Flask
+import threading
+from unittest.mock import AsyncMock, Mock
+from flask import Flask, current_app
+
+import routes
 from app import create_app
+from asgi import AsyncFlaskApp, create_asgi_app
+from benchmarks import import_time
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.load_test import percentile
 from config import TestingConfig
+from models import DiagramResponse
+from services import metrics
+from services.async_openai_service import AsyncOpenAIService
+from services.openai_service import OpenAIService
 
 
 @pytest.fixture
@@ -82,4 +97,642 @@ class TestApp:
                                    'diagram_type': 'flowchart'})
         assert response.status_code == 200
         data = response.get_json()
-        assert data['is_valid'] is True
\ No newline at end of file
+        assert data['is_valid'] is True
+    
+    def test_api_format(self, client):
+        """Test /api/format respells lines but keeps their order"""
+        syntax = 'flowchart TD\nB-->C\n  A-->B;'
+        response = client.post('/api/format', json={'syntax': syntax, 'diagram_type': 'flowchart'})
+        assert response.status_code == 200
+        assert response.get_json() == {'success': True, 'changed': True,
+                                       'syntax': 'flowchart TD\n    B --> C\n    A --> B'}
+        
+        assert client.post('/api/format', json={}).status_code == 400
+    
+    def test_api_cache_stats(self, client):
+        """Test cache stats API reports disabled cache under testing config"""
+        response = client.get('/api/cache-stats')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['success'] is True
+        assert 'enabled' in data
+    
+    def test_generate_semantic_cache_opt_out(self, client, monkeypatch):
+        """Test the semantic_cache flag reaches the service"""
+        calls = []
+        
+        def fake_generate(prompt, diagram_type, previous_syntax=None, use_semantic_cache=True):
+            calls.append(use_semantic_cache)
+            return DiagramResponse(syntax='flowchart TD\n    A --> B', diagram_type=diagram_type, success=True)
+        
+        monkeypatch.setattr(routes.openai_service, 'generate_diagram_syntax', fake_generate)
+        for body in ({}, {'semantic_cache': False}):
+            response = client.post('/api/generate-diagram',
+                                   json={'prompt': 'login flow', 'diagram_type': 'flowchart', **body})
+            assert response.status_code == 200
+        
+        assert calls == [True, False]
+        assert client.get('/api/cache-stats').get_json()['semantic'] == {'enabled': False, 'stats': None}
+    
+    def test_api_generate_diagram_stream(self, client, monkeypatch):
+        """Test streaming generation emits line and done events"""
+        def fake_stream(prompt, diagram_type, previous_syntax=None, use_semantic_cache=True):
+            yield 'line', 'flowchart TD'
+            yield 'line', '    A --> B'
+            yield 'done', DiagramResponse(syntax='flowchart TD\n    A --> B',
+                                          diagram_type=diagram_type, success=True)
+        
+        monkeypatch.setattr(routes.openai_service, 'stream_diagram_syntax', fake_stream)
+        response = client.post('/api/generate-diagram/stream',
+                               json={'prompt': 'test diagram', 'diagram_type': 'flowchart'})
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        
+        events = [block for block in response.get_data(as_text=True).split('\n\n') if block]
+        assert len(events) == 3
+        assert events[0].startswith('event: line')
+        done = json.loads(events[-1].split('data: ', 1)[1])
+        assert done['success'] is True
+        assert done['validation']['is_valid'] is True
+    
+    def test_api_generate_diagram_stream_commits(self, client, monkeypatch):
+        """Test valid streamed results are committed to the session store"""
+        def fake_stream(prompt, diagram_type, previous_syntax=None, use_semantic_cache=True):
+            yield 'done', DiagramResponse(syntax='flowchart TD\n    A --> B',
+                                          diagram_type=diagram_type, success=True)
+        
+        monkeypatch.setattr(routes.openai_service, 'stream_diagram_syntax', fake_stream)
+        response = client.post('/api/generate-diagram/stream',
+                               json={'prompt': 'test diagram', 'diagram_type': 'flowchart'})
+        done = json.loads(response.get_data(as_text=True).split('data: ', 1)[1])
+        assert done['committed'] is True
+        
+        info = client.get('/api/session-info').get_json()
+        assert info['session']['current_syntax'] == 'flowchart TD\n    A --> B'
+    
+    def test_api_generate_diagram_stream_invalid_type(self, client):
+        """Test streaming generation rejects invalid requests before streaming"""
+        response = client.post('/api/generate-diagram/stream',
+                               json={'prompt': 'test diagram', 'diagram_type': 'invalid'})
+        assert response.status_code == 400
+        assert 'Invalid diagram type' in response.get_json()['error']
+    
+    def test_api_generate_batch(self, client, monkeypatch):
+        """Test batch generation streams a result per request"""
+        def fake_generate_many(requests):
+            for position, diagram_request in reversed(list(enumerate(requests))):
+                yield position, DiagramResponse(syntax=f'pie title {diagram_request.prompt}',
+                                                diagram_type=diagram_request.diagram_type, success=True)
+        
+        monkeypatch.setattr(routes.openai_service, 'generate_many', fake_generate_many)
+        response = client.post('/api/generate-batch', json={'requests': [
+            {'prompt': 'first', 'diagram_type': 'pie'},
+            {'prompt': '', 'diagram_type': 'pie'},
+            {'prompt': 'third', 'diagram_type': 'pie'},
+        ]})
+        assert response.status_code == 200
+        
+        results = {r['index']: r for r in map(json.loads, response.get_data(as_text=True).splitlines())}
+        assert results[0]['syntax'] == 'pie title first'
+        assert results[1]['success'] is False
+        assert results[2]['syntax'] == 'pie title third'
+    
+    def test_api_generate_batch_iterations(self, client, monkeypatch):
+        """Test batch requests carry the diagram they iterate on"""
+        received = []
+        
+        def fake_generate_many(requests):
+            received.extend(requests)
+            return iter(())
+        
+        monkeypatch.setattr(routes.openai_service, 'generate_many', fake_generate_many)
+        response = client.post('/api/generate-batch', json={'requests': [
+            {'prompt': 'add a node', 'diagram_type': 'flowchart', 'previous_syntax': 'flowchart TD\n    A --> B'},
+            {'prompt': 'bad', 'diagram_type': 'flowchart', 'previous_syntax': 42},
+        ]})
+        
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert results == [{'index': 1, 'success': False, 'error': 'previous_syntax must be a string'}]
+        assert received[0].previous_syntax == 'flowchart TD\n    A --> B'
+        assert received[0].is_iteration is True
+    
+    def test_api_generate_batch_no_requests(self, client):
+        """Test batch generation requires a list of requests"""
+        response = client.post('/api/generate-batch', json={'requests': []})
+        assert response.status_code == 400
+    
+    def test_api_commit_generated_diagram(self, client):
+        """Test committing validated syntax updates the session"""
+        response = client.post('/api/generate-diagram/commit',
+                               json={'prompt': 'test diagram', 'diagram_type': 'flowchart',
+                                     'syntax': 'flowchart TD\n    A --> B'})
+        assert response.status_code == 200
+        
+        info = client.get('/api/session-info').get_json()
+        assert info['session']['current_syntax'] == 'flowchart TD\n    A --> B'
+    
+    def test_session_history_kept_server_side(self, client):
+        """Test the cookie only carries an id while history stays on the server"""
+        syntaxes = ['flowchart TD\n    A --> B', 'flowchart TD\n    A --> C', 'flowchart TD\n    A --> D']
+        for syntax in syntaxes:
+            client.post('/api/generate-diagram/commit',
+                        json={'prompt': 'test diagram', 'diagram_type': 'flowchart',
+                              'is_iteration': True, 'syntax': syntax})
+        
+        with client.session_transaction() as cookie_session:
+            assert set(cookie_session.keys()) == {'session_id'}
+        
+        info = client.get('/api/session-info').get_json()
+        assert info['session']['current_syntax'] == syntaxes[-1]
+        assert info['session']['history'] == syntaxes[:-1]
+        
+        client.post('/api/clear-session')
+        info = client.get('/api/session-info').get_json()
+        assert info['has_current_diagram'] is False
+    
+    def test_session_stores_formatting_only_commits_in_place(self, client):
+        """Test committing the /api/format result replaces the current syntax without a new version"""
+        syntaxes = ['flowchart TD\n    A --> B', 'flowchart TD\nA-->B\nB-->C', 'flowchart TD\nA-->B\nB-->C\nC-->D']
+        for syntax in syntaxes:
+            client.post('/api/generate-diagram/commit',
+                        json={'prompt': 'test diagram', 'diagram_type': 'flowchart',
+                              'is_iteration': True, 'syntax': syntax})
+        formatted = client.post('/api/format', json={'syntax': syntaxes[2],
+                                                     'diagram_type': 'flowchart'}).get_json()['syntax']
+        client.post('/api/generate-diagram/commit',
+                    json={'prompt': 'test diagram', 'diagram_type': 'flowchart',
+                          'is_iteration': True, 'syntax': formatted})
+        
+        info = client.get('/api/session-info').get_json()
+        assert info['session']['current_syntax'] == formatted != syntaxes[2]
+        assert info['session']['history'] == syntaxes[:2]
+        assert client.post('/api/diff', json={}).get_json()['patch']['edges']['added'][0]['source'] == 'C'
+    
+    def test_session_history_byte_limit(self):
+        """Test generations trim stored history to SESSION_HISTORY_MAX_BYTES"""
+        class SmallHistoryConfig(TestingConfig):
+            SESSION_HISTORY_KEYFRAME_INTERVAL = 1
+            SESSION_HISTORY_MAX_BYTES = 100
+        
+        client = create_app(SmallHistoryConfig).test_client()
+        syntaxes = [f'flowchart TD\n    A --> B{index}\n    B{index} --> C' for index in range(6)]
+        for syntax in syntaxes:
+            client.post('/api/generate-diagram/commit',
+                        json={'prompt': 'test diagram', 'diagram_type': 'flowchart',
+                              'is_iteration': True, 'syntax': syntax})
+        
+        info = client.get('/api/session-info').get_json()
+        assert info['session']['current_syntax'] == syntaxes[-1]
+        assert info['session']['history'] == syntaxes[-3:-1]
+    
+    def test_api_diff_between_session_versions(self, client):
+        """Test /api/diff compares session versions by index and arbitrary syntaxes"""
+        syntaxes = ['flowchart TD\n    A[Start] --> B', 'flowchart TD\n    A[Begin] --> B\n    B --> C']
+        for syntax in syntaxes:
+            client.post('/api/generate-diagram/commit',
+                        json={'prompt': 'test diagram', 'diagram_type': 'flowchart',
+                              'is_iteration': True, 'syntax': syntax})
+        
+        data = client.post('/api/diff', json={}).get_json()
+        assert (data['from'], data['to'], data['identical']) == (-2, -1, False)
+        assert data['patch'] == {
+            'nodes': {'added': [{'id': 'C', 'label': None}], 'changed': [{'id': 'A', 'label': 'Begin'}]},
+            'edges': {'added': [{'source': 'B', 'target': 'C', 'arrow': '-->', 'label': None}]}
+        }
+        assert client.post('/api/diff', json={'from': 0, 'to': 0}).get_json()['identical'] is True
+        assert client.post('/api/diff', json={'from': -3}).status_code == 404
+        
+        response = client.post('/api/diff', json={'old_syntax': syntaxes[0], 'new_syntax': 'flowchart TD\nA[Start]-->B',
+                                                  'diagram_type': 'flowchart'})
+        assert response.get_json()['identical'] is True
+        assert client.post('/api/diff', json={'old_syntax': ['A --> B'], 'new_syntax': 'A --> B'}).status_code == 400
+        assert client.post('/api/diff', json={'from': '0'}).status_code == 400
+    
+    def test_api_commit_rejects_invalid_syntax(self, client):
+        """Test committing invalid syntax leaves the session untouched"""
+        response = client.post('/api/generate-diagram/commit',
+                               json={'prompt': 'test diagram', 'diagram_type': 'flowchart',
+                                     'syntax': 'sequenceDiagram\n    A->>B: Hi'})
+        assert response.status_code == 422
+        
+        info = client.get('/api/session-info').get_json()
+        assert info['has_current_diagram'] is False
+
+
+class TestAsgiApp:
+    """Test cases for the ASGI entry point"""
+    
+    @pytest.fixture
+    def asgi_app(self):
+        """Create ASGI application for testing"""
+        return create_asgi_app(TestingConfig)
+    
+    @staticmethod
+    def _request(asgi_app, method, path, body=None):
+        """Run a single HTTP request through the ASGI app"""
+        payload = json.dumps(body).encode() if body is not None else b''
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'root_path': '',
+            'query_string': b'',
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(payload)).encode())],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 1234),
+        }
+        messages = [{'type': 'http.request', 'body': payload, 'more_body': False}]
+        sent = []
+        
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {'type': 'http.disconnect'}
+        
+        async def send(message):
+            sent.append(message)
+        
+        asyncio.run(asgi_app(scope, receive, send))
+        status = sent[0]['status']
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        return status, dict(sent[0]['headers']), body
+    
+    def test_generate_diagram_uses_async_service(self, asgi_app, monkeypatch):
+        """Test generate-diagram is served by the async view"""
+        async def fake_generate(prompt, diagram_type, previous_syntax=None, use_semantic_cache=True):
+            return DiagramResponse(syntax='flowchart TD\n    A --> B',
+                                   diagram_type=diagram_type, success=True)
+        
+        monkeypatch.setattr(routes.async_openai_service, 'generate_diagram_syntax', fake_generate)
+        status, headers, body = self._request(
+            asgi_app, 'POST', '/api/generate-diagram',
+            {'prompt': 'test diagram', 'diagram_type': 'flowchart'}
+        )
+        assert status == 200
+        assert json.loads(body)['syntax'] == 'flowchart TD\n    A --> B'
+        assert b'session=' in headers[b'set-cookie']
+    
+    def test_blocking_calls_run_off_the_event_loop(self, asgi_app, monkeypatch):
+        """Test session store and cache calls of async generations run on worker threads"""
+        threads = []
+        
+        def on_thread(func):
+            def run(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return func(*args, **kwargs)
+            return run
+        
+        async def create(**kwargs):
+            return Mock(choices=[Mock(message=Mock(content='flowchart TD\n    A --> B'))])
+        
+        service = AsyncOpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create = AsyncMock(side_effect=create)
+        monkeypatch.setattr(routes, 'async_openai_service', service)
+        monkeypatch.setattr(routes, '_prepare_generation', on_thread(routes._prepare_generation))
+        monkeypatch.setattr(routes, '_commit_generation', on_thread(routes._commit_generation))
+        monkeypatch.setattr(service, '_lookup_answer', on_thread(service._lookup_answer))
+        monkeypatch.setattr(service, '_answer', on_thread(service._answer))
+        
+        status, _, _ = self._request(
+            asgi_app, 'POST', '/api/generate-diagram',
+            {'prompt': 'test diagram', 'diagram_type': 'flowchart'}
+        )
+        assert status == 200
+        assert len(threads) == 4
+        assert threading.main_thread() not in threads
+        assert set(routes.ASYNC_VIEWS) == {'api.generate_diagram', 'api.generate_diagram_stream',
+                                           'api.generate_batch'}
+    
+    def test_generate_diagram_async_validation_error(self, asgi_app):
+        """Test async view rejects invalid requests"""
+        status, _, body = self._request(
+            asgi_app, 'POST', '/api/generate-diagram',
+            {'prompt': '', 'diagram_type': 'flowchart'}
+        )
+        assert status == 400
+        assert 'Prompt cannot be empty' in json.loads(body)['error']
+    
+    def test_sync_routes_fall_back_to_wsgi(self, asgi_app):
+        """Test endpoints without an async view are served by Flask"""
+        status, _, body = self._request(
+            asgi_app, 'POST', '/api/validate-batch',
+            [{'syntax': 'flowchart TD\n    A --> B', 'diagram_type': 'flowchart'}]
+        )
+        assert status == 200
+        assert json.loads(body)['is_valid'] is True
+        
+        status, _, body = self._request(
+            asgi_app, 'POST', '/api/validate-syntax',
+            {'syntax': 'flowchart TD\n    A --> B', 'diagram_type': 'flowchart'}
+        )
+        assert status == 200
+        assert json.loads(body)['is_valid'] is True
+    
+    def test_stream_and_batch_use_async_service(self, asgi_app, monkeypatch):
+        """Test streamed and batch generations are served on the event loop"""
+        async def chunks():
+            for text in ("flowchart TD\n", "    A --> B"):
+                yield Mock(choices=[Mock(delta=Mock(content=text))])
+        
+        async def create(**kwargs):
+            if kwargs.get('stream'):
+                return chunks()
+            return Mock(choices=[Mock(message=Mock(content='pie\n    "A" : 1'))])
+        
+        service = AsyncOpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create = AsyncMock(side_effect=create)
+        monkeypatch.setattr(routes, 'async_openai_service', service)
+        
+        status, headers, body = self._request(
+            asgi_app, 'POST', '/api/generate-diagram/stream',
+            {'prompt': 'test diagram', 'diagram_type': 'flowchart'}
+        )
+        events = [block.split('\n', 1) for block in body.decode().strip().split('\n\n')]
+        assert status == 200
+        assert headers[b'content-type'].startswith(b'text/event-stream')
+        assert [event for event, _ in events] == ['event: line', 'event: line', 'event: done']
+        assert json.loads(events[-1][1][len('data: '):])['committed'] is True
+        
+        status, _, body = self._request(
+            asgi_app, 'POST', '/api/generate-batch',
+            [{'prompt': 'pets', 'diagram_type': 'pie'}, {'prompt': 'pets', 'diagram_type': 'pie'}, {'prompt': ''}]
+        )
+        results = {result['index']: result for result in map(json.loads, body.decode().splitlines())}
+        assert status == 200
+        assert results[0]['syntax'] == results[1]['syntax'] == 'pie\n    "A" : 1'
+        assert results[2]['success'] is False
+        assert service.client.chat.completions.create.await_count == 2
+    
+    def test_lifespan_warms_up_on_the_event_loop(self):
+        """Test the async client is warmed at startup when OPENAI_WARMUP is set"""
+        flask_app = create_app(TestingConfig)
+        flask_app.config['OPENAI_WARMUP'] = True
+        warmed = []
+        
+        async def warm_up():
+            warmed.append(current_app.name)
+            return True
+        
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+        
+        async def receive():
+            await asyncio.sleep(0)
+            return messages.pop(0)
+        
+        async def send(message):
+            sent.append(message['type'])
+        
+        asyncio.run(AsyncFlaskApp(flask_app, {}, warm_up=warm_up)({'type': 'lifespan'}, receive, send))
+        
+        assert warmed == [flask_app.name]
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    
+    def test_api_render(self, client):
+        """Test /api/render returns SVG for supported charts and a JSON error otherwise"""
+        response = client.post('/api/render', json={'syntax': 'pie\n    "A" : 1', 'diagram_type': 'pie'})
+        assert response.status_code == 200
+        assert response.mimetype == 'image/svg+xml'
+        assert response.get_data(as_text=True).startswith('<svg')
+        
+        response = client.post('/api/render', json={'syntax': 'pie\n    "A" : x', 'diagram_type': 'pie'})
+        assert response.status_code == 400
+        assert response.get_json()['line_number'] == 2
+        
+        response = client.post('/api/render', json={'syntax': 'flowchart TD', 'diagram_type': 'flowchart'})
+        assert response.status_code == 400
+        
+        response = client.post('/api/render', json={'syntax': 'gantt\n    Forever :2024-01-01, 1000000w',
+                                                    'diagram_type': 'gantt'})
+        assert response.status_code == 400
+    
+    def test_artifacts_are_immutable_and_conditional(self, tmp_path):
+        """Test rendered SVG is served from its artifact URL with a strong ETag and 304 on revalidation"""
+        class ArtifactConfig(TestingConfig):
+            ARTIFACT_STORE_ENABLED = True
+            ARTIFACT_STORE_DIR = str(tmp_path)
+        
+        client = create_app(ArtifactConfig).test_client()
+        rendered = client.post('/api/render', json={'syntax': 'pie\n    "A" : 1', 'diagram_type': 'pie'})
+        url = rendered.headers['Content-Location']
+        
+        response = client.get(url)
+        revalidated = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'image/svg+xml'
+        assert response.get_data() == rendered.get_data()
+        assert response.headers['ETag'] == rendered.headers['ETag']
+        assert response.cache_control.immutable
+        assert revalidated.status_code == 304
+        assert revalidated.headers['ETag'] == response.headers['ETag']
+        assert client.get(url.replace('.svg', '.gif')).status_code == 404
+        assert client.get(f"/api/artifacts/{'0' * 64}.svg").status_code == 404
+        assert client.get('/api/cache-stats').get_json()['artifacts']['stats']['writes'] == 1
+    
+    def test_api_validate_incremental(self, client):
+        """Test incremental validation applies edits to a synced document"""
+        response = client.post('/api/validate-incremental',
+                               json={'syntax': 'flowchart TD\n    A --> B', 'diagram_type': 'flowchart'})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['is_valid'] is True
+        
+        response = client.post('/api/validate-incremental',
+                               json={'base_hash': data['document_hash'], 'diagram_type': 'flowchart',
+                                     'edits': [{'start': 1, 'end': 2, 'lines': ['    A --> B]']}]})
+        assert response.status_code == 200
+        edited = response.get_json()
+        assert edited['is_valid'] is False
+        assert edited['line_number'] == 2
+        assert edited['document_hash'] != data['document_hash']
+    
+    def test_api_validate_batch_ndjson(self, client):
+        """Test batch validation streams results in input order"""
+        body = '\n'.join([
+            json.dumps({'syntax': 'flowchart TD\n    A --> B', 'diagram_type': 'flowchart'}),
+            'not json',
+            json.dumps({'syntax': 'flowchart TD\n    A[Start', 'diagram_type': 'flowchart'}),
+        ])
+        response = client.post('/api/validate-batch', data=body, content_type='application/x-ndjson')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [r['index'] for r in results] == [0, 1, 2]
+        assert results[0]['is_valid'] is True
+        assert results[1]['error'] == 'Invalid JSON'
+        assert results[2]['is_valid'] is False
+    
+    def test_api_validate_batch_json_array(self, client):
+        """Test batch validation accepts a JSON array"""
+        response = client.post('/api/validate-batch', json=[
+            {'syntax': 'pie title Pets\n    "Dogs" : 3', 'diagram_type': 'pie'},
+            {'diagram_type': 'pie'},
+        ])
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert results[0]['is_valid'] is True
+        assert results[1]['error'] == 'No syntax provided'
+    
+    def test_api_validate_incremental_unknown_base(self, client):
+        """Test unknown base documents ask the client to resync"""
+        response = client.post('/api/validate-incremental',
+                               json={'base_hash': 'missing', 'diagram_type': 'flowchart', 'edits': []})
+        assert response.status_code == 409
+        assert response.get_json()['resync'] is True
+
+
+class TestFakeOpenAIBackend:
+    """Test the app end to end against the benchmark's fake OpenAI server"""
+    
+    @pytest.fixture
+    def fake_api(self):
+        """Run the fake completions API on a free port"""
+        server = FakeOpenAIServer(tokens_per_second=100000).start()
+        yield server
+        server.stop()
+    
+    def test_generate_against_fake_api(self, fake_api, monkeypatch):
+        """Test OPENAI_BASE_URL routes generation to the fake server"""
+        class FakeApiConfig(TestingConfig):
+            OPENAI_BASE_URL = fake_api.base_url
+        
+        monkeypatch.setattr(routes, 'openai_service', OpenAIService())
+        client = create_app(FakeApiConfig).test_client()
+        
+        response = client.post('/api/generate-diagram', json={'prompt': 'pets', 'diagram_type': 'pie'})
+        assert response.status_code == 200
+        assert response.get_json()['syntax'].startswith('pie title')
+        
+        response = client.post('/api/generate-diagram/stream', json={'prompt': 'pets', 'diagram_type': 'pie'})
+        done = json.loads(response.get_data(as_text=True).rsplit('data: ', 1)[1])
+        assert done['validation']['is_valid'] is True
+        assert fake_api.request_count == 2
+    
+    def test_warm_up_connects_to_api(self, fake_api):
+        """Test warm-up opens a connection to the configured API without a completion"""
+        class FakeApiConfig(TestingConfig):
+            OPENAI_BASE_URL = fake_api.base_url
+        
+        service = OpenAIService()
+        with create_app(FakeApiConfig).app_context():
+            assert service.warm_up() is True
+        assert fake_api.request_count == 0
+    
+    def test_rate_limit_headers_hold_back_requests(self, monkeypatch):
+        """Test the limiter learns the fake API's limit and queues instead of hitting a 429"""
+        fake_api = FakeOpenAIServer(tokens_per_second=100000, requests_per_minute=1).start()
+        
+        class LimitedApiConfig(TestingConfig):
+            OPENAI_BASE_URL = fake_api.base_url
+            OPENAI_QUEUE_TIMEOUT = 0.1
+        
+        monkeypatch.setattr(routes, 'openai_service', OpenAIService())
+        client = create_app(LimitedApiConfig).test_client()
+        try:
+            first = client.post('/api/generate-diagram', json={'prompt': 'pets', 'diagram_type': 'pie'})
+            second = client.post('/api/generate-diagram', json={'prompt': 'cars', 'diagram_type': 'pie'})
+            stats = client.get('/api/rate-limit-stats').get_json()['stats']
+        finally:
+            fake_api.stop()
+        
+        assert first.status_code == 200
+        assert second.status_code == 500
+        assert 'Rate limit queue' in second.get_json()['error']
+        assert stats['requests_per_minute'] == 1
+        assert stats['timeouts'] == 1
+        assert fake_api.request_count == 1
+    
+    def test_metrics_endpoint(self, monkeypatch):
+        """Test /metrics exposes OpenAI latency, token usage, validation time and cache hit rates"""
+        fake_api = FakeOpenAIServer(tokens_per_second=100000).start()
+        
+        class FakeApiConfig(TestingConfig):
+            OPENAI_BASE_URL = fake_api.base_url
+            RESPONSE_CACHE_BACKEND = 'memory'
+        
+        monkeypatch.setattr(routes, 'openai_service', OpenAIService())
+        client = create_app(FakeApiConfig).test_client()
+        try:
+            for _ in range(2):
+                client.post('/api/generate-diagram', json={'prompt': 'pets', 'diagram_type': 'pie'})
+            client.post('/api/validate-syntax', json={'syntax': 'pie\n    "A" : 1', 'diagram_type': 'pie'})
+            response = client.get('/metrics')
+        finally:
+            fake_api.stop()
+        
+        text = response.get_data(as_text=True)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert 'openai_request_duration_seconds_count{priority="new",call="complete"} 1' in text
+        assert 'openai_prompt_tokens_bucket{priority="new",le="+Inf"} 1' in text
+        # The generated diagram is validated once before it is returned, then once by the request
+        assert 'validate_syntax_duration_seconds_count{diagram_type="pie"} 2' in text
+        assert 'session_serialized_bytes_count{part="state"} 2' in text
+        assert 'cache_hit_ratio{cache="response"} 0.5' in text
+    
+    def test_metrics_disabled(self):
+        """Test disabled metrics bind no-op hooks and hide the endpoint"""
+        class NoMetricsConfig(TestingConfig):
+            METRICS_ENABLED = False
+        
+        client = create_app(NoMetricsConfig).test_client()
+        
+        assert client.get('/metrics').status_code == 404
+        assert metrics.registry is None
+        with metrics.timer('clean_syntax_duration_seconds'):
+            metrics.observe('unknown_metric', 1.0)
+    
+    def test_profiling_header_writes_listed_profiles(self, tmp_path):
+        """Test a request carrying the profiling header is profiled and its profile can be read back"""
+        class ProfilingConfig(TestingConfig):
+            PROFILING_ENABLED = True
+            PROFILING_TOKEN = 'secret'
+            PROFILING_DIR = str(tmp_path)
+        
+        client = create_app(ProfilingConfig).test_client()
+        payload = {'syntax': 'flowchart TD\n    A --> B', 'diagram_type': 'flowchart'}
+        client.post('/api/validate-syntax', json=payload)
+        validated = client.post('/api/validate-syntax', json=payload, headers={'X-Profile-Request': 'secret'})
+        
+        denied = client.get('/api/debug/profiles')
+        listing = client.get('/api/debug/profiles', headers={'X-Profile-Request': 'secret'}).get_json()
+        profile = listing['profiles'][0]
+        collapsed = client.get(f"/api/debug/profiles/{profile['id']}/collapsed",
+                               headers={'X-Profile-Request': 'secret'})
+        
+        assert validated.status_code == 200
+        assert denied.status_code == 404
+        assert len(listing['profiles']) == 1
+        assert profile['path'] == '/api/validate-syntax'
+        assert profile['status'] == 200
+        assert listing['stats']['requested'] == 1
+        assert 'validate_syntax' in collapsed.get_data(as_text=True)
+    
+    def test_profiling_disabled_by_default(self, client):
+        """Test profiling is off unless configured"""
+        response = client.get('/api/debug/profiles', headers={'X-Profile-Request': '1'})
+        
+        assert response.status_code == 404
+    
+    def test_percentile(self):
+        """Test nearest-rank percentiles used in load test reports"""
+        samples = list(range(1, 101))
+        assert percentile(samples, 0.50) == 50
+        assert percentile(samples, 0.99) == 99
+        assert percentile([], 0.5) is None
+    
+    def test_import_keeps_openai_lazy(self):
+        """Test importing the app does not load the OpenAI SDK"""
+        report = import_time.run(module='app', repeat=1, top=5)
+        
+        assert report['total_ms'] > 0
+        assert report['top_cumulative'][0]['module'] == 'app'
+        assert import_time.check(report, budget_ms=float('inf'), lazy_modules=['openai', 'httpx']) == []
+        assert import_time.check(report, budget_ms=0.0, lazy_modules=['flask'])
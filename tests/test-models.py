@@ -4,12 +4,17 @@ Tests for data models
 
 import pytest
 from datetime import datetime
-from models import DiagramRequest, DiagramResponse, ValidationResult
+from models import DIAGRAM_TYPES, DiagramRequest, DiagramResponse, ValidationResult, DiagramSession, DiagramHistory
+from services import validation_rules
 
 
 class TestDiagramRequest:
     """Test cases for DiagramRequest model"""
     
+    def test_types_match_validation_rules(self):
+        """Test the accepted types are the ones the validator has rules for"""
+        assert DIAGRAM_TYPES == validation_rules.DIAGRAM_TYPES
+    
     def test_valid_request(self):
         """Test valid diagram request"""
         request = DiagramRequest(
@@ -160,4 +165,92 @@ class TestValidationResult:
         assert isinstance(data, dict)
         assert data['is_valid'] is False
         assert data['error'] == "Invalid syntax"
-        assert data['line_number'] == 3
\ No newline at end of file
+        assert data['line_number'] == 3
+
+
+class TestDiagramSession:
+    """Test cases for DiagramSession history"""
+    
+    @staticmethod
+    def _versions(count):
+        lines = [f"    N{i}[Node {i}] --> N{i + 1}" for i in range(50)]
+        versions = []
+        for index in range(count):
+            lines[index % 50] = f"    N{index}[Edited {index}] --> N{index + 1}"
+            versions.append("flowchart TD\n" + "\n".join(lines))
+        return versions
+    
+    def test_history_round_trip(self):
+        """Test every previous version is rebuilt exactly"""
+        versions = self._versions(12)
+        session = DiagramSession(history=DiagramHistory(keyframe_interval=4))
+        for syntax in versions:
+            session.add_to_history(syntax)
+        
+        assert session.current_syntax == versions[-1]
+        assert session.get_history() == versions[:-1]
+        assert session.history.version(5, session.current_syntax) == versions[5]
+        assert session.history.version(-1, session.current_syntax) == versions[-2]
+    
+    def test_history_stores_deltas_between_keyframes(self):
+        """Test only every keyframe_interval-th entry is a full copy"""
+        session = DiagramSession(history=DiagramHistory(keyframe_interval=4))
+        for syntax in self._versions(9):
+            session.add_to_history(syntax)
+        
+        keyframes = [index for index, entry in enumerate(session.history.entries) if isinstance(entry, str)]
+        assert keyframes == [0, 4]
+        assert session.history.size_bytes < sum(len(syntax) for syntax in session.get_history()) / 2
+    
+    def test_history_replaces_formatting_only_changes(self):
+        """Test a version the comparison calls equal replaces the current syntax and re-bases the newest entry"""
+        def same_diagram(current, new):
+            return current.replace(' ', '').rstrip(';') == new.replace(' ', '').rstrip(';')
+        
+        versions = ["flowchart TD\n    A --> B", "flowchart TD\n    A --> B\n    B --> C",
+                    "flowchart TD\n    A --> B\n    B --> C\n    C --> D"]
+        session = DiagramSession(history=DiagramHistory(keyframe_interval=10))
+        for syntax in versions:
+            session.add_to_history(syntax, same_diagram)
+        
+        reformatted = "flowchart TD\n    A-->B\n    B-->C\n    C-->D;"
+        assert session.add_to_history(reformatted, same_diagram) is None
+        assert session.current_syntax == reformatted
+        assert len(session.history) == 2
+        assert session.get_history() == versions[:-1]
+        assert [session.history.version(index, session.current_syntax) for index in range(2)] == versions[:-1]
+        assert session.history.size_bytes == DiagramHistory(entries=list(session.history.entries)).size_bytes
+        
+        session.add_to_history("flowchart TD\n    A --> E", same_diagram)
+        assert session.get_history() == versions[:-1] + [reformatted]
+    
+    def test_history_caps(self):
+        """Test depth and byte caps drop the oldest versions"""
+        versions = self._versions(10)
+        session = DiagramSession(history=DiagramHistory(max_depth=3))
+        for syntax in versions:
+            session.add_to_history(syntax)
+        assert session.get_history() == versions[-4:-1]
+        
+        session = DiagramSession(history=DiagramHistory(keyframe_interval=1, max_bytes=len(versions[-1]) * 2 + 1))
+        for syntax in versions:
+            session.add_to_history(syntax)
+        assert session.get_history() == versions[-3:-1]
+    
+    def test_serialization(self):
+        """Test the compact encoding and the older list of full versions"""
+        versions = self._versions(5)
+        session = DiagramSession(diagram_type='flowchart')
+        for syntax in versions:
+            session.add_to_history(syntax)
+        
+        restored = DiagramSession.from_dict(session.to_dict())
+        assert restored.get_history() == versions[:-1]
+        
+        legacy = DiagramSession.from_dict({
+            'current_syntax': versions[-1],
+            'diagram_type': 'flowchart',
+            'history': versions[:-1]
+        })
+        assert legacy.get_history() == versions[:-1]
+        assert legacy.to_dict()['history'] == session.to_dict()['history']
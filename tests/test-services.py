@@ -2,9 +2,47 @@
 Tests for services
 """
 
+import asyncio
+import json
+import pstats
+import socketserver
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+import httpx
+import openai
 import pytest
+from unittest.mock import Mock, AsyncMock
+
+from app import create_app
+from config import TestingConfig
+from services import cache_service
+from benchmarks.validators import compare, generate_diagram
+from services.artifact_store import ArtifactStore
+from services.async_openai_service import AsyncOpenAIService
+from services.cache_service import MemoryCache, SQLiteCache, create_cache, make_cache_key
+from services.canonical_syntax import canonicalize
+from services import diagram_service
 from services.diagram_service import DiagramService
-from models import ValidationResult
+from services.edit_script import EditScriptError, apply_edit_script, number_lines, parse_edit_script
+from services.incremental_validation import IncrementalValidator, LineEdit
+from services.mermaid_parser import Task, tokenize
+from services.metrics import MetricsRegistry
+from services.profiler import RequestProfiler
+from services import openai_service
+from services.openai_service import OpenAIService, StreamingSyntaxCleaner, TokenBudget
+from services import session_store
+from services.rate_limiter import (PRIORITY_BATCH, PRIORITY_ITERATION, RateLimiter, RateLimitTimeout,
+                                   backoff_delay, retry_after_seconds)
+from services.semantic_cache import SemanticCache, jaccard, prompt_features, roles_swapped
+from services.single_flight import SingleFlight
+from services.svg_renderer import RenderError, SVGRenderer, render_key
+from services.syntax_repair import balance_line, failing_excerpt, repair_locally
+from services.session_store import (MemorySessionStore, SQLiteSessionStore, RedisClient,
+                                    RedisSessionStore, RedisError, create_session_store)
+from services.validation_rules import DIAGRAM_TYPE_NAMES, get_rules
+from models import ValidationResult, DiagramRequest, DiagramResponse
 
 
 class TestDiagramService:
@@ -188,4 +226,1655 @@ class TestDiagramService:
         syntax = "sequenceDiagram\n    participant A"
         result = service.validate_syntax(syntax, "flowchart")
         assert result.is_valid is False
-        assert "must start with" in result.error
\ No newline at end of file
+        assert "must start with" in result.error
+    
+    def test_validate_many_matches_validate_syntax(self, service):
+        """Test batch validation in-process and across worker processes"""
+        items = [
+            ("flowchart TD\n    A --> B", "flowchart"),
+            ("flowchart TD\n    A[Start --> B", "flowchart"),
+            ("pie title Pets\n    \"Dogs\" : abc", "pie"),
+            ("sequenceDiagram\n    A->>B: Hi", "sequence"),
+            ("", "flowchart"),
+        ] * 3
+        expected = [service.validate_syntax(syntax, diagram_type) for syntax, diagram_type in items]
+        
+        assert list(service.validate_many(items, workers=1)) == expected
+        assert list(service.validate_many(iter(items), workers=2, chunk_size=4)) == expected
+        
+        # Later batches reuse the worker processes
+        pool = diagram_service._pool
+        assert list(service.validate_many(items, workers=2, chunk_size=4)) == expected
+        assert pool is not None and diagram_service._pool is pool
+    
+    @pytest.mark.parametrize('diagram_type', [t['value'] for t in TestingConfig.DIAGRAM_TYPES])
+    def test_benchmark_diagrams_are_valid(self, service, diagram_type):
+        """Test the validator benchmark's synthetic diagrams validate at every size"""
+        for lines in (10, 1000):
+            syntax = generate_diagram(diagram_type, lines)
+            assert syntax.count('\n') + 1 == lines
+            assert service.validate_syntax(syntax, diagram_type).is_valid is True
+    
+    def test_benchmark_compare_flags_regressions(self):
+        """Test the baseline check reports slowdowns and allocation growth"""
+        baseline = {'results': {'pie:1000': {'is_valid': True, 'seconds': 0.001, 'peak_alloc_bytes': 100000}}}
+        within = {'results': {'pie:1000': {'is_valid': True, 'seconds': 0.0011, 'peak_alloc_bytes': 100000}}}
+        slower = {'results': {'pie:1000': {'is_valid': True, 'seconds': 0.002, 'peak_alloc_bytes': 200000}}}
+        
+        assert compare(within, baseline, threshold=0.25) == []
+        assert len(compare(slower, baseline, threshold=0.25)) == 2
+
+
+class TestResponseCache:
+    """Test cases for the response cache backends"""
+    
+    CONFIG = {'OPENAI_MODEL': 'gpt-4o-mini', 'OPENAI_TEMPERATURE': 0.2, 'OPENAI_MAX_TOKENS': 1000}
+    
+    def test_cache_key_normalizes_prompt_whitespace(self):
+        """Test prompts differing only in whitespace share a key"""
+        key1 = make_cache_key("login   flow", "flowchart", None, self.CONFIG)
+        key2 = make_cache_key("  login flow\n", "flowchart", None, self.CONFIG)
+        assert key1 == key2
+    
+    def test_cache_key_canonicalizes_previous_syntax(self):
+        """Test previous versions that only differ in formatting share a key, but not reordered ones"""
+        key1 = make_cache_key("add C", "flowchart", "flowchart TD\n    A-->B;\n  B --> C", self.CONFIG)
+        key2 = make_cache_key("add C", "flowchart", "flowchart TD\n    A --> B\n    B --> C", self.CONFIG)
+        key3 = make_cache_key("add C", "flowchart", "flowchart TD\n    B --> C\n    A --> B", self.CONFIG)
+        assert key1 == key2
+        assert key1 != key3
+    
+    def test_cache_key_depends_on_inputs(self):
+        """Test diagram type, previous syntax and model settings change the key"""
+        base = make_cache_key("login flow", "flowchart", None, self.CONFIG)
+        assert base != make_cache_key("login flow", "sequence", None, self.CONFIG)
+        assert base != make_cache_key("login flow", "flowchart", "flowchart TD\n    A --> B", self.CONFIG)
+        assert base != make_cache_key("login flow", "flowchart", None,
+                                      dict(self.CONFIG, OPENAI_TEMPERATURE=0.7))
+    
+    def test_memory_cache_hit_and_miss(self):
+        """Test memory cache counts hits and misses"""
+        cache = MemoryCache(max_entries=10)
+        assert cache.get("a") is None
+        cache.set("a", "flowchart TD")
+        assert cache.get("a") == "flowchart TD"
+        assert cache.stats.hits == 1
+        assert cache.stats.misses == 1
+    
+    def test_memory_cache_lru_eviction(self):
+        """Test least recently used entries are evicted first"""
+        cache = MemoryCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        assert cache.get("b") is None
+        assert cache.get("a") == "1"
+        assert cache.get("c") == "3"
+        assert cache.stats.evictions == 1
+    
+    def test_memory_cache_byte_budget(self):
+        """Test memory cache stays within its byte budget"""
+        cache = MemoryCache(max_entries=100, max_bytes=20)
+        cache.set("a", "x" * 9)
+        cache.set("b", "y" * 9)
+        cache.set("c", "z" * 9)
+        assert cache.current_bytes <= 20
+        assert len(cache) == 2
+        assert cache.get("a") is None
+    
+    def test_memory_cache_ttl(self, monkeypatch):
+        """Test expired entries are treated as misses"""
+        now = [1000.0]
+        monkeypatch.setattr(cache_service.time, 'monotonic', lambda: now[0])
+        cache = MemoryCache(ttl=10)
+        cache.set("a", "1")
+        now[0] += 11
+        assert cache.get("a") is None
+        assert cache.stats.expirations == 1
+    
+    def test_sqlite_cache_survives_reopen(self, tmp_path):
+        """Test SQLite cache entries persist across instances"""
+        path = str(tmp_path / "cache.sqlite3")
+        SQLiteCache(path).set("a", "pie title Pets")
+        cache = SQLiteCache(path)
+        assert cache.get("a") == "pie title Pets"
+        assert cache.stats.hits == 1
+    
+    def test_sqlite_cache_eviction(self, tmp_path):
+        """Test SQLite cache evicts beyond max entries"""
+        cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.set("c", "3")
+        assert len(cache) == 2
+        assert cache.stats.evictions == 1
+    
+    def test_create_cache_from_config(self):
+        """Test backend selection from config"""
+        assert isinstance(create_cache({'RESPONSE_CACHE_BACKEND': 'memory'}), MemoryCache)
+        assert create_cache({'RESPONSE_CACHE_BACKEND': 'none'}) is None
+
+
+class TestOpenAIService:
+    """Test cases for OpenAIService"""
+    
+    @pytest.fixture
+    def app(self):
+        """Create application context for the service"""
+        app = create_app(TestingConfig)
+        with app.app_context():
+            yield app
+    
+    @staticmethod
+    def _completion(content):
+        message = Mock(content=content)
+        return Mock(choices=[Mock(message=message)])
+    
+    def test_client_uses_transport_config_and_is_rebuilt_after_fork(self, app):
+        """Test pool limits and timeouts come from config and a forked process gets its own client"""
+        app.config.update(OPENAI_CONNECT_TIMEOUT=2.0, OPENAI_READ_TIMEOUT=7.0, OPENAI_MAX_CONNECTIONS=4,
+                          OPENAI_HTTP2=True)
+        service = OpenAIService()
+        
+        client = service._get_client()
+        transport = service._http_client._transport._pool
+        assert service._get_client() is client
+        assert client.timeout == httpx.Timeout(connect=2.0, read=7.0, write=30.0, pool=10.0)
+        assert transport._max_connections == 4
+        assert transport._http2 is openai_service.transport_options(app.config)['http2']
+        
+        service._client_pid = -1  # as seen from a child forked after the client was built
+        assert service._get_client() is not client
+    
+    def test_cache_hit_skips_api_call(self, app):
+        """Test repeated requests are served from the response cache"""
+        service = OpenAIService(cache=MemoryCache())
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = self._completion("flowchart TD\n    A --> B")
+        
+        first = service.generate_diagram_syntax("login flow", "flowchart")
+        second = service.generate_diagram_syntax("login  flow", "flowchart")
+        
+        assert first.success is True
+        assert isinstance(second, DiagramResponse)
+        assert second.syntax == first.syntax
+        assert service.client.chat.completions.create.call_count == 1
+        assert service.cache_stats()['hits'] == 1
+    
+    def test_failed_generation_not_cached(self, app):
+        """Test API errors are not stored in the cache"""
+        service = OpenAIService(cache=MemoryCache())
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = RuntimeError("boom")
+        
+        response = service.generate_diagram_syntax("login flow", "flowchart")
+        
+        assert response.success is False
+        assert len(service.cache) == 0
+    
+    def test_semantic_cache_serves_similar_prompt(self, app):
+        """Test a near-duplicate prompt reuses the stored diagram without an API call"""
+        service = OpenAIService(cache=MemoryCache(), semantic_cache=SemanticCache(threshold=0.8))
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = Mock(
+            choices=[Mock(message=Mock(content="flowchart TD\n    A --> B"))]
+        )
+        
+        first = service.generate_diagram_syntax("login flow with 2FA", "flowchart")
+        similar = service.generate_diagram_syntax("2FA login flowchart", "flowchart")
+        opted_out = service.generate_diagram_syntax("2FA login flowchart", "flowchart", use_semantic_cache=False)
+        other_type = service.generate_diagram_syntax("2FA login flowchart", "sequence")
+        iteration = service.generate_diagram_syntax("2FA login flowchart", "flowchart", previous_syntax=first.syntax)
+        
+        assert similar.syntax == first.syntax
+        assert similar.similarity >= 0.8
+        assert first.similarity is None and opted_out.similarity is None
+        assert other_type.similarity is None and iteration.similarity is None
+        assert service.client.chat.completions.create.call_count == 4
+        stats = service.semantic_cache_stats()
+        assert stats['hits'] == 1
+        assert stats['lookups'] == 3
+    
+    def test_identical_concurrent_requests_share_one_call(self, app):
+        """Test concurrent identical generations are coalesced into one API call"""
+        release = threading.Event()
+        
+        def create(**kwargs):
+            release.wait(5)
+            return self._completion("flowchart TD\n    A --> B")
+        
+        service = OpenAIService(single_flight=SingleFlight())
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = create
+        responses = []
+        
+        def worker():
+            with app.app_context():
+                responses.append(service.generate_diagram_syntax("viral prompt", "flowchart"))
+        
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        while service.single_flight.stats.coalesced < 5:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        assert service.client.chat.completions.create.call_count == 1
+        assert len({id(response) for response in responses}) == 1
+        assert service.coalescing_stats()['coalesced'] == 5
+    
+    def test_streams_and_batches_join_generations_in_flight(self, app):
+        """Test a stream and a batch wait for an identical generation instead of calling the API"""
+        release = threading.Event()
+        
+        def create(**kwargs):
+            release.wait(5)
+            return self._completion("flowchart TD\n    A --> B")
+        
+        service = OpenAIService(single_flight=SingleFlight())
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = create
+        results = {}
+        
+        def generate():
+            with app.app_context():
+                results['single'] = service.generate_diagram_syntax("viral prompt", "flowchart")
+        
+        def stream():
+            with app.app_context():
+                results['stream'] = list(service.stream_diagram_syntax("viral prompt", "flowchart"))
+        
+        def batch():
+            with app.app_context():
+                results['batch'] = list(service.generate_many([DiagramRequest(prompt="viral prompt",
+                                                                              diagram_type="flowchart")]))
+        
+        leader = threading.Thread(target=generate)
+        leader.start()
+        while service.client.chat.completions.create.call_count < 1:
+            time.sleep(0.01)
+        followers = [threading.Thread(target=stream), threading.Thread(target=batch)]
+        for thread in followers:
+            thread.start()
+        while service.single_flight.stats.coalesced < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        
+        assert service.client.chat.completions.create.call_count == 1
+        assert results['stream'] == [('line', 'flowchart TD'), ('line', '    A --> B'), ('done', results['single'])]
+        assert results['batch'] == [(0, results['single'])]
+    
+    def test_stream_leads_identical_generations(self, app):
+        """Test generations arriving while a stream is in flight get the streamed answer"""
+        flight = SingleFlight()
+        service = OpenAIService(single_flight=flight)
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = [
+            Mock(choices=[Mock(delta=Mock(content="pie title Pets"))])
+        ]
+        results = []
+        stream = service.stream_diagram_syntax("pets", "pie")
+        assert next(stream) == ('line', 'pie title Pets')
+        
+        def generate():
+            with app.app_context():
+                results.append(service.generate_diagram_syntax("pets", "pie", use_semantic_cache=False))
+        
+        follower = threading.Thread(target=generate)
+        follower.start()
+        while flight.stats.coalesced < 1:
+            time.sleep(0.01)
+        event, response = next(stream)
+        follower.join()
+        
+        assert event == 'done' and results == [response]
+        assert service.client.chat.completions.create.call_count == 1
+    
+    def test_warm_up_fork_hook_registered_once(self, app, monkeypatch):
+        """Test repeated start-ups warm each service but register one fork hook"""
+        hooks = []
+        monkeypatch.setattr(openai_service.os, 'register_at_fork', lambda **kwargs: hooks.append(kwargs))
+        monkeypatch.setattr(openai_service, '_fork_hook_registered', False)
+        monkeypatch.setattr(openai_service, '_warm_up_target', None)
+        warmed = threading.Semaphore(0)
+        services = [OpenAIService(), OpenAIService()]
+        for service in services:
+            service.warm_up = Mock(side_effect=lambda: warmed.release())
+            openai_service.start_warm_up(app, service)
+        
+        assert warmed.acquire(timeout=5) and warmed.acquire(timeout=5)
+        assert hooks == [{'after_in_child': openai_service._warm_up_after_fork}]
+        hooks[0]['after_in_child']()
+        assert warmed.acquire(timeout=5)
+        assert services[1].warm_up.call_count == 2
+    
+    def test_stream_yields_lines_then_response(self, app):
+        """Test streaming yields cleaned lines and a final response"""
+        chunks = ["```mermaid\nflow", "chart TD\n    A --> B\n", "    B --> C\n```"]
+        service = OpenAIService(cache=MemoryCache())
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = [
+            Mock(choices=[Mock(delta=Mock(content=chunk))]) for chunk in chunks
+        ]
+        
+        events = list(service.stream_diagram_syntax("flow", "flowchart"))
+        
+        lines = [payload for event, payload in events if event == 'line']
+        event, response = events[-1]
+        assert lines == ["flowchart TD", "    A --> B", "    B --> C"]
+        assert event == 'done'
+        assert response.success is True
+        assert response.syntax == "flowchart TD\n    A --> B\n    B --> C"
+        assert service.client.chat.completions.create.call_args.kwargs['stream'] is True
+    
+    def test_stream_error_yields_failed_response(self, app):
+        """Test streaming errors surface as a failed final response"""
+        service = OpenAIService(cache=MemoryCache())
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = RuntimeError("boom")
+        
+        events = list(service.stream_diagram_syntax("flow", "flowchart"))
+        
+        assert len(events) == 1
+        assert events[0][0] == 'done'
+        assert events[0][1].success is False
+
+    
+    def test_generate_many_dedupes_and_uses_cache(self, app):
+        """Test batch generation makes one call per distinct uncached request"""
+        cache = MemoryCache()
+        cache.set(make_cache_key("cached", "pie", None, app.config), "pie title Cached")
+        service = OpenAIService(cache=cache)
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = self._completion("flowchart TD\n    A --> B")
+        requests = [
+            DiagramRequest(prompt="login flow", diagram_type="flowchart"),
+            DiagramRequest(prompt="cached", diagram_type="pie"),
+            DiagramRequest(prompt="login  flow", diagram_type="flowchart"),
+            DiagramRequest(prompt="signup flow", diagram_type="flowchart"),
+        ]
+        
+        results = dict(service.generate_many(requests, max_in_flight=2))
+        
+        assert sorted(results) == [0, 1, 2, 3]
+        assert results[1].syntax == "pie title Cached"
+        assert results[0] is results[2]
+        assert all(response.success for response in results.values())
+        assert service.client.chat.completions.create.call_count == 2
+    
+    def test_generate_many_reports_failures(self, app):
+        """Test failed requests yield failed responses without stopping the batch"""
+        service = OpenAIService(cache=MemoryCache())
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = RuntimeError("boom")
+        
+        results = list(service.generate_many([DiagramRequest(prompt="flow", diagram_type="flowchart")]))
+        
+        assert len(results) == 1
+        assert results[0][1].success is False
+        assert len(service.cache) == 0
+    
+    def test_generate_many_passes_previous_syntax(self, app):
+        """Test batch iterations send and cache under the diagram they edit"""
+        cache = MemoryCache()
+        service = OpenAIService(cache=cache)
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = self._completion("flowchart TD\n    A --> C")
+        previous = "flowchart TD\n    A --> B"
+        requests = [
+            DiagramRequest(prompt="login flow", diagram_type="flowchart"),
+            DiagramRequest(prompt="login flow", diagram_type="flowchart", previous_syntax=previous),
+        ]
+        
+        results = dict(service.generate_many(requests))
+        
+        assert results[0] is not results[1]
+        assert service.client.chat.completions.create.call_count == 2
+        calls = service.client.chat.completions.create.call_args_list
+        sent = [call.kwargs['messages'][-1]['content'] for call in calls]
+        assert sum(previous in content for content in sent) == 1
+        assert cache.get(make_cache_key("login flow", "flowchart", previous, app.config)) == "flowchart TD\n    A --> C"
+    
+    def test_token_budget(self, monkeypatch):
+        """Test the token budget refills at its per-minute rate"""
+        now = [1000.0]
+        monkeypatch.setattr(openai_service.time, 'monotonic', lambda: now[0])
+        budget = TokenBudget(600)
+        
+        assert budget.reserve(500) == 0
+        assert budget.reserve(200) == pytest.approx(10.0)
+        now[0] += 10
+        assert budget.reserve(200) == 0
+    
+    def test_rate_limited_call_is_retried(self, app, monkeypatch):
+        """Test a 429 is retried after the server's retry-after delay"""
+        delays = []
+        monkeypatch.setattr(openai_service.time, 'sleep', delays.append)
+        rate_limited = openai.RateLimitError(
+            "Rate limit reached",
+            response=httpx.Response(429, headers={'retry-after-ms': '1500'},
+                                    request=httpx.Request('POST', 'http://api.test/v1/chat/completions')),
+            body=None
+        )
+        service = OpenAIService(rate_limiter=RateLimiter())
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = [rate_limited, self._completion("flowchart TD\n    A --> B")]
+        
+        response = service.generate_diagram_syntax("login flow", "flowchart")
+        
+        assert response.success is True
+        assert delays and delays[0] >= 1.5
+        assert service.rate_limit_stats()['retries'] == 1
+    
+    def test_retries_are_bounded(self, app, monkeypatch):
+        """Test retryable errors give up after OPENAI_MAX_RETRIES attempts"""
+        monkeypatch.setattr(openai_service.time, 'sleep', lambda seconds: None)
+        service = OpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = openai.APIConnectionError(
+            request=httpx.Request('POST', 'http://api.test/v1/chat/completions')
+        )
+        
+        response = service.generate_diagram_syntax("login flow", "flowchart")
+        
+        assert response.success is False
+        assert service.client.chat.completions.create.call_count == app.config['OPENAI_MAX_RETRIES'] + 1
+    
+    def test_iteration_applies_edit_script(self, app):
+        """Test large-diagram iterations ask for an edit script and apply it locally"""
+        previous = generate_diagram('flowchart', 200)
+        service = OpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = self._completion(json.dumps({'edits': [
+            {'op': 'replace', 'start': 2, 'lines': ['    N0[Begin] --> N1(Next 0)']},
+            {'op': 'insert', 'after': 200, 'lines': ['    N199 --> Z[Done]']}
+        ]}))
+        
+        response = service.generate_diagram_syntax("rename the start and finish with Done", "flowchart",
+                                                   previous_syntax=previous)
+        
+        lines = response.syntax.split('\n')
+        assert response.success is True
+        assert lines[1] == '    N0[Begin] --> N1(Next 0)'
+        assert lines[-1] == '    N199 --> Z[Done]'
+        assert lines[2:-1] == previous.split('\n')[2:]
+        kwargs = service.client.chat.completions.create.call_args.kwargs
+        assert kwargs['max_tokens'] == app.config['OPENAI_EDIT_MAX_TOKENS']
+        assert '200|     N198' in kwargs['messages'][1]['content']
+        stats = service.edit_script_stats()
+        assert stats['applied'] == 1
+        assert stats['output_ratio'] < 0.1
+    
+    def test_stream_iteration_applies_edit_script(self, app):
+        """Test streamed iterations on large diagrams use the edit script instead of regenerating"""
+        previous = generate_diagram('flowchart', 50)
+        service = OpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = self._completion(json.dumps({'edits': [
+            {'op': 'insert', 'after': 50, 'lines': ['    N49 --> Z[Done]']}
+        ]}))
+        
+        events = list(service.stream_diagram_syntax("finish with Done", "flowchart", previous_syntax=previous))
+        
+        event, response = events[-1]
+        assert event == 'done' and response.syntax == previous + '\n    N49 --> Z[Done]'
+        assert [payload for event, payload in events[:-1]] == response.syntax.split('\n')
+        assert 'stream' not in service.client.chat.completions.create.call_args.kwargs
+        assert service.edit_script_stats()['applied'] == 1
+    
+    def test_rejected_edit_script_falls_back_to_regeneration(self, app):
+        """Test an edit script that does not apply is followed by a full regeneration"""
+        previous = generate_diagram('flowchart', 50)
+        service = OpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = [
+            self._completion('{"edits": [{"op": "delete", "start": 90}]}'),
+            self._completion("flowchart TD\n    A --> B")
+        ]
+        
+        response = service.generate_diagram_syntax("drop the last step", "flowchart", previous_syntax=previous)
+        small = OpenAIService()
+        small.client = Mock()
+        small.client.chat.completions.create.return_value = self._completion("flowchart TD\n    A --> C")
+        small_response = small.generate_diagram_syntax("swap B for C", "flowchart",
+                                                       previous_syntax="flowchart TD\n    A --> B")
+        
+        assert response.syntax == "flowchart TD\n    A --> B"
+        assert service.client.chat.completions.create.call_count == 2
+        assert service.edit_script_stats()['rejected_scripts'] == 1
+        # Diagrams below OPENAI_EDIT_MIN_LINES are regenerated directly; counters are shared by the app's services
+        assert small_response.syntax == "flowchart TD\n    A --> C"
+        assert small.edit_script_stats()['attempts'] == 1
+    
+    def test_invalid_answer_is_repaired_locally(self, app):
+        """Test prose, a spelled-out direction and an unclosed bracket are fixed without another call"""
+        service = OpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create.return_value = self._completion(
+            "Here is your diagram:\nflowchart left to right\n    A[Start --> B[End]\nIt has two steps."
+        )
+        
+        response = service.generate_diagram_syntax("two steps", "flowchart")
+        
+        assert response.syntax == "flowchart LR\n    A[Start] --> B[End]"
+        assert service.client.chat.completions.create.call_count == 1
+        stats = service.syntax_repair_stats()
+        assert stats['checked'] == 1
+        assert stats['local_repairs'] == 1
+        assert stats['reprompts'] == 0
+    
+    def test_invalid_answer_is_repaired_with_targeted_reprompt(self, app, monkeypatch):
+        """Test what local fixes miss is re-prompted with only the failing lines, within the budget"""
+        answer = 'pie title Pets\n' + '\n'.join(f'    "Pet {i}" : {i + 1}' for i in range(20)) + '\n    "Fish" : few'
+        service = OpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create.side_effect = [
+            self._completion(answer),
+            self._completion('{"edits": [{"op": "replace", "start": 22, "lines": ["    \\"Fish\\" : 2"]}]}')
+        ]
+        
+        response = service.generate_diagram_syntax("pets", "pie")
+        
+        assert response.syntax.endswith('\n    "Fish" : 2')
+        kwargs = service.client.chat.completions.create.call_args.kwargs
+        assert kwargs['max_tokens'] == app.config['OPENAI_REPAIR_MAX_TOKENS']
+        assert 0 < kwargs['timeout'] <= app.config['OPENAI_REPAIR_BUDGET_SECONDS']
+        assert 'Pie chart values must be numbers' in kwargs['messages'][1]['content']
+        assert '22|     "Fish" : few' in kwargs['messages'][1]['content']
+        assert 'Pet 5' not in kwargs['messages'][1]['content']
+        stats = service.syntax_repair_stats()
+        assert stats['reprompts'] == 1
+        assert stats['reprompt_repairs'] == 1
+        
+        # Once the budget is spent the invalid answer is returned without a second call
+        app.config['OPENAI_REPAIR_BUDGET_SECONDS'] = 0
+        service.client.chat.completions.create.side_effect = None
+        service.client.chat.completions.create.return_value = self._completion('pie\n    "Fish" : few')
+        response = service.generate_diagram_syntax("fish", "pie")
+        
+        assert response.syntax == 'pie\n    "Fish" : few'
+        assert service.client.chat.completions.create.call_count == 3
+        stats = service.syntax_repair_stats()
+        assert stats['budget_exhausted'] == 1
+        assert stats['unrepaired'] == 1
+    
+    def test_unrepaired_answer_is_reported_and_not_cached(self, app):
+        """Test syntax still invalid after repair fails the response and is generated again next time"""
+        app.config['OPENAI_REPAIR_MAX_REPROMPTS'] = 0
+        service = OpenAIService()
+        service.client = Mock()
+        answer = 'pie\n    "Fish" : few'
+        chunks = [Mock(choices=[Mock(delta=Mock(content=answer))])]
+        service.client.chat.completions.create.side_effect = lambda **kwargs: (
+            iter(chunks) if kwargs.get('stream') else self._completion(answer)
+        )
+        
+        response = service.generate_diagram_syntax("fish", "pie")
+        events = list(service.stream_diagram_syntax("fish", "pie"))
+        
+        assert not response.success
+        assert response.syntax == 'pie\n    "Fish" : few'
+        assert 'Pie chart values must be numbers' in response.error
+        event, streamed = events[-1]
+        assert event == 'done' and not streamed.success and streamed.syntax == response.syntax
+        assert service.client.chat.completions.create.call_count == 2
+        assert service.syntax_repair_stats()['unrepaired'] == 2
+
+
+class TestRateLimiter:
+    """Test cases for the OpenAI rate limiter"""
+    
+    def test_iterations_overtake_queued_batch_work(self):
+        """Test the queue serves higher priorities first and reports its depth"""
+        limiter = RateLimiter()
+        limiter.update_from_headers({'retry-after-ms': '300'}, status_code=429)
+        threads = [threading.Thread(target=limiter.acquire, args=(100, priority))
+                   for priority in (PRIORITY_BATCH, PRIORITY_ITERATION)]
+        for thread in threads:
+            thread.start()
+        while limiter.metrics()['queue_depth'] < 2:
+            time.sleep(0.01)
+        
+        metrics = limiter.metrics()
+        assert metrics['queue_depth_by_priority'] == {'iteration': 1, 'new': 0, 'batch': 1}
+        assert limiter._queue[0][0] == PRIORITY_ITERATION
+        assert metrics['rate_limited'] == 1
+        for thread in threads:
+            thread.join()
+        assert limiter.metrics()['queue_depth'] == 0
+        assert limiter.stats.queued == 2
+    
+    def test_limits_adapt_to_response_headers(self):
+        """Test x-ratelimit headers set and tighten the budgets"""
+        limiter = RateLimiter(tokens_per_minute=100000)
+        limiter.update_from_headers({
+            'x-ratelimit-limit-requests': '500',
+            'x-ratelimit-remaining-requests': '0',
+            'x-ratelimit-limit-tokens': '40000',
+        })
+        
+        metrics = limiter.metrics()
+        assert metrics['requests_per_minute'] == 500
+        assert metrics['tokens_per_minute'] == 40000
+        assert metrics['adaptations'] == 2
+        assert limiter.requests.wait_time(1) > 0
+    
+    def test_queue_timeout(self):
+        """Test callers give up once the queue timeout passes"""
+        limiter = RateLimiter(requests_per_minute=1, queue_timeout=0.05)
+        limiter.acquire(10)
+        with pytest.raises(RateLimitTimeout):
+            limiter.acquire(10)
+        assert limiter.stats.timeouts == 1
+    
+    def test_async_waiters_queue_without_threads(self):
+        """Test coroutines wait in the same priority queue without holding a thread each"""
+        limiter = RateLimiter(tokens_per_minute=60000)
+        limiter.tokens.available = 0
+        order = []
+        
+        async def call(priority):
+            await limiter.acquire_async(10, priority)
+            order.append(priority)
+        
+        async def main():
+            batch = [asyncio.ensure_future(call(PRIORITY_BATCH)) for _ in range(10)]
+            await asyncio.sleep(0)
+            iteration = asyncio.ensure_future(call(PRIORITY_ITERATION))
+            await asyncio.sleep(0)
+            threads = threading.active_count()
+            await asyncio.gather(*batch, iteration)
+            return threads
+        
+        threads_before = threading.active_count()
+        assert asyncio.run(main()) == threads_before
+        assert order.index(PRIORITY_ITERATION) <= 1
+        assert limiter.metrics()['acquired'] == 11
+        assert limiter.metrics()['queue_depth'] == 0
+    
+    def test_backoff_delay(self):
+        """Test backoff grows with the attempt, stays under the cap and honors retry-after"""
+        assert all(0 <= backoff_delay(attempt, 0.5, 4.0) <= min(4.0, 0.5 * 2 ** attempt) for attempt in range(8))
+        assert backoff_delay(0, 0.5, 4.0, retry_after=2.0) >= 2.0
+        assert retry_after_seconds({'retry-after': '3'}) == 3.0
+        assert retry_after_seconds({'retry-after-ms': '250'}) == 0.25
+
+
+class TestSemanticCache:
+    """Test cases for the MinHash/LSH prompt index"""
+    
+    def test_features_ignore_filler_and_keep_order(self):
+        """Test stopwords are dropped and word order still counts"""
+        assert prompt_features("Create a login flow with 2FA") == prompt_features("login 2FA")
+        assert prompt_features("the diagram") == frozenset()
+        similarity = jaccard(prompt_features("Alice calls Bob"), prompt_features("Bob calls Alice"))
+        assert 0.5 < similarity < 1.0
+    
+    def test_lookup_threshold_and_namespaces(self):
+        """Test only similar prompts in the same namespace are served"""
+        cache = SemanticCache(threshold=0.8)
+        cache.add('flowchart', "login flow with 2FA", "flowchart TD\n    A --> B")
+        
+        match = cache.lookup('flowchart', "2FA login flowchart")
+        assert match.syntax == "flowchart TD\n    A --> B"
+        assert match.prompt == "login flow with 2FA"
+        assert cache.lookup('flowchart', "checkout with payment") is None
+        assert cache.lookup('sequence', "login flow with 2FA") is None
+        assert cache.stats.to_dict()['reuse_rate'] == pytest.approx(1 / 3)
+    
+    def test_lookup_rejects_swapped_roles(self):
+        """Test a prompt with the same words in swapped roles is not served the stored diagram"""
+        cache = SemanticCache(threshold=0.8)
+        cache.add('sequence', "Alice sends money to Bob", "sequenceDiagram\n    Alice->>Bob: money")
+        
+        assert jaccard(prompt_features("Alice sends money to Bob"),
+                       prompt_features("Bob sends money to Alice")) >= 0.8
+        assert cache.lookup('sequence', "Bob sends money to Alice") is None
+        assert cache.stats.role_swaps == 1
+        assert cache.lookup('sequence', "Alice sends the money to Bob") is not None
+        assert roles_swapped(["login", "2fa"], ["2fa", "login"]) is False
+    
+    def test_eviction_removes_index_entries(self):
+        """Test the least recently used prompt leaves both the entries and the LSH buckets"""
+        cache = SemanticCache(max_entries=2)
+        cache.add('pie', "pets adopted by volunteers", "pie\n    \"Dogs\" : 1")
+        cache.add('pie', "browser market share", "pie\n    \"Chrome\" : 1")
+        cache.lookup('pie', "pets adopted by volunteers")
+        cache.add('pie', "programming language popularity", "pie\n    \"Python\" : 1")
+        
+        assert len(cache) == 2
+        assert cache.stats.evictions == 1
+        assert cache.lookup('pie', "browser market share") is None
+        assert cache.lookup('pie', "pets adopted by volunteers") is not None
+        assert all(key[1] != prompt_features("browser market share")
+                   for keys in cache._buckets.values() for key in keys)
+    
+    def test_bands_must_divide_signature(self):
+        """Test invalid LSH parameters are rejected"""
+        with pytest.raises(ValueError):
+            SemanticCache(num_perm=64, bands=10)
+
+
+class TestSingleFlight:
+    """Test cases for single-flight request coalescing"""
+    
+    def test_followers_share_leader_error(self):
+        """Test an error in the shared call reaches every waiting caller"""
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        errors = []
+        
+        def fail():
+            started.set()
+            release.wait(5)
+            raise RuntimeError("boom")
+        
+        def call():
+            try:
+                flight.do('key', fail)
+            except RuntimeError as e:
+                errors.append(e)
+        
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        while flight.stats.coalesced < 1:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+        
+        assert len(errors) == 2 and errors[0] is errors[1]
+        assert flight.do('key', lambda: 'fresh') == ('fresh', False)
+    
+    def test_lock_file_shares_result_across_processes(self, tmp_path):
+        """Test a second coalescer on the same lock directory reads the first one's result"""
+        # Separate open files conflict under flock just like separate processes
+        first, second = SingleFlight(lock_dir=str(tmp_path)), SingleFlight(lock_dir=str(tmp_path))
+        started, release = threading.Event(), threading.Event()
+        results = {}
+        
+        def slow():
+            started.set()
+            release.wait(5)
+            return {'syntax': 'pie'}
+        
+        leader = threading.Thread(target=lambda: results.update(first=first.do('key', slow, json.dumps, json.loads)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(
+            target=lambda: results.update(second=second.do('key', lambda: {'syntax': 'other'}, json.dumps, json.loads))
+        )
+        follower.start()
+        while second.stats.cross_process_waits < 1:
+            time.sleep(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+        
+        assert results == {'first': ({'syntax': 'pie'}, False), 'second': ({'syntax': 'pie'}, True)}
+        assert second.stats.cross_process_shared == 1
+        assert second.stats.leaders == 0
+    
+    def test_coroutines_share_a_thread_led_call(self):
+        """Test a coroutine waiting on a key led by a thread gets the thread's result"""
+        flight = SingleFlight(poll_interval=0.005)
+        started, release = threading.Event(), threading.Event()
+        results = []
+        
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'answer'
+        
+        async def other():
+            return 'other'
+        
+        async def follow():
+            waiter = asyncio.ensure_future(flight.do_async('key', other))
+            while flight.stats.coalesced < 1:
+                await asyncio.sleep(0.005)
+            release.set()
+            return await waiter
+        
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+        leader.start()
+        started.wait(5)
+        shared = asyncio.run(follow())
+        leader.join()
+        
+        assert shared == ('answer', True)
+        assert results == [('answer', False)]
+        assert flight.stats.leaders == 1
+
+
+class TestEditScript:
+    """Test cases for edit-script application"""
+    
+    SYNTAX = "flowchart TD\n    A[Start] --> B{Ok}\n    B --> C[End]\n    E[Extra]\n    A --> E"
+    
+    def test_operations_refer_to_original_line_numbers(self):
+        """Test operations are applied against the numbering shown to the model"""
+        operations = parse_edit_script('```json\n{"edits": ['
+                                       '{"op": "replace", "start": 3, "lines": ["    B --> D[Finish]"]},'
+                                       '{"op": "insert", "after": 1, "lines": ["    Z --> A"]},'
+                                       '{"op": "delete", "start": 4, "end": 5}]}\n```')
+        
+        result = apply_edit_script(self.SYNTAX, operations, 'flowchart')
+        
+        assert result == "flowchart TD\n    Z --> A\n    A[Start] --> B{Ok}\n    B --> D[Finish]"
+        assert number_lines(self.SYNTAX).split('\n')[1] == '2|     A[Start] --> B{Ok}'
+    
+    def test_remove_node_deletes_its_lines(self):
+        """Test remove_node drops the node's definition and its edges"""
+        result = apply_edit_script(self.SYNTAX, [{'op': 'remove_node', 'id': 'E'}, {'op': 'delete', 'start': 5}],
+                                   'flowchart')
+        
+        assert result == "flowchart TD\n    A[Start] --> B{Ok}\n    B --> C[End]"
+    
+    def test_invalid_scripts_are_rejected(self):
+        """Test malformed, out-of-range and overlapping scripts raise EditScriptError"""
+        for answer in ('flowchart TD', '{"edits": {}}'):
+            with pytest.raises(EditScriptError):
+                parse_edit_script(answer)
+        for operations in ([{'op': 'delete', 'start': 9}],
+                           [{'op': 'replace', 'start': 2, 'end': 3, 'lines': []},
+                            {'op': 'delete', 'start': 3}],
+                           [{'op': 'move', 'start': 1}],
+                           [{'op': 'remove_node', 'id': 'Q'}]):
+            with pytest.raises(EditScriptError):
+                apply_edit_script(self.SYNTAX, operations, 'flowchart')
+
+
+class TestCanonicalSyntax:
+    """Test cases for the Mermaid canonicalizer"""
+    
+    def test_flowchart_spelling_is_normalized(self):
+        """Test spacing, quoting and link-label style do not change the canonical form, but order and ids do"""
+        first = 'flowchart TD\n  A["Start"]-->B{Ready?}\n    B -- Yes --> C[Go]\nB-->|No|A;'
+        second = 'flowchart TD\n    A[Start] --> B{Ready?}\n    B -->|"Yes"| C[Go]\n    B -->|No| A'
+        
+        assert canonicalize(first, 'flowchart') == canonicalize(second, 'flowchart') == (
+            'flowchart TD\n    A[Start] --> B{Ready?}\n    B -->|Yes| C[Go]\n    B -->|No| A'
+        )
+        assert canonicalize(first, 'flowchart') != canonicalize(second.replace('C[Go]', 'D[Go]'), 'flowchart')
+    
+    def test_blocks_are_reindented_and_order_kept(self):
+        """Test block nesting sets indentation while messages and subgraphs keep their order"""
+        sequence = 'sequenceDiagram\nloop Poll\nB ->> +A :  ping\n    else stop\nA-->>B:pong\nend'
+        flowchart = 'flowchart LR\nsubgraph one\nB-->C\nA  -->  B\nend\nclick A call()'
+        
+        assert canonicalize(sequence, 'sequence') == (
+            'sequenceDiagram\n    loop Poll\n        B->>+A: ping\n    else stop\n        A-->>B: pong\n    end'
+        )
+        assert canonicalize(flowchart, 'flowchart') == (
+            'flowchart LR\n    subgraph one\n        B --> C\n        A --> B\n    end\n    click A call()'
+        )
+    
+    def test_data_lines_and_unknown_lines(self):
+        """Test chart lines are respelled and lines that are not understood are only trimmed"""
+        pie = 'pie title  Pets\n"Dogs":386.0\n  "Cats" :  "85.50"\n  weird   line'
+        
+        assert canonicalize(pie, 'pie') == 'pie title Pets\n    "Dogs" : 386.0\n    "Cats" : 85.50\n    weird line'
+        assert canonicalize('quadrantChart\nA:[0.50, .3]', 'quadrantChart') == 'quadrantChart\n    A: [0.5, 0.3]'
+        assert canonicalize('gantt\nsection A\nWrite:w1,2024-01-01 ,3d', 'gantt') == (
+            'gantt\n    section A\n        Write :w1, 2024-01-01, 3d'
+        )
+        assert canonicalize('flowchart TD\n    A --> B extra', 'flowchart') == 'flowchart TD\n    A --> B extra'
+        assert canonicalize('  \n', 'pie') == ''
+
+
+class TestStructuralDiff:
+    """Test cases for the structural diff"""
+    
+    def test_sequence_messages_and_participants(self):
+        """Test repeated messages are told apart by occurrence and participants are reported separately"""
+        old = 'sequenceDiagram\n    A->>B: hi\n    A->>B: again'
+        new = 'sequenceDiagram\n    participant C as Carol\n    A->>B: hi\n    A->>B: later'
+        
+        assert DiagramService().diff(old, new, 'sequence') == {
+            'participants': {'added': [{'name': 'C', 'alias': 'Carol'}]},
+            'edges': {'changed': [{'source': 'A', 'target': 'B', 'arrow': '->>', 'label': 'later', 'occurrence': 1}]}
+        }
+    
+    def test_chart_data_and_properties(self):
+        """Test slices are matched by label, removals carry only their identity and formatting is ignored"""
+        old = 'pie title Pets\n    "Dogs" : 3\n    "Cats" : 1'
+        new = 'pie\n"Dogs":5\n  "Fish" : 1'
+        
+        assert DiagramService().diff(old, new, 'pie') == {
+            'properties': {'removed': [{'name': 'title'}]},
+            'slices': {'added': [{'label': 'Fish', 'value': '1'}], 'removed': [{'label': 'Cats'}],
+                       'changed': [{'label': 'Dogs', 'value': '5'}]}
+        }
+        assert DiagramService().diff(old, 'pie title Pets\n"Dogs":3\n"Cats":1', 'pie') == {}
+
+
+class TestSyntaxRepair:
+    """Test cases for the local syntax repairs"""
+    
+    def test_balance_line(self):
+        """Test unclosed brackets are closed before the next link and stray closers are dropped"""
+        assert balance_line('    A[Start --> B(Next') == '    A[Start] --> B(Next)'
+        assert balance_line('    A[Start]] --> B;') == '    A[Start] --> B;'
+        assert balance_line('    A[Start] -.-> B') == '    A[Start] -.-> B'
+    
+    def test_repairs_only_invalid_syntax(self):
+        """Test each fix runs only while the syntax is still invalid"""
+        syntax, validation, fixes = repair_locally("```mermaid\nsequenceDiagram\n    A->>B: hi\n```", 'sequence')
+        assert (syntax, validation.is_valid, fixes) == ('sequenceDiagram\n    A->>B: hi', True, ['prose'])
+        
+        syntax, validation, fixes = repair_locally('    A --> B', 'flowchart')
+        assert (syntax, fixes) == ('flowchart TD\n    A --> B', ['header'])
+        
+        valid = 'flowchart TD\n    A["Done."] --> B'
+        assert repair_locally(valid, 'flowchart') == (valid, ValidationResult(is_valid=True), [])
+    
+    def test_failing_excerpt(self):
+        """Test the excerpt keeps the diagram's line numbers and finds unclosed brackets"""
+        syntax = 'flowchart TD\n' + '\n'.join(f'    N{i} --> N{i + 1}' for i in range(10)) + '\n    X[x --> Y'
+        validation = DiagramService().validate_syntax(syntax, 'flowchart')
+        
+        assert failing_excerpt(syntax, validation, context=1) == '11|     N9 --> N10\n12|     X[x --> Y'
+        assert failing_excerpt(syntax, ValidationResult(False, 'bad', 2), context=0) == ' 2|     N0 --> N1'
+
+
+class TestSVGRenderer:
+    """Test cases for server-side SVG rendering"""
+    
+    SVG = '{http://www.w3.org/2000/svg}'
+    
+    def test_pie_slices_and_cache(self):
+        """Test a pie chart draws one slice per value and repeat renders come from the cache"""
+        renderer = SVGRenderer(cache=MemoryCache())
+        syntax = 'pie title Pets\n    "Dogs" : 3\n    "Cats" : 1'
+        
+        svg = renderer.render(syntax, 'pie')
+        root = ElementTree.fromstring(svg)
+        
+        assert len(root.findall(f'{self.SVG}path')) == 2
+        assert [text.text for text in root.iter(f'{self.SVG}text')][:3] == ['Pets', '75%', '25%']
+        assert renderer.render(syntax + '\n', 'pie') == svg
+        assert renderer.render_stats()['rendered'] == 1
+        assert renderer.render_stats()['cached'] == 1
+        assert renderer.render(syntax, 'pie', theme='dark') != svg
+    
+    def test_show_data_values_keep_their_spelling(self):
+        """Test pie values shown by showData are not served from a render of another spelling"""
+        renderer = SVGRenderer(cache=MemoryCache())
+        first = renderer.render('pie showData\n    "A" : 1.50\n    "B" : 1', 'pie')
+        second = renderer.render('pie showData\n    "A" : 1.5\n    "B" : 1', 'pie')
+        
+        assert 'A [1.50]' in first and 'A [1.5]' in second
+        assert render_key('pie\n  "A":1.50', 'pie', 'default') == render_key('pie\n    "A" : 1.50', 'pie', 'default')
+        assert renderer.render_stats()['cached'] == 0
+    
+    def test_gantt_schedules_dependencies(self):
+        """Test 'after' and durations place bars on a shared time scale"""
+        syntax = ("gantt\n    dateFormat YYYY-MM-DD\n    section Design\n"
+                  "    Sketch :done, a1, 2024-01-01, 10d\n    Review :crit, after a1, 5d\n"
+                  "    section Build\n    Code :2024-01-16, 2024-01-31")
+        
+        bars = [rect for rect in ElementTree.fromstring(SVGRenderer().render(syntax, 'gantt'))
+                .findall(f'{self.SVG}rect') if rect.get('rx')]
+        starts = [float(bar.get('x')) for bar in bars]
+        widths = [float(bar.get('width')) for bar in bars]
+        
+        assert starts[1] == pytest.approx(starts[0] + widths[0], abs=0.02)
+        assert widths[0] == pytest.approx(widths[1] * 2, abs=0.02)
+        assert starts[2] == pytest.approx(starts[1] + widths[1], abs=0.02)
+        assert widths[2] == pytest.approx(widths[1] * 3, abs=0.02)
+    
+    def test_quadrant_points_and_errors(self):
+        """Test points land in their quadrant and undrawable input is rejected with its line"""
+        syntax = "quadrantChart\n    x-axis Low --> High\n    y-axis Low --> High\n    A: [0.75, 0.75]"
+        point = ElementTree.fromstring(SVGRenderer().render(syntax, 'quadrantChart')).find(f'{self.SVG}circle')
+        assert (float(point.get('cx')), float(point.get('cy'))) == (340.0, 110.0)
+        
+        with pytest.raises(RenderError) as error:
+            SVGRenderer().render(syntax.replace('0.75, 0.75', '1.5, 0.2'), 'quadrantChart')
+        assert error.value.line_number == 4
+        with pytest.raises(RenderError):
+            SVGRenderer().render("gantt\n    Task :after missing, 2d", 'gantt')
+        with pytest.raises(RenderError):
+            SVGRenderer().render("flowchart TD\n    A --> B", 'flowchart')
+    
+    def test_gantt_dates_out_of_range(self):
+        """Test a duration past the last representable date is rejected and the final year still draws"""
+        with pytest.raises(RenderError) as error:
+            SVGRenderer().render("gantt\n    Forever :2024-01-01, 1000000w", 'gantt')
+        assert error.value.line_number == 2
+        assert SVGRenderer().render("gantt\n    Last :9999-12-20, 10d", 'gantt').startswith('<svg')
+    
+    def test_undrawable_sizes_are_bounded(self):
+        """Test infinite pie values are rejected and a span of millennia keeps a handful of ticks"""
+        for values in ('"A" : 1e400', '"A" : inf', '"A" : 1e308\n    "B" : 1e308'):
+            with pytest.raises(RenderError):
+                SVGRenderer().render(f"pie\n    {values}", 'pie')
+        
+        svg = SVGRenderer().render("gantt\n    Ages :0001-01-01, 9999-12-31", 'gantt')
+        ticks = ElementTree.fromstring(svg).findall(f'{self.SVG}line')
+        assert 'nan' not in svg
+        assert 2 <= len(ticks) <= 11
+        assert len(svg) < 10000
+
+
+class TestArtifactStore:
+    """Test cases for the on-disk artifact store"""
+    
+    def test_evicts_least_recently_used_by_size(self, tmp_path):
+        """Test the store stays within its size limit and drops the least recently read artifact"""
+        store = ArtifactStore(str(tmp_path), max_bytes=250)
+        keys = [f"{i:064x}" for i in range(3)]
+        store.put(keys[0], 'svg', b'a' * 100)
+        store.put(keys[1], 'svg', b'b' * 100)
+        assert store.get(keys[0], 'svg') is not None
+        
+        store.put(keys[2], 'svg', b'c' * 100)
+        
+        assert store.get(keys[1], 'svg') is None
+        assert open(store.get(keys[0], 'svg'), 'rb').read() == b'a' * 100
+        assert store.store_stats()['bytes'] == 200
+        assert store.store_stats()['evictions'] == 1
+    
+    def test_reloads_existing_artifacts(self, tmp_path):
+        """Test a new store indexes the files left by a previous process"""
+        key = 'ab' * 32
+        ArtifactStore(str(tmp_path)).put(key, 'svg', b'<svg/>')
+        (tmp_path / 'ab' / 'stray.txt').write_text('ignored')
+        
+        store = ArtifactStore(str(tmp_path))
+        
+        assert len(store) == 1
+        assert store.store_stats()['bytes'] == 6
+        assert store.get(key, 'svg') == store.path(key, 'svg')
+
+
+class TestMetricsRegistry:
+    """Test cases for the metrics registry"""
+    
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test histograms render cumulative buckets, sum and count per label set"""
+        registry = MetricsRegistry({'latency_seconds': ('histogram', "Latency", ('route',), (0.1, 1.0))})
+        for value in (0.05, 0.5, 5.0):
+            registry.observe('latency_seconds', value, route='a"b')
+        
+        lines = registry.render().splitlines()
+        
+        assert lines[:2] == ['# HELP latency_seconds Latency', '# TYPE latency_seconds histogram']
+        assert lines[2:] == [
+            'latency_seconds_bucket{route="a\\"b",le="0.1"} 1',
+            'latency_seconds_bucket{route="a\\"b",le="1"} 2',
+            'latency_seconds_bucket{route="a\\"b",le="+Inf"} 3',
+            'latency_seconds_sum{route="a\\"b"} 5.55',
+            'latency_seconds_count{route="a\\"b"} 3',
+        ]
+    
+    def test_counters_and_timers(self):
+        """Test counters accumulate, gauges are set and timers observe elapsed time"""
+        registry = MetricsRegistry()
+        registry.inc('cache_hits_total', cache='response')
+        registry.inc('cache_hits_total', 2, cache='response')
+        registry.set_value('cache_hit_ratio', 0.25, cache='response')
+        with registry.timer('clean_syntax_duration_seconds'):
+            pass
+        
+        text = registry.render()
+        
+        assert 'cache_hits_total{cache="response"} 3' in text
+        assert 'cache_hit_ratio{cache="response"} 0.25' in text
+        assert 'clean_syntax_duration_seconds_count 1' in text
+        assert 'openai_prompt_tokens' not in text
+
+
+class TestRequestProfiler:
+    """Test cases for sampled request profiling"""
+    
+    @staticmethod
+    def _work():
+        return sum(DiagramService().validate_syntax(generate_diagram('flowchart', 200), 'flowchart').is_valid
+                   for _ in range(3))
+    
+    def test_profiles_are_kept_in_a_ring(self, tmp_path):
+        """Test profiles are written as pstats and collapsed stacks and only the newest are kept"""
+        profiler = RequestProfiler(str(tmp_path), max_profiles=2)
+        ids = []
+        for _ in range(3):
+            result, profile = profiler.profile(self._work, 'header')
+            ids.append(profiler.save(profile, {'path': '/api/test'}))
+        
+        listed = profiler.list_profiles()
+        collapsed = open(profiler.profile_path(ids[-1], 'collapsed')).read()
+        
+        assert result == 3
+        assert [entry['id'] for entry in listed] == ids[:0:-1]
+        assert profiler.profile_path(ids[0], 'pstats') is None
+        assert pstats.Stats(profiler.profile_path(ids[-1], 'pstats')).total_calls > 0
+        assert any('_work' in line and 'validate_syntax' in line for line in collapsed.splitlines())
+        assert profiler.profile_path('../etc', 'pstats') is None
+    
+    def test_trigger_and_busy_profiler(self, tmp_path):
+        """Test the header needs the token, debug paths are never profiled and one request is profiled at a time"""
+        profiler = RequestProfiler(str(tmp_path), token='secret')
+        
+        assert profiler.trigger('/api/validate-syntax', 'secret') == 'header'
+        assert profiler.trigger('/api/validate-syntax', 'guess') is None
+        assert profiler.trigger('/api/debug/profiles', 'secret') is None
+        assert profiler.trigger('/', 'secret') is None
+        
+        nested = []
+        _, profile = profiler.profile(lambda: nested.append(profiler.profile(lambda: 1, 'sample')), 'header')
+        
+        assert profile is not None
+        assert nested == [(1, None)]
+        assert profiler.stats.skipped_busy == 1
+
+
+class TestStreamingSyntaxCleaner:
+    """Test cases for StreamingSyntaxCleaner"""
+    
+    def _clean(self, chunks):
+        cleaner = StreamingSyntaxCleaner()
+        lines = []
+        for chunk in chunks:
+            lines.extend(cleaner.feed(chunk))
+        return lines + cleaner.finish()
+    
+    def test_matches_batch_cleaning(self):
+        """Test incremental cleaning agrees with _clean_syntax"""
+        raw = "```\nmermaid\npie title Pets\n    \"Dogs\" : 386\n\n    \"Cats\" : 85\n```\n"
+        expected = OpenAIService()._clean_syntax(raw.strip())
+        chunks = [raw[i:i + 3] for i in range(0, len(raw), 3)]
+        assert '\n'.join(self._clean(chunks)) == expected
+    
+    def test_plain_syntax_passes_through(self):
+        """Test unfenced syntax is emitted line by line"""
+        assert self._clean(["sequenceDiagram\n", "    A->>B: Hi"]) == ["sequenceDiagram", "    A->>B: Hi"]
+
+
+class TestAsyncOpenAIService:
+    """Test cases for AsyncOpenAIService"""
+    
+    @pytest.fixture
+    def app(self):
+        """Create application context for the service"""
+        app = create_app(TestingConfig)
+        with app.app_context():
+            yield app
+    
+    def test_generate_awaits_async_client(self, app):
+        """Test generation awaits the async completion and cleans the result"""
+        service = AsyncOpenAIService(cache=MemoryCache())
+        service.client = Mock()
+        message = Mock(content="```mermaid\nflowchart TD\n    A --> B\n```")
+        service.client.chat.completions.create = AsyncMock(return_value=Mock(choices=[Mock(message=message)]))
+        
+        response = asyncio.run(service.generate_diagram_syntax("login flow", "flowchart"))
+        cached = asyncio.run(service.generate_diagram_syntax("login flow", "flowchart"))
+        
+        assert response.success is True
+        assert response.syntax == "flowchart TD\n    A --> B"
+        assert cached.syntax == response.syntax
+        assert service.client.chat.completions.create.await_count == 1
+    
+    def test_generate_error_returns_failed_response(self, app):
+        """Test async API errors become failed responses"""
+        service = AsyncOpenAIService(cache=MemoryCache())
+        service.client = Mock()
+        service.client.chat.completions.create = AsyncMock(side_effect=RuntimeError("boom"))
+        
+        response = asyncio.run(service.generate_diagram_syntax("login flow", "flowchart"))
+        
+        assert response.success is False
+        assert "boom" in response.error
+    
+    def test_stream_and_batch(self, app):
+        """Test streaming and batch generation await the async client"""
+        async def chunks():
+            for text in ("```mermaid\nflowchart TD\n", "    A --> B\n", "```"):
+                yield Mock(choices=[Mock(delta=Mock(content=text))])
+        
+        async def create(**kwargs):
+            if kwargs.get('stream'):
+                return chunks()
+            return Mock(choices=[Mock(message=Mock(content="pie\n    \"A\" : 1"))])
+        
+        service = AsyncOpenAIService()
+        service.client = Mock()
+        service.client.chat.completions.create = AsyncMock(side_effect=create)
+        
+        async def collect(iterator):
+            return [item async for item in iterator]
+        
+        events = asyncio.run(collect(service.stream_diagram_syntax("login flow", "flowchart")))
+        results = asyncio.run(collect(service.generate_many([DiagramRequest(prompt="pets", diagram_type="pie")] * 3)))
+        
+        assert events[:2] == [('line', 'flowchart TD'), ('line', '    A --> B')]
+        assert events[-1][1].syntax == "flowchart TD\n    A --> B"
+        assert sorted(index for index, _ in results) == [0, 1, 2]
+        assert all(response.syntax == 'pie\n    "A" : 1' for _, response in results)
+        assert service.client.chat.completions.create.await_count == 2
+    
+    def test_stream_replays_generation_in_flight(self, app):
+        """Test an async stream waits for an identical generation led elsewhere"""
+        flight = SingleFlight(poll_interval=0.005)
+        service = AsyncOpenAIService(single_flight=flight)
+        service.client = Mock()
+        key = make_cache_key("login flow", "flowchart", None, app.config)
+        call, _ = flight.join(key)
+        response = DiagramResponse(syntax="flowchart TD\n    A --> B", diagram_type="flowchart", success=True)
+        
+        async def collect():
+            stream = service.stream_diagram_syntax("login flow", "flowchart")
+            first = asyncio.ensure_future(stream.__anext__())
+            while flight.stats.coalesced < 1:
+                await asyncio.sleep(0.005)
+            flight.finish(key, call, result=response)
+            return [await first] + [event async for event in stream]
+        
+        events = asyncio.run(collect())
+        
+        assert events == [('line', 'flowchart TD'), ('line', '    A --> B'), ('done', response)]
+        service.client.chat.completions.create.assert_not_called()
+    
+    def test_shares_components_with_sync_service(self, app):
+        """Test both services of an app use the same caches, rate limiter and counters"""
+        app.config['RESPONSE_CACHE_BACKEND'] = 'memory'
+        sync_service, async_service = OpenAIService(), AsyncOpenAIService()
+        async_service.client = Mock()
+        async_service.client.chat.completions.create = AsyncMock(
+            return_value=Mock(choices=[Mock(message=Mock(content="flowchart TD\n    A --> B"))])
+        )
+        
+        generated = asyncio.run(async_service.generate_diagram_syntax("login flow", "flowchart"))
+        cached = sync_service.generate_diagram_syntax("login flow", "flowchart")
+        
+        assert cached.syntax == generated.syntax
+        assert sync_service.cache_stats()['hits'] == 1
+        assert sync_service.coalescing_stats()['leaders'] == 1
+        assert sync_service.syntax_repair_stats()['checked'] == 1
+        assert sync_service._get_rate_limiter() is async_service._get_rate_limiter()
+
+
+class TestValidationRules:
+    """Test cases for the compiled validation rule registry"""
+    
+    def test_registry_covers_configured_types(self):
+        """Test every configured diagram type has rules"""
+        assert DIAGRAM_TYPE_NAMES == {t['value'] for t in TestingConfig.DIAGRAM_TYPES}
+    
+    def test_flowchart_header_with_extra_spaces(self):
+        """Test the direction is found after several spaces"""
+        rules = get_rules('flowchart')
+        assert rules.check_header("flowchart  TD") is None
+        assert "Invalid flowchart direction" in rules.check_header("flowchart   XY")
+    
+    def test_unknown_type_rejects_every_header(self):
+        """Test unknown diagram types fail on the declaration"""
+        assert get_rules('nope').check_header("flowchart TD") == "Diagram must start with one of: "
+    
+    def test_pie_body_scan_reports_line_number(self):
+        """Test one-pass body checks skip titles and blank lines and keep line numbers"""
+        rules = get_rules('pie')
+        texts = ['title Pets', '', '"Dogs" : 3.5e2', '"Cats" : "85"', '', '"Rats" : many']
+        assert rules.check_body(texts) == (7, "Pie chart values must be numbers")
+        assert rules.check_body(texts[:-1]) is None
+        assert rules.check_line('"Rats" : many') == "Pie chart values must be numbers"
+
+
+class TestMermaidParser:
+    """Test cases for the Mermaid tokenizer and AST"""
+    
+    def test_tokenize_tracks_bracket_depth(self):
+        """Test bracket balance is measured during tokenization"""
+        document = tokenize("flowchart TD\n    A[Start] --> B]\n    B --> C[", "flowchart")
+        assert document.texts[1] == "A[Start] --> B]"
+        assert document.bracket_deltas == [0, -1, 1]
+        assert document.balance_error == (2, "Unmatched closing bracket ']'")
+    
+    def test_flowchart_ast(self):
+        """Test flowchart nodes, labels and edges are parsed"""
+        document = tokenize("flowchart LR\n    A[Start] -->|Yes| B{Check}\n    B -- No --> C & D", "flowchart")
+        ast = document.ast
+        assert ast.direction == "LR"
+        assert ast.nodes == {'A': 'Start', 'B': 'Check', 'C': None, 'D': None}
+        assert [(edge.source, edge.target, edge.label) for edge in ast.edges] == [
+            ('A', 'B', 'Yes'), ('B', 'C', 'No'), ('B', 'D', 'No')
+        ]
+    
+    def test_sequence_ast(self):
+        """Test sequence participants and messages are parsed"""
+        ast = tokenize("sequenceDiagram\n    participant A as Alice\n    A->>B: Hello\n    B-->>A: Hi", "sequence").ast
+        assert ast.participants == ['A', 'B']
+        assert ast.nodes['A'] == 'Alice'
+        assert [(edge.source, edge.target, edge.label) for edge in ast.edges] == [('A', 'B', 'Hello'), ('B', 'A', 'Hi')]
+    
+    def test_pie_ast(self):
+        """Test pie slices keep raw and numeric values"""
+        ast = tokenize('pie title Pets\n    "Dogs" : 386\n    "Cats" : abc', "pie").ast
+        assert ast.title == "Pets"
+        assert [(s.label, s.value, s.line) for s in ast.slices] == [('Dogs', 386.0, 2), ('Cats', None, 3)]
+    
+    def test_gantt_ast(self):
+        """Test Gantt sections and tasks skip directives"""
+        ast = tokenize("gantt\n    title Plan\n    dateFormat YYYY-MM-DD\n    axisFormat %H:%M\n"
+                       "    section Build\n    Code :a1, 2024-01-01, 3d", "gantt").ast
+        assert ast.title == "Plan"
+        assert ast.sections == ['Build']
+        assert ast.tasks == [Task('Build', 'Code', 'a1, 2024-01-01, 3d', 6)]
+    
+    def test_mindmap_ast(self):
+        """Test mindmap hierarchy comes from indentation"""
+        ast = tokenize("mindmap\n  root((Ideas))\n    A\n      A1\n    B", "mindmap").ast
+        assert ast.nodes['root'] == 'Ideas'
+        assert [(edge.source, edge.target) for edge in ast.edges] == [('root', 'A'), ('A', 'A1'), ('root', 'B')]
+
+
+class TestIncrementalValidator:
+    """Test cases for IncrementalValidator"""
+    
+    @pytest.fixture
+    def validator(self):
+        """Create validator with small blocks so edits cross block boundaries"""
+        return IncrementalValidator(block_size=4)
+    
+    def test_edits_match_full_validation(self, validator):
+        """Test results after edits equal validating the edited text from scratch"""
+        service = DiagramService()
+        lines = ["", "flowchart TD"] + [f"    N{i}[Node {i}] --> N{i + 1}" for i in range(20)]
+        doc_hash, result = validator.validate_full('\n'.join(lines), 'flowchart')
+        assert result.is_valid is True
+        
+        edits = [
+            LineEdit(10, 10, ["    X]"]),
+            LineEdit(3, 7, []),
+            LineEdit(0, 1, ["", "", "  "]),
+            LineEdit(8, 9, ["    Y(("]),
+        ]
+        for edit in edits:
+            lines[edit.start:edit.end] = edit.lines
+            doc_hash, result = validator.apply_edits(doc_hash, [edit], 'flowchart')
+            assert result == service.validate_syntax('\n'.join(lines), 'flowchart')
+    
+    def test_line_errors_are_tracked(self, validator):
+        """Test type-specific line errors come from the checkpoints"""
+        doc_hash, _ = validator.validate_full('pie title Pets\n    "Dogs" : 386', 'pie')
+        doc_hash, result = validator.apply_edits(doc_hash, [LineEdit(2, 2, ['    "Cats" : lots'])], 'pie')
+        assert result.is_valid is False
+        assert result.line_number == 3
+        assert "must be numbers" in result.error
+    
+    def test_unknown_base_hash(self, validator):
+        """Test unknown documents return None"""
+        assert validator.apply_edits("missing", [], 'flowchart') is None
+    
+    def test_invalid_edit_range(self, validator):
+        """Test out-of-range edits are rejected"""
+        doc_hash, _ = validator.validate_full('flowchart TD\n    A --> B', 'flowchart')
+        with pytest.raises(ValueError):
+            validator.apply_edits(doc_hash, [LineEdit(5, 6, ["x"])], 'flowchart')
+    
+    def test_document_store_is_bounded(self):
+        """Test least recently used documents are dropped"""
+        validator = IncrementalValidator(max_documents=2)
+        first, _ = validator.validate_full('flowchart TD\n    A --> B', 'flowchart')
+        validator.validate_full('flowchart TD\n    B --> C', 'flowchart')
+        validator.validate_full('flowchart TD\n    C --> D', 'flowchart')
+        assert len(validator) == 2
+        assert validator.apply_edits(first, [], 'flowchart') is None
+    
+    def test_document_store_is_bounded_by_size(self):
+        """Test documents are dropped once their combined size exceeds the budget"""
+        small = 'flowchart TD\n' + '\n'.join(f'    N{i} --> N{i + 1}' for i in range(20))
+        validator = IncrementalValidator(max_bytes=3000)
+        first, _ = validator.validate_full(small, 'flowchart')
+        second, _ = validator.validate_full(small + '\n    X --> Y', 'flowchart')
+        assert len(validator) == 1
+        assert validator.current_bytes <= 3000
+        assert validator.apply_edits(first, [], 'flowchart') is None
+        
+        # Edits that grow a document count against the budget too
+        grown, _ = validator.apply_edits(second, [LineEdit(1, 1, ['    P --> Q'] * 40)], 'flowchart')
+        assert len(validator) == 0
+        assert validator.current_bytes == 0
+        assert validator.apply_edits(grown, [], 'flowchart') is None
+    
+    def test_oversized_document_is_not_tracked(self):
+        """Test a document larger than the whole budget is validated but not kept"""
+        validator = IncrementalValidator(max_bytes=2000)
+        kept, _ = validator.validate_full('flowchart TD\n    A --> B', 'flowchart')
+        large = 'flowchart TD\n' + '\n'.join(f'    N{i} --> N{i + 1}' for i in range(50))
+        doc_hash, result = validator.validate_full(large, 'flowchart')
+        assert result.is_valid
+        assert len(validator) == 1
+        assert validator.apply_edits(doc_hash, [], 'flowchart') is None
+        assert validator.apply_edits(kept, [], 'flowchart') is not None
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Serve the subset of Redis commands the session store uses"""
+    
+    def handle(self):
+        data = self.server.data
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2].decode('utf-8'))
+            command, args = args[0].upper(), args[1:]
+            self.server.commands.append(command)
+            
+            if command == 'HSET':
+                fields = data.setdefault(args[0], {})
+                fields.update(zip(args[1::2], args[2::2]))
+                reply = ':1'
+            elif command == 'HGETALL':
+                reply = [item for pair in data.get(args[0], {}).items() for item in pair]
+            elif command == 'RPUSH':
+                items = data.setdefault(args[0], [])
+                items.extend(args[1:])
+                reply = f':{len(items)}'
+            elif command in ('LRANGE', 'LTRIM'):
+                stop = int(args[2])
+                items = data.get(args[0], [])[int(args[1]):None if stop == -1 else stop + 1]
+                if command == 'LTRIM':
+                    data[args[0]] = items
+                reply = items if command == 'LRANGE' else '+OK'
+            elif command == 'LINDEX':
+                items = data.get(args[0], [])
+                index = int(args[1])
+                item = items[index] if -len(items) <= index < len(items) else None
+                reply = f'${len(item.encode())}\r\n{item}' if item is not None else '$-1'
+            elif command == 'LSET':
+                data[args[0]][int(args[1])] = args[2]
+                reply = '+OK'
+            elif command == 'EVAL':
+                # The store's scripts, emulated in Python
+                keys, argv = args[2:2 + int(args[1])], args[2 + int(args[1]):]
+                script = {session_store._APPEND_HISTORY_SCRIPT: self._append_history,
+                          session_store._REPLACE_LAST_HISTORY_SCRIPT: self._replace_last_history}[args[0]]
+                reply = f':{script(data, keys, argv)}'
+            elif command == 'DEL':
+                reply = f':{sum(data.pop(key, None) is not None for key in args)}'
+            elif command == 'EXPIRE':
+                self.server.expiries[args[0]] = int(args[1])
+                reply = ':1'
+            else:
+                reply = f'-ERR unknown command {command}'
+            self.wfile.write(self._encode(reply))
+    
+    def _append_history(self, data, keys, argv):
+        history, sizes = data.setdefault(keys[0], []), data.setdefault(keys[1], [])
+        if len(sizes) != len(history):
+            sizes[:] = [str(len(entry.encode())) for entry in history]
+        history.append(argv[0])
+        sizes.append(str(len(argv[0].encode())))
+        limit, max_bytes, ttl = map(int, argv[1:])
+        while history and ((0 <= limit < len(history)) or (0 <= max_bytes < sum(map(int, sizes)))):
+            history.pop(0)
+            sizes.pop(0)
+        data[keys[2]] = str(sum(map(int, sizes)))
+        for key in keys if ttl else ():
+            self.server.expiries[key] = ttl
+        return len(history)
+    
+    @staticmethod
+    def _replace_last_history(data, keys, argv):
+        history, sizes = data.get(keys[0]), data.get(keys[1], [])
+        if not history:
+            return 0
+        history[-1] = argv[0]
+        if len(sizes) == len(history):
+            sizes[-1] = str(len(argv[0].encode()))
+            data[keys[2]] = str(sum(map(int, sizes)))
+        return 1
+    
+    @staticmethod
+    def _encode(reply):
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(
+                b'$%d\r\n%s\r\n' % (len(item.encode()), item.encode()) for item in reply
+            )
+        return reply.encode() + b'\r\n'
+
+
+class TestSessionStore:
+    """Test cases for session store backends"""
+    
+    @pytest.fixture
+    def redis_server(self):
+        """Run a fake Redis server on a local port"""
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+        server.daemon_threads = True
+        server.data = {}
+        server.expiries = {}
+        server.commands = []
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+    
+    @pytest.fixture(params=['memory', 'sqlite', 'redis'])
+    def store(self, request, tmp_path):
+        """Create each backend with a short history limit"""
+        if request.param == 'memory':
+            return MemorySessionStore(history_limit=3)
+        if request.param == 'sqlite':
+            return SQLiteSessionStore(str(tmp_path / 'sessions.sqlite3'), history_limit=3)
+        server = request.getfixturevalue('redis_server')
+        client = RedisClient(f'redis://127.0.0.1:{server.server_address[1]}/0')
+        return RedisSessionStore(client, ttl=60, history_limit=3)
+    
+    def test_state_and_history(self, store):
+        """Test state and history are stored separately"""
+        assert store.load('abc') is None
+        store.save('abc', 'flowchart TD\n    A --> B', 'flowchart')
+        for index in range(5):
+            store.append_history('abc', f'pie title {index}')
+        
+        store.save('abc', 'flowchart TD\n    A --> B', 'flowchart', history_total=5)
+        assert store.load('abc') == {'current_syntax': 'flowchart TD\n    A --> B',
+                                     'diagram_type': 'flowchart', 'history_total': 5}
+        assert store.load_history('abc') == ['pie title 2', 'pie title 3', 'pie title 4']
+        
+        store.delete('abc')
+        assert store.load('abc') is None
+        assert store.load_history('abc') == []
+    
+    @pytest.mark.parametrize('backend', ['memory', 'sqlite', 'redis'])
+    def test_history_byte_limit(self, backend, request, tmp_path):
+        """Test the oldest history entries are dropped once the session exceeds its byte limit"""
+        if backend == 'memory':
+            store = MemorySessionStore(history_max_bytes=25)
+        elif backend == 'sqlite':
+            store = SQLiteSessionStore(str(tmp_path / 'sessions.sqlite3'), history_max_bytes=25)
+        else:
+            server = request.getfixturevalue('redis_server')
+            client = RedisClient(f'redis://127.0.0.1:{server.server_address[1]}/0')
+            store = RedisSessionStore(client, history_max_bytes=25)
+        for index in range(4):
+            store.append_history('abc', f'pie title {index}')
+        
+        assert store.load_history('abc') == ['pie title 2', 'pie title 3']
+        store.append_history('abc', 'x' * 30)
+        assert store.load_history('abc') == []
+    
+    def test_redis_history_append_is_one_script(self, redis_server):
+        """Test a Redis append is one atomic call that never reads the history back"""
+        client = RedisClient(f'redis://127.0.0.1:{redis_server.server_address[1]}/0')
+        store = RedisSessionStore(client, ttl=60, history_limit=3, history_max_bytes=25)
+        # Entries written before sizes were tracked are counted once
+        redis_server.data['diagram-session:abc:history'] = ['pie title 0']
+        for index in range(1, 4):
+            store.append_history('abc', f'pie title {index}')
+        store.replace_last_history('abc', 'pie 3')
+        
+        assert redis_server.commands == ['EVAL'] * 4
+        assert store.load_history('abc') == ['pie title 2', 'pie 3']
+        assert redis_server.data['diagram-session:abc:history:sizes'] == ['11', '5']
+        assert redis_server.expiries['diagram-session:abc:history:bytes'] == 60
+    
+    def test_replace_last_history(self, store):
+        """Test the newest history entry can be read and replaced in place"""
+        assert store.last_history('abc') is None
+        store.replace_last_history('abc', 'pie title 9')
+        assert store.load_history('abc') == []
+        
+        for index in range(2):
+            store.append_history('abc', f'pie title {index}')
+        store.replace_last_history('abc', 'pie title 9')
+        
+        assert store.last_history('abc') == 'pie title 9'
+        assert store.load_history('abc') == ['pie title 0', 'pie title 9']
+    
+    def test_memory_store_evicts_least_recently_used(self):
+        """Test the in-memory store is bounded"""
+        store = MemorySessionStore(max_sessions=2)
+        store.save('a', 'x', 'pie')
+        store.save('b', 'y', 'pie')
+        store.load('a')
+        store.save('c', 'z', 'pie')
+        
+        assert len(store) == 2
+        assert store.load('b') is None
+        assert store.load('a') is not None
+    
+    def test_memory_store_ttl(self, monkeypatch):
+        """Test idle sessions expire"""
+        now = [1000.0]
+        monkeypatch.setattr(session_store.time, 'monotonic', lambda: now[0])
+        store = MemorySessionStore(ttl=10)
+        store.save('a', 'x', 'pie')
+        now[0] += 11
+        assert store.load('a') is None
+    
+    def test_sqlite_store_survives_reopen(self, tmp_path):
+        """Test SQLite sessions persist across store instances"""
+        path = str(tmp_path / 'sessions.sqlite3')
+        SQLiteSessionStore(path).save('a', 'pie title Pets', 'pie')
+        assert SQLiteSessionStore(path).load('a')['current_syntax'] == 'pie title Pets'
+    
+    def test_redis_store_sets_expiry(self, redis_server):
+        """Test Redis keys get the session TTL"""
+        client = RedisClient(f'redis://127.0.0.1:{redis_server.server_address[1]}/0')
+        RedisSessionStore(client, ttl=60).save('a', 'pie', 'pie')
+        assert redis_server.expiries['diagram-session:a'] == 60
+        
+        with pytest.raises(RedisError):
+            client.execute('FLUSHALL')
+    
+    def test_create_session_store_from_config(self):
+        """Test the configured backend is created"""
+        assert isinstance(create_session_store({'SESSION_STORE_BACKEND': 'memory'}), MemorySessionStore)
+        assert isinstance(create_session_store({'SESSION_STORE_BACKEND': 'bogus'}), MemorySessionStore)